@@ -1,4 +1,5 @@
-import yfinance as yf
+import logging
+import numpy as np
 from datetime import datetime, date as datetime_date, timedelta
 from dateutil.relativedelta import relativedelta
 from pydantic import BaseModel, validator, Field
@@ -17,6 +18,9 @@ from database import ( # Now this should work if backend/ is in sys.path
     get_db # Added for get_rendimentos_isentos_por_ano
 )
 from models import EventoCorporativoInfo
+from app.services.precos_historicos import obter_precos_historicos
+from indice_eventos import IndiceEventos, obter_indice_eventos
+from registro_operacao import RegistroOperacao
 # Note: datetime is already imported, List, Dict, Any, Optional are from typing.
 # datetime_date is an alias for date, which is fine.
 
@@ -52,11 +56,13 @@ class Operacao(BaseModel):
 def get_historical_prices(ticker: str, start_date: str, end_date: str) -> Dict[str, float]:
     """
     Fetches historical closing prices for a given stock ticker between two dates.
+    Prices are served from the local price cache (see precos_historicos.py); only
+    the missing date ranges are fetched from the external provider.
 
     Args:
-        ticker (str): The stock ticker symbol (e.g., "AAPL").
+        ticker (str): The stock ticker symbol (e.g., "PETR4"), without the ".SA" suffix.
         start_date (str): The start date in "YYYY-MM-DD" format.
-        end_date (str): The end date in "YYYY-MM-DD" format.
+        end_date (str): The end date in "YYYY-MM-DD" format (inclusive).
 
     Returns:
         dict: A dictionary where keys are dates (as strings in "YYYY-MM-DD" format)
@@ -65,29 +71,17 @@ def get_historical_prices(ticker: str, start_date: str, end_date: str) -> Dict[s
               or an error occurs.
     """
     try:
-        # Append .SA for B3 tickers, conditionally if needed, or always if this service is B3 specific
-        # For this task, we'll always append .SA as per request.
-        # Consider making this conditional if the service should handle international tickers.
-        ticker_sa = f"{ticker}.SA"
-
-        stock = yf.Ticker(ticker_sa)
-        history = stock.history(start=start_date, end=end_date)
-
-        if history.empty:
-            print(f"No data found for ticker {ticker_sa} between {start_date} and {end_date}.")
-            return {}
-
-        prices = {}
-        for index, row in history.iterrows():
-            prices[index.strftime('%Y-%m-%d')] = row['Close']
-
-        return prices
-
+        prices = obter_precos_historicos(
+            ticker, datetime_date.fromisoformat(start_date), datetime_date.fromisoformat(end_date)
+        )
     except Exception as e:
-        # It's good to log the original ticker and the modified one if an error occurs.
-        print(f"Error fetching data for ticker {ticker} (as {ticker_sa if 'ticker_sa' in locals() else 'N/A'}): {e}")
+        logging.error(f"Error fetching data for ticker {ticker}: {e}", exc_info=True)
         return {}
 
+    if not prices:
+        logging.warning(f"No data found for ticker {ticker} between {start_date} and {end_date}.")
+    return {price_date.isoformat(): price for price_date, price in prices.items()}
+
 if __name__ == '__main__':
     # Example usage:
     # Make sure to install yfinance: pip install yfinance
@@ -215,80 +209,23 @@ def get_holdings_on_date(operations: List[Operacao], target_date_str: str) -> Di
     else: # operations is already List[Operacao]
         parsed_operations = operations
 
-    # --- START NEW LOGIC FOR CORPORATE EVENTS ---
-
-    # 1. Collect unique tickers and fetch their corporate events
-    unique_tickers = list(set(op.ticker for op in parsed_operations))
-    events_by_ticker: Dict[str, List[EventoCorporativoInfo]] = {}
-
-    for ticker_symbol in unique_tickers:
-        id_acao = obter_id_acao_por_ticker(ticker_symbol)
-        if id_acao:
-            raw_events_data = obter_eventos_corporativos_por_id_acao_e_data_ex_anterior_a(id_acao, target_d)
-            print(f"Eventos retornados para {ticker_symbol} até {target_d}: {raw_events_data}")
-            # raw_events_data returns List[Dict[str, Any]], suitable for EventoCorporativoInfo(**event_data)
-            events_by_ticker[ticker_symbol] = [EventoCorporativoInfo(**event_data) for event_data in raw_events_data]
-
-    # 2. Define helper to apply events to a single operation
-    def _apply_events_to_operation(operation: Operacao, ticker_events: List[EventoCorporativoInfo]) -> Operacao:
-        adjusted_op = operation
-
-        # ticker_events are already sorted by data_ex ASC from the database function.
-        for event_info in ticker_events:
-            if event_info.data_ex is None:
-                continue
-
-            if adjusted_op.date < event_info.data_ex:
-                if event_info.evento and event_info.evento.lower().startswith("bonific"):
-                    bonus_increase = event_info.get_bonus_quantity_increase(float(adjusted_op.quantity))
-                    new_quantity = float(adjusted_op.quantity) + bonus_increase
-                    # Preço por ação é diluído: novo_preco = (preco_antigo * quantidade_antiga) / quantidade_nova
-                    if new_quantity > 0:
-                        new_price = float(adjusted_op.price) * float(adjusted_op.quantity) / new_quantity
-                    else:
-                        new_price = float(adjusted_op.price)
-                    update_data = {
-                        'quantity': int(round(new_quantity)),
-                        'price': new_price
-                    }
-                    adjusted_op = adjusted_op.copy(update=update_data)
-                    continue
-                factor = event_info.get_adjustment_factor()
-                if factor == 1.0:
-                    continue
-
-                new_quantity_float = float(adjusted_op.quantity)
-                new_price_float = float(adjusted_op.price)
-
-                new_quantity_float = new_quantity_float * factor
-                if factor != 0.0:
-                    new_price_float = new_price_float / factor
-
-                update_data = {
-                    'quantity': int(round(new_quantity_float)),
-                    'price': new_price_float
-                }
-                adjusted_op = adjusted_op.copy(update=update_data)
-        return adjusted_op
-
-    # 3. Create a list of adjusted operations
-    adjusted_operations_list: List[Operacao] = []
-    for op in parsed_operations:
-        ticker_events_for_op = events_by_ticker.get(op.ticker, [])
-        adjusted_op = _apply_events_to_operation(op, ticker_events_for_op)
-        adjusted_operations_list.append(adjusted_op)
-    # --- END NEW LOGIC FOR CORPORATE EVENTS ---
+    # Corporate events come from the cached per-ticker index (see indice_eventos.py):
+    # each operation is adjusted by the events with data_ex after it and up to target_d.
+    events_index_by_ticker: Dict[str, IndiceEventos] = {
+        ticker_symbol: obter_indice_eventos(ticker_symbol)
+        for ticker_symbol in set(op.ticker for op in parsed_operations)
+    }
 
     holdings: Dict[str, int] = {}
-    # Use adjusted_operations_list for calculating holdings
-    for op_adj in adjusted_operations_list:
-        # op_adj.date is already a datetime.date object due to Pydantic validator
-        if op_adj.date <= target_d: # Filter operations up to the target date
-            current_quantity = holdings.get(op_adj.ticker, 0)
-            if op_adj.operation_type == 'buy':
-                holdings[op_adj.ticker] = current_quantity + op_adj.quantity
-            elif op_adj.operation_type == 'sell':
-                holdings[op_adj.ticker] = current_quantity - op_adj.quantity
+    for op in parsed_operations:
+        # op.date is already a datetime.date object due to Pydantic validator
+        if op.date <= target_d: # Filter operations up to the target date
+            adjusted_quantity = events_index_by_ticker[op.ticker].ajustar_quantidade(op.quantity, op.date, target_d)
+            current_quantity = holdings.get(op.ticker, 0)
+            if op.operation_type == 'buy':
+                holdings[op.ticker] = current_quantity + adjusted_quantity
+            elif op.operation_type == 'sell':
+                holdings[op.ticker] = current_quantity - adjusted_quantity
             # Pydantic validator on Operacao model handles unknown operation_type
 
     # Filter out tickers with zero or negative quantities if necessary,
@@ -437,8 +374,93 @@ def _generate_date_series(start_date: datetime_date, end_date: datetime_date, fr
     return dates
 
 
+def _build_holdings_matrix(
+    operations: List[Operacao],
+    tickers: List[str],
+    date_series: List[datetime_date]
+) -> np.ndarray:
+    """
+    Builds the (dates x tickers) matrix of holdings, equivalent to calling
+    get_holdings_on_date for every date of the series (before the quantity > 0 filter),
+    using the cached corporate-events index of each ticker.
+
+    On a given date only the events with data_ex <= date are applied, each one to the
+    operations dated before its data_ex, in data_ex order and rounding after each event.
+    So for every ticker there are len(events) + 1 versions of the adjusted quantities;
+    each version is accumulated over the date series with a cumulative sum and every
+    date picks the version matching the number of events already in effect.
+    """
+    series = np.array(date_series, dtype='datetime64[D]')
+    last_date = date_series[-1]
+    quantities = np.zeros((len(date_series), len(tickers)))
+
+    operations_by_ticker: Dict[str, List[Operacao]] = {}
+    for op in operations:
+        operations_by_ticker.setdefault(op.ticker, []).append(op)
+
+    for column, ticker in enumerate(tickers):
+        ticker_ops = operations_by_ticker.get(ticker, [])
+        if not ticker_ops:
+            continue
+
+        events_index = obter_indice_eventos(ticker)
+        events_count = len(events_index.eventos_ate(last_date))
+
+        op_dates = np.array([op.date for op in ticker_ops], dtype='datetime64[D]')
+        signs = np.array([1.0 if op.operation_type == 'buy' else -1.0 for op in ticker_ops])
+        # Version k of the quantities = operations adjusted by the first k events
+        versions = [np.array([float(op.quantity) for op in ticker_ops])]
+        for position in range(events_count):
+            current = versions[-1]
+            applies = op_dates < np.datetime64(events_index.datas_ex[position], 'D')
+            if events_index.bonificacao[position]:
+                adjusted = np.rint(current + current * events_index.proporcao_bonus[position])
+            else:
+                factor = events_index.fatores[position]
+                adjusted = current if factor == 1.0 else np.rint(current * factor)
+            versions.append(np.where(applies, adjusted, current))
+
+        # Index of the first series date on which each operation counts
+        start_positions = np.searchsorted(series, op_dates, side='left')
+        deltas = np.zeros((len(versions), len(date_series) + 1))
+        for k, version in enumerate(versions):
+            np.add.at(deltas[k], start_positions, signs * version)
+        cumulative = np.cumsum(deltas[:, :-1], axis=1)
+
+        event_dates = np.array(events_index.datas_ex[:events_count], dtype='datetime64[D]')
+        events_in_effect = np.searchsorted(event_dates, series, side='right')
+        quantities[:, column] = cumulative[events_in_effect, np.arange(len(date_series))]
+
+    return quantities
+
+
+def _build_price_matrix(
+    prices_by_ticker: Dict[str, Dict[str, float]],
+    tickers: List[str],
+    date_series: List[datetime_date]
+) -> np.ndarray:
+    """Builds the (dates x tickers) matrix of closing prices, NaN where there is no quote."""
+    positions = {current_date.strftime("%Y-%m-%d"): row for row, current_date in enumerate(date_series)}
+    prices = np.full((len(date_series), len(tickers)), np.nan)
+    for column, ticker in enumerate(tickers):
+        for date_str, price in prices_by_ticker.get(ticker, {}).items():
+            row = positions.get(date_str)
+            if row is not None and price is not None:
+                prices[row, column] = price
+    return prices
+
+
+def _forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """Propagates the last non-NaN value of each column downwards."""
+    rows = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[0])[:, None])
+    np.maximum.accumulate(rows, axis=0, out=rows)
+    filled = matrix[rows, np.arange(matrix.shape[1])]
+    # Leading NaNs stay NaN (row 0 is picked but is itself NaN)
+    return filled
+
+
 def calculate_portfolio_history(
-    operations_data: List[Dict[str, Any]], # Expect raw dicts
+    operations_data: List[Any], # Raw dicts or RegistroOperacao records
     start_date_str: str,
     end_date_str: str,
     period_frequency: str = 'monthly'
@@ -453,11 +475,13 @@ def calculate_portfolio_history(
     if start_date > end_date:
         return {"equity_curve": [], "profitability": {"absolute": 0, "percentage": 0, "details": "Start date after end date."}}
 
-    # Parse operations from dicts to Pydantic models
-    operations: List[Operacao] = []
+    # Parse operations from dicts to Pydantic models. Records loaded by
+    # database.obter_operacoes_motor_db are already typed and are used as they are.
+    operations: List[Any] = []
     if operations_data:
         try:
-            operations = [Operacao(**op_data) for op_data in operations_data]
+            operations = [op_data if isinstance(op_data, RegistroOperacao) else Operacao(**op_data)
+                          for op_data in operations_data]
         except Exception as e:
             # Consider how to handle parsing errors, maybe raise or return error state
             print(f"Error parsing operations data: {e}") # Or log
@@ -492,29 +516,21 @@ def calculate_portfolio_history(
             all_historical_prices[ticker] = prices
 
 
-    # Cache for last known prices to handle missing data points (e.g. weekends, holidays)
-    last_known_prices: Dict[str, float] = {}
-
-    for current_eval_date in date_series:
-        current_eval_date_str = current_eval_date.strftime("%Y-%m-%d")
-        holdings_on_eval_date = get_holdings_on_date(operations, current_eval_date_str)
-
-        current_portfolio_value = 0.0
-        for ticker, quantity in holdings_on_eval_date.items():
-            ticker_prices = all_historical_prices.get(ticker, {})
-            price_on_eval_date = ticker_prices.get(current_eval_date_str)
-
-            if price_on_eval_date is not None:
-                current_portfolio_value += price_on_eval_date * quantity
-                last_known_prices[ticker] = price_on_eval_date # Update cache
-            elif ticker in last_known_prices:
-                # Price not found for current_eval_date, use last known price
-                # print(f"Warning: Price for {ticker} on {current_eval_date_str} not found. Using last known price: {last_known_prices[ticker]}")
-                current_portfolio_value += last_known_prices[ticker] * quantity
-            # else:
-                # print(f"Warning: Price for {ticker} on {current_eval_date_str} not found, and no prior price cached. Assuming value 0 for this holding.")
+    if all_tickers and date_series:
+        quantities = _build_holdings_matrix(operations, all_tickers, date_series)
+        prices = _build_price_matrix(all_historical_prices, all_tickers, date_series)
+        # Only holdings with quantity > 0 count (same rule as get_holdings_on_date).
+        held = quantities > 0
+        # A price is only remembered while the ticker is held: dates without a quote
+        # (weekends, holidays) use the last price seen on a date the ticker was held,
+        # and count as zero if there is none.
+        prices = _forward_fill(np.where(held, prices, np.nan))
+        values = np.where(held & ~np.isnan(prices), prices * quantities, 0.0).sum(axis=1)
+    else:
+        values = np.zeros(len(date_series))
 
-        equity_curve.append({'date': current_eval_date_str, 'value': round(current_portfolio_value, 2)})
+    for current_eval_date, value in zip(date_series, values.tolist()):
+        equity_curve.append({'date': current_eval_date.strftime("%Y-%m-%d"), 'value': round(value, 2)})
 
     # Profitability Calculation
     if not equity_curve: # No data points generated
@@ -827,89 +843,34 @@ def calculate_average_price_up_to_date(
     # We need to apply adjustments as we calculate the average price.
     # This makes the function self-contained for price calculation.
 
-    id_acao = obter_id_acao_por_ticker(ticker) # Fetch from DB
-    raw_events_data = []
-    if id_acao:
-        raw_events_data = obter_eventos_corporativos_por_id_acao_e_data_ex_anterior_a(id_acao, target_date)
-
-    ticker_events: List[EventoCorporativoInfo] = []
-    if raw_events_data:
-        ticker_events = [EventoCorporativoInfo(**event_data) for event_data in raw_events_data]
-
-    # Sort events by date_ex (already sorted from DB function)
-    # ticker_events.sort(key=lambda ev: ev.data_ex if ev.data_ex else datetime_date.min)
-
-
-    # Helper to apply events to a running quantity and average price
-    # This is complex. A simpler way for average price is to track total_cost and total_quantity.
+    # Events come from the cached per-ticker index (see indice_eventos.py).
     # Corporate events that don't change total cost (splits, bonus) mean new_avg_price = total_cost / new_total_quantity.
+    events_index = obter_indice_eventos(ticker)
 
-    processed_ops_for_avg_price: List[Operacao] = []
     for op_original in sorted_ops:
         if op_original.date > target_date: # Ensure op is within target_date
             continue
 
-        adjusted_op = op_original
-        # Apply events that occurred *before or on* this operation's date,
-        # but *after* the previous operation's date if we were iterating through time.
-        # Simpler: apply all events *up to* the operation's date to this single operation's quantity and price.
-        # This is what _apply_events_to_operation in get_holdings_on_date does.
-
         # We need to adjust the *historical* operations themselves based on subsequent events
         # if we are calculating a historical average price that reflects future splits.
         # Example: Buy 10 AAPL @ $100. Split 2:1. Now have 20 AAPL @ $50. Avg price is $50.
-        # If calculating avg price *for Dec 31st*, and split happened in June, then ops before June
-        # need to be seen as adjusted.
-
-        # The `_apply_events_to_operation` adjusts an op based on events *after* op.date but *before* target_date (implicit).
-        # Let's use it here:
-
-        # Filter events relevant for *this specific operation op_original*
-        # These are events whose ex-date is AFTER op_original.date but BEFORE or ON target_date
-        relevant_events_for_op = [
-            ev for ev in ticker_events
-            if ev.data_ex and op_original.date < ev.data_ex <= target_date
-        ]
-        # Sort these relevant events by their ex-date
-        relevant_events_for_op.sort(key=lambda ev: ev.data_ex if ev.data_ex else datetime_date.min)
-
-
-        # Apply these relevant events to the op_original
-        op_to_process = op_original
-        for event_info in relevant_events_for_op:
-            # This logic is from _apply_events_to_operation
-            if event_info.evento and event_info.evento.lower().startswith("bonific"):
-                bonus_increase = event_info.get_bonus_quantity_increase(float(op_to_process.quantity))
-                new_quantity = float(op_to_process.quantity) + bonus_increase
-                if new_quantity > 0:
-                    new_price = float(op_to_process.price) * float(op_to_process.quantity) / new_quantity
-                else:
-                    new_price = float(op_to_process.price)
-                op_to_process = op_to_process.copy(update={'quantity': int(round(new_quantity)), 'price': new_price})
-                continue
-
-            factor = event_info.get_adjustment_factor()
-            if factor != 1.0:
-                new_quantity_float = float(op_to_process.quantity) * factor
-                new_price_float = float(op_to_process.price) / factor if factor != 0 else float(op_to_process.price)
-                op_to_process = op_to_process.copy(update={
-                    'quantity': int(round(new_quantity_float)),
-                    'price': new_price_float
-                })
-
-        # Now use op_to_process for avg price calculation
-        if op_to_process.operation_type == 'buy':
-            total_cost += op_to_process.quantity * op_to_process.price
-            current_quantity += op_to_process.quantity
-        elif op_to_process.operation_type == 'sell':
+        # Relevant events for this operation: ex-date AFTER op_original.date and BEFORE or ON target_date.
+        adjusted_quantity, adjusted_price = events_index.ajustar(
+            op_original.quantity, op_original.price, op_original.date, target_date
+        )
+        # The adjusted values are used directly (no copy of the operation per adjustment)
+        if op_original.operation_type == 'buy':
+            total_cost += adjusted_quantity * adjusted_price
+            current_quantity += adjusted_quantity
+        elif op_original.operation_type == 'sell':
             # For FIFO/average cost, selling reduces quantity at the current average cost.
             # The cost of goods sold (COGS) would be sell_quantity * current_avg_price.
             # total_cost is then reduced by this COGS.
             if current_quantity > 0: # Cannot sell if quantity is zero
                 avg_price_before_sell = total_cost / current_quantity if current_quantity > 0 else 0
-                cost_of_sold_shares = op_to_process.quantity * avg_price_before_sell
+                cost_of_sold_shares = adjusted_quantity * avg_price_before_sell
                 total_cost -= cost_of_sold_shares
-            current_quantity -= op_to_process.quantity
+            current_quantity -= adjusted_quantity
 
             if current_quantity < 0: # Should not happen with proper sell logic if not shorting
                 current_quantity = 0 # Or handle as error
@@ -943,53 +904,30 @@ def get_bens_e_direitos_acoes(
     # Calcular data de 31/12 do ano anterior
     ano_anterior = target_date.year - 1
     data_ano_anterior = datetime.strptime(f"{ano_anterior}-12-31", "%Y-%m-%d").date()
-    data_ano_anterior_str = f"{ano_anterior}-12-31"
-
-    from services import listar_operacoes_service
-    user_operations_raw_dicts: List[Dict[str, Any]] = listar_operacoes_service(usuario_id=user_id)
-
-    operations_for_service: List[Operacao] = []
-    for op_raw in user_operations_raw_dicts:
-        try:
-            transformed_op_data = {
-                'ticker': op_raw['ticker'],
-                'date': op_raw['date'],
-                'operation_type': op_raw['operation'],
-                'quantity': op_raw['quantity'],
-                'price': op_raw['price'],
-                'fees': op_raw.get('fees', 0.0)
-            }
-            operations_for_service.append(Operacao(**transformed_op_data))
-        except Exception as e:
-            print(f"Skipping operation due to parsing error: {op_raw}. Error: {e}")
-            continue
-
-    # Holdings em target_date
-    ops_up_to_target_date = [op for op in operations_for_service if op.date <= target_date]
-    holdings_on_target_date: Dict[str, int] = get_holdings_on_date(ops_up_to_target_date, target_date_str)
 
-    # Holdings em 31/12 do ano anterior
-    ops_up_to_ano_anterior = [op for op in operations_for_service if op.date <= data_ano_anterior]
-    holdings_on_ano_anterior: Dict[str, int] = get_holdings_on_date(ops_up_to_ano_anterior, data_ano_anterior_str)
+    # Uma única passada do motor de posições fornece as duas datas (quantidade e PM
+    # ajustados por eventos corporativos, com taxas compondo o custo de aquisição)
+    from services import executar_motor_usuario
+    saida_motor = executar_motor_usuario(user_id, datas_snapshot=[target_date, data_ano_anterior])
+    posicoes_target_date = saida_motor["snapshots"].get(target_date, {})
+    posicoes_ano_anterior = saida_motor["snapshots"].get(data_ano_anterior, {})
 
     bens_e_direitos_list: List[BemDireitoAcaoSchema] = []
 
-    for ticker, quantity in holdings_on_target_date.items():
+    for ticker, posicao in posicoes_target_date.items():
+        quantity = posicao["quantidade"]
         if quantity <= 0:
             continue
         acao_info_dict = obter_acao_info_por_ticker(ticker)
         nome_empresa = acao_info_dict.get('nome') if acao_info_dict else None
         cnpj = acao_info_dict.get('cnpj') if acao_info_dict else None
-        ops_for_ticker_up_to_target_date = [op for op in operations_for_service if op.ticker == ticker and op.date <= target_date]
-        preco_medio = calculate_average_price_up_to_date(user_id, ticker, target_date, operations_for_ticker=ops_for_ticker_up_to_target_date)
+        preco_medio = posicao["preco_medio"]
         valor_total_data_base = round(quantity * preco_medio, 2)
 
         # Calcular valor total em 31/12 do ano anterior
-        quantidade_ano_anterior = holdings_on_ano_anterior.get(ticker, 0)
-        if quantidade_ano_anterior > 0:
-            ops_for_ticker_up_to_ano_anterior = [op for op in operations_for_service if op.ticker == ticker and op.date <= data_ano_anterior]
-            preco_medio_ano_anterior = calculate_average_price_up_to_date(user_id, ticker, data_ano_anterior, operations_for_ticker=ops_for_ticker_up_to_ano_anterior)
-            valor_total_ano_anterior = round(quantidade_ano_anterior * preco_medio_ano_anterior, 2)
+        posicao_ano_anterior = posicoes_ano_anterior.get(ticker)
+        if posicao_ano_anterior and posicao_ano_anterior["quantidade"] > 0:
+            valor_total_ano_anterior = round(posicao_ano_anterior["quantidade"] * posicao_ano_anterior["preco_medio"], 2)
         else:
             valor_total_ano_anterior = 0.0
 
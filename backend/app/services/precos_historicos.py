@@ -0,0 +1,244 @@
+"""
+Cache de preços históricos de fechamento.
+
+Os preços consultados no provedor externo (yfinance, por padrão) ficam gravados
+na tabela precos_historicos, e os intervalos já consultados em precos_cobertura:
+uma nova consulta busca no provedor apenas os intervalos que faltam. Por cima do
+banco há um cache LRU em memória, por (ticker, início, fim), de modo que as
+curvas de patrimônio repetidas não fazem nenhuma consulta externa.
+
+O pregão corrente nunca é marcado como coberto: o fechamento de hoje ainda pode
+mudar, então intervalos que chegam até hoje são reconsultados (e ficam no LRU
+apenas por PRICE_CACHE_TTL_HOJE segundos).
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from database import (
+    obter_precos_historicos_db,
+    obter_cobertura_precos_db,
+    salvar_precos_historicos_db,
+)
+from metricas import registrar_cache
+
+# Quantidade de consultas (ticker, início, fim) mantidas no LRU em memória
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "512"))
+# Segundos que uma consulta que inclui o dia corrente permanece no LRU
+PRICE_CACHE_TTL_HOJE = float(os.getenv("PRICE_CACHE_TTL_HOJE", "900"))
+
+Intervalo = Tuple[date, date]
+
+class ProvedorPrecos(ABC):
+    """
+    Fonte externa de preços de fechamento. Implementações devem devolver apenas
+    os dias com pregão dentro do intervalo (inclusive nas duas pontas).
+    """
+
+    @abstractmethod
+    def buscar(self, ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+        """Preços de fechamento do ticker entre `inicio` e `fim`, por dia."""
+
+class ProvedorYFinance(ProvedorPrecos):
+    """Preços da B3 via yfinance (ticker com sufixo .SA)."""
+
+    def buscar(self, ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+        # Importação tardia: o yfinance (e o pandas) só são carregados se houver consulta externa
+        import yfinance as yf
+
+        # O parâmetro end do yfinance é exclusivo
+        historico = yf.Ticker(f"{ticker}.SA").history(
+            start=inicio.isoformat(), end=(fim + timedelta(days=1)).isoformat()
+        )
+        if historico.empty:
+            return {}
+        return {
+            indice.date(): float(fechamento)
+            for indice, fechamento in zip(historico.index, historico["Close"].tolist())
+        }
+
+class ProvedorPrecosLocal(ProvedorPrecos):
+    """
+    Provedor em memória, para testes e uso offline. Registra cada consulta em `chamadas`.
+    """
+
+    def __init__(self, precos: Optional[Dict[str, Dict[date, float]]] = None):
+        self.precos: Dict[str, Dict[date, float]] = precos or {}
+        self.chamadas: List[Tuple[str, date, date]] = []
+
+    def buscar(self, ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+        self.chamadas.append((ticker, inicio, fim))
+        return {data: preco for data, preco in self.precos.get(ticker, {}).items() if inicio <= data <= fim}
+
+def _mesclar_intervalos(intervalos: List[Intervalo]) -> List[Intervalo]:
+    """Une intervalos sobrepostos ou adjacentes, devolvendo-os ordenados."""
+    mesclados: List[Intervalo] = []
+    for inicio, fim in sorted(intervalos):
+        if mesclados and inicio <= mesclados[-1][1] + timedelta(days=1):
+            if fim > mesclados[-1][1]:
+                mesclados[-1] = (mesclados[-1][0], fim)
+        else:
+            mesclados.append((inicio, fim))
+    return mesclados
+
+def _calcular_lacunas(cobertura: List[Intervalo], inicio: date, fim: date) -> List[Intervalo]:
+    """Retorna os trechos de [inicio, fim] que não estão na cobertura (ordenada e disjunta)."""
+    lacunas: List[Intervalo] = []
+    cursor = inicio
+    for coberto_inicio, coberto_fim in cobertura:
+        if coberto_fim < cursor:
+            continue
+        if coberto_inicio > fim:
+            break
+        if coberto_inicio > cursor:
+            lacunas.append((cursor, coberto_inicio - timedelta(days=1)))
+        cursor = max(cursor, coberto_fim + timedelta(days=1))
+        if cursor > fim:
+            break
+    if cursor <= fim:
+        lacunas.append((cursor, fim))
+    return lacunas
+
+class CachePrecosHistoricos:
+    """
+    Cache em dois níveis (LRU em memória e SQLite) na frente de um `ProvedorPrecos`.
+    """
+
+    def __init__(self, provedor: ProvedorPrecos, tamanho: int = PRICE_CACHE_SIZE):
+        self.provedor = provedor
+        self.tamanho = tamanho
+        self._lru: "OrderedDict[Tuple[str, date, date], Tuple[Optional[float], Dict[date, float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Um lock por ticker evita consultas externas duplicadas para o mesmo ativo
+        self._locks_ticker: Dict[str, threading.Lock] = {}
+        # Consultas atendidas (ou não) pelo LRU, para a métrica investir_cache_*{cache="precos"}
+        self.acertos = 0
+        self.falhas = 0
+
+    def _lock_ticker(self, ticker: str) -> threading.Lock:
+        with self._lock:
+            return self._locks_ticker.setdefault(ticker, threading.Lock())
+
+    def _ler_lru(self, chave: Tuple[str, date, date], contar: bool = False) -> Optional[Dict[date, float]]:
+        with self._lock:
+            entrada = self._lru.get(chave)
+            if entrada is not None:
+                expira_em, precos = entrada
+                if expira_em is not None and expira_em <= time.monotonic():
+                    del self._lru[chave]
+                    entrada = None
+                else:
+                    self._lru.move_to_end(chave)
+            if contar:
+                if entrada is None:
+                    self.falhas += 1
+                else:
+                    self.acertos += 1
+            return None if entrada is None else precos
+
+    def _gravar_lru(self, chave: Tuple[str, date, date], precos: Dict[date, float], expira_em: Optional[float]) -> None:
+        if self.tamanho <= 0:
+            return
+        with self._lock:
+            self._lru[chave] = (expira_em, precos)
+            self._lru.move_to_end(chave)
+            while len(self._lru) > self.tamanho:
+                self._lru.popitem(last=False)
+
+    def limpar(self) -> None:
+        """Esvazia o LRU em memória (o banco é mantido)."""
+        with self._lock:
+            self._lru.clear()
+
+    def estatisticas(self) -> Dict[str, int]:
+        """Acertos, falhas e entradas atuais do LRU."""
+        with self._lock:
+            return {"acertos": self.acertos, "falhas": self.falhas, "entradas": len(self._lru)}
+
+    def obter(self, ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+        """
+        Retorna os fechamentos do ticker entre `inicio` e `fim` (inclusive),
+        consultando o provedor apenas para os intervalos ainda não cobertos.
+
+        Args:
+            ticker: Ticker sem o sufixo de bolsa (ex.: "PETR4").
+            inicio: Primeira data.
+            fim: Última data.
+
+        Returns:
+            Dict[date, float]: Fechamento por data de pregão.
+        """
+        chave = (ticker, inicio, fim)
+        precos = self._ler_lru(chave, contar=True)
+        if precos is not None:
+            return precos
+
+        with self._lock_ticker(ticker):
+            # Outra thread pode ter carregado o mesmo intervalo enquanto esperávamos
+            precos = self._ler_lru(chave)
+            if precos is not None:
+                return precos
+            precos, completo = self._carregar(ticker, inicio, fim)
+
+        if completo:
+            expira_em = None if fim < date.today() else time.monotonic() + PRICE_CACHE_TTL_HOJE
+            self._gravar_lru(chave, precos, expira_em)
+        return precos
+
+    def _carregar(self, ticker: str, inicio: date, fim: date) -> Tuple[Dict[date, float], bool]:
+        # Só o que for anterior a hoje é considerado definitivo
+        limite_cobertura = date.today() - timedelta(days=1)
+        cobertura = obter_cobertura_precos_db(ticker)
+        lacunas = _calcular_lacunas(cobertura, inicio, fim)
+
+        completo = True
+        novos: Dict[date, float] = {}
+        cobertos: List[Intervalo] = []
+        for lacuna_inicio, lacuna_fim in lacunas:
+            try:
+                novos.update(self.provedor.buscar(ticker, lacuna_inicio, lacuna_fim))
+            except Exception as e:
+                # Sem marcar a lacuna como coberta: a próxima consulta tenta de novo
+                logging.warning(f"Falha ao buscar preços de {ticker} entre {lacuna_inicio} e {lacuna_fim}: {e}")
+                completo = False
+                continue
+            if lacuna_inicio <= limite_cobertura:
+                cobertos.append((lacuna_inicio, min(lacuna_fim, limite_cobertura)))
+
+        if cobertos:
+            definitivos = {data: preco for data, preco in novos.items() if data <= limite_cobertura}
+            salvar_precos_historicos_db(ticker, definitivos, _mesclar_intervalos(cobertura + cobertos))
+
+        precos = obter_precos_historicos_db(ticker, inicio, fim)
+        # Fechamentos do dia corrente vêm do provedor, sem passar pelo banco
+        precos.update({data: preco for data, preco in novos.items() if data > limite_cobertura})
+        return dict(sorted(precos.items())), completo
+
+_cache_precos = CachePrecosHistoricos(ProvedorYFinance())
+registrar_cache("precos", lambda: _cache_precos.estatisticas())
+
+def configurar_provedor_precos(provedor: ProvedorPrecos) -> None:
+    """
+    Substitui o provedor de preços (ex.: `ProvedorPrecosLocal` nos testes) e esvazia o LRU.
+    """
+    _cache_precos.provedor = provedor
+    _cache_precos.limpar()
+
+def limpar_cache_precos() -> None:
+    """Esvazia o LRU em memória de preços históricos."""
+    _cache_precos.limpar()
+
+def obter_precos_historicos(ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+    """
+    Retorna os fechamentos do ticker entre `inicio` e `fim` (inclusive), servidos
+    do cache em memória, do banco ou, para os intervalos faltantes, do provedor.
+
+    Returns:
+        Dict[date, float]: Fechamento por data de pregão.
+    """
+    return _cache_precos.obter(ticker, inicio, fim)
@@ -4,16 +4,21 @@ Este módulo contém funções para gerenciar usuários, autenticação e contro
 """
 
 import hashlib # Standard library
+import hmac    # Standard library
 import secrets # Standard library
 import time    # Standard library
 import jwt     # Third-party
 import os      # Standard library (for getenv)
+import threading # Standard library
+from collections import OrderedDict # Standard library
 from datetime import datetime, timedelta # Standard library
-from typing import Dict, List, Any, Optional # Standard library
+from typing import Dict, List, Any, Optional, Callable, Hashable, Tuple # Standard library
 # sqlite3, Tuple, contextmanager were unused directly in this file. get_db handles its own context.
 
 # Importa a função get_db do módulo database
-from database import get_db
+import database
+from database import get_db, criar_tabelas
+from metricas import registrar_cache
 
 # Custom Exception Classes for Token Handling
 class TokenExpiredError(Exception):
@@ -38,6 +43,108 @@ JWT_SECRET = os.getenv("JWT_SECRET", "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzd
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION = 24 * 60 * 60
 
+# Parâmetros do PBKDF2 para novos hashes de senha. Hashes gravados com outros parâmetros
+# continuam válidos e são refeitos com os atuais no próximo login (verificar_credenciais).
+PASSWORD_HASH_ALGORITHM = os.getenv("PASSWORD_HASH_ALGORITHM", "sha256")
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "100000"))
+
+# Cache de tokens verificados e de usuários usado por dependencies.get_current_user.
+# Revogações e alterações feitas por este processo invalidam o cache na hora; feitas por
+# outro processo (ou direto no banco), valem em até AUTH_CACHE_TTL segundos (0 desativa o cache).
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_TAMANHO = int(os.getenv("AUTH_CACHE_TAMANHO", "10000"))
+
+class CacheTTL:
+    """
+    Cache limitado com expiração por entrada, seguro entre threads.
+
+    Acima de `tamanho` entradas, a usada há mais tempo é descartada. Cada invalidação
+    incrementa uma geração: um valor lido do banco antes dela não é guardado (ver
+    `guardar`), para que uma leitura concorrente não reintroduza um valor já invalidado.
+    """
+
+    def __init__(self, tamanho: int):
+        self.tamanho = tamanho
+        self._entradas: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._geracao = 0
+        self.acertos = 0
+        self.falhas = 0
+
+    def geracao(self) -> int:
+        with self._lock:
+            return self._geracao
+
+    def obter(self, chave: Hashable) -> Optional[Any]:
+        """Retorna o valor em cache (None se ausente ou expirado)."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.falhas += 1
+                return None
+            valor, expira_em = entrada
+            if expira_em <= time.monotonic():
+                del self._entradas[chave]
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave: Hashable, valor: Any, ttl: float, geracao: int) -> None:
+        """Guarda `valor` por `ttl` segundos, se não houve invalidação desde `geracao`."""
+        if ttl <= 0 or self.tamanho <= 0:
+            return
+        with self._lock:
+            if geracao != self._geracao:
+                return
+            self._entradas[chave] = (valor, time.monotonic() + ttl)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho:
+                self._entradas.popitem(last=False)
+
+    def remover(self, predicado: Callable[[Hashable, Any], bool]) -> None:
+        """Remove as entradas para as quais predicado(chave, valor) é verdadeiro."""
+        with self._lock:
+            self._geracao += 1
+            for chave in [c for c, (v, _) in self._entradas.items() if predicado(c, v)]:
+                del self._entradas[chave]
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._geracao += 1
+            self._entradas.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entradas)
+
+    def estatisticas(self) -> Dict[str, int]:
+        """Acertos, falhas e entradas atuais (métricas investir_cache_*)."""
+        with self._lock:
+            return {"acertos": self.acertos, "falhas": self.falhas, "entradas": len(self._entradas)}
+
+# Chaves incluem o arquivo do banco: testes e scripts trocam de banco no mesmo processo.
+# Tokens: (arquivo, token) -> payload; usuários: (arquivo, usuario_id) -> dados do usuário.
+_cache_tokens = CacheTTL(AUTH_CACHE_TAMANHO)
+_cache_usuarios = CacheTTL(AUTH_CACHE_TAMANHO)
+registrar_cache("tokens", _cache_tokens.estatisticas)
+registrar_cache("usuarios", _cache_usuarios.estatisticas)
+
+def invalidar_cache_usuario(usuario_id: int, tokens: bool = False) -> None:
+    """
+    Descarta do cache os dados do usuário e, com `tokens`, os tokens dele já verificados.
+    """
+    _cache_usuarios.remover(lambda chave, _: chave[1] == usuario_id)
+    if tokens:
+        sub = str(usuario_id)
+        _cache_tokens.remover(lambda _, payload: payload.get("sub") == sub)
+
+def invalidar_cache_autenticacao() -> None:
+    """Descarta todos os tokens e usuários em cache."""
+    _cache_tokens.limpar()
+    _cache_usuarios.limpar()
+
 def criar_tabelas_autenticacao() -> None:
     """
     Cria as tabelas necessárias para autenticação e autorização.
@@ -203,25 +310,55 @@ def gerar_salt() -> str:
     """
     return secrets.token_hex(16)
 
+def _parametros_hash(senha_hash: str) -> Tuple[str, int, str]:
+    """Retorna (algoritmo, iterações, digest hexadecimal) de um hash de senha gravado."""
+    if senha_hash.startswith('pbkdf2_'):
+        esquema, iteracoes, digest = senha_hash.split('$', 2)
+        return esquema[len('pbkdf2_'):], int(iteracoes), digest
+    # Formato anterior: apenas o digest, PBKDF2 com SHA-256 e 100.000 iterações
+    return 'sha256', 100000, senha_hash
+
 def hash_senha(senha: str, salt: str) -> str:
     """
-    Gera um hash seguro para a senha usando PBKDF2.
+    Gera um hash seguro para a senha usando PBKDF2, com os parâmetros atuais
+    (PASSWORD_HASH_ALGORITHM, PASSWORD_HASH_ITERATIONS).
     
     Args:
         senha: Senha em texto plano.
         salt: Salt para o hash.
         
     Returns:
-        str: Hash da senha em formato hexadecimal.
+        str: Hash no formato pbkdf2_<algoritmo>$<iterações>$<digest hexadecimal>.
     """
-    # Usa PBKDF2 com SHA-256, 100.000 iterações
     key = hashlib.pbkdf2_hmac(
-        'sha256',
+        PASSWORD_HASH_ALGORITHM,
         senha.encode('utf-8'),
         bytes.fromhex(salt),
-        100000
+        PASSWORD_HASH_ITERATIONS
     )
-    return key.hex()
+    return f"pbkdf2_{PASSWORD_HASH_ALGORITHM}${PASSWORD_HASH_ITERATIONS}${key.hex()}"
+
+def verificar_senha(senha: str, salt: str, senha_hash: str) -> bool:
+    """
+    Verifica uma senha contra o hash gravado, com os parâmetros com que ele foi gerado.
+    
+    Args:
+        senha: Senha em texto plano.
+        salt: Salt do hash gravado.
+        senha_hash: Hash gravado (formato atual ou anterior).
+        
+    Returns:
+        bool: True se a senha confere.
+    """
+    algoritmo, iteracoes, esperado = _parametros_hash(senha_hash)
+    obtido = hashlib.pbkdf2_hmac(algoritmo, senha.encode('utf-8'), bytes.fromhex(salt), iteracoes).hex()
+    # Comparação em tempo constante
+    return hmac.compare_digest(obtido, esperado)
+
+def precisa_rehash(senha_hash: str) -> bool:
+    """Indica se o hash gravado usa parâmetros diferentes dos atuais."""
+    algoritmo, iteracoes, _ = _parametros_hash(senha_hash)
+    return (algoritmo, iteracoes) != (PASSWORD_HASH_ALGORITHM, PASSWORD_HASH_ITERATIONS)
 
 def criar_usuario(username: str, email: str, senha: str, nome_completo: Optional[str] = None) -> int:
     """
@@ -372,6 +509,9 @@ def atualizar_usuario(usuario_id: int, dados: Dict[str, Any]) -> bool:
         cursor.execute(query, valores)
         conn.commit()
         
+        # Troca de senha ou desativação também revogou os tokens do usuário
+        invalidar_cache_usuario(usuario_id, tokens='senha' in dados or ('ativo' in dados and not dados['ativo']))
+        
         return True
 
 def excluir_usuario(usuario_id: int) -> bool:
@@ -398,6 +538,7 @@ def excluir_usuario(usuario_id: int) -> bool:
         # As tabelas relacionadas serão limpas automaticamente devido às restrições ON DELETE CASCADE
         
         conn.commit()
+        invalidar_cache_usuario(usuario_id, tokens=True)
         
         return cursor.rowcount > 0
 
@@ -441,6 +582,27 @@ def obter_usuario(usuario_id: int) -> Optional[Dict[str, Any]]:
         
         return usuario_dict
 
+def obter_usuario_cacheado(usuario_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Obtém os dados de um usuário pelo ID, reaproveitando uma leitura recente
+    (até AUTH_CACHE_TTL segundos, ou até a próxima alteração do usuário ou de suas funções).
+
+    Args:
+        usuario_id: ID do usuário.
+
+    Returns:
+        Optional[Dict[str, Any]]: Dados do usuário (cópia) ou None se não encontrado.
+    """
+    chave = (database.DATABASE_FILE, usuario_id)
+    usuario = _cache_usuarios.obter(chave)
+    if usuario is None:
+        geracao = _cache_usuarios.geracao()
+        usuario = obter_usuario(usuario_id)
+        if usuario is None:
+            return None
+        _cache_usuarios.guardar(chave, usuario, AUTH_CACHE_TTL, geracao)
+    return {**usuario, 'funcoes': list(usuario['funcoes'])}
+
 def obter_usuario_por_username(username: str) -> Optional[Dict[str, Any]]:
     """
     Obtém os dados de um usuário pelo username.
@@ -547,11 +709,16 @@ def verificar_credenciais(username_ou_email: str, senha: str) -> Optional[Dict[s
             return None
         
         # Verifica a senha
-        senha_hash = hash_senha(senha, usuario['senha_salt'])
-        
-        if senha_hash != usuario['senha_hash']:
+        if not verificar_senha(senha, usuario['senha_salt'], usuario['senha_hash']):
             return None
         
+        # Parâmetros de hash alterados desde a última troca de senha: refaz o hash com os atuais
+        if precisa_rehash(usuario['senha_hash']):
+            novo_salt = gerar_salt()
+            cursor.execute('UPDATE usuarios SET senha_hash = ?, senha_salt = ? WHERE id = ?',
+                           (hash_senha(senha, novo_salt), novo_salt, usuario['id']))
+            conn.commit()
+        
         # Retorna os dados do usuário (sem a senha)
         usuario_dict = {
             'id': usuario['id'],
@@ -573,6 +740,13 @@ def verificar_credenciais(username_ou_email: str, senha: str) -> Optional[Dict[s
         
         return usuario_dict
 
+def digest_token(token: str) -> str:
+    """
+    Digest SHA-256 (hexadecimal) de um token JWT, guardado e indexado na tabela tokens
+    no lugar do token completo.
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
 def gerar_token(usuario_id: int) -> str:
     """
     Gera um token JWT para um usuário.
@@ -604,7 +778,9 @@ def gerar_token(usuario_id: int) -> str:
         'sub': str(usuario_id), # Convertido para string
         'iat': agora,
         'exp': expiracao,
-        'roles': funcoes
+        'roles': funcoes,
+        # Identificador único: dois logins no mesmo segundo geram tokens (e digests) distintos
+        'jti': secrets.token_hex(16)
     }
     
     # Gera o token
@@ -615,11 +791,11 @@ def gerar_token(usuario_id: int) -> str:
         cursor = conn.cursor()
         
         cursor.execute('''
-        INSERT INTO tokens (usuario_id, token, data_criacao, data_expiracao)
+        INSERT INTO tokens (usuario_id, token_hash, data_criacao, data_expiracao)
         VALUES (?, ?, ?, ?)
         ''', (
             usuario_id,
-            token,
+            digest_token(token),
             datetime.fromtimestamp(agora).isoformat(),
             datetime.fromtimestamp(expiracao).isoformat()
         ))
@@ -649,8 +825,8 @@ def verificar_token(token: str) -> Dict[str, Any]:
         cursor.execute('''
         SELECT id, revogado 
         FROM tokens
-        WHERE token = ?
-        ''', (token,))
+        WHERE token_hash = ?
+        ''', (digest_token(token),))
         token_data = cursor.fetchone()
 
         if not token_data:
@@ -690,6 +866,33 @@ def verificar_token(token: str) -> Dict[str, Any]:
     except jwt.PyJWTError as e: # Captura outras exceções do PyJWT
         raise InvalidTokenError(str(e)) # The original error 'e' is included in the exception.
 
+def verificar_token_cacheado(token: str) -> Dict[str, Any]:
+    """
+    Verifica um token JWT, reaproveitando uma verificação recente.
+
+    Um token verificado fica em cache por até AUTH_CACHE_TTL segundos, nunca além da
+    sua expiração; a partir daí (ou após revogar_token / revogar_todos_tokens_usuario)
+    a verificação volta ao banco por verificar_token.
+
+    Args:
+        token: Token JWT.
+
+    Returns:
+        Dict[str, Any]: Payload do token se válido.
+
+    Raises:
+        As mesmas exceções de verificar_token.
+    """
+    chave = (database.DATABASE_FILE, token)
+    payload = _cache_tokens.obter(chave)
+    if payload is not None:
+        return payload
+    geracao = _cache_tokens.geracao()
+    payload = verificar_token(token)
+    restante = payload["exp"] - time.time() if "exp" in payload else AUTH_CACHE_TTL
+    _cache_tokens.guardar(chave, payload, min(AUTH_CACHE_TTL, restante), geracao)
+    return payload
+
 def revogar_token(token: str) -> bool:
     """
     Revoga um token JWT.
@@ -703,9 +906,10 @@ def revogar_token(token: str) -> bool:
     with get_db() as conn:
         cursor = conn.cursor()
         
-        cursor.execute('UPDATE tokens SET revogado = 1 WHERE token = ?', (token,))
+        cursor.execute('UPDATE tokens SET revogado = 1 WHERE token_hash = ?', (digest_token(token),))
         
         conn.commit()
+        _cache_tokens.remover(lambda chave, _: chave[1] == token)
         
         return cursor.rowcount > 0
 
@@ -725,9 +929,28 @@ def revogar_todos_tokens_usuario(usuario_id: int) -> int:
         cursor.execute('UPDATE tokens SET revogado = 1 WHERE usuario_id = ?', (usuario_id,))
         
         conn.commit()
+        invalidar_cache_usuario(usuario_id, tokens=True)
         
         return cursor.rowcount
 
+def purgar_tokens(agora: Optional[datetime] = None) -> int:
+    """
+    Remove os tokens expirados e os revogados (que já não autenticam). Executada
+    periodicamente pela manutenção do banco (main._manutencao_periodica_banco).
+
+    Args:
+        agora: Momento de referência da expiração (padrão: agora).
+
+    Returns:
+        int: Número de tokens removidos.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM tokens WHERE revogado = 1 OR data_expiracao < ?',
+                       ((agora or datetime.now()).isoformat(),))
+        conn.commit()
+        return cursor.rowcount
+
 def adicionar_funcao_usuario(usuario_id: int, funcao_nome: str) -> bool:
     """
     Adiciona uma função a um usuário.
@@ -770,6 +993,7 @@ def adicionar_funcao_usuario(usuario_id: int, funcao_nome: str) -> bool:
         ''', (usuario_id, funcao['id']))
         
         conn.commit()
+        invalidar_cache_usuario(usuario_id)
         
         return True
 
@@ -801,6 +1025,7 @@ def remover_funcao_usuario(usuario_id: int, funcao_nome: str) -> bool:
         ''', (usuario_id, funcao['id']))
         
         conn.commit()
+        invalidar_cache_usuario(usuario_id)
         
         return cursor.rowcount > 0
 
@@ -949,6 +1174,8 @@ def atualizar_funcao(funcao_id: int, nome: Optional[str] = None, descricao: Opti
         try:
             cursor.execute(query_sql, tuple(valores_para_atualizar))
             conn.commit()
+            # Renomear uma função altera a lista de funções de todos os usuários que a têm
+            _cache_usuarios.limpar()
             return cursor.rowcount > 0
         except sqlite3.IntegrityError:
              # Captura erro de unicidade caso a verificação anterior falhe por alguma race condition (improvável em SQLite por padrão, mas boa prática)
@@ -1106,11 +1333,15 @@ def redefinir_senha(token: str, nova_senha: str) -> bool:
 def inicializar_autenticacao() -> None:
     """
     Inicializa o sistema de autenticação.
-    Cria as tabelas necessárias, modifica tabelas existentes e insere dados iniciais.
+    Garante o esquema do banco (as tabelas de autenticação fazem parte do esquema
+    versionado de database.criar_tabelas) e o usuário administrador padrão.
+    """
+    criar_tabelas()
+
+def garantir_administrador_padrao() -> None:
+    """
+    Cria o usuário administrador padrão se nenhum usuário tiver a função admin.
     """
-    criar_tabelas_autenticacao()
-    modificar_tabelas_existentes()  # Adicionado para modificar tabelas existentes
-    
     # Verifica se já existe um usuário administrador
     with get_db() as conn:
         cursor = conn.cursor()
@@ -0,0 +1,86 @@
+"""
+Benchmark da verificação de tokens conforme o histórico de logins cresce.
+
+A tabela tokens é preenchida com N tokens de histórico (por padrão 10 mil, 100 mil e
+1 milhão) e a latência de auth.verificar_token (consulta pelo digest indexado e
+decodificação do JWT) é medida sobre tokens válidos. Com o índice UNIQUE em
+token_hash a latência deve ficar estável; também é medido o tempo de auth.purgar_tokens
+quando metade do histórico está expirada.
+
+Uso (a partir de backend/):
+    python -m benchmarks.consulta_tokens [--tamanhos 10000,100000,1000000] [--consultas 2000]
+"""
+import argparse
+import os
+import random
+import secrets
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import auth
+
+def _preencher_historico(quantidade: int, usuario_id: int) -> None:
+    agora = datetime.now()
+    with database.get_db() as conn:
+        lote = []
+        for i in range(quantidade):
+            # Metade do histórico já expirou
+            expiracao = agora + timedelta(days=1) if i % 2 else agora - timedelta(days=1 + i % 30)
+            lote.append((usuario_id, auth.digest_token(secrets.token_hex(32)), agora.isoformat(), expiracao.isoformat()))
+            if len(lote) == 50000:
+                conn.executemany('INSERT INTO tokens (usuario_id, token_hash, data_criacao, data_expiracao) VALUES (?, ?, ?, ?)', lote)
+                lote = []
+        if lote:
+            conn.executemany('INSERT INTO tokens (usuario_id, token_hash, data_criacao, data_expiracao) VALUES (?, ?, ?, ?)', lote)
+        conn.commit()
+
+def _executar_cenario(tamanho: int, consultas: int) -> dict:
+    tmpdir = tempfile.TemporaryDirectory()
+    with patch.object(database, "DATABASE_FILE", os.path.join(tmpdir.name, "bench.db")):
+        database.criar_tabelas()
+        usuario_id = auth.criar_usuario("bench", "bench@example.com", "senha-bench")
+        _preencher_historico(tamanho, usuario_id)
+        tokens = [auth.gerar_token(usuario_id) for _ in range(100)]
+
+        latencias = []
+        for _ in range(consultas):
+            token = random.choice(tokens)
+            inicio = time.perf_counter()
+            auth.verificar_token(token)
+            latencias.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        removidos = auth.purgar_tokens()
+        tempo_purga = time.perf_counter() - inicio
+        database.fechar_conexoes_pool()
+    tmpdir.cleanup()
+
+    latencias.sort()
+    return {
+        "tamanho": tamanho,
+        "media_us": 1e6 * sum(latencias) / len(latencias),
+        "p95_us": 1e6 * latencias[int(len(latencias) * 0.95)],
+        "removidos": removidos,
+        "purga_s": tempo_purga,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanhos", default="10000,100000,1000000", help="Tamanhos do histórico, separados por vírgula")
+    parser.add_argument("--consultas", type=int, default=2000, help="Verificações medidas por tamanho")
+    args = parser.parse_args()
+
+    random.seed(19)
+    print(f"{'histórico':>10} {'média µs':>9} {'p95 µs':>8} {'removidos':>10} {'purga s':>8}")
+    for tamanho in (int(t) for t in args.tamanhos.split(",")):
+        r = _executar_cenario(tamanho, args.consultas)
+        print(f"{r['tamanho']:>10} {r['media_us']:>9.1f} {r['p95_us']:>8.1f} {r['removidos']:>10} {r['purga_s']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
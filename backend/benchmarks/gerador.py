@@ -0,0 +1,173 @@
+"""
+Gerador de carteiras sintéticas para os benchmarks.
+
+A carteira é gerada a partir de uma semente (random.Random próprio), de modo que a
+mesma configuração produz sempre as mesmas operações, eventos, proventos e preços:
+
+- operações distribuídas pelos pregões de `anos` anos, em lotes de 100 ações;
+- day trades (compra e venda do mesmo ticker no mesmo dia) na proporção `day_trade`;
+- vendas a descoberto (venda com posição zerada, coberta pelas compras seguintes)
+  na proporção `descoberto`;
+- eventos corporativos (desdobramento, grupamento e bonificação) e proventos
+  (dividendos e JCP) por ticker;
+- preços diários em passeio aleatório, usados nas operações e servidos pelo
+  `ProvedorPrecosLocal` no lugar do yfinance.
+"""
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+import database
+from models import OperacaoCreate
+
+INICIO_PADRAO = date(2019, 1, 2)
+
+# (evento, razão, fator aplicado à quantidade)
+EVENTOS = (("Desdobramento", "1:2", 2.0), ("Grupamento", "2:1", 0.5), ("Bonificação", "1:10", 1.1))
+TIPOS_PROVENTO = ("DIVIDENDO", "JCP")
+
+def _pregoes(inicio: date, anos: int) -> List[date]:
+    """Dias úteis (segunda a sexta) a partir de `inicio`."""
+    fim = inicio.replace(year=inicio.year + anos)
+    dias = []
+    dia = inicio
+    while dia < fim:
+        if dia.weekday() < 5:
+            dias.append(dia)
+        dia += timedelta(days=1)
+    return dias
+
+def _gerar_precos(rng: random.Random, tickers: List[str], pregoes: List[date]) -> Dict[str, Dict[date, float]]:
+    precos: Dict[str, Dict[date, float]] = {}
+    for ticker in tickers:
+        preco = rng.uniform(5.0, 80.0)
+        serie = {}
+        for dia in pregoes:
+            preco = max(0.5, preco * (1.0 + rng.gauss(0.0, 0.02)))
+            serie[dia] = round(preco, 2)
+        precos[ticker] = serie
+    return precos
+
+def gerar_carteira(
+    operacoes: int,
+    tickers: int = 20,
+    day_trade: float = 0.1,
+    descoberto: float = 0.02,
+    eventos_por_ticker: int = 2,
+    proventos_por_ticker: int = 8,
+    anos: int = 4,
+    semente: int = 22,
+    inicio: date = INICIO_PADRAO,
+) -> Dict[str, Any]:
+    """
+    Gera uma carteira sintética reprodutível.
+
+    Args:
+        operacoes: Número total de operações.
+        tickers: Número de tickers distintos.
+        day_trade: Fração das operações que pertencem a day trades.
+        descoberto: Fração das operações que abrem vendas a descoberto.
+        eventos_por_ticker: Eventos corporativos por ticker.
+        proventos_por_ticker: Proventos por ticker.
+        anos: Anos cobertos pelas operações.
+        semente: Semente do gerador.
+        inicio: Primeiro dia do período.
+
+    Returns:
+        Dict[str, Any]: tickers, operacoes (dicts no formato de OperacaoCreate),
+        eventos, proventos, precos ({ticker: {data: preço}}), inicio e fim.
+    """
+    rng = random.Random(semente)
+    pregoes = _pregoes(inicio, anos)
+    lista_tickers = [f"SINT{i:02d}" for i in range(tickers)]
+    precos = _gerar_precos(rng, lista_tickers, pregoes)
+
+    eventos = []
+    for ticker in lista_tickers:
+        for dia in sorted(rng.sample(pregoes[20:], eventos_por_ticker)):
+            evento, razao, fator = rng.choice(EVENTOS)
+            eventos.append({"ticker": ticker, "evento": evento, "razao": razao, "fator": fator,
+                            "data_ex": dia, "data_aprovacao": dia - timedelta(days=30)})
+
+    proventos = []
+    for ticker in lista_tickers:
+        for dia in sorted(rng.sample(pregoes[20:], proventos_por_ticker)):
+            proventos.append({"ticker": ticker, "tipo": rng.choice(TIPOS_PROVENTO), "valor": round(rng.uniform(0.05, 1.5), 4),
+                              "data_registro": dia - timedelta(days=1), "data_ex": dia,
+                              "dt_pagamento": dia + timedelta(days=rng.randint(10, 60))})
+
+    # Eventos por data ex, para manter a posição acompanhada igual à do motor
+    eventos_pendentes: List[Tuple[date, str, float]] = sorted((e["data_ex"], e["ticker"], e["fator"]) for e in eventos)
+    posicao = dict.fromkeys(lista_tickers, 0)
+    lista_operacoes: List[Dict[str, Any]] = []
+
+    def registrar(dia: date, ticker: str, operacao: str, quantidade: int) -> None:
+        preco = round(precos[ticker][dia] * rng.uniform(0.99, 1.01), 2)
+        lista_operacoes.append({"date": dia.isoformat(), "ticker": ticker, "operation": operacao,
+                                "quantity": quantidade, "price": preco, "fees": round(preco * quantidade * 0.0003, 2)})
+
+    while len(lista_operacoes) < operacoes:
+        dia = pregoes[len(lista_operacoes) * len(pregoes) // operacoes]
+        while eventos_pendentes and eventos_pendentes[0][0] <= dia:
+            _, ticker_evento, fator = eventos_pendentes.pop(0)
+            posicao[ticker_evento] = int(round(posicao[ticker_evento] * fator))
+
+        ticker = rng.choice(lista_tickers)
+        quantidade = rng.randint(1, 10) * 100
+        sorteio = rng.random()
+        if sorteio < day_trade and len(lista_operacoes) + 2 <= operacoes:
+            registrar(dia, ticker, "buy", quantidade)
+            registrar(dia, ticker, "sell", quantidade)
+        elif sorteio < day_trade + descoberto and posicao[ticker] == 0:
+            registrar(dia, ticker, "sell", quantidade)
+            posicao[ticker] -= quantidade
+        elif posicao[ticker] > 0 and rng.random() < 0.4:
+            # Venda parcial ou, às vezes, zerando a posição
+            quantidade = posicao[ticker] if rng.random() < 0.2 else min(quantidade, posicao[ticker])
+            registrar(dia, ticker, "sell", quantidade)
+            posicao[ticker] -= quantidade
+        else:
+            registrar(dia, ticker, "buy", quantidade)
+            posicao[ticker] += quantidade
+
+    return {
+        "tickers": lista_tickers,
+        "operacoes": lista_operacoes,
+        "eventos": eventos,
+        "proventos": proventos,
+        "precos": precos,
+        "inicio": pregoes[0],
+        "fim": pregoes[-1],
+    }
+
+def gravar_referencias(carteira: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Grava as ações, os eventos corporativos e os proventos da carteira (tabelas
+    globais, compartilhadas por todos os usuários).
+
+    Returns:
+        Dict[str, int]: ID da ação de cada ticker.
+    """
+    with database.get_db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO acoes (ticker, nome) VALUES (?, ?)",
+                         [(ticker, f"Sintética {ticker}") for ticker in carteira["tickers"]])
+        conn.commit()
+        ids = {row["ticker"]: row["id"] for row in conn.execute("SELECT id, ticker FROM acoes")}
+
+    for evento in carteira["eventos"]:
+        database.inserir_evento_corporativo({
+            "id_acao": ids[evento["ticker"]], "evento": evento["evento"], "razao": evento["razao"],
+            "data_aprovacao": evento["data_aprovacao"].isoformat(), "data_registro": evento["data_ex"].isoformat(),
+            "data_ex": evento["data_ex"].isoformat(),
+        })
+    for provento in carteira["proventos"]:
+        database.inserir_provento({
+            "id_acao": ids[provento["ticker"]], "tipo": provento["tipo"], "valor": provento["valor"],
+            "data_registro": provento["data_registro"].isoformat(), "data_ex": provento["data_ex"].isoformat(),
+            "dt_pagamento": provento["dt_pagamento"].isoformat(),
+        })
+    return ids
+
+def operacoes_create(carteira: Dict[str, Any]) -> List[OperacaoCreate]:
+    """Operações da carteira como OperacaoCreate, prontas para processar_operacoes."""
+    return [OperacaoCreate(**op) for op in carteira["operacoes"]]
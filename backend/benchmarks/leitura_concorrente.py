@@ -0,0 +1,122 @@
+"""
+Benchmark de leituras concorrentes durante um recálculo em massa.
+
+Um usuário com muitas operações é recalculado em laço (recalcular_posicoes_usuario,
+que reescreve carteira, resultados mensais e operações fechadas) enquanto threads
+leitoras consultam a carteira e os resultados mensais de outros usuários, como os
+endpoints de resumo. O mesmo cenário roda com cada modo de journal (por padrão,
+DELETE, o padrão do SQLite, e WAL) e reporta leituras por segundo e latência.
+
+Uso (a partir de backend/):
+    python -m benchmarks.leitura_concorrente [--operacoes 5000] [--leitores 4] [--segundos 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+
+TICKERS = ["PETR4", "VALE3", "ITUB4", "BBAS3", "BBDC4", "ABEV3", "WEGE3", "ITSA4"]
+
+def _gerar_operacoes(quantidade: int, usuario_id: int, rng: random.Random) -> List[tuple]:
+    linhas = []
+    inicio = date(2020, 1, 1).toordinal()
+    for _ in range(quantidade):
+        linhas.append((date.fromordinal(inicio + rng.randint(0, 1800)).isoformat(), rng.choice(TICKERS),
+                       rng.choice(["buy", "buy", "sell"]), rng.randint(1, 20) * 100,
+                       round(rng.uniform(10, 50), 2), round(rng.uniform(0, 10), 2), usuario_id))
+    return sorted(linhas)
+
+def _preparar_banco(operacoes_recalculo: int, usuarios_leitura: int) -> None:
+    database.criar_tabelas()
+    rng = random.Random(17)
+    with database.get_db() as conn:
+        conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', [(t, t) for t in TICKERS])
+        for usuario_id in range(1, usuarios_leitura + 2):
+            quantidade = operacoes_recalculo if usuario_id == 1 else 500
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                _gerar_operacoes(quantidade, usuario_id, rng))
+        conn.commit()
+    for usuario_id in range(1, usuarios_leitura + 2):
+        services.recalcular_posicoes_usuario(usuario_id)
+
+def _executar_cenario(journal_mode: str, operacoes: int, leitores: int, segundos: float) -> Dict[str, Any]:
+    tmpdir = tempfile.TemporaryDirectory()
+    arquivo = os.path.join(tmpdir.name, "bench.db")
+    with patch.object(database, "DATABASE_FILE", arquivo), \
+            patch.object(database, "DB_JOURNAL_MODE", journal_mode), \
+            patch.object(database, "_pool_conexoes", database.PoolConexoes(leitores + 4)):
+        _preparar_banco(operacoes, leitores)
+
+        parar = threading.Event()
+        latencias: List[List[float]] = [[] for _ in range(leitores)]
+        erros = [0] * leitores
+        recalculos = [0]
+
+        def recalcular():
+            while not parar.is_set():
+                services.recalcular_posicoes_usuario(1)
+                recalculos[0] += 1
+            database.fechar_conexoes_pool()
+
+        def ler(indice: int):
+            usuario_id = indice + 2
+            while not parar.is_set():
+                inicio = time.perf_counter()
+                try:
+                    database.obter_carteira_atual(usuario_id)
+                    database.obter_resultados_mensais(usuario_id)
+                except database.sqlite3.OperationalError:
+                    erros[indice] += 1  # "database is locked" após o busy_timeout
+                    continue
+                latencias[indice].append(time.perf_counter() - inicio)
+            database.fechar_conexoes_pool()
+
+        threads = [threading.Thread(target=recalcular)] + [threading.Thread(target=ler, args=(i,)) for i in range(leitores)]
+        for thread in threads:
+            thread.start()
+        time.sleep(segundos)
+        parar.set()
+        for thread in threads:
+            thread.join()
+        database.fechar_conexoes_pool()
+
+    tmpdir.cleanup()
+    todas = sorted(latencia for por_leitor in latencias for latencia in por_leitor)
+    return {
+        "journal_mode": journal_mode,
+        "leituras_por_segundo": len(todas) / segundos,
+        "latencia_media_ms": 1000 * sum(todas) / len(todas) if todas else 0.0,
+        "latencia_p95_ms": 1000 * todas[int(len(todas) * 0.95)] if todas else 0.0,
+        "latencia_max_ms": 1000 * todas[-1] if todas else 0.0,
+        "erros_lock": sum(erros),
+        "recalculos": recalculos[0],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--operacoes", type=int, default=5000, help="Operações do usuário recalculado em laço")
+    parser.add_argument("--leitores", type=int, default=4, help="Threads leitoras")
+    parser.add_argument("--segundos", type=float, default=5.0, help="Duração de cada cenário")
+    parser.add_argument("--modos", default="DELETE,WAL", help="Modos de journal comparados, separados por vírgula")
+    args = parser.parse_args()
+
+    print(f"{'journal':<8} {'leituras/s':>11} {'média ms':>9} {'p95 ms':>8} {'máx ms':>8} {'locks':>6} {'recálculos':>10}")
+    for modo in args.modos.upper().split(","):
+        r = _executar_cenario(modo, args.operacoes, args.leitores, args.segundos)
+        print(f"{r['journal_mode']:<8} {r['leituras_por_segundo']:>11.1f} {r['latencia_media_ms']:>9.2f} "
+              f"{r['latencia_p95_ms']:>8.2f} {r['latencia_max_ms']:>8.2f} {r['erros_lock']:>6} {r['recalculos']:>10}")
+
+if __name__ == "__main__":
+    main()
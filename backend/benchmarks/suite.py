@@ -0,0 +1,149 @@
+"""
+Suíte de benchmarks dos caminhos de recálculo e de análise.
+
+Para cada tamanho (por padrão 1 mil, 10 mil e 100 mil operações) uma carteira
+sintética é gerada com benchmarks.gerador (mesma semente, mesmos dados) em um banco
+temporário e cada etapa é medida:
+
+- processar_operacoes: gravação das operações e recálculo incremental;
+- recalcular_carteira, recalcular_resultados, calcular_operacoes_fechadas;
+- recalcular_proventos_recebidos_rapido;
+- calculate_portfolio_history: leitura das operações como no endpoint de histórico e
+  curva mensal, com os preços do gerador servidos por ProvedorPrecosLocal (offline);
+- get_bens_e_direitos_acoes em 31/12 do último ano.
+
+São reportados o tempo, o número de comandos SQL executados (trace callback das
+conexões do pool) e o pico de memória alocada (tracemalloc). Como o tracemalloc
+deixa o código várias vezes mais lento, o pico é medido em uma segunda passada sobre
+um segundo usuário com as mesmas operações; o tempo vem da primeira passada.
+
+Uso (a partir de backend/):
+    python -m benchmarks.suite [--tamanhos 1000,10000,100000] [--tickers 20] [--day-trade 0.1]
+        [--descoberto 0.02] [--eventos 2] [--proventos 8] [--semente 22] [--sem-memoria] [--json saida.json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date
+from typing import Any, Callable, Dict, List, Tuple
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+from app.services import precos_historicos
+from app.services.portfolio_analysis_service import calculate_portfolio_history, get_bens_e_direitos_acoes
+from app.services.precos_historicos import ProvedorPrecosLocal
+from benchmarks import gerador
+
+class ContadorConsultas:
+    """Conta os comandos SQL executados pelas conexões abertas durante o benchmark."""
+
+    def __init__(self):
+        self.total = 0
+
+    def _contar(self, comando: str) -> None:
+        self.total += 1
+
+    def instalar(self):
+        """Aplica o trace callback a cada conexão nova do pool."""
+        original = database._aplicar_perfil_armazenamento
+
+        def aplicar(conn, arquivo):
+            original(conn, arquivo)
+            conn.set_trace_callback(self._contar)
+        return patch.object(database, "_aplicar_perfil_armazenamento", aplicar)
+
+def _historico(usuario_id: int, inicio: date, fim: date) -> Dict[str, Any]:
+    # Mesma leitura do endpoint /analysis/portfolio/equity-history
+    operacoes = database.obter_operacoes_motor_db(usuario_id)
+    return calculate_portfolio_history(operacoes, inicio.isoformat(), fim.isoformat(), "monthly")
+
+def _etapas(carteira: Dict[str, Any], operacoes: List[Any], usuario_id: int) -> List[Tuple[str, Callable[[], Any]]]:
+    return [
+        ("processar_operacoes", lambda: services.processar_operacoes(operacoes, usuario_id)),
+        ("recalcular_carteira", lambda: services.recalcular_carteira(usuario_id)),
+        ("recalcular_resultados", lambda: services.recalcular_resultados(usuario_id)),
+        ("calcular_operacoes_fechadas", lambda: services.calcular_operacoes_fechadas(usuario_id)),
+        ("recalcular_proventos_recebidos_rapido", lambda: services.recalcular_proventos_recebidos_rapido(usuario_id)),
+        ("calculate_portfolio_history", lambda: _historico(usuario_id, carteira["inicio"], carteira["fim"])),
+        ("get_bens_e_direitos_acoes", lambda: get_bens_e_direitos_acoes(usuario_id, f"{carteira['fim'].year}-12-31")),
+    ]
+
+def executar_tamanho(tamanho: int, parametros: Dict[str, Any], medir_memoria: bool = True) -> List[Dict[str, Any]]:
+    """
+    Gera a carteira de `tamanho` operações em um banco temporário e mede cada etapa.
+
+    Returns:
+        List[Dict[str, Any]]: Uma linha por etapa (etapa, operacoes, tempo_s, consultas, pico_mib).
+    """
+    carteira = gerador.gerar_carteira(tamanho, **parametros)
+    operacoes = gerador.operacoes_create(carteira)
+    contador = ContadorConsultas()
+    resultados: List[Dict[str, Any]] = []
+    tmpdir = tempfile.TemporaryDirectory()
+    provedor_original = precos_historicos._cache_precos.provedor
+    # Os serviços ainda imprimem mensagens de diagnóstico; ficam fora do relatório
+    with open(os.devnull, "w") as nulo, redirect_stdout(nulo), contador.instalar(), \
+            patch.object(database, "DATABASE_FILE", os.path.join(tmpdir.name, "bench.db")):
+        try:
+            database.criar_tabelas()
+            precos_historicos.configurar_provedor_precos(ProvedorPrecosLocal(carteira["precos"]))
+            gerador.gravar_referencias(carteira)
+
+            for nome, etapa in _etapas(carteira, operacoes, usuario_id=1):
+                consultas_antes = contador.total
+                inicio = time.perf_counter()
+                etapa()
+                resultados.append({"etapa": nome, "operacoes": tamanho, "tempo_s": time.perf_counter() - inicio,
+                                   "consultas": contador.total - consultas_antes, "pico_mib": None})
+
+            if medir_memoria:
+                precos_historicos.limpar_cache_precos()
+                for resultado, (_, etapa) in zip(resultados, _etapas(carteira, operacoes, usuario_id=2)):
+                    tracemalloc.start()
+                    try:
+                        etapa()
+                        resultado["pico_mib"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                    finally:
+                        tracemalloc.stop()
+        finally:
+            precos_historicos.configurar_provedor_precos(provedor_original)
+            database.fechar_conexoes_pool()
+    tmpdir.cleanup()
+    return resultados
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanhos", default="1000,10000,100000", help="Números de operações, separados por vírgula")
+    parser.add_argument("--tickers", type=int, default=20, help="Tickers distintos na carteira")
+    parser.add_argument("--day-trade", type=float, default=0.1, help="Fração das operações em day trades")
+    parser.add_argument("--descoberto", type=float, default=0.02, help="Fração das operações que abrem vendas a descoberto")
+    parser.add_argument("--eventos", type=int, default=2, help="Eventos corporativos por ticker")
+    parser.add_argument("--proventos", type=int, default=8, help="Proventos por ticker")
+    parser.add_argument("--semente", type=int, default=22, help="Semente do gerador")
+    parser.add_argument("--sem-memoria", action="store_true", help="Não mede o pico de memória (sem a segunda passada)")
+    parser.add_argument("--json", help="Grava os resultados em JSON, para comparação entre versões")
+    args = parser.parse_args()
+
+    parametros = {"tickers": args.tickers, "day_trade": args.day_trade, "descoberto": args.descoberto,
+                  "eventos_por_ticker": args.eventos, "proventos_por_ticker": args.proventos, "semente": args.semente}
+    todos: List[Dict[str, Any]] = []
+    print(f"{'etapa':<38} {'operações':>9} {'tempo s':>8} {'consultas':>9} {'pico MiB':>9}")
+    for tamanho in (int(t) for t in args.tamanhos.split(",")):
+        for r in executar_tamanho(tamanho, parametros, medir_memoria=not args.sem_memoria):
+            pico = f"{r['pico_mib']:>9.1f}" if r["pico_mib"] is not None else f"{'-':>9}"
+            print(f"{r['etapa']:<38} {r['operacoes']:>9} {r['tempo_s']:>8.3f} {r['consultas']:>9} {pico}")
+            todos.append(r)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as arquivo:
+            json.dump({"parametros": parametros, "resultados": todos}, arquivo, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,46 @@
 import sqlite3
-from datetime import date, datetime
+import os
+import json
+import threading
+import logging
+from datetime import date, datetime, timedelta
 from contextlib import contextmanager
-from typing import Dict, List, Any, Optional
-# Unused imports json, Union, defaultdict removed
+from typing import Dict, List, Any, Optional, Set
+# Unused imports Union, defaultdict removed
+
+from migracoes import VERSAO_ESQUEMA, aplicar_migracoes, obter_versao_esquema
+from instrumentacao_db import ConexaoInstrumentada, sem_medicao
+from metricas import MetricaColetada
+from registro_operacao import COLUNAS_REGISTRO, RegistroOperacao, linha_para_registro
 
 # Caminho para o banco de dados SQLite
 DATABASE_FILE = "acoes_ir.db" # Changed to relative path
 
+# Número máximo de conexões mantidas abertas para reutilização (somando todas as threads)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))
+
+# Perfil de armazenamento aplicado a cada conexão nova (ver _aplicar_perfil_armazenamento).
+# WAL permite leituras concorrentes com uma escrita em andamento; com WAL, synchronous=NORMAL
+# só sincroniza o disco nos checkpoints e continua seguro contra corrupção (uma queda de
+# energia pode perder apenas as últimas transações confirmadas).
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL").upper()
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL").upper()
+# Cache de páginas por conexão, em KiB
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+# Bytes do arquivo lidos via mmap (0 desativa)
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Tempo máximo de espera por um lock antes de "database is locked", em milissegundos
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# Intervalo da manutenção periódica (checkpoint do WAL e PRAGMA optimize), em segundos; 0 desativa
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_INTERVAL", "600"))
+# Dias que os jobs de recálculo finalizados (concluido/erro) ficam na tabela jobs_recalculo
+RECALC_JOBS_RETENTION_DAYS = int(os.getenv("RECALC_JOBS_RETENTION_DAYS", "7"))
+# Conexões com contagem de consultas, linhas e tempo por requisição (ver instrumentacao_db.py)
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "1").lower() in ("1", "true", "sim")
+
+_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+_SYNCHRONOUS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
 def obter_acao_info_por_ticker(ticker: str) -> Optional[Dict[str, Any]]:
     """
     Obtém informações de uma ação (ticker, nome, cnpj) pelo ticker.
@@ -23,7 +57,7 @@ def obter_acao_info_por_ticker(ticker: str) -> Optional[Dict[str, Any]]:
 sqlite3.register_adapter(date, lambda val: val.isoformat())
 
 # Convert DATE column string (YYYY-MM-DD) from DB to datetime.date objects when reading
-sqlite3.register_converter("date", lambda val: datetime.strptime(val.decode(), "%Y-%m-%d").date())
+sqlite3.register_converter("date", lambda val: date.fromisoformat(val.decode()))
 
 def _transform_date_string_to_iso(date_str: Optional[str]) -> Optional[str]:
     if not date_str or date_str.strip() == '--' or date_str.strip() == '':
@@ -43,21 +77,264 @@ def _transform_date_string_to_iso(date_str: Optional[str]) -> Optional[str]:
             print(f"WARNING: Could not parse date string '{date_str}' during proventos migration. Storing as NULL.")
             return None
 
+class _EntradaConexao:
+    """Conexão mantida no pool para uma thread e um arquivo de banco."""
+    __slots__ = ("conn", "inode", "profundidade", "em_cache")
+
+    def __init__(self, conn: sqlite3.Connection, inode: Optional[int], em_cache: bool):
+        self.conn = conn
+        self.inode = inode
+        self.profundidade = 0
+        self.em_cache = em_cache
+
+
+def _aplicar_perfil_armazenamento(conn: sqlite3.Connection, arquivo: str) -> None:
+    """
+    Aplica o perfil de armazenamento (DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE, DB_BUSY_TIMEOUT_MS) a uma conexão recém-aberta.
+    """
+    # Primeiro o busy_timeout: a troca para WAL precisa de um lock exclusivo momentâneo
+    conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+    if arquivo != ":memory:":
+        # journal_mode é persistente no arquivo; mmap não se aplica a bancos em memória
+        if DB_JOURNAL_MODE in _JOURNAL_MODES:
+            try:
+                conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+            except sqlite3.OperationalError as e:
+                logging.warning(f"Não foi possível aplicar journal_mode={DB_JOURNAL_MODE} em {arquivo}: {e}")
+        else:
+            logging.warning(f"DB_JOURNAL_MODE inválido: {DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+    if DB_SYNCHRONOUS in _SYNCHRONOUS:
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    else:
+        logging.warning(f"DB_SYNCHRONOUS inválido: {DB_SYNCHRONOUS}")
+    # Valor negativo: tamanho em KiB, independente do tamanho de página
+    conn.execute(f"PRAGMA cache_size = {-int(DB_CACHE_SIZE_KB)}")
+
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite com afinidade por thread.
+
+    Cada thread reutiliza sua própria conexão para cada arquivo de banco (conexões sqlite3
+    não podem ser compartilhadas entre threads). Chamadas aninhadas de get_db() na mesma
+    thread compartilham a conexão; ao sair do contexto mais externo, uma transação não
+    confirmada é desfeita, como acontecia ao fechar a conexão. No máximo `tamanho`
+    conexões ficam abertas para reutilização; acima disso a conexão é fechada ao final do uso.
+    """
+
+    def __init__(self, tamanho: int):
+        self.tamanho = tamanho
+        self._lock = threading.Lock()
+        self._conexoes: Dict[threading.Thread, Dict[str, _EntradaConexao]] = {}
+        self._metricas = {"checkouts": 0, "reutilizacoes": 0, "conexoes_criadas": 0, "conexoes_descartadas": 0}
+
+    @staticmethod
+    def _inode(arquivo: str) -> Optional[int]:
+        try:
+            return os.stat(arquivo).st_ino
+        except OSError:
+            return None
+
+    def _valida(self, entrada: _EntradaConexao, arquivo: str) -> bool:
+        """Verifica se a conexão ainda está aberta e aponta para o mesmo arquivo."""
+        try:
+            entrada.conn.total_changes
+        except sqlite3.ProgrammingError:
+            return False
+        return entrada.inode is None or self._inode(arquivo) == entrada.inode
+
+    def _conexoes_em_cache(self) -> int:
+        return sum(1 for por_arquivo in self._conexoes.values() for e in por_arquivo.values() if e.em_cache)
+
+    def _liberar_espaco(self, thread_atual: threading.Thread) -> None:
+        """Descarta conexões de threads encerradas e, se preciso, a conexão ociosa mais antiga da thread atual."""
+        for thread in [t for t in self._conexoes if not t.is_alive()]:
+            # A conexão é finalizada pelo coletor de lixo (não pode ser fechada por outra thread)
+            self._metricas["conexoes_descartadas"] += len(self._conexoes.pop(thread))
+        if self._conexoes_em_cache() < self.tamanho:
+            return
+        por_arquivo = self._conexoes.get(thread_atual, {})
+        for arquivo, entrada in list(por_arquivo.items()):
+            if entrada.profundidade == 0:
+                entrada.conn.close()
+                del por_arquivo[arquivo]
+                self._metricas["conexoes_descartadas"] += 1
+                return
+
+    def obter(self, arquivo: str) -> sqlite3.Connection:
+        """Obtém a conexão da thread atual para `arquivo`, abrindo uma nova se necessário."""
+        thread_atual = threading.current_thread()
+        with self._lock:
+            self._metricas["checkouts"] += 1
+            por_arquivo = self._conexoes.setdefault(thread_atual, {})
+            entrada = por_arquivo.get(arquivo)
+            if entrada is not None and entrada.profundidade == 0 and not self._valida(entrada, arquivo):
+                # Arquivo removido/recriado ou conexão fechada externamente
+                entrada.conn.close()
+                del por_arquivo[arquivo]
+                self._metricas["conexoes_descartadas"] += 1
+                entrada = None
+            if entrada is not None:
+                self._metricas["reutilizacoes"] += 1
+                entrada.profundidade += 1
+                return entrada.conn
+
+            if self._conexoes_em_cache() >= self.tamanho:
+                self._liberar_espaco(thread_atual)
+            em_cache = self._conexoes_em_cache() < self.tamanho
+
+        conn = sqlite3.connect(arquivo, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES,
+                               factory=ConexaoInstrumentada if DB_INSTRUMENTATION else sqlite3.Connection)
+        conn.row_factory = sqlite3.Row
+        # A configuração da conexão não entra na contagem de consultas da requisição
+        with sem_medicao():
+            _aplicar_perfil_armazenamento(conn, arquivo)
+        entrada = _EntradaConexao(conn, None if arquivo == ":memory:" else self._inode(arquivo), em_cache)
+        entrada.profundidade = 1
+        with self._lock:
+            self._metricas["conexoes_criadas"] += 1
+            self._conexoes.setdefault(thread_atual, {})[arquivo] = entrada
+        return conn
+
+    def devolver(self, arquivo: str) -> None:
+        """Devolve a conexão da thread atual ao final do contexto get_db()."""
+        thread_atual = threading.current_thread()
+        with self._lock:
+            entrada = self._conexoes.get(thread_atual, {}).get(arquivo)
+            if entrada is None:
+                return
+            entrada.profundidade -= 1
+            if entrada.profundidade > 0:
+                return
+            if not entrada.em_cache:
+                del self._conexoes[thread_atual][arquivo]
+        if entrada.em_cache:
+            try:
+                if entrada.conn.in_transaction:
+                    entrada.conn.rollback()
+                entrada.conn.row_factory = sqlite3.Row
+            except sqlite3.ProgrammingError:
+                pass  # Conexão fechada durante o uso; será descartada no próximo checkout
+        else:
+            entrada.conn.close()
+
+    def fechar_conexoes_thread(self) -> None:
+        """Fecha as conexões ociosas da thread atual (ex.: ao final de testes ou no shutdown)."""
+        thread_atual = threading.current_thread()
+        with self._lock:
+            por_arquivo = self._conexoes.get(thread_atual, {})
+            for arquivo, entrada in list(por_arquivo.items()):
+                if entrada.profundidade == 0:
+                    entrada.conn.close()
+                    del por_arquivo[arquivo]
+
+    def metricas(self) -> Dict[str, Any]:
+        """Retorna os contadores de uso do pool."""
+        with self._lock:
+            metricas = dict(self._metricas)
+            metricas["conexoes_em_cache"] = self._conexoes_em_cache()
+            metricas["conexoes_em_uso"] = sum(1 for por_arquivo in self._conexoes.values()
+                                              for e in por_arquivo.values() if e.profundidade > 0)
+            metricas["tamanho_pool"] = self.tamanho
+            metricas["taxa_reutilizacao"] = metricas["reutilizacoes"] / metricas["checkouts"] if metricas["checkouts"] else 0.0
+            return metricas
+
+
+_pool_conexoes = PoolConexoes(DB_POOL_SIZE)
+
+
+def configurar_pool_conexoes(tamanho: int) -> None:
+    """
+    Altera o número máximo de conexões mantidas abertas para reutilização.
+
+    Args:
+        tamanho: Novo tamanho do pool (0 desativa a reutilização entre chamadas).
+    """
+    _pool_conexoes.tamanho = tamanho
+
+
+def obter_metricas_pool_conexoes() -> Dict[str, Any]:
+    """
+    Retorna as métricas do pool de conexões (checkouts, reutilizações, conexões
+    criadas/descartadas, conexões em cache, tamanho do pool e taxa de reutilização).
+    """
+    return _pool_conexoes.metricas()
+
+
+def _coletar_pool(*campos: str):
+    def coletar():
+        metricas = _pool_conexoes.metricas()
+        return [((), sum(metricas[campo] for campo in campos))]
+    return coletar
+
+MetricaColetada("investir_db_conexoes_em_uso", "Conexões do pool em uso por alguma thread.", "gauge", (), _coletar_pool("conexoes_em_uso"))
+MetricaColetada("investir_db_conexoes_em_cache", "Conexões mantidas abertas pelo pool.", "gauge", (), _coletar_pool("conexoes_em_cache"))
+MetricaColetada("investir_db_pool_tamanho", "Máximo de conexões mantidas abertas (DB_POOL_SIZE).", "gauge", (), _coletar_pool("tamanho_pool"))
+MetricaColetada("investir_db_checkouts_total", "Conexões obtidas do pool (get_db).", "counter", (), _coletar_pool("checkouts"))
+MetricaColetada("investir_db_conexoes_criadas_total", "Conexões SQLite abertas pelo pool.", "counter", (), _coletar_pool("conexoes_criadas"))
+
+
+def fechar_conexoes_pool() -> None:
+    """Fecha as conexões ociosas do pool mantidas pela thread atual."""
+    _pool_conexoes.fechar_conexoes_thread()
+
+
+def manter_banco() -> Dict[str, Any]:
+    """
+    Manutenção periódica do banco: checkpoint do WAL (truncando o arquivo -wal, que
+    só cresce enquanto houver leitores impedindo o checkpoint automático) e
+    PRAGMA optimize (atualiza as estatísticas do planejador quando necessário).
+
+    Returns:
+        Dict[str, Any]: Resultado do checkpoint (ocupado, paginas_wal, paginas_copiadas).
+        Fora do modo WAL, paginas_wal e paginas_copiadas são -1.
+    """
+    with get_db() as conn:
+        ocupado, paginas_wal, paginas_copiadas = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        conn.execute("PRAGMA optimize")
+    return {"ocupado": bool(ocupado), "paginas_wal": paginas_wal, "paginas_copiadas": paginas_copiadas}
+
+
 @contextmanager
 def get_db():
     """
     Contexto para conexão com o banco de dados.
+    A conexão vem do pool (reutilizada pela thread atual); uma transação não
+    confirmada ao final do contexto mais externo é desfeita.
     """
-    conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
+    arquivo = DATABASE_FILE
+    conn = _pool_conexoes.obter(arquivo)
     try:
         yield conn
     finally:
-        conn.close()
+        _pool_conexoes.devolver(arquivo)
 
 def criar_tabelas():
     """
-    Cria as tabelas necessárias se não existirem e adiciona colunas ausentes.
+    Garante o esquema do banco e o usuário administrador padrão.
+
+    Um banco já na versão atual custa uma única consulta a schema_version. Um banco
+    novo, ou anterior ao versionamento (versão 0), recebe o esquema base (com as
+    verificações e migrações legadas) uma única vez; em seguida são aplicadas as
+    migrações pendentes de migracoes.py.
+    """
+    with get_db() as conn:
+        versao = obter_versao_esquema(conn)
+        if versao < VERSAO_ESQUEMA:
+            if versao == 0:
+                _criar_esquema_base()
+            aplicar_migracoes(conn)
+
+    from auth import garantir_administrador_padrao # Importação tardia: auth importa este módulo
+    garantir_administrador_padrao()
+
+def _criar_esquema_base():
+    """
+    Cria as tabelas se não existirem e adiciona colunas ausentes (esquema anterior ao
+    versionamento). Executado apenas para bancos na versão 0; alterações de esquema
+    posteriores entram como migrações em migracoes.py.
     """
     with get_db() as conn:
         cursor = conn.cursor()
@@ -119,7 +396,9 @@ def criar_tabelas():
                 cursor.execute('''
                     INSERT INTO operacoes_temp (id, date, ticker, operation, quantity, price, fees, usuario_id, corretora_id)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (row['id'], date_iso, row['ticker'], row['operation'], row['quantity'], row['price'], row['fees'], row['usuario_id'], row['corretora_id']))
+                ''', (row['id'], date_iso, row['ticker'], row['operation'], row['quantity'], row['price'], row['fees'], row['usuario_id'],
+                      # corretora_id só é adicionada mais adiante em bancos antigos
+                      row['corretora_id'] if 'corretora_id' in row.keys() else None))
             cursor.execute('DROP TABLE operacoes')
             cursor.execute('ALTER TABLE operacoes_temp RENAME TO operacoes')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_date ON operacoes(date)')
@@ -263,6 +542,18 @@ def criar_tabelas():
         # Adicionar a coluna usuario_id se ela não existir
         if 'usuario_id' not in colunas:
             cursor.execute('ALTER TABLE operacoes_fechadas ADD COLUMN usuario_id INTEGER DEFAULT NULL')
+
+        # Campos da OperacaoFechada guardados para que a leitura não precise recalcular o FIFO.
+        # operacoes_relacionadas é a lista de OperacaoDetalhe em JSON.
+        for coluna, definicao in [
+            ('tipo', 'TEXT'),
+            ('taxas_total', 'REAL NOT NULL DEFAULT 0.0'),
+            ('day_trade', 'BOOLEAN NOT NULL DEFAULT 0'),
+            ('status_ir', 'TEXT'),
+            ('operacoes_relacionadas', 'TEXT'),
+        ]:
+            if coluna not in colunas:
+                cursor.execute(f'ALTER TABLE operacoes_fechadas ADD COLUMN {coluna} {definicao}')
         
         # Criar índices para melhorar performance nas consultas
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_date ON operacoes(date)')
@@ -433,12 +724,20 @@ def criar_tabelas():
         # Criar índice para a coluna id_acao na tabela eventos_corporativos
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_eventos_corporativos_id_acao ON eventos_corporativos(id_acao);')
         
-        # Adiciona índices para as colunas usuario_id
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_usuario_id ON operacoes(usuario_id)')
+        # Adiciona índices para as colunas usuario_id (os demais índices por usuário estão em migracoes.py)
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_usuario_ticker_date ON operacoes(usuario_id, ticker, date);') # New composite index
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_resultados_mensais_usuario_id ON resultados_mensais(usuario_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_carteira_atual_usuario_id ON carteira_atual(usuario_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_fechadas_usuario_id ON operacoes_fechadas(usuario_id)')
+        # Busca dos usuários com posição em um ticker (distribuição de novos proventos)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_ticker_usuario_date ON operacoes(ticker, usuario_id, date);')
+        # Um resultado por usuário e mês: permite o upsert em lote de salvar_resultados_mensais_em_lote
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_resultados_mensais_usuario_mes'")
+        if not cursor.fetchone():
+            # Remove duplicatas antigas (mantém o registro mais recente de cada mês)
+            cursor.execute('''
+                DELETE FROM resultados_mensais
+                WHERE usuario_id IS NOT NULL
+                  AND id NOT IN (SELECT MAX(id) FROM resultados_mensais WHERE usuario_id IS NOT NULL GROUP BY usuario_id, mes)
+            ''')
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_resultados_mensais_usuario_mes ON resultados_mensais(usuario_id, mes)')
 
         # Tabela usuario_proventos_recebidos
         cursor.execute('''
@@ -463,7 +762,6 @@ def criar_tabelas():
         ''')
 
         # Índices para usuario_proventos_recebidos
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_usr_prov_rec_usuario_id ON usuario_proventos_recebidos(usuario_id);')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_usr_prov_rec_acao_id ON usuario_proventos_recebidos(id_acao);')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_usr_prov_rec_dt_pagamento ON usuario_proventos_recebidos(dt_pagamento);')
         cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_usr_prov_rec_usr_prov_glob ON usuario_proventos_recebidos(usuario_id, provento_global_id);')
@@ -478,6 +776,108 @@ def criar_tabelas():
         )
         ''')
 
+        # Tabela de checkpoints mensais do apurador de resultados (estado de swing trade por ticker
+        # ao final de cada mês com operações). Permite recalcular apenas a partir do mês afetado.
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS checkpoints_resultados (
+            usuario_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            custo_total REAL NOT NULL DEFAULT 0.0,
+            preco_medio REAL NOT NULL DEFAULT 0.0,
+            quantidade_vendida INTEGER NOT NULL DEFAULT 0,
+            valor_total_venda REAL NOT NULL DEFAULT 0.0,
+            preco_medio_venda REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (usuario_id, ticker, mes)
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkpoints_resultados_usuario_mes ON checkpoints_resultados(usuario_id, mes);')
+
+        # Versão das operações de cada usuário e ticker, incrementada por gatilhos a cada
+        # inclusão, alteração ou remoção (e por novos eventos corporativos do ticker).
+        # operacoes_fechadas_versoes guarda a versão a partir da qual as operações fechadas
+        # do ticker foram calculadas: versões diferentes indicam operações fechadas desatualizadas.
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='versoes_operacoes'")
+        versoes_existentes = cursor.fetchone() is not None
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS versoes_operacoes (
+            usuario_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            versao INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (usuario_id, ticker)
+        )
+        ''')
+        if not versoes_existentes:
+            # Base anterior às versões: todos os tickers com operações começam na versão 1
+            cursor.execute('''
+                INSERT OR IGNORE INTO versoes_operacoes (usuario_id, ticker, versao)
+                SELECT DISTINCT usuario_id, ticker, 1 FROM operacoes WHERE usuario_id IS NOT NULL
+            ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS operacoes_fechadas_versoes (
+            usuario_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            versao INTEGER NOT NULL,
+            PRIMARY KEY (usuario_id, ticker)
+        )
+        ''')
+        for gatilho, momento, linhas in [
+            ('trg_operacoes_versao_insert', 'AFTER INSERT', ['NEW']),
+            ('trg_operacoes_versao_delete', 'AFTER DELETE', ['OLD']),
+            ('trg_operacoes_versao_update', 'AFTER UPDATE', ['OLD', 'NEW']),
+        ]:
+            incrementos = ''.join(
+                f'''
+                INSERT INTO versoes_operacoes (usuario_id, ticker, versao)
+                SELECT {linha}.usuario_id, {linha}.ticker, 1 WHERE {linha}.usuario_id IS NOT NULL
+                ON CONFLICT(usuario_id, ticker) DO UPDATE SET versao = versao + 1;'''
+                for linha in linhas
+            )
+            cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {gatilho} {momento} ON operacoes BEGIN {incrementos} END;')
+
+        # Histórico de preços de fechamento (cache persistente dos provedores de cotações).
+        # precos_cobertura guarda os intervalos já consultados no provedor, inclusive os
+        # dias sem pregão, para que apenas os intervalos faltantes sejam buscados.
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precos_historicos (
+            ticker TEXT NOT NULL,
+            data DATE NOT NULL,
+            fechamento REAL NOT NULL,
+            PRIMARY KEY (ticker, data)
+        )
+        ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS precos_cobertura (
+            ticker TEXT NOT NULL,
+            inicio DATE NOT NULL,
+            fim DATE NOT NULL,
+            PRIMARY KEY (ticker, inicio)
+        )
+        ''')
+
+        # Fila de jobs de recálculo executados em segundo plano (ver fila_recalculo.py).
+        # tickers NULL = carteira completa; a_partir_de NULL = todos os meses.
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs_recalculo (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            a_partir_de DATE,
+            tickers TEXT,
+            recalcular_carteira INTEGER NOT NULL DEFAULT 1,
+            solicitacoes INTEGER NOT NULL DEFAULT 1,
+            progresso INTEGER NOT NULL DEFAULT 0,
+            etapa TEXT,
+            erro TEXT,
+            criado_em TEXT NOT NULL,
+            iniciado_em TEXT,
+            concluido_em TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_recalculo_status_usuario ON jobs_recalculo(status, usuario_id);')
+
         # Adicionar coluna corretora_id em operacoes, se não existir
         cursor.execute("PRAGMA table_info(operacoes)")
         colunas_operacoes = [info[1] for info in cursor.fetchall()]
@@ -507,9 +907,10 @@ def criar_tabelas():
             cursor.execute('ALTER TABLE usuario_proventos_recebidos ADD COLUMN data_calculo DATETIME')
         conn.commit()
     
-    # Inicializa o sistema de autenticação
-    from auth import inicializar_autenticacao # Relative import
-    inicializar_autenticacao()
+    # Tabelas do sistema de autenticação e colunas usuario_id das tabelas legadas
+    from auth import criar_tabelas_autenticacao, modificar_tabelas_existentes # Relative import
+    criar_tabelas_autenticacao()
+    modificar_tabelas_existentes()
     
 def date_converter(obj):
     """
@@ -561,6 +962,65 @@ def inserir_operacao(operacao: Dict[str, Any], usuario_id: Optional[int] = None)
         conn.commit()
         return cursor.lastrowid
 
+_SQL_INSERIR_OPERACAO = '''
+INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id, corretora_id)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def obter_tickers_existentes(tickers: List[str]) -> Set[str]:
+    """
+    Retorna, dentre os tickers informados, os que existem na tabela `acoes`.
+
+    Args:
+        tickers: Lista de tickers a verificar.
+
+    Returns:
+        Set[str]: Tickers encontrados.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    encontrados: Set[str] = set()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # Consulta em blocos para não ultrapassar o limite de parâmetros do SQLite
+        for inicio in range(0, len(tickers), 500):
+            bloco = tickers[inicio:inicio + 500]
+            cursor.execute(
+                f"SELECT ticker FROM acoes WHERE ticker IN ({','.join('?' * len(bloco))})", bloco
+            )
+            encontrados.update(row["ticker"] for row in cursor.fetchall())
+    return encontrados
+
+def inserir_operacoes_em_lote(operacoes: List[Dict[str, Any]], usuario_id: Optional[int] = None) -> int:
+    """
+    Insere várias operações em uma única transação.
+    Diferente de `inserir_operacao`, não verifica os tickers na tabela `acoes`:
+    o chamador deve validá-los antes (ver `obter_tickers_existentes`).
+
+    Args:
+        operacoes: Lista de dicionários com os dados das operações.
+        usuario_id: ID do usuário dono das operações.
+
+    Returns:
+        int: Quantidade de operações inseridas.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(_SQL_INSERIR_OPERACAO, [
+            (
+                operacao["date"].isoformat() if isinstance(operacao["date"], (datetime, date)) else operacao["date"],
+                operacao["ticker"],
+                operacao["operation"],
+                operacao["quantity"],
+                operacao["price"],
+                operacao.get("fees", 0.0),
+                usuario_id,
+                operacao.get("corretora_id"),
+            )
+            for operacao in operacoes
+        ])
+        conn.commit()
+        return len(operacoes)
+
 def obter_operacao_por_id(operacao_id: int, usuario_id: int) -> Optional[Dict[str, Any]]:
     """
     Obtém uma operação pelo ID e usuario_id.
@@ -715,6 +1175,11 @@ def remover_operacao(operacao_id: int, usuario_id: int) -> bool:
 
 # Comment about duplicate function already removed as the function itself was removed in prior step.
 
+_SQL_UPSERT_CARTEIRA = '''
+        INSERT OR REPLACE INTO carteira_atual (ticker, quantidade, custo_total, preco_medio, usuario_id)
+        VALUES (?, ?, ?, ?, ?)
+        '''
+
 def atualizar_carteira(ticker: str, quantidade: int, preco_medio: float, custo_total: float, usuario_id: int) -> None:
     """
     Atualiza ou insere um item na carteira atual de um usuário.
@@ -732,10 +1197,7 @@ def atualizar_carteira(ticker: str, quantidade: int, preco_medio: float, custo_t
         # Usa INSERT OR REPLACE para simplificar (considerando UNIQUE(ticker, usuario_id))
         # A tabela carteira_atual já deve ter a restrição UNIQUE(ticker, usuario_id)
         # e a coluna usuario_id, conforme definido em criar_tabelas e auth.modificar_tabelas_existentes
-        cursor.execute('''
-        INSERT OR REPLACE INTO carteira_atual (ticker, quantidade, custo_total, preco_medio, usuario_id)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (
+        cursor.execute(_SQL_UPSERT_CARTEIRA, (
             ticker,
             quantidade,
             custo_total,
@@ -744,6 +1206,85 @@ def atualizar_carteira(ticker: str, quantidade: int, preco_medio: float, custo_t
         ))
         
         conn.commit()
+
+class ErroRecalculoEmAndamento(Exception):
+    """A carteira do usuário está sendo reconstruída por um job de recálculo em execução."""
+
+def salvar_edicao_manual_carteira(ticker: str, quantidade: int, preco_medio: float, custo_total: float,
+                                  usuario_id: int) -> int:
+    """
+    Grava uma edição manual da carteira e enfileira o recálculo dos resultados na mesma
+    transação, registrando o ticker no job para que a reconstrução da carteira pelo job
+    não sobrescreva a edição.
+
+    Args:
+        ticker: Código da ação.
+        quantidade: Quantidade de ações.
+        preco_medio: Preço médio das ações.
+        custo_total: Custo total da posição.
+        usuario_id: ID do usuário.
+
+    Returns:
+        int: ID do job de recálculo (novo ou mesclado).
+
+    Raises:
+        ErroRecalculoEmAndamento: Se um job do usuário estiver reconstruindo a carteira.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE serializa a verificação com reservar_proximo_job_recalculo: o job que
+        # ainda não começou é reservado depois da edição e já a encontra registrada
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(
+                "SELECT 1 FROM jobs_recalculo WHERE usuario_id = ? AND status = 'executando' AND recalcular_carteira = 1",
+                (usuario_id,)
+            )
+            if cursor.fetchone() is not None:
+                raise ErroRecalculoEmAndamento(
+                    "A carteira está sendo recalculada. Tente editar a posição novamente em instantes."
+                )
+            cursor.execute(_SQL_UPSERT_CARTEIRA, (ticker, quantidade, custo_total, preco_medio, usuario_id))
+        except Exception:
+            conn.rollback()
+            raise
+        # Confirma a edição junto com o job
+        return enfileirar_job_recalculo(usuario_id, recalcular_carteira=False, tickers_manuais=[ticker])
+
+def salvar_carteira_em_lote(usuario_id: int, itens: List[Dict[str, Any]], substituir: bool = False,
+                            tickers_removidos: Optional[List[str]] = None,
+                            tickers_preservados: Optional[List[str]] = None) -> None:
+    """
+    Grava várias posições da carteira de um usuário em uma única transação.
+
+    Args:
+        usuario_id: ID do usuário.
+        itens: Posições (ticker, quantidade, preco_medio, custo_total).
+        substituir: Se True, a carteira existente do usuário é removida antes da gravação.
+        tickers_removidos: Tickers cujas posições devem ser removidas (opcional).
+        tickers_preservados: Tickers cujas posições não são removidas nem gravadas (opcional).
+    """
+    if tickers_preservados:
+        preservados = set(tickers_preservados)
+        itens = [item for item in itens if item["ticker"] not in preservados]
+        tickers_removidos = [t for t in tickers_removidos or [] if t not in preservados]
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if substituir and tickers_preservados:
+            marcadores = ",".join("?" * len(preservados))
+            cursor.execute(f'DELETE FROM carteira_atual WHERE usuario_id = ? AND ticker NOT IN ({marcadores})',
+                           (usuario_id, *sorted(preservados)))
+        elif substituir:
+            cursor.execute('DELETE FROM carteira_atual WHERE usuario_id = ?', (usuario_id,))
+        if tickers_removidos:
+            cursor.executemany('DELETE FROM carteira_atual WHERE usuario_id = ? AND ticker = ?',
+                               [(usuario_id, ticker) for ticker in tickers_removidos])
+        cursor.executemany(_SQL_UPSERT_CARTEIRA, [
+            (item["ticker"], item["quantidade"], item["custo_total"], item["preco_medio"], usuario_id)
+            for item in itens
+        ])
+        conn.commit()
         
 def obter_carteira_atual(usuario_id: int) -> List[Dict[str, Any]]:
     """
@@ -778,9 +1319,69 @@ def obter_carteira_atual(usuario_id: int) -> List[Dict[str, Any]]:
         
         return carteira
 
+def obter_item_carteira_db(usuario_id: int, ticker: str) -> Optional[Dict[str, Any]]:
+    """
+    Obtém a posição de um único ticker na carteira atual de um usuário
+    (busca pela chave única ticker/usuario_id).
+
+    Args:
+        usuario_id: ID do usuário.
+        ticker: Ticker da ação.
+
+    Returns:
+        Optional[Dict[str, Any]]: ticker, quantidade, custo_total e preco_medio, ou None.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT ticker, quantidade, custo_total, preco_medio FROM carteira_atual WHERE ticker = ? AND usuario_id = ?",
+            (ticker, usuario_id)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+_COLUNAS_RESULTADOS_MENSAIS = (
+    "mes", "vendas_swing", "custo_swing", "ganho_liquido_swing", "isento_swing",
+    "ir_devido_swing", "ir_pagar_swing", "darf_codigo_swing", "darf_competencia_swing",
+    "darf_valor_swing", "darf_vencimento_swing", "status_darf_swing_trade",
+    "vendas_day_trade", "custo_day_trade", "ganho_liquido_day", "ir_devido_day",
+    "irrf_day", "ir_pagar_day", "darf_codigo_day", "darf_competencia_day",
+    "darf_valor_day", "darf_vencimento_day", "status_darf_day_trade",
+    "prejuizo_acumulado_swing", "prejuizo_acumulado_day",
+)
+
+# Note: The old generic darf_codigo, darf_competencia, darf_valor, darf_vencimento columns are omitted here
+# as they are replaced by specific _swing and _day versions in the new model.
+_SQL_UPSERT_RESULTADO_MENSAL = f'''
+    INSERT INTO resultados_mensais ({", ".join(_COLUNAS_RESULTADOS_MENSAIS)}, usuario_id)
+    VALUES ({", ".join("?" for _ in _COLUNAS_RESULTADOS_MENSAIS)}, ?)
+    ON CONFLICT(usuario_id, mes) DO UPDATE SET
+        {", ".join(f"{coluna} = excluded.{coluna}" for coluna in _COLUNAS_RESULTADOS_MENSAIS[1:])}
+'''
+
+def _valores_resultado_mensal(resultado: Dict[str, Any], usuario_id: int) -> tuple:
+    """Converte um resultado mensal na tupla de parâmetros de _SQL_UPSERT_RESULTADO_MENSAL."""
+    return (
+        resultado["mes"], resultado["vendas_swing"], resultado["custo_swing"], resultado["ganho_liquido_swing"],
+        1 if resultado["isento_swing"] else 0, resultado["ir_devido_swing"], resultado["ir_pagar_swing"],
+        resultado.get("darf_codigo_swing"), resultado.get("darf_competencia_swing"),
+        resultado.get("darf_valor_swing"),
+        resultado.get("darf_vencimento_swing").isoformat() if resultado.get("darf_vencimento_swing") else None,
+        resultado.get("status_darf_swing_trade"),
+        resultado["vendas_day_trade"], resultado["custo_day_trade"], resultado["ganho_liquido_day"],
+        resultado["ir_devido_day"], resultado["irrf_day"], resultado["ir_pagar_day"],
+        resultado.get("darf_codigo_day"), resultado.get("darf_competencia_day"),
+        resultado.get("darf_valor_day"),
+        resultado.get("darf_vencimento_day").isoformat() if resultado.get("darf_vencimento_day") else None,
+        resultado.get("status_darf_day_trade"),
+        resultado["prejuizo_acumulado_swing"], resultado["prejuizo_acumulado_day"],
+        usuario_id,
+    )
+
 def salvar_resultado_mensal(resultado: Dict[str, Any], usuario_id: int) -> int:
     """
     Salva um resultado mensal no banco de dados para um usuário.
+    Se já existe um resultado para o mês, ele é atualizado (upsert).
     
     Args:
         resultado: Dicionário com os dados do resultado mensal.
@@ -791,87 +1392,38 @@ def salvar_resultado_mensal(resultado: Dict[str, Any], usuario_id: int) -> int:
     """
     with get_db() as conn:
         cursor = conn.cursor()
-        
-        # Verifica se já existe um resultado para o mês e usuário
-        cursor.execute('SELECT id FROM resultados_mensais WHERE mes = ? AND usuario_id = ?', 
+        cursor.execute(_SQL_UPSERT_RESULTADO_MENSAL, _valores_resultado_mensal(resultado, usuario_id))
+        cursor.execute('SELECT id FROM resultados_mensais WHERE mes = ? AND usuario_id = ?',
                        (resultado["mes"], usuario_id))
-        existente = cursor.fetchone()
-        
-        darf_vencimento_iso = None
-        if resultado.get("darf_vencimento"):
-            if isinstance(resultado["darf_vencimento"], (datetime, date)):
-                darf_vencimento_iso = resultado["darf_vencimento"].isoformat()
-            else: # Assume que já é uma string no formato ISO
-                darf_vencimento_iso = resultado["darf_vencimento"]
-
-        if existente:
-            # Se já existe, atualiza
-            cursor.execute('''
-            UPDATE resultados_mensais
-            SET mes = ?, 
-                vendas_swing = ?, custo_swing = ?, ganho_liquido_swing = ?, isento_swing = ?,
-                ir_devido_swing = ?, ir_pagar_swing = ?, darf_codigo_swing = ?, darf_competencia_swing = ?,
-                darf_valor_swing = ?, darf_vencimento_swing = ?, status_darf_swing_trade = ?,
-                vendas_day_trade = ?, custo_day_trade = ?, ganho_liquido_day = ?, ir_devido_day = ?,
-                irrf_day = ?, ir_pagar_day = ?, darf_codigo_day = ?, darf_competencia_day = ?,
-                darf_valor_day = ?, darf_vencimento_day = ?, status_darf_day_trade = ?,
-                prejuizo_acumulado_swing = ?, prejuizo_acumulado_day = ?
-            WHERE id = ? AND usuario_id = ? 
-            ''', (
-                resultado["mes"], 
-                resultado["vendas_swing"], resultado["custo_swing"], resultado["ganho_liquido_swing"],
-                1 if resultado["isento_swing"] else 0, 
-                resultado["ir_devido_swing"], resultado["ir_pagar_swing"],
-                resultado.get("darf_codigo_swing"), resultado.get("darf_competencia_swing"),
-                resultado.get("darf_valor_swing"), 
-                resultado.get("darf_vencimento_swing").isoformat() if resultado.get("darf_vencimento_swing") else None,
-                resultado.get("status_darf_swing_trade"),
-                resultado["vendas_day_trade"], resultado["custo_day_trade"], resultado["ganho_liquido_day"],
-                resultado["ir_devido_day"], resultado["irrf_day"], resultado["ir_pagar_day"],
-                resultado.get("darf_codigo_day"), resultado.get("darf_competencia_day"),
-                resultado.get("darf_valor_day"),
-                resultado.get("darf_vencimento_day").isoformat() if resultado.get("darf_vencimento_day") else None,
-                resultado.get("status_darf_day_trade"),
-                resultado["prejuizo_acumulado_swing"], resultado["prejuizo_acumulado_day"],
-                existente["id"], 
-                usuario_id
-            ))
-            conn.commit()
-            return existente["id"]
+        resultado_id = cursor.fetchone()["id"]
+        conn.commit()
+        return resultado_id
+
+def salvar_resultados_mensais_em_lote(usuario_id: int, resultados: List[Dict[str, Any]],
+                                      checkpoints: Optional[List[Dict[str, Any]]] = None,
+                                      mes_inicio: Optional[str] = None) -> None:
+    """
+    Substitui os resultados mensais de um usuário (todos, ou a partir de um mês) em uma
+    única transação, junto com os checkpoints de recálculo incremental, se informados.
+
+    Args:
+        usuario_id: ID do usuário.
+        resultados: Resultados mensais recalculados.
+        checkpoints: Checkpoints do recálculo (opcional; se None, os checkpoints não são alterados).
+        mes_inicio: Mês inicial ('YYYY-MM'). Se None, todos os resultados do usuário são substituídos.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if mes_inicio is None:
+            cursor.execute('DELETE FROM resultados_mensais WHERE usuario_id = ?', (usuario_id,))
         else:
-            # Se não existe, insere
-            # Note: The old generic darf_codigo, darf_competencia, darf_valor, darf_vencimento columns are omitted here
-            # as they are replaced by specific _swing and _day versions in the new model.
-            # Also, darf_swing_trade_valor and darf_day_trade_valor are omitted as they are redundant.
-            cursor.execute('''
-            INSERT INTO resultados_mensais (
-                mes, vendas_swing, custo_swing, ganho_liquido_swing, isento_swing,
-                ir_devido_swing, ir_pagar_swing, darf_codigo_swing, darf_competencia_swing,
-                darf_valor_swing, darf_vencimento_swing, status_darf_swing_trade,
-                vendas_day_trade, custo_day_trade, ganho_liquido_day, ir_devido_day,
-                irrf_day, ir_pagar_day, darf_codigo_day, darf_competencia_day,
-                darf_valor_day, darf_vencimento_day, status_darf_day_trade,
-                prejuizo_acumulado_swing, prejuizo_acumulado_day, usuario_id
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                resultado["mes"], resultado["vendas_swing"], resultado["custo_swing"], resultado["ganho_liquido_swing"],
-                1 if resultado["isento_swing"] else 0, resultado["ir_devido_swing"], resultado["ir_pagar_swing"],
-                resultado.get("darf_codigo_swing"), resultado.get("darf_competencia_swing"),
-                resultado.get("darf_valor_swing"),
-                resultado.get("darf_vencimento_swing").isoformat() if resultado.get("darf_vencimento_swing") else None,
-                resultado.get("status_darf_swing_trade"),
-                resultado["vendas_day_trade"], resultado["custo_day_trade"], resultado["ganho_liquido_day"],
-                resultado["ir_devido_day"], resultado["irrf_day"], resultado["ir_pagar_day"],
-                resultado.get("darf_codigo_day"), resultado.get("darf_competencia_day"),
-                resultado.get("darf_valor_day"),
-                resultado.get("darf_vencimento_day").isoformat() if resultado.get("darf_vencimento_day") else None,
-                resultado.get("status_darf_day_trade"),
-                resultado["prejuizo_acumulado_swing"], resultado["prejuizo_acumulado_day"], usuario_id
-            ))
-            
-            conn.commit()
-            return cursor.lastrowid
+            cursor.execute('DELETE FROM resultados_mensais WHERE usuario_id = ? AND mes >= ?', (usuario_id, mes_inicio))
+        cursor.executemany(_SQL_UPSERT_RESULTADO_MENSAL, [
+            _valores_resultado_mensal(resultado, usuario_id) for resultado in resultados
+        ])
+        if checkpoints is not None:
+            _substituir_checkpoints_resultados(cursor, usuario_id, checkpoints, mes_inicio)
+        conn.commit()
         
 def obter_resultados_mensais(usuario_id: int) -> List[Dict[str, Any]]:
     """
@@ -917,6 +1469,7 @@ def limpar_banco_dados_usuario(usuario_id: int) -> None:
         cursor.execute('DELETE FROM resultados_mensais WHERE usuario_id = ?', (usuario_id,))
         cursor.execute('DELETE FROM carteira_atual WHERE usuario_id = ?', (usuario_id,))
         cursor.execute('DELETE FROM operacoes_fechadas WHERE usuario_id = ?', (usuario_id,)) # Adicionado
+        cursor.execute('DELETE FROM checkpoints_resultados WHERE usuario_id = ?', (usuario_id,))
         
         # Não reseta sqlite_sequence aqui, pois é global.
         # Se precisar resetar para um usuário, seria mais complexo e geralmente não é feito.
@@ -935,6 +1488,7 @@ def limpar_banco_dados() -> None:
         cursor.execute('DELETE FROM resultados_mensais')
         cursor.execute('DELETE FROM carteira_atual')
         cursor.execute('DELETE FROM operacoes_fechadas') # Adicionado
+        cursor.execute('DELETE FROM checkpoints_resultados')
         
         # Reseta os contadores de autoincremento
         cursor.execute('DELETE FROM sqlite_sequence WHERE name IN ("operacoes", "resultados_mensais", "carteira_atual", "operacoes_fechadas")')
@@ -970,105 +1524,249 @@ def obter_operacoes_para_calculo_fechadas(usuario_id: int) -> List[Dict[str, Any
         
         return operacoes
 
+_SQL_INSERIR_OPERACAO_FECHADA = '''
+    INSERT INTO operacoes_fechadas (
+        data_abertura, data_fechamento, ticker, quantidade,
+        valor_compra, valor_venda, resultado, percentual_lucro, usuario_id,
+        tipo, taxas_total, day_trade, status_ir, operacoes_relacionadas
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _valores_operacao_fechada(op_fechada: Dict[str, Any], usuario_id: int) -> tuple:
+    """Converte uma operação fechada na tupla de parâmetros de _SQL_INSERIR_OPERACAO_FECHADA."""
+    return (
+        op_fechada['data_abertura'].isoformat() if isinstance(op_fechada['data_abertura'], (date, datetime)) else op_fechada['data_abertura'],
+        op_fechada['data_fechamento'].isoformat() if isinstance(op_fechada['data_fechamento'], (date, datetime)) else op_fechada['data_fechamento'],
+        op_fechada['ticker'],
+        op_fechada['quantidade'],
+        op_fechada['valor_compra'],
+        op_fechada['valor_venda'],
+        op_fechada['resultado'],
+        op_fechada['percentual_lucro'],
+        usuario_id,
+        op_fechada.get('tipo'),
+        op_fechada.get('taxas_total') or 0.0,
+        bool(op_fechada.get('day_trade')),
+        op_fechada.get('status_ir'),
+        # Datas das operações relacionadas em ISO (default=str)
+        json.dumps(op_fechada.get('operacoes_relacionadas') or [], default=str),
+    )
+
+def _salvar_versoes_operacoes_fechadas(cursor: sqlite3.Cursor, usuario_id: int, versoes: Dict[str, int]) -> None:
+    cursor.executemany(
+        "INSERT OR REPLACE INTO operacoes_fechadas_versoes (usuario_id, ticker, versao) VALUES (?, ?, ?)",
+        [(usuario_id, ticker, versao) for ticker, versao in versoes.items()]
+    )
+
 def salvar_operacao_fechada(op_fechada: Dict[str, Any], usuario_id: int) -> None:
     """
     Salva uma operação fechada no banco de dados.
     """
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO operacoes_fechadas (
-                data_abertura, data_fechamento, ticker, quantidade,
-                valor_compra, valor_venda, resultado, percentual_lucro, usuario_id
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            op_fechada['data_abertura'].isoformat() if isinstance(op_fechada['data_abertura'], (date, datetime)) else op_fechada['data_abertura'],
-            op_fechada['data_fechamento'].isoformat() if isinstance(op_fechada['data_fechamento'], (date, datetime)) else op_fechada['data_fechamento'],
-            op_fechada['ticker'],
-            op_fechada['quantidade'],
-            op_fechada['valor_compra'],
-            op_fechada['valor_venda'],
-            op_fechada['resultado'],
-            op_fechada['percentual_lucro'],
-            usuario_id
-        ))
+        cursor.execute(_SQL_INSERIR_OPERACAO_FECHADA, _valores_operacao_fechada(op_fechada, usuario_id))
         conn.commit()
 
-def obter_operacoes_fechadas_salvas(usuario_id: int) -> List[Dict[str, Any]]:
+def salvar_operacoes_fechadas_em_lote(usuario_id: int, operacoes_fechadas: List[Dict[str, Any]],
+                                      versoes: Optional[Dict[str, int]] = None) -> None:
     """
-    Obtém as operações fechadas já salvas no banco de dados para um usuário.
+    Substitui as operações fechadas de um usuário em uma única transação.
+
+    Args:
+        usuario_id: ID do usuário.
+        operacoes_fechadas: Operações fechadas recalculadas.
+        versoes: Versão das operações de cada ticker usada no cálculo (ver obter_versoes_operacoes_db).
+            Sem versões, as operações fechadas ficam marcadas como desatualizadas.
     """
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM operacoes_fechadas WHERE usuario_id = ? ORDER BY data_fechamento", (usuario_id,))
-        ops_fechadas = []
-        for row in cursor.fetchall():
-            op = dict(row)
-            if isinstance(op["data_abertura"], str):
-                op["data_abertura"] = datetime.fromisoformat(op["data_abertura"].split("T")[0]).date()
-            if isinstance(op["data_fechamento"], str):
-                op["data_fechamento"] = datetime.fromisoformat(op["data_fechamento"].split("T")[0]).date()
-            ops_fechadas.append(op)
-        return ops_fechadas
+        cursor.execute("DELETE FROM operacoes_fechadas WHERE usuario_id = ?", (usuario_id,))
+        cursor.execute("DELETE FROM operacoes_fechadas_versoes WHERE usuario_id = ?", (usuario_id,))
+        cursor.executemany(_SQL_INSERIR_OPERACAO_FECHADA, [
+            _valores_operacao_fechada(op_fechada, usuario_id) for op_fechada in operacoes_fechadas
+        ])
+        _salvar_versoes_operacoes_fechadas(cursor, usuario_id, versoes or {})
+        conn.commit()
 
-def limpar_operacoes_fechadas_usuario(usuario_id: int) -> None:
+def substituir_operacoes_fechadas_tickers_db(usuario_id: int, tickers: List[str],
+                                             operacoes_fechadas: List[Dict[str, Any]],
+                                             versoes: Dict[str, int]) -> None:
     """
-    Limpa as operações fechadas de um usuário antes de recalcular.
+    Substitui as operações fechadas de alguns tickers de um usuário em uma única transação,
+    mantendo as dos demais tickers.
+
+    Args:
+        usuario_id: ID do usuário.
+        tickers: Tickers recalculados.
+        operacoes_fechadas: Operações fechadas recalculadas desses tickers.
+        versoes: Versão das operações de cada ticker usada no cálculo.
     """
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM operacoes_fechadas WHERE usuario_id = ?", (usuario_id,))
+        cursor.executemany("DELETE FROM operacoes_fechadas WHERE usuario_id = ? AND ticker = ?",
+                           [(usuario_id, ticker) for ticker in tickers])
+        cursor.executemany("DELETE FROM operacoes_fechadas_versoes WHERE usuario_id = ? AND ticker = ?",
+                           [(usuario_id, ticker) for ticker in tickers])
+        cursor.executemany(_SQL_INSERIR_OPERACAO_FECHADA, [
+            _valores_operacao_fechada(op_fechada, usuario_id) for op_fechada in operacoes_fechadas
+        ])
+        _salvar_versoes_operacoes_fechadas(cursor, usuario_id, versoes)
         conn.commit()
 
-def remover_todas_operacoes_usuario(usuario_id: int) -> int:
+def atualizar_status_ir_operacoes_fechadas_db(atualizacoes: List[tuple]) -> None:
     """
-    Remove todas as operações de um usuário específico do banco de dados.
+    Atualiza o status de IR de operações fechadas já salvas.
 
     Args:
-        usuario_id: ID do usuário.
-
-    Returns:
-        int: Número de operações removidas.
+        atualizacoes: Pares (status_ir, id da operação fechada).
     """
+    if not atualizacoes:
+        return
     with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM operacoes WHERE usuario_id = ?', (usuario_id,))
+        conn.executemany("UPDATE operacoes_fechadas SET status_ir = ? WHERE id = ?", atualizacoes)
         conn.commit()
-        return cursor.rowcount
 
-def atualizar_status_darf_db(usuario_id: int, year_month: str, darf_type: str, new_status: str) -> bool:
+def obter_versoes_operacoes_db(usuario_id: int, tickers: Optional[List[str]] = None) -> Dict[str, int]:
     """
-    Atualiza o status de um DARF específico (swing ou daytrade) para um usuário e mês.
+    Obtém a versão atual das operações de cada ticker de um usuário.
 
     Args:
         usuario_id: ID do usuário.
-        year_month: Mês e ano no formato YYYY-MM.
-        darf_type: Tipo de DARF ("swing" or "daytrade").
-        new_status: Novo status para o DARF (e.g., 'Pago', 'Pendente').
+        tickers: Tickers desejados (opcional; padrão todos).
 
     Returns:
-        bool: True se a atualização foi bem-sucedida (1 linha afetada), False caso contrário.
+        Dict[str, int]: Versão por ticker.
     """
-    if darf_type == "swing":
-        status_column_name = "status_darf_swing_trade"
-    elif darf_type == "daytrade":
-        status_column_name = "status_darf_day_trade"
-    else:
-        return False # Tipo de DARF inválido
-
     with get_db() as conn:
         cursor = conn.cursor()
-        try:
-            # Usar f-string para o nome da coluna é seguro aqui, pois darf_type é validado.
-            # No entanto, para valores, sempre use placeholders.
-            query = f"UPDATE resultados_mensais SET {status_column_name} = ? WHERE usuario_id = ? AND mes = ?"
-            cursor.execute(query, (new_status, usuario_id, year_month))
-            conn.commit()
-            return cursor.rowcount > 0
-        except sqlite3.Error as e:
-            # Logar o erro e.g., print(f"Database error: {e}") ou usar logging
-            # Considerar se deve propagar o erro ou retornar False
-            return False
+        cursor.execute("SELECT ticker, versao FROM versoes_operacoes WHERE usuario_id = ?", (usuario_id,))
+        versoes = {row["ticker"]: row["versao"] for row in cursor.fetchall()}
+    if tickers is not None:
+        versoes = {ticker: versoes.get(ticker, 0) for ticker in tickers}
+    return versoes
+
+def obter_tickers_operacoes_fechadas_desatualizadas_db(usuario_id: int, ticker: Optional[str] = None) -> List[str]:
+    """
+    Lista os tickers do usuário cujas operações mudaram desde o último cálculo das
+    operações fechadas (ou que nunca tiveram as operações fechadas calculadas).
+
+    Args:
+        usuario_id: ID do usuário.
+        ticker: Verifica apenas este ticker (opcional).
+    """
+    filtro_ticker = " AND v.ticker = ?" if ticker else ""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT v.ticker FROM versoes_operacoes v
+            LEFT JOIN operacoes_fechadas_versoes f ON f.usuario_id = v.usuario_id AND f.ticker = v.ticker
+            WHERE v.usuario_id = ?{filtro_ticker} AND (f.versao IS NULL OR f.versao != v.versao)
+            ORDER BY v.ticker
+        ''', (usuario_id, ticker) if ticker else (usuario_id,))
+        return [row["ticker"] for row in cursor.fetchall()]
+
+def incrementar_versoes_operacoes_ticker_db(ticker: str) -> None:
+    """
+    Marca como desatualizadas as operações fechadas de todos os usuários com operações
+    no ticker (ex.: após o registro de um evento corporativo).
+    """
+    with get_db() as conn:
+        conn.execute("UPDATE versoes_operacoes SET versao = versao + 1 WHERE ticker = ?", (ticker,))
+        conn.commit()
+
+def obter_operacoes_fechadas_salvas(usuario_id: int, a_partir_de: Optional[date] = None,
+                                    ticker: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Obtém as operações fechadas já salvas no banco de dados para um usuário.
+
+    Args:
+        usuario_id: ID do usuário.
+        a_partir_de: Apenas operações fechadas nesta data ou depois (opcional).
+        ticker: Apenas operações fechadas deste ticker (opcional).
+    """
+    condicoes = ["usuario_id = ?"]
+    parametros: List[Any] = [usuario_id]
+    if ticker is not None:
+        condicoes.append("ticker = ?")
+        parametros.append(ticker)
+    if a_partir_de is not None:
+        condicoes.append("data_fechamento >= ?")
+        parametros.append(a_partir_de.isoformat())
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM operacoes_fechadas WHERE {' AND '.join(condicoes)} ORDER BY data_fechamento, id", parametros
+        )
+        ops_fechadas = []
+        for row in cursor.fetchall():
+            op = dict(row)
+            if isinstance(op["data_abertura"], str):
+                op["data_abertura"] = datetime.fromisoformat(op["data_abertura"].split("T")[0]).date()
+            if isinstance(op["data_fechamento"], str):
+                op["data_fechamento"] = datetime.fromisoformat(op["data_fechamento"].split("T")[0]).date()
+            op["day_trade"] = bool(op.get("day_trade"))
+            op["operacoes_relacionadas"] = json.loads(op["operacoes_relacionadas"]) if op.get("operacoes_relacionadas") else []
+            ops_fechadas.append(op)
+        return ops_fechadas
+
+def limpar_operacoes_fechadas_usuario(usuario_id: int) -> None:
+    """
+    Limpa as operações fechadas de um usuário antes de recalcular.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM operacoes_fechadas WHERE usuario_id = ?", (usuario_id,))
+        conn.commit()
+
+def remover_todas_operacoes_usuario(usuario_id: int) -> int:
+    """
+    Remove todas as operações de um usuário específico do banco de dados.
+
+    Args:
+        usuario_id: ID do usuário.
+
+    Returns:
+        int: Número de operações removidas.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM operacoes WHERE usuario_id = ?', (usuario_id,))
+        conn.commit()
+        return cursor.rowcount
+
+def atualizar_status_darf_db(usuario_id: int, year_month: str, darf_type: str, new_status: str) -> bool:
+    """
+    Atualiza o status de um DARF específico (swing ou daytrade) para um usuário e mês.
+
+    Args:
+        usuario_id: ID do usuário.
+        year_month: Mês e ano no formato YYYY-MM.
+        darf_type: Tipo de DARF ("swing" or "daytrade").
+        new_status: Novo status para o DARF (e.g., 'Pago', 'Pendente').
+
+    Returns:
+        bool: True se a atualização foi bem-sucedida (1 linha afetada), False caso contrário.
+    """
+    if darf_type == "swing":
+        status_column_name = "status_darf_swing_trade"
+    elif darf_type == "daytrade":
+        status_column_name = "status_darf_day_trade"
+    else:
+        return False # Tipo de DARF inválido
+
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            # Usar f-string para o nome da coluna é seguro aqui, pois darf_type é validado.
+            # No entanto, para valores, sempre use placeholders.
+            query = f"UPDATE resultados_mensais SET {status_column_name} = ? WHERE usuario_id = ? AND mes = ?"
+            cursor.execute(query, (new_status, usuario_id, year_month))
+            conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            # Logar o erro e.g., print(f"Database error: {e}") ou usar logging
+            # Considerar se deve propagar o erro ou retornar False
+            return False
 
 def limpar_carteira_usuario_db(usuario_id: int) -> None:
     """
@@ -1108,6 +1806,208 @@ def limpar_resultados_mensais_usuario_db(usuario_id: int) -> None:
             # O log é importante para a depuração.
             pass # Silenciosamente continua, mas idealmente logaria.
 
+def limpar_resultados_mensais_a_partir_de_db(usuario_id: int, mes_inicio: str) -> None:
+    """
+    Remove os resultados mensais de um usuário a partir de um mês (inclusive).
+
+    Args:
+        usuario_id: ID do usuário.
+        mes_inicio: Mês inicial no formato 'YYYY-MM'.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM resultados_mensais WHERE usuario_id = ? AND mes >= ?', (usuario_id, mes_inicio))
+        conn.commit()
+
+def obter_ultimo_resultado_mensal_anterior_a(usuario_id: int, mes: str) -> Optional[Dict[str, Any]]:
+    """
+    Obtém o último resultado mensal salvo de um usuário anterior a um mês.
+    Usado para recuperar os prejuízos acumulados que são transportados para o mês seguinte.
+
+    Args:
+        usuario_id: ID do usuário.
+        mes: Mês de referência no formato 'YYYY-MM' (exclusivo).
+
+    Returns:
+        Optional[Dict[str, Any]]: Mês e prejuízos acumulados, ou None se não houver.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT mes, prejuizo_acumulado_swing, prejuizo_acumulado_day
+            FROM resultados_mensais
+            WHERE usuario_id = ? AND mes < ?
+            ORDER BY mes DESC
+            LIMIT 1
+        ''', (usuario_id, mes))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def obter_checkpoints_resultados_anteriores_a(usuario_id: int, mes: str) -> List[Dict[str, Any]]:
+    """
+    Obtém, para cada ticker, o checkpoint mais recente anterior a um mês.
+
+    Args:
+        usuario_id: ID do usuário.
+        mes: Mês de referência no formato 'YYYY-MM' (exclusivo).
+
+    Returns:
+        List[Dict[str, Any]]: Um checkpoint por ticker com o estado de swing trade ao final do mês.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT cr.*
+            FROM checkpoints_resultados cr
+            JOIN (
+                SELECT ticker, MAX(mes) AS ultimo_mes
+                FROM checkpoints_resultados
+                WHERE usuario_id = ? AND mes < ?
+                GROUP BY ticker
+            ) ult ON cr.ticker = ult.ticker AND cr.mes = ult.ultimo_mes
+            WHERE cr.usuario_id = ?
+        ''', (usuario_id, mes, usuario_id))
+        return [dict(row) for row in cursor.fetchall()]
+
+def salvar_checkpoints_resultados(usuario_id: int, checkpoints: List[Dict[str, Any]], mes_inicio: Optional[str] = None) -> None:
+    """
+    Substitui os checkpoints de resultados de um usuário a partir de um mês, em uma única transação.
+
+    Args:
+        usuario_id: ID do usuário.
+        checkpoints: Lista de checkpoints (ticker, mes, estado da posição e eventos_ate, a data
+            até a qual os eventos corporativos já estão aplicados ao estado).
+        mes_inicio: Mês inicial ('YYYY-MM'). Se None, todos os checkpoints do usuário são substituídos.
+    """
+    with get_db() as conn:
+        _substituir_checkpoints_resultados(conn.cursor(), usuario_id, checkpoints, mes_inicio)
+        conn.commit()
+
+def _substituir_checkpoints_resultados(cursor: sqlite3.Cursor, usuario_id: int, checkpoints: List[Dict[str, Any]],
+                                       mes_inicio: Optional[str]) -> None:
+    """Substitui os checkpoints (todos ou a partir de `mes_inicio`) na transação do cursor informado."""
+    if mes_inicio is None:
+        cursor.execute('DELETE FROM checkpoints_resultados WHERE usuario_id = ?', (usuario_id,))
+    else:
+        cursor.execute('DELETE FROM checkpoints_resultados WHERE usuario_id = ? AND mes >= ?', (usuario_id, mes_inicio))
+    cursor.executemany('''
+        INSERT OR REPLACE INTO checkpoints_resultados (
+            usuario_id, ticker, mes, quantidade, custo_total, preco_medio,
+            quantidade_vendida, valor_total_venda, preco_medio_venda, eventos_ate
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (
+            usuario_id, cp["ticker"], cp["mes"], cp["quantidade"], cp["custo_total"], cp["preco_medio"],
+            cp["quantidade_vendida"], cp["valor_total_venda"], cp["preco_medio_venda"], cp.get("eventos_ate")
+        )
+        for cp in checkpoints
+    ])
+
+def limpar_checkpoints_resultados_usuario_db(usuario_id: int) -> None:
+    """
+    Remove todos os checkpoints de resultados de um usuário.
+
+    Args:
+        usuario_id: ID do usuário.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM checkpoints_resultados WHERE usuario_id = ?', (usuario_id,))
+        conn.commit()
+
+def limpar_checkpoints_resultados_por_ticker_db(ticker: str) -> None:
+    """
+    Remove todos os checkpoints de resultados dos usuários que têm checkpoint do ticker.
+    Usado quando um evento corporativo do ticker é registrado: os checkpoints desses
+    usuários deixam de refletir o evento e o próximo recálculo deve ser completo.
+
+    Args:
+        ticker: Ticker da ação afetada.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM checkpoints_resultados
+            WHERE usuario_id IN (SELECT DISTINCT usuario_id FROM checkpoints_resultados WHERE ticker = ?)
+        ''', (ticker,))
+        conn.commit()
+
+def obter_operacoes_a_partir_de_data(usuario_id: int, data_inicio: date) -> List[Dict[str, Any]]:
+    """
+    Obtém as operações de um usuário a partir de uma data (inclusive), ordenadas por data e ID.
+
+    Args:
+        usuario_id: ID do usuário.
+        data_inicio: Data inicial.
+
+    Returns:
+        List[Dict[str, Any]]: Lista de operações no mesmo formato de obter_todas_operacoes.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, date, ticker, operation, quantity, price, fees, usuario_id, corretora_id
+            FROM operacoes
+            WHERE usuario_id = ? AND date >= ?
+            ORDER BY date, id
+        ''', (usuario_id, data_inicio.isoformat()))
+        operacoes = []
+        for row in cursor.fetchall():
+            operacao = dict(row)
+            if isinstance(operacao["date"], str):
+                operacao["date"] = datetime.fromisoformat(operacao["date"].split("T")[0]).date()
+            operacoes.append(operacao)
+        return operacoes
+
+def obter_operacoes_motor_db(usuario_id: int, ticker: Optional[str] = None,
+                             data_inicio: Optional[date] = None) -> List[RegistroOperacao]:
+    """
+    Obtém as operações de um usuário como registros compactos para o motor de posições,
+    ordenadas por data e ID. Os registros são montados pelo próprio cursor (row_factory),
+    sem sqlite3.Row nem dict por operação.
+
+    Args:
+        usuario_id: ID do usuário.
+        ticker: Apenas as operações deste ticker (opcional).
+        data_inicio: Apenas as operações a partir desta data, inclusive (opcional).
+
+    Returns:
+        List[RegistroOperacao]: Operações com id, date, ticker, operation, quantity, price e fees.
+    """
+    filtros = ["usuario_id = ?"]
+    parametros: List[Any] = [usuario_id]
+    if ticker is not None:
+        filtros.append("ticker = ?")
+        parametros.append(ticker)
+    if data_inicio is not None:
+        filtros.append("date >= ?")
+        parametros.append(data_inicio.isoformat())
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = linha_para_registro
+        cursor.execute(
+            f"SELECT {COLUNAS_REGISTRO} FROM operacoes WHERE {' AND '.join(filtros)} ORDER BY date, id",
+            parametros,
+        )
+        return cursor.fetchall()
+
+def existe_operacao_anterior_a(usuario_id: int, data_limite: date) -> bool:
+    """
+    Verifica se um usuário possui alguma operação anterior a uma data.
+
+    Args:
+        usuario_id: ID do usuário.
+        data_limite: Data de referência (exclusiva).
+
+    Returns:
+        bool: True se existir ao menos uma operação anterior à data.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM operacoes WHERE usuario_id = ? AND date < ? LIMIT 1', (usuario_id, data_limite.isoformat()))
+        return cursor.fetchone() is not None
+
 def remover_item_carteira_db(usuario_id: int, ticker: str) -> bool:
     """
     Remove um item específico (ticker) da carteira de um usuário.
@@ -1146,7 +2046,7 @@ def obter_operacoes_por_ticker_db(usuario_id: int, ticker: str) -> List[Dict[str
             SELECT id, date, ticker, operation, quantity, price, fees, usuario_id
             FROM operacoes 
             WHERE usuario_id = ? AND ticker = ? 
-            ORDER BY date
+            ORDER BY date, id
         ''', (usuario_id, ticker))
         
         operacoes = []
@@ -1318,6 +2218,97 @@ def inserir_usuario_provento_recebido_db(usuario_id: int, provento_global_id: in
         except Exception as e:
             raise
 
+_CAMPOS_PROVENTO_RECEBIDO = [
+    'provento_global_id', 'id_acao', 'ticker_acao', 'nome_acao', 'tipo_provento',
+    'data_ex', 'dt_pagamento', 'valor_unitario_provento', 'quantidade_possuida_na_data_ex',
+    'valor_total_recebido', 'data_calculo'
+]
+_SQL_INSERIR_PROVENTO_RECEBIDO = (
+    f"INSERT {{conflito}} INTO usuario_proventos_recebidos (usuario_id, {', '.join(_CAMPOS_PROVENTO_RECEBIDO)}) "
+    f"VALUES (?, {', '.join(['?'] * len(_CAMPOS_PROVENTO_RECEBIDO))})"
+)
+
+def obter_posicoes_operacoes_usuario_db(usuario_id: int) -> List[Dict[str, Any]]:
+    """
+    Obtém, em uma única consulta, as operações de um usuário com apenas os campos
+    que alteram a posição (ticker, data, tipo e quantidade), ordenadas por ticker e data.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ticker, date, operation, quantity
+            FROM operacoes
+            WHERE usuario_id = ?
+            ORDER BY ticker, date, id
+        ''', (usuario_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+def substituir_usuario_proventos_recebidos_db(usuario_id: int, registros: List[Dict[str, Any]]) -> int:
+    """
+    Substitui os proventos recebidos calculados de um usuário em uma única transação:
+    remove os registros antigos e grava os novos com executemany.
+
+    Args:
+        usuario_id: ID do usuário.
+        registros: Registros com as colunas de usuario_proventos_recebidos (exceto id e usuario_id).
+
+    Returns:
+        int: Quantidade de registros gravados.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('DELETE FROM usuario_proventos_recebidos WHERE usuario_id = ?', (usuario_id,))
+            cursor.executemany(
+                _SQL_INSERIR_PROVENTO_RECEBIDO.format(conflito=""),
+                [(usuario_id, *(registro[campo] for campo in _CAMPOS_PROVENTO_RECEBIDO)) for registro in registros]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(registros)
+
+def inserir_usuario_proventos_recebidos_em_lote_db(registros: List[Dict[str, Any]]) -> int:
+    """
+    Insere proventos recebidos de vários usuários em uma única transação. Registros
+    já existentes (mesmo usuário e provento) são mantidos.
+
+    Args:
+        registros: Registros com usuario_id e as colunas de usuario_proventos_recebidos.
+
+    Returns:
+        int: Quantidade de registros efetivamente inseridos.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        alteracoes_antes = conn.total_changes
+        try:
+            cursor.executemany(
+                _SQL_INSERIR_PROVENTO_RECEBIDO.format(conflito="OR IGNORE"),
+                [(registro["usuario_id"], *(registro[campo] for campo in _CAMPOS_PROVENTO_RECEBIDO)) for registro in registros]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return conn.total_changes - alteracoes_antes
+
+def obter_operacoes_ticker_usuarios_ate_data_db(ticker: str, data_ex: date) -> List[Dict[str, Any]]:
+    """
+    Obtém as operações de todos os usuários em um ticker anteriores a uma data
+    (exclusive), ordenadas por usuário e data (índice operacoes(ticker, usuario_id, date)).
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT usuario_id, date, operation, quantity
+            FROM operacoes
+            WHERE ticker = ? AND date < ?
+            ORDER BY usuario_id, date, id
+        ''', (ticker, data_ex))
+        return [dict(row) for row in cursor.fetchall()]
+
 # Mantém a versão antiga para compatibilidade, mas recomenda-se migrar para a nova assinatura
 # def inserir_usuario_provento_recebido_db(dados: Dict[str, Any]) -> int:
 #     ...
@@ -1655,4 +2646,260 @@ def get_sum_proventos_by_month_for_user(user_id: int, start_date: date, end_date
 
         cursor.execute(query, (user_id, start_date_str, end_date_str))
         rows = cursor.fetchall()
-        return [dict(row) for row in rows]
\ No newline at end of file
+        return [dict(row) for row in rows]
+
+# --- Fila de jobs de recálculo ---
+
+def _job_recalculo_para_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["tickers"] = job["tickers"].split(",") if job["tickers"] else ([] if job["tickers"] == "" else None)
+    job["recalcular_carteira"] = bool(job["recalcular_carteira"])
+    job["tickers_manuais"] = job["tickers_manuais"].split(",") if job.get("tickers_manuais") else []
+    return job
+
+def _mesclar_tickers_manuais(atuais: List[str], tickers: Optional[List[str]], recalcular_carteira: bool,
+                             tickers_manuais: Optional[List[str]]) -> Optional[str]:
+    """
+    Tickers editados manualmente após um pedido: um pedido que recalcula a carteira
+    devolve seus tickers à reconstrução (None = todos); uma edição manual os preserva.
+    """
+    if recalcular_carteira:
+        atuais = [] if tickers is None else [t for t in atuais if t not in tickers]
+    mesclados = set(atuais) | set(tickers_manuais or [])
+    return ",".join(sorted(mesclados)) if mesclados else None
+
+def enfileirar_job_recalculo(usuario_id: int, a_partir_de: Optional[date] = None,
+                             tickers: Optional[List[str]] = None, recalcular_carteira: bool = True,
+                             tickers_manuais: Optional[List[str]] = None) -> int:
+    """
+    Enfileira um job de recálculo para o usuário, mesclando-o com o job pendente do
+    mesmo usuário, se houver: a data inicial passa a ser a menor das duas e os tickers
+    são unidos (None, em qualquer um dos lados, significa todos os meses/tickers).
+    Os tickers editados manualmente ficam fora da reconstrução da carteira pelo job,
+    até que um pedido posterior (nova alteração de operações) os inclua de novo.
+
+    Args:
+        usuario_id: ID do usuário.
+        a_partir_de: Data da operação mais antiga afetada (None = histórico completo).
+        tickers: Tickers cuja posição deve ser recalculada (None = carteira completa).
+        recalcular_carteira: Se False, a carteira não é recalculada (edição manual da carteira).
+        tickers_manuais: Tickers cuja posição acaba de ser editada manualmente (opcional).
+
+    Returns:
+        int: ID do job (novo ou mesclado).
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE garante que dois enfileiramentos simultâneos não criem dois jobs pendentes
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "SELECT * FROM jobs_recalculo WHERE usuario_id = ? AND status = 'pendente' ORDER BY id LIMIT 1",
+            (usuario_id,)
+        )
+        pendente = cursor.fetchone()
+        if pendente is None:
+            cursor.execute('''
+            INSERT INTO jobs_recalculo (usuario_id, status, a_partir_de, tickers, recalcular_carteira, tickers_manuais, criado_em)
+            VALUES (?, 'pendente', ?, ?, ?, ?, ?)
+            ''', (
+                usuario_id, a_partir_de, None if tickers is None else ",".join(sorted(set(tickers))),
+                int(recalcular_carteira), _mesclar_tickers_manuais([], tickers, recalcular_carteira, tickers_manuais),
+                datetime.now().isoformat(timespec="seconds")
+            ))
+            job_id = cursor.lastrowid
+        else:
+            job = _job_recalculo_para_dict(pendente)
+            if a_partir_de is None or job["a_partir_de"] is None:
+                a_partir_de_mesclado = None
+            else:
+                a_partir_de_mesclado = min(a_partir_de, job["a_partir_de"])
+            if recalcular_carteira and job["recalcular_carteira"]:
+                tickers_mesclados = None if tickers is None or job["tickers"] is None else sorted(set(tickers) | set(job["tickers"]))
+            else:
+                # Apenas um dos lados recalcula a carteira: vale o conjunto de tickers dele
+                tickers_mesclados = tickers if recalcular_carteira else job["tickers"]
+            cursor.execute('''
+            UPDATE jobs_recalculo
+            SET a_partir_de = ?, tickers = ?, recalcular_carteira = ?, tickers_manuais = ?, solicitacoes = solicitacoes + 1
+            WHERE id = ?
+            ''', (
+                a_partir_de_mesclado, None if tickers_mesclados is None else ",".join(sorted(set(tickers_mesclados))),
+                int(recalcular_carteira or job["recalcular_carteira"]),
+                _mesclar_tickers_manuais(job["tickers_manuais"], tickers, recalcular_carteira, tickers_manuais), job["id"]
+            ))
+            job_id = job["id"]
+        conn.commit()
+        return job_id
+
+def reservar_proximo_job_recalculo(usuario_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Marca como 'executando' o job pendente mais antigo de um usuário que não tenha
+    outro job em execução (os jobs de um mesmo usuário são executados em série).
+
+    Args:
+        usuario_id: Reserva apenas jobs deste usuário (opcional; padrão: qualquer usuário).
+
+    Returns:
+        Optional[Dict[str, Any]]: Job reservado ou None se não houver job disponível.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if not conn.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute('''
+        SELECT * FROM jobs_recalculo j
+        WHERE j.status = 'pendente'
+          AND (? IS NULL OR j.usuario_id = ?)
+          AND NOT EXISTS (
+              SELECT 1 FROM jobs_recalculo e WHERE e.usuario_id = j.usuario_id AND e.status = 'executando'
+          )
+        ORDER BY j.id
+        LIMIT 1
+        ''', (usuario_id, usuario_id))
+        row = cursor.fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        iniciado_em = datetime.now().isoformat(timespec="seconds")
+        cursor.execute(
+            "UPDATE jobs_recalculo SET status = 'executando', iniciado_em = ? WHERE id = ?",
+            (iniciado_em, row["id"])
+        )
+        conn.commit()
+        job = _job_recalculo_para_dict(row)
+        job.update(status="executando", iniciado_em=iniciado_em)
+        return job
+
+def atualizar_progresso_job_recalculo(job_id: int, progresso: int, etapa: str) -> None:
+    """Registra o progresso (0 a 100) e a etapa corrente de um job em execução."""
+    with get_db() as conn:
+        conn.execute("UPDATE jobs_recalculo SET progresso = ?, etapa = ? WHERE id = ?", (progresso, etapa, job_id))
+        conn.commit()
+
+def finalizar_job_recalculo(job_id: int, erro: Optional[str] = None) -> None:
+    """
+    Marca um job como 'concluido' ou, se `erro` for informado, como 'erro'.
+    """
+    with get_db() as conn:
+        conn.execute('''
+        UPDATE jobs_recalculo
+        SET status = ?, progresso = CASE WHEN ? IS NULL THEN 100 ELSE progresso END, erro = ?, concluido_em = ?
+        WHERE id = ?
+        ''', ("erro" if erro else "concluido", erro, erro, datetime.now().isoformat(timespec="seconds"), job_id))
+        conn.commit()
+
+def purgar_jobs_recalculo_finalizados(dias: int) -> int:
+    """
+    Remove os jobs 'concluido' e 'erro' finalizados há mais de `dias` dias
+    (chamada periodicamente pela manutenção do banco).
+
+    Returns:
+        int: Quantidade de jobs removidos.
+    """
+    limite = (datetime.now() - timedelta(days=dias)).isoformat(timespec="seconds")
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM jobs_recalculo WHERE status IN ('concluido', 'erro') AND concluido_em < ?", (limite,)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+def reiniciar_jobs_recalculo_interrompidos() -> int:
+    """
+    Devolve à fila os jobs que ficaram 'executando' (ex.: servidor reiniciado no meio do recálculo).
+
+    Returns:
+        int: Quantidade de jobs devolvidos à fila.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE jobs_recalculo SET status = 'pendente', progresso = 0, etapa = NULL, iniciado_em = NULL WHERE status = 'executando'"
+        )
+        conn.commit()
+        return cursor.rowcount
+
+def obter_job_recalculo(job_id: int, usuario_id: int) -> Optional[Dict[str, Any]]:
+    """Obtém um job de recálculo do usuário pelo ID."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM jobs_recalculo WHERE id = ? AND usuario_id = ?", (job_id, usuario_id))
+        row = cursor.fetchone()
+        return _job_recalculo_para_dict(row) if row else None
+
+def listar_jobs_recalculo_usuario(usuario_id: int, limite: int = 20) -> List[Dict[str, Any]]:
+    """Lista os jobs de recálculo mais recentes do usuário."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM jobs_recalculo WHERE usuario_id = ? ORDER BY id DESC LIMIT ?", (usuario_id, limite)
+        )
+        return [_job_recalculo_para_dict(row) for row in cursor.fetchall()]
+
+def contar_jobs_recalculo_por_status() -> Dict[str, int]:
+    """Retorna a quantidade de jobs pendentes e em execução (todos os usuários), por status."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM jobs_recalculo WHERE status IN ('pendente', 'executando') GROUP BY status")
+        contagens = {"pendente": 0, "executando": 0}
+        contagens.update({row[0]: row[1] for row in cursor.fetchall()})
+        return contagens
+
+def contar_jobs_recalculo_ativos() -> int:
+    """Retorna a quantidade de jobs pendentes ou em execução (todos os usuários)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM jobs_recalculo WHERE status IN ('pendente', 'executando')")
+        return cursor.fetchone()[0]
+
+
+# --- Histórico de preços ---
+
+def obter_precos_historicos_db(ticker: str, inicio: date, fim: date) -> Dict[date, float]:
+    """
+    Obtém os preços de fechamento armazenados de um ticker entre duas datas (inclusive).
+
+    Returns:
+        Dict[date, float]: Fechamento por data.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT data, fechamento FROM precos_historicos WHERE ticker = ? AND data BETWEEN ? AND ? ORDER BY data",
+            (ticker, inicio, fim)
+        )
+        return {row["data"]: row["fechamento"] for row in cursor.fetchall()}
+
+def obter_cobertura_precos_db(ticker: str) -> List[tuple]:
+    """
+    Retorna os intervalos (inicio, fim), ordenados e disjuntos, já consultados no provedor para o ticker.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT inicio, fim FROM precos_cobertura WHERE ticker = ? ORDER BY inicio", (ticker,))
+        return [(row["inicio"], row["fim"]) for row in cursor.fetchall()]
+
+def salvar_precos_historicos_db(ticker: str, precos: Dict[date, float], cobertura: List[tuple]) -> None:
+    """
+    Grava preços de fechamento de um ticker e substitui seus intervalos de cobertura,
+    em uma única transação.
+
+    Args:
+        ticker: Ticker.
+        precos: Fechamento por data.
+        cobertura: Intervalos (inicio, fim) já mesclados que passam a estar cobertos.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO precos_historicos (ticker, data, fechamento) VALUES (?, ?, ?)",
+            [(ticker, data, fechamento) for data, fechamento in precos.items()]
+        )
+        cursor.execute("DELETE FROM precos_cobertura WHERE ticker = ?", (ticker,))
+        cursor.executemany(
+            "INSERT INTO precos_cobertura (ticker, inicio, fim) VALUES (?, ?, ?)",
+            [(ticker, inicio, fim) for inicio, fim in cobertura]
+        )
+        conn.commit()
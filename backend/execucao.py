@@ -0,0 +1,210 @@
+"""
+Camada de execução dos serviços bloqueantes chamados pelos endpoints async.
+
+Os endpoints `async def` não podem chamar diretamente o SQLite ou os cálculos em
+Python puro sem travar o event loop (e, com ele, todas as outras requisições do
+worker). Aqui esses serviços rodam em um pool de threads limitado, com um limite
+de chamadas simultâneas por endpoint. Cada endpoint acumula métricas de fila (chamadas aguardando
+vaga, em execução, tempo de espera). O hash de senhas (PBKDF2, deliberadamente caro)
+tem um pool próprio e pequeno, para que uma rajada de logins não ocupe as threads
+dos demais serviços.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from metricas import MetricaColetada
+
+# Threads do pool que executa os serviços bloqueantes
+SERVICE_THREADS = int(os.getenv("SERVICE_THREADS", "8"))
+# Threads do pool dedicado ao hash de senhas (login, registro, troca de senha): é também
+# o número máximo de hashes calculados ao mesmo tempo
+PASSWORD_HASH_THREADS = int(os.getenv("PASSWORD_HASH_THREADS", "2"))
+# Chamadas simultâneas permitidas por endpoint, salvo os limites específicos abaixo
+LIMITE_CONCORRENCIA_PADRAO = int(os.getenv("ENDPOINT_CONCURRENCY", "4"))
+# Endpoints pesados (histórico completo, preços externos) recebem limites menores
+LIMITES_CONCORRENCIA: Dict[str, int] = {
+    "analysis.equity_history": 2,
+    "analysis.bens_e_direitos": 2,
+    "operacoes.fechadas": 2,
+    "operacoes.upload": 2,
+}
+
+class _MetricasEndpoint:
+    def __init__(self, limite: int):
+        self.limite = limite
+        self.em_espera = 0
+        self.em_execucao = 0
+        self.max_em_espera = 0
+        self.concluidas = 0
+        self.falhas = 0
+        self.tempo_espera_total = 0.0
+        self.tempo_execucao_total = 0.0
+
+    def como_dict(self) -> Dict[str, Any]:
+        total = self.concluidas + self.falhas
+        return {
+            "limite": self.limite,
+            "em_espera": self.em_espera,
+            "em_execucao": self.em_execucao,
+            "max_em_espera": self.max_em_espera,
+            "concluidas": self.concluidas,
+            "falhas": self.falhas,
+            "tempo_medio_espera": self.tempo_espera_total / total if total else 0.0,
+            "tempo_medio_execucao": self.tempo_execucao_total / total if total else 0.0,
+        }
+
+class ExecutorServicos:
+    """
+    Executa funções bloqueantes fora do event loop, respeitando um limite de
+    concorrência por endpoint.
+    """
+
+    def __init__(self, threads: int = SERVICE_THREADS):
+        self.threads = threads
+        self._pool_threads: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._metricas: Dict[str, _MetricasEndpoint] = {}
+        # Semáforos por event loop (um asyncio.Semaphore fica preso ao loop em que é usado)
+        self._semaforos: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+        self._aguardando_pool = 0
+
+    def _obter_pool_threads(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool_threads is None:
+                self._pool_threads = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="servicos")
+            return self._pool_threads
+
+    def _metricas_endpoint(self, nome: str) -> _MetricasEndpoint:
+        with self._lock:
+            if nome not in self._metricas:
+                self._metricas[nome] = _MetricasEndpoint(LIMITES_CONCORRENCIA.get(nome, LIMITE_CONCORRENCIA_PADRAO))
+            return self._metricas[nome]
+
+    def _semaforo(self, nome: str, limite: int) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        por_loop = self._semaforos.setdefault(loop, {})
+        if nome not in por_loop:
+            por_loop[nome] = asyncio.Semaphore(limite)
+        return por_loop[nome]
+
+    def _marcar_inicio(self, func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def executar(*args, **kwargs):
+            with self._lock:
+                self._aguardando_pool -= 1
+            return func(*args, **kwargs)
+        return executar
+
+    async def executar(self, nome: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Executa `func(*args, **kwargs)` no pool de threads sob o limite do endpoint `nome`.
+        """
+        metricas = self._metricas_endpoint(nome)
+        semaforo = self._semaforo(nome, metricas.limite)
+        loop = asyncio.get_running_loop()
+
+        inicio_espera = time.perf_counter()
+        metricas.em_espera += 1
+        metricas.max_em_espera = max(metricas.max_em_espera, metricas.em_espera)
+        try:
+            await semaforo.acquire()
+        finally:
+            metricas.em_espera -= 1
+        inicio_execucao = time.perf_counter()
+        metricas.tempo_espera_total += inicio_execucao - inicio_espera
+        metricas.em_execucao += 1
+        try:
+            with self._lock:
+                self._aguardando_pool += 1
+            # O serviço roda no contexto da requisição (medição das consultas, rastreio)
+            contexto = contextvars.copy_context()
+            resultado = await loop.run_in_executor(
+                self._obter_pool_threads(), functools.partial(contexto.run, self._marcar_inicio(func), *args, **kwargs)
+            )
+        except BaseException:
+            metricas.falhas += 1
+            raise
+        else:
+            metricas.concluidas += 1
+            return resultado
+        finally:
+            metricas.em_execucao -= 1
+            metricas.tempo_execucao_total += time.perf_counter() - inicio_execucao
+            semaforo.release()
+
+    def metricas(self) -> Dict[str, Any]:
+        """Retorna as métricas dos pools e de cada endpoint."""
+        with self._lock:
+            endpoints = {nome: m.como_dict() for nome, m in self._metricas.items()}
+            return {
+                "threads": self.threads,
+                "aguardando_pool_threads": self._aguardando_pool,
+                "endpoints": endpoints,
+            }
+
+    def encerrar(self) -> None:
+        """Encerra o pool de threads (shutdown da API)."""
+        with self._lock:
+            if self._pool_threads is not None:
+                self._pool_threads.shutdown(wait=True)
+                self._pool_threads = None
+
+_executor_servicos = ExecutorServicos()
+_executor_senhas = ExecutorServicos(threads=PASSWORD_HASH_THREADS)
+
+def _coletar_endpoints(campo: str):
+    def coletar():
+        for pool, executor in (("servicos", _executor_servicos), ("hash_senhas", _executor_senhas)):
+            for nome, metricas in executor.metricas()["endpoints"].items():
+                yield (pool, nome), metricas[campo]
+    return coletar
+
+MetricaColetada("investir_servicos_em_espera", "Chamadas aguardando vaga no limite do endpoint.", "gauge",
+                ("pool", "endpoint"), _coletar_endpoints("em_espera"))
+MetricaColetada("investir_servicos_em_execucao", "Chamadas em execução no pool, por endpoint.", "gauge",
+                ("pool", "endpoint"), _coletar_endpoints("em_execucao"))
+MetricaColetada("investir_servicos_concluidos_total", "Chamadas concluídas no pool, por endpoint.", "counter",
+                ("pool", "endpoint"), _coletar_endpoints("concluidas"))
+MetricaColetada("investir_servicos_falhas_total", "Chamadas que terminaram em exceção, por endpoint.", "counter",
+                ("pool", "endpoint"), _coletar_endpoints("falhas"))
+
+async def executar_servico(nome: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Executa um serviço bloqueante (SQLite, cálculos) fora do event loop.
+
+    Args:
+        nome: Nome do endpoint, usado para o limite de concorrência e as métricas.
+        func: Função a executar; os demais argumentos são repassados a ela.
+
+    Returns:
+        Any: Retorno de `func`.
+    """
+    return await _executor_servicos.executar(nome, func, *args, **kwargs)
+
+async def executar_hash_senha(nome: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Executa um serviço que calcula hash de senha (ex.: auth.verificar_credenciais,
+    auth.criar_usuario) no pool dedicado, limitado a PASSWORD_HASH_THREADS threads.
+    """
+    return await _executor_senhas.executar(nome, func, *args, **kwargs)
+
+def obter_metricas_execucao() -> Dict[str, Any]:
+    """
+    Retorna as métricas da camada de execução (fila e concorrência por endpoint);
+    as do pool de hash de senhas ficam em "hash_senhas".
+    """
+    metricas = _executor_servicos.metricas()
+    metricas["hash_senhas"] = _executor_senhas.metricas()
+    return metricas
+
+def encerrar_executor_servicos() -> None:
+    """Encerra os pools de threads dos serviços e do hash de senhas."""
+    _executor_servicos.encerrar()
+    _executor_senhas.encerrar()
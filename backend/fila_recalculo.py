@@ -0,0 +1,210 @@
+"""
+Fila de recálculo em segundo plano.
+
+As mutações (upload, inclusão/remoção de operações, edição da carteira) apenas
+enfileiram um job "recalcular o usuário X a partir da data D" na tabela
+jobs_recalculo; um pool de threads do próprio processo executa os jobs. Pedidos
+de um mesmo usuário feitos enquanto o job ainda está pendente são mesclados em
+um único recálculo, e os jobs de um usuário são executados em série.
+
+A fila pressupõe um único processo servindo a API: ao iniciar, os jobs que
+ficaram 'executando' (processo interrompido) voltam para 'pendente'.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from database import (
+    enfileirar_job_recalculo,
+    reservar_proximo_job_recalculo,
+    atualizar_progresso_job_recalculo,
+    finalizar_job_recalculo,
+    reiniciar_jobs_recalculo_interrompidos,
+    contar_jobs_recalculo_ativos,
+    contar_jobs_recalculo_por_status,
+    fechar_conexoes_pool,
+)
+from metricas import BUCKETS_LATENCIA, Histograma, MetricaColetada
+
+# Threads que executam os jobs (0 = executa o recálculo na própria requisição)
+RECALC_WORKERS = int(os.getenv("RECALC_WORKERS", "2"))
+# Intervalo máximo, em segundos, entre consultas à tabela de jobs quando a fila está ociosa
+INTERVALO_VERIFICACAO_FILA = 5.0
+# Espera, em segundos, após uma falha ao consultar a fila (ex.: "database is locked")
+ESPERA_APOS_FALHA_FILA = 1.0
+
+DURACAO_JOBS = Histograma("investir_fila_recalculo_job_duracao_segundos",
+                          "Duração dos jobs de recálculo, por resultado (ok ou erro).", ("resultado",),
+                          buckets=BUCKETS_LATENCIA + (120.0, 300.0))
+# Profundidade da fila lida da tabela jobs_recalculo a cada coleta (uma consulta indexada)
+MetricaColetada("investir_fila_recalculo_jobs", "Jobs de recálculo pendentes e em execução.", "gauge", ("status",),
+                lambda: [((status,), quantidade) for status, quantidade in contar_jobs_recalculo_por_status().items()])
+
+def executar_job_recalculo(job: Dict[str, Any]) -> None:
+    """
+    Executa um job de recálculo: carteira (se solicitada), resultados mensais
+    a partir da data do job e proventos recebidos, registrando o progresso.
+
+    Args:
+        job: Job reservado por `reservar_proximo_job_recalculo`.
+    """
+    # Importação tardia: services enfileira jobs e, portanto, importa este módulo
+    from services import recalcular_carteira, recalcular_resultados, recalcular_proventos_recebidos_rapido
+
+    usuario_id = job["usuario_id"]
+    if job["recalcular_carteira"]:
+        atualizar_progresso_job_recalculo(job["id"], 10, "carteira")
+        # As posições editadas manualmente depois do pedido não são reconstruídas
+        recalcular_carteira(usuario_id=usuario_id, tickers=job["tickers"], tickers_preservados=job["tickers_manuais"])
+    atualizar_progresso_job_recalculo(job["id"], 40, "resultados")
+    recalcular_resultados(usuario_id=usuario_id, a_partir_de=job["a_partir_de"])
+    atualizar_progresso_job_recalculo(job["id"], 75, "proventos")
+    recalcular_proventos_recebidos_rapido(usuario_id=usuario_id)
+
+class FilaRecalculo:
+    """
+    Pool de threads que consome a tabela jobs_recalculo.
+    """
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self._threads: List[threading.Thread] = []
+        self._sinal = threading.Event()
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def ativa(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    def iniciar(self) -> None:
+        """Inicia as threads da fila, se ainda não estiverem rodando."""
+        with self._lock:
+            if self.ativa or self.num_workers <= 0:
+                return
+            self._parar.clear()
+            self._threads = [
+                threading.Thread(target=self._executar, name=f"recalculo-{i}", daemon=True)
+                for i in range(self.num_workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def parar(self, timeout: Optional[float] = None) -> None:
+        """Sinaliza as threads para terminar (após o job corrente) e aguarda."""
+        with self._lock:
+            self._parar.set()
+            self._sinal.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def notificar(self) -> None:
+        """Acorda as threads ociosas para consultar a fila."""
+        self._sinal.set()
+
+    def executar_pendentes(self, usuario_id: Optional[int] = None) -> None:
+        """
+        Executa, na thread atual, os jobs disponíveis até a fila esvaziar.
+
+        Args:
+            usuario_id: Executa apenas os jobs deste usuário (opcional).
+        """
+        while True:
+            job = reservar_proximo_job_recalculo(usuario_id)
+            if job is None:
+                return
+            self._executar_job(job)
+
+    def _executar(self) -> None:
+        try:
+            while not self._parar.is_set():
+                # Uma falha ao consultar ou finalizar um job não encerra a thread
+                try:
+                    job = reservar_proximo_job_recalculo()
+                    if job is not None:
+                        self._executar_job(job)
+                        continue
+                except Exception as e:
+                    logging.error(f"Falha na fila de recálculo; nova tentativa em {ESPERA_APOS_FALHA_FILA}s: {e}", exc_info=True)
+                    self._parar.wait(ESPERA_APOS_FALHA_FILA)
+                    continue
+                self._sinal.wait(INTERVALO_VERIFICACAO_FILA)
+                self._sinal.clear()
+        finally:
+            fechar_conexoes_pool()
+
+    def _executar_job(self, job: Dict[str, Any]) -> None:
+        inicio = time.perf_counter()
+        try:
+            executar_job_recalculo(job)
+        except Exception as e:
+            DURACAO_JOBS.observar(time.perf_counter() - inicio, "erro")
+            logging.error(f"Falha no job de recálculo {job['id']} do usuário {job['usuario_id']}: {e}", exc_info=True)
+            finalizar_job_recalculo(job["id"], erro=str(e) or e.__class__.__name__)
+        else:
+            DURACAO_JOBS.observar(time.perf_counter() - inicio, "ok")
+            finalizar_job_recalculo(job["id"])
+
+_fila_recalculo = FilaRecalculo(RECALC_WORKERS)
+
+def iniciar_fila_recalculo() -> None:
+    """Retoma os jobs interrompidos e inicia as threads da fila (startup da API)."""
+    reiniciados = reiniciar_jobs_recalculo_interrompidos()
+    if reiniciados:
+        logging.warning(f"{reiniciados} job(s) de recálculo interrompido(s) devolvido(s) à fila.")
+    _fila_recalculo.iniciar()
+    _fila_recalculo.notificar()
+
+def parar_fila_recalculo(timeout: Optional[float] = 30.0) -> None:
+    """Encerra as threads da fila (shutdown da API)."""
+    _fila_recalculo.parar(timeout)
+
+def enfileirar_recalculo(usuario_id: int, a_partir_de: Optional[date] = None,
+                         tickers: Optional[List[str]] = None, recalcular_carteira: bool = True) -> int:
+    """
+    Enfileira (ou mescla ao job pendente do usuário) um recálculo em segundo plano.
+
+    Args:
+        usuario_id: ID do usuário.
+        a_partir_de: Data da operação mais antiga afetada (None = histórico completo).
+        tickers: Tickers cuja posição deve ser recalculada (None = carteira completa).
+        recalcular_carteira: Se False, apenas resultados e proventos são recalculados.
+
+    Returns:
+        int: ID do job, para acompanhamento em /api/jobs/{id}.
+    """
+    job_id = enfileirar_job_recalculo(usuario_id, a_partir_de, tickers, recalcular_carteira)
+    processar_fila_recalculo(usuario_id)
+    return job_id
+
+def processar_fila_recalculo(usuario_id: int) -> None:
+    """
+    Encaminha o job recém-enfileirado: acorda as threads da fila ou, sem workers
+    (RECALC_WORKERS=0), executa na própria requisição apenas os jobs do usuário.
+
+    Args:
+        usuario_id: ID do usuário que enfileirou o job.
+    """
+    if _fila_recalculo.num_workers <= 0:
+        _fila_recalculo.executar_pendentes(usuario_id)
+    else:
+        _fila_recalculo.iniciar()
+        _fila_recalculo.notificar()
+
+def aguardar_fila_recalculo(timeout: float = 30.0) -> bool:
+    """
+    Aguarda até que não haja jobs pendentes ou em execução.
+
+    Returns:
+        bool: True se a fila esvaziou dentro do prazo.
+    """
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        if contar_jobs_recalculo_ativos() == 0:
+            return True
+        time.sleep(0.05)
+    return contar_jobs_recalculo_ativos() == 0
@@ -0,0 +1,307 @@
+"""
+Importação de arquivos de operações em streaming (/api/upload).
+
+O arquivo é lido em blocos: o array JSON é decodificado elemento a elemento e os
+CSVs (inclusive as exportações de negociação da B3) linha a linha. As operações
+são validadas e gravadas em lotes de TAMANHO_LOTE_IMPORTACAO, cada lote em uma
+transação, e a carteira/resultados são recalculados uma única vez ao final
+(na própria chamada ou por um job da fila de recálculo).
+
+Uma operação inválida interrompe a importação com ErroImportacao: os lotes
+anteriores continuam gravados, e o erro informa quantas operações foram importadas
+e qual operação do arquivo falhou, para que o reenvio parta da primeira não gravada.
+"""
+import codecs
+import csv
+import io
+import itertools
+import json
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set
+
+from models import OperacaoCreate
+from services import gravar_lote_operacoes, recalcular_carteira, recalcular_resultados
+from fila_recalculo import enfileirar_recalculo
+
+# Bytes lidos do arquivo por vez
+TAMANHO_BLOCO_LEITURA = 64 * 1024
+# Operações validadas e gravadas por transação
+TAMANHO_LOTE_IMPORTACAO = 1000
+
+class ErroImportacao(ValueError):
+    """
+    Falha em uma operação do arquivo depois de zero ou mais lotes já gravados.
+
+    Attributes:
+        operacao: Posição (a partir de 1) da operação que falhou no arquivo.
+        operacoes_importadas: Operações gravadas antes da falha (as primeiras do arquivo).
+        job_id: Job de recálculo enfileirado para as operações gravadas (ou None).
+        causa: Exceção original (JSONDecodeError, csv.Error, ValidationError, ValueError...).
+    """
+
+    def __init__(self, causa: Exception, operacao: int, operacoes_importadas: int, job_id: Optional[int]):
+        super().__init__(f"Operação {operacao} do arquivo: {causa}")
+        self.causa = causa
+        self.operacao = operacao
+        self.operacoes_importadas = operacoes_importadas
+        self.job_id = job_id
+
+def _converter_numero_br(valor: str) -> float:
+    """
+    Converte um número em texto no formato brasileiro ("R$ 1.234,56") ou
+    internacional ("1234.56") para float.
+    """
+    texto = valor.replace("R$", "").strip()
+    if "," in texto:
+        # Vírgula decimal: os pontos são separadores de milhar
+        texto = texto.replace(".", "").replace(",", ".")
+    return float(texto)
+
+def preprocess_imported_operation(op: dict) -> dict:
+    # Mapeamento de campos
+    field_map = {
+        "Data do Negócio": "date",
+        "Código de Negociação": "ticker",
+        "Tipo de Movimentação": "operation",
+        "Quantidade": "quantity",
+        "Preço": "price",
+        "Instituição": "corretora_nome",
+        # Outros campos podem ser mapeados conforme necessário
+    }
+    new_op = {}
+    for k, v in op.items():
+        key = field_map.get(k, k)
+        new_op[key] = v
+    # Conversão de valores
+    if "price" in new_op and isinstance(new_op["price"], str):
+        new_op["price"] = _converter_numero_br(new_op["price"])
+    if "quantity" in new_op:
+        new_op["quantity"] = int(new_op["quantity"])
+    if "operation" in new_op:
+        if new_op["operation"].lower().startswith("compra"):
+            new_op["operation"] = "buy"
+        elif new_op["operation"].lower().startswith("venda"):
+            new_op["operation"] = "sell"
+    if "ticker" in new_op:
+        new_op["ticker"] = str(new_op["ticker"]).replace("F", "")
+    if isinstance(new_op.get("date"), str) and "/" in new_op["date"]:
+        # Converte para ISO
+        try:
+            new_op["date"] = datetime.strptime(new_op["date"], "%d/%m/%Y").date().isoformat()
+        except Exception:
+            pass
+    # Taxas e fees default
+    if "fees" not in new_op:
+        new_op["fees"] = 0.0
+    return new_op
+
+def iterar_operacoes_json(arquivo: BinaryIO, tamanho_bloco: int = TAMANHO_BLOCO_LEITURA) -> Iterator[Any]:
+    """
+    Percorre um array JSON lendo o arquivo em blocos, devolvendo um elemento por vez.
+    Apenas o elemento corrente e o bloco em leitura ficam em memória.
+
+    Args:
+        arquivo: Arquivo binário posicionado no início do array.
+        tamanho_bloco: Quantidade de bytes lida por vez.
+
+    Returns:
+        Iterator[Any]: Elementos do array, na ordem do arquivo.
+
+    Raises:
+        json.JSONDecodeError: Se o conteúdo não for um array JSON válido.
+    """
+    decodificador_texto = codecs.getincrementaldecoder("utf-8-sig")()
+    decodificador_json = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    fim_arquivo = False
+
+    def ler_bloco() -> None:
+        nonlocal buffer, pos, fim_arquivo
+        bloco = arquivo.read(tamanho_bloco)
+        fim_arquivo = not bloco
+        # Descarta o que já foi consumido para manter o buffer limitado
+        buffer = buffer[pos:] + decodificador_texto.decode(bloco or b"", final=fim_arquivo)
+        pos = 0
+
+    def proximo_caractere() -> Optional[str]:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if fim_arquivo:
+                return None
+            ler_bloco()
+
+    if proximo_caractere() != "[":
+        raise json.JSONDecodeError("Esperado '[' no início do arquivo", buffer, pos)
+    pos += 1
+
+    if proximo_caractere() == "]":
+        pos += 1
+    else:
+        while True:
+            if proximo_caractere() is None:
+                raise json.JSONDecodeError("Fim inesperado do arquivo", buffer, pos)
+            try:
+                elemento, fim = decodificador_json.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if fim_arquivo:
+                    raise
+                # O elemento pode estar cortado no fim do bloco: lê mais e tenta de novo
+                ler_bloco()
+                continue
+            if fim == len(buffer) and not fim_arquivo:
+                # Um número no fim do buffer pode continuar no próximo bloco
+                ler_bloco()
+                continue
+            pos = fim
+            yield elemento
+
+            separador = proximo_caractere()
+            if separador == "]":
+                pos += 1
+                break
+            if separador != ",":
+                raise json.JSONDecodeError("Esperado ',' ou ']' entre os elementos", buffer, pos)
+            pos += 1
+
+    if proximo_caractere() is not None:
+        raise json.JSONDecodeError("Conteúdo inesperado após o fim do array", buffer, pos)
+
+def iterar_operacoes_csv(arquivo: BinaryIO) -> Iterator[Dict[str, str]]:
+    """
+    Percorre um CSV de operações linha a linha. Aceita o cabeçalho do próprio sistema
+    (date, ticker, operation, ...) ou o da exportação de negociação da B3
+    ("Data do Negócio", "Tipo de Movimentação", "Código de Negociação", ...),
+    separado por vírgula, ponto e vírgula ou tabulação.
+
+    Args:
+        arquivo: Arquivo binário posicionado no início do CSV.
+
+    Returns:
+        Iterator[Dict[str, str]]: Uma linha por vez, indexada pelo cabeçalho.
+    """
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    try:
+        cabecalho = texto.readline()
+        delimitador = max(";,\t", key=cabecalho.count)
+        leitor = csv.DictReader(itertools.chain([cabecalho], texto), delimiter=delimitador)
+        for linha in leitor:
+            registro = {
+                chave.strip(): valor.strip()
+                for chave, valor in linha.items()
+                if chave and isinstance(valor, str) and valor.strip()
+            }
+            if registro:  # Ignora linhas em branco
+                yield registro
+    finally:
+        # Devolve o arquivo sem fechá-lo; quem abriu é responsável por isso
+        texto.detach()
+
+def detectar_formato(arquivo: BinaryIO, nome_arquivo: Optional[str] = None) -> str:
+    """
+    Determina se o arquivo é JSON ou CSV pela extensão ou, na falta dela, pelo primeiro caractere.
+
+    Returns:
+        str: "json" ou "csv".
+    """
+    extensao = (nome_arquivo or "").lower().rsplit(".", 1)[-1]
+    if extensao in ("json", "csv"):
+        return extensao
+    inicio = arquivo.read(512)
+    arquivo.seek(0)
+    return "json" if inicio.lstrip(b"\xef\xbb\xbf \t\r\n")[:1] in (b"[", b"{") else "csv"
+
+def importar_operacoes_arquivo(
+    arquivo: BinaryIO,
+    usuario_id: int,
+    nome_arquivo: Optional[str] = None,
+    tamanho_lote: int = TAMANHO_LOTE_IMPORTACAO,
+    em_segundo_plano: bool = False,
+) -> Dict[str, Any]:
+    """
+    Importa as operações de um arquivo JSON ou CSV sem carregá-lo inteiro na memória.
+    Cada lote é validado e gravado em uma transação; ao final (mesmo em caso de erro
+    em um lote posterior) a carteira e os resultados são recalculados uma única vez
+    para os tickers e meses efetivamente gravados. Os lotes são gravados em ordem:
+    em caso de erro, as operações importadas são sempre as primeiras do arquivo.
+
+    Args:
+        arquivo: Arquivo binário com as operações.
+        usuario_id: ID do usuário.
+        nome_arquivo: Nome original do arquivo, usado para detectar o formato.
+        tamanho_lote: Operações por transação.
+        em_segundo_plano: Se True, o recálculo (inclusive de proventos) é enfileirado
+            na fila de recálculo em vez de executado na chamada.
+
+    Returns:
+        Dict[str, Any]: "operacoes_importadas" e "job_id" (None se nada foi enfileirado).
+
+    Raises:
+        ErroImportacao: Se o arquivo for inválido (JSON ou CSV malformado), uma operação
+            for inválida ou o ticker não existir; a exceção original fica em `causa`.
+    """
+    if detectar_formato(arquivo, nome_arquivo) == "csv":
+        registros = iterar_operacoes_csv(arquivo)
+    else:
+        registros = iterar_operacoes_json(arquivo)
+
+    cache_tickers: Dict[str, bool] = {}
+    cache_corretoras: Dict[str, int] = {}
+    tickers_importados: Set[str] = set()
+    data_minima: Optional[date] = None
+    total_importado = 0
+    job_id: Optional[int] = None
+    lote: List[OperacaoCreate] = []
+
+    def gravar_lote() -> None:
+        nonlocal data_minima, total_importado, posicao_erro
+        try:
+            gravar_lote_operacoes(lote, usuario_id, cache_tickers, cache_corretoras)
+        except Exception:
+            # O lote inteiro é descartado; a operação com erro é a do primeiro ticker inexistente
+            invalida = next((i for i, op in enumerate(lote) if not cache_tickers.get(op.ticker, True)), 0)
+            posicao_erro = total_importado + invalida + 1
+            raise
+        for op in lote:
+            data_op = date.fromisoformat(str(op.date))
+            data_minima = data_op if data_minima is None else min(data_minima, data_op)
+            tickers_importados.add(op.ticker)
+        total_importado += len(lote)
+        lote.clear()
+
+    # Operações lidas do arquivo, das quais `validadas` passaram pela validação
+    posicao = 0
+    validadas = 0
+    posicao_erro: Optional[int] = None
+    erro: Optional[Exception] = None
+    try:
+        for registro in registros:
+            posicao += 1
+            if not isinstance(registro, dict):
+                raise ValueError("Cada operação do arquivo deve ser um objeto.")
+            lote.append(OperacaoCreate(**preprocess_imported_operation(registro)))
+            validadas = posicao
+            if len(lote) >= tamanho_lote:
+                gravar_lote()
+        if lote:
+            gravar_lote()
+    except Exception as e:
+        erro = e
+        if posicao_erro is None:
+            # Falha na validação da operação lida ou na leitura da seguinte (arquivo malformado)
+            posicao_erro = posicao if validadas < posicao else posicao + 1
+
+    # Recalcula (ou enfileira) o que foi gravado, mesmo que a importação tenha sido interrompida
+    if total_importado and em_segundo_plano:
+        job_id = enfileirar_recalculo(usuario_id, a_partir_de=data_minima, tickers=sorted(tickers_importados))
+    elif total_importado:
+        recalcular_carteira(usuario_id=usuario_id, tickers=sorted(tickers_importados))
+        recalcular_resultados(usuario_id=usuario_id, a_partir_de=data_minima)
+
+    if erro is not None:
+        raise ErroImportacao(erro, posicao_erro, total_importado, job_id) from erro
+    return {"operacoes_importadas": total_importado, "job_id": job_id}
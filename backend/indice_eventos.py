@@ -0,0 +1,179 @@
+"""
+Índice de eventos corporativos por ticker.
+
+Os eventos de cada ticker são lidos do banco uma única vez, ordenados por data ex,
+e guardados com os fatores de quantidade já calculados e acumulados. Ajustar uma
+operação pelos eventos posteriores a ela (até uma data limite) passa a ser uma busca
+binária e uma multiplicação, sem consultas ao banco nem chamadas a
+get_adjustment_factor / get_bonus_quantity_increase por operação.
+
+O resultado é o mesmo do ajuste evento a evento (arredondando a quantidade a cada
+evento): quando todos os eventos do intervalo têm fator inteiro (desdobramentos,
+bonificações de 100%) o fator acumulado é exato; caso contrário (agrupamentos,
+bonificações fracionárias) os eventos do intervalo são aplicados um a um, com os
+fatores pré-calculados.
+
+O índice fica em cache por processo e é invalidado quando um evento é registrado
+(registrar_evento_corporativo_service).
+"""
+import bisect
+import threading
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import database
+from database import obter_id_acao_por_ticker, obter_eventos_corporativos_por_acao_id
+from models import EventoCorporativoInfo
+
+def _eh_bonificacao(evento: EventoCorporativoInfo) -> bool:
+    return bool(evento.evento and evento.evento.lower().startswith("bonific"))
+
+class IndiceEventos:
+    """
+    Eventos corporativos de um ticker, ordenados por data ex, com fatores acumulados.
+    """
+
+    def __init__(self, eventos: Iterable[EventoCorporativoInfo], id_acao: Optional[int] = None):
+        self.id_acao = id_acao
+        self.eventos: List[EventoCorporativoInfo] = sorted(
+            (evento for evento in eventos if evento.data_ex is not None),
+            key=lambda evento: (evento.data_ex, evento.id or 0),
+        )
+        self.datas_ex: List[date] = [evento.data_ex for evento in self.eventos]
+        # Por evento: se é bonificação, proporção bonificada (numerador/denominador) e fator de quantidade
+        self.bonificacao: List[bool] = []
+        self.proporcao_bonus: List[float] = []
+        self.fatores: List[float] = []
+        for evento in self.eventos:
+            bonificacao = _eh_bonificacao(evento)
+            proporcao = evento.get_bonus_quantity_increase(1.0) if bonificacao else 0.0
+            self.bonificacao.append(bonificacao)
+            self.proporcao_bonus.append(proporcao)
+            self.fatores.append(1.0 + proporcao if bonificacao else evento.get_adjustment_factor())
+
+        # Prefixos acumulados (posição k = eventos[0:k]):
+        # - produto exato (int) dos fatores inteiros não nulos;
+        # - quantidade de fatores nulos e de fatores não inteiros;
+        # - produto dos fatores não nulos, usado para o preço.
+        self._produto_inteiros: List[int] = [1]
+        self._nulos: List[int] = [0]
+        self._nao_inteiros: List[int] = [0]
+        self._produto_preco: List[float] = [1.0]
+        for fator in self.fatores:
+            inteiro = float(fator).is_integer()
+            self._produto_inteiros.append(self._produto_inteiros[-1] * (int(fator) if inteiro and fator else 1))
+            self._nulos.append(self._nulos[-1] + (1 if fator == 0.0 else 0))
+            self._nao_inteiros.append(self._nao_inteiros[-1] + (0 if inteiro else 1))
+            self._produto_preco.append(self._produto_preco[-1] * (fator if fator else 1.0))
+
+    def __len__(self) -> int:
+        return len(self.eventos)
+
+    def _posicao_limite(self, data_limite: Optional[date]) -> int:
+        return len(self.datas_ex) if data_limite is None else bisect.bisect_right(self.datas_ex, data_limite)
+
+    def eventos_ate(self, data_limite: Optional[date] = None) -> List[EventoCorporativoInfo]:
+        """Eventos com data ex até `data_limite` (inclusive; None = todos), por data ex."""
+        return self.eventos[:self._posicao_limite(data_limite)]
+
+    def intervalo(self, data_operacao: date, data_limite: Optional[date] = None) -> Tuple[int, int]:
+        """
+        Posições [inicio, fim) dos eventos que ajustam uma operação de `data_operacao`:
+        data ex posterior à operação e até `data_limite`.
+        """
+        return bisect.bisect_right(self.datas_ex, data_operacao), self._posicao_limite(data_limite)
+
+    def ajustar(self, quantidade: int, preco: float, data_operacao: date,
+                data_limite: Optional[date] = None) -> Tuple[int, float]:
+        """
+        Ajusta quantidade e preço de uma operação pelos eventos com data ex posterior
+        a ela e até `data_limite`. O valor total da operação é preservado.
+
+        Args:
+            quantidade: Quantidade da operação.
+            preco: Preço unitário da operação.
+            data_operacao: Data da operação.
+            data_limite: Data de referência do ajuste (None = todos os eventos).
+
+        Returns:
+            Tuple[int, float]: Quantidade e preço ajustados.
+        """
+        inicio, fim = self.intervalo(data_operacao, data_limite)
+        if fim <= inicio:
+            return quantidade, preco
+
+        if self._nao_inteiros[fim] == self._nao_inteiros[inicio]:
+            if self._nulos[fim] > self._nulos[inicio]:
+                nova_quantidade = 0
+            else:
+                nova_quantidade = quantidade * (self._produto_inteiros[fim] // self._produto_inteiros[inicio])
+            return nova_quantidade, float(preco) / (self._produto_preco[fim] / self._produto_preco[inicio])
+
+        # Há fatores fracionários: aplica os eventos um a um, arredondando a cada evento
+        for posicao in range(inicio, fim):
+            if self.bonificacao[posicao]:
+                nova_quantidade = float(quantidade) + float(quantidade) * self.proporcao_bonus[posicao]
+                if nova_quantidade > 0:
+                    preco = float(preco) * float(quantidade) / nova_quantidade
+                quantidade = int(round(nova_quantidade))
+                continue
+            fator = self.fatores[posicao]
+            if fator == 1.0:
+                continue
+            if fator != 0.0:
+                preco = float(preco) / fator
+            quantidade = int(round(float(quantidade) * fator))
+        return quantidade, float(preco)
+
+    def ajustar_quantidade(self, quantidade: int, data_operacao: date, data_limite: Optional[date] = None) -> int:
+        """Ajusta apenas a quantidade de uma operação (ver `ajustar`)."""
+        return self.ajustar(quantidade, 1.0, data_operacao, data_limite)[0]
+
+_indices: Dict[Tuple[str, str], IndiceEventos] = {}
+_lock_indices = threading.Lock()
+# Incrementada a cada invalidação: um índice lido antes dela não é guardado
+_geracao_indices = 0
+
+def obter_indice_eventos(ticker: str) -> IndiceEventos:
+    """
+    Retorna o índice de eventos corporativos do ticker, lendo o banco apenas na
+    primeira consulta (ou após a invalidação).
+
+    Args:
+        ticker: Ticker da ação.
+
+    Returns:
+        IndiceEventos: Índice (vazio se a ação não estiver cadastrada).
+    """
+    # O arquivo do banco faz parte da chave: testes e scripts trocam de banco no mesmo processo
+    chave = (database.DATABASE_FILE, ticker)
+    with _lock_indices:
+        indice = _indices.get(chave)
+        geracao = _geracao_indices
+    if indice is not None:
+        return indice
+
+    id_acao = obter_id_acao_por_ticker(ticker)
+    if not id_acao:
+        # Ação não cadastrada: não guarda, ela pode ser cadastrada depois
+        return IndiceEventos([])
+    eventos = [EventoCorporativoInfo.model_validate(evento) for evento in obter_eventos_corporativos_por_acao_id(id_acao)]
+    indice = IndiceEventos(eventos, id_acao=id_acao)
+    with _lock_indices:
+        if geracao != _geracao_indices:
+            return indice
+        return _indices.setdefault(chave, indice)
+
+def invalidar_indice_eventos(ticker: Optional[str] = None) -> None:
+    """
+    Descarta o índice de eventos do ticker (ou de todos os tickers), para que a
+    próxima consulta releia o banco.
+    """
+    global _geracao_indices
+    with _lock_indices:
+        _geracao_indices += 1
+        if ticker is None:
+            _indices.clear()
+        else:
+            for chave in [chave for chave in _indices if chave[1] == ticker]:
+                del _indices[chave]
@@ -0,0 +1,209 @@
+"""
+Instrumentação das consultas ao banco por requisição.
+
+Cada requisição HTTP abre uma medição com `medir_consultas` (middleware em main.py);
+as conexões do pool são criadas com `ConexaoInstrumentada`, cujos cursores acumulam
+na medição ativa o número de comandos executados, as linhas lidas e o tempo gasto no
+SQLite (execução e leitura das linhas). Apenas as linhas lidas por fetchone/fetchmany/
+fetchall são contadas: a iteração direta sobre o cursor não é redefinida, porque
+interceptar cada linha custa caro mesmo sem medição ativa. A medição fica em um ContextVar, propagado
+às threads de execucao.executar_servico, de modo que os serviços bloqueantes de uma
+requisição são contados nela. Fora de uma requisição (fila de recálculo, manutenção)
+nada é medido.
+
+Cada comando também é agrupado pela sua forma (SQL normalizado, sem literais nem o
+tamanho das listas IN): uma forma repetida mais de DB_QUERY_REPEAT_LIMIT vezes na
+mesma requisição indica uma consulta dentro de um laço (N+1) e gera um aviso no
+logger "investir.db" ao final da requisição. Com DB_DEBUG_HEADERS=1 a resposta traz
+os cabeçalhos X-DB-Queries, X-DB-Rows, X-DB-Time-Ms e X-DB-Repeated-Queries.
+"""
+import contextvars
+import functools
+import logging
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("investir.db")
+
+# Repetições de uma mesma forma de consulta, por requisição, a partir das quais há aviso (0 desativa)
+DB_QUERY_REPEAT_LIMIT = int(os.getenv("DB_QUERY_REPEAT_LIMIT", "20"))
+# Inclui a contagem de consultas e o tempo de banco nos cabeçalhos das respostas
+DB_DEBUG_HEADERS = os.getenv("DB_DEBUG_HEADERS", "0").lower() in ("1", "true", "sim")
+
+_RE_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_LISTA = re.compile(r"\?(?:\s*,\s*\?)+")
+_RE_ESPACOS = re.compile(r"\s+")
+
+@functools.lru_cache(maxsize=2048)
+def forma_consulta(sql: str) -> str:
+    """
+    Normaliza um comando SQL para agrupar execuções da mesma consulta: literais viram
+    `?`, listas de parâmetros viram `?+` e os espaços são colapsados.
+    """
+    forma = _RE_TEXTO.sub("?", sql)
+    forma = _RE_NUMERO.sub("?", forma)
+    forma = _RE_LISTA.sub("?+", forma)
+    return _RE_ESPACOS.sub(" ", forma).strip()
+
+class MedicaoConsultas:
+    """Consultas, linhas e tempo de banco de uma requisição."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.consultas = 0
+        self.linhas = 0
+        self.tempo = 0.0
+        self.formas: Dict[str, int] = {}
+
+    def registrar(self, sql: str, duracao: float) -> None:
+        self.consultas += 1
+        self.tempo += duracao
+        forma = forma_consulta(sql)
+        self.formas[forma] = self.formas.get(forma, 0) + 1
+
+    def repetidas(self, limite: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Formas executadas mais de `limite` vezes (padrão DB_QUERY_REPEAT_LIMIT), da mais repetida à menos."""
+        limite = DB_QUERY_REPEAT_LIMIT if limite is None else limite
+        if limite <= 0:
+            return []
+        return sorted(((forma, n) for forma, n in self.formas.items() if n > limite), key=lambda item: -item[1])
+
+    def cabecalhos(self) -> Dict[str, str]:
+        return {
+            "X-DB-Queries": str(self.consultas),
+            "X-DB-Rows": str(self.linhas),
+            "X-DB-Time-Ms": f"{1000 * self.tempo:.1f}",
+            "X-DB-Repeated-Queries": str(len(self.repetidas())),
+        }
+
+    def finalizar(self) -> None:
+        for forma, repeticoes in self.repetidas()[:5]:
+            logger.warning("[%s] consulta executada %dx na mesma requisição (possível N+1): %s",
+                           self.nome, repeticoes, forma[:300])
+        logger.debug("[%s] %d consultas, %d linhas, %.1fms de banco",
+                     self.nome, self.consultas, self.linhas, 1000 * self.tempo)
+
+_medicao_atual: contextvars.ContextVar[Optional[MedicaoConsultas]] = contextvars.ContextVar("medicao_consultas", default=None)
+
+@contextmanager
+def medir_consultas(nome: str) -> Iterator[MedicaoConsultas]:
+    """
+    Abre a medição das consultas de uma requisição, ou reutiliza a medição já ativa.
+
+    Args:
+        nome: Identificação da requisição nos avisos (ex.: "GET /api/proventos").
+
+    Yields:
+        Medição ativa.
+    """
+    atual = _medicao_atual.get()
+    if atual is not None:
+        yield atual
+        return
+    medicao = MedicaoConsultas(nome)
+    token = _medicao_atual.set(medicao)
+    try:
+        yield medicao
+    finally:
+        _medicao_atual.reset(token)
+        medicao.finalizar()
+
+def medicao_atual() -> Optional[MedicaoConsultas]:
+    """Medição da requisição em andamento (None fora de uma requisição)."""
+    return _medicao_atual.get()
+
+@contextmanager
+def sem_medicao() -> Iterator[None]:
+    """Suspende a medição no bloco (ex.: PRAGMAs de configuração de uma conexão nova)."""
+    token = _medicao_atual.set(None)
+    try:
+        yield
+    finally:
+        _medicao_atual.reset(token)
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """Cursor que acumula comandos, linhas e tempo na medição ativa (sem custo de medição fora dela)."""
+
+    def execute(self, sql, parametros=()):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().execute(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            medicao.registrar(sql, time.perf_counter() - inicio)
+
+    def executemany(self, sql, sequencia):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().executemany(sql, sequencia)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, sequencia)
+        finally:
+            medicao.registrar(sql, time.perf_counter() - inicio)
+
+    def executescript(self, script):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().executescript(script)
+        inicio = time.perf_counter()
+        try:
+            return super().executescript(script)
+        finally:
+            medicao.registrar(script, time.perf_counter() - inicio)
+
+    def fetchone(self):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().fetchone()
+        inicio = time.perf_counter()
+        linha = super().fetchone()
+        medicao.tempo += time.perf_counter() - inicio
+        if linha is not None:
+            medicao.linhas += 1
+        return linha
+
+    def fetchmany(self, size=None):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().fetchmany(self.arraysize if size is None else size)
+        inicio = time.perf_counter()
+        linhas = super().fetchmany(self.arraysize if size is None else size)
+        medicao.tempo += time.perf_counter() - inicio
+        medicao.linhas += len(linhas)
+        return linhas
+
+    def fetchall(self):
+        medicao = _medicao_atual.get()
+        if medicao is None:
+            return super().fetchall()
+        inicio = time.perf_counter()
+        linhas = super().fetchall()
+        medicao.tempo += time.perf_counter() - inicio
+        medicao.linhas += len(linhas)
+        return linhas
+
+class ConexaoInstrumentada(sqlite3.Connection):
+    """
+    Conexão cujos cursores são `CursorInstrumentado`. Os atalhos execute/executemany
+    da conexão são redefinidos porque os de sqlite3.Connection não passam por cursor().
+    """
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, sequencia):
+        return self.cursor().executemany(sql, sequencia)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
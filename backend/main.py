@@ -1,5 +1,11 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Path, Body, Depends, status
+from fastapi import FastAPI, UploadFile, File, HTTPException, Path, Body, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
+import asyncio
+import csv
+import hmac
+import time
 import json
 from typing import List, Dict, Any
 import uvicorn
@@ -17,7 +23,7 @@ from models import (
     LoginResponse, FuncaoCreate, FuncaoUpdate, FuncaoResponse, TokenResponse,
     Corretora # Added Corretora model
 )
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
 
 # Pydantic model for DARF status update
@@ -27,12 +33,21 @@ class DARFStatusUpdate(BaseModel):
 from database import (
     criar_tabelas, 
     limpar_banco_dados, 
+    manter_banco,
+    DB_MAINTENANCE_INTERVAL,
+    RECALC_JOBS_RETENTION_DAYS,
+    purgar_jobs_recalculo_finalizados,
+    ErroRecalculoEmAndamento,
     # get_db, remover_operacao, obter_todas_operacoes removed
 )
 
 import services # Keep this for other service functions
+from importador_operacoes import ErroImportacao, importar_operacoes_arquivo
+from fila_recalculo import iniciar_fila_recalculo, parar_fila_recalculo
+from execucao import executar_servico, executar_hash_senha, encerrar_executor_servicos, obter_metricas_execucao
+from instrumentacao_db import medir_consultas, DB_DEBUG_HEADERS
+from metricas import exportar_prometheus, DURACAO_HTTP, CONSULTAS_DB_HTTP, TEMPO_DB_HTTP, METRICS_TOKEN
 from services import (
-    calcular_operacoes_fechadas,
     processar_operacoes,
     calcular_resultados_mensais,
     calcular_carteira_atual,
@@ -74,16 +89,47 @@ import auth # Keep this for other auth functions
 from routers import analysis_router
 from routers import proventos_router # Added proventos_router import
 from routers import usuario_router # Added usuario_router import
+from routers import jobs_router
 from dependencies import get_current_user, oauth2_scheme # Import from dependencies
 
 # Inicialização do banco de dados
-criar_tabelas() # Creates non-auth tables
-auth.inicializar_autenticacao() # Initializes authentication system (creates auth tables, modifies others, adds admin)
+# Esquema versionado (inclui as tabelas de autenticação) e administrador padrão
+criar_tabelas()
+
+async def _manutencao_periodica_banco():
+    """
+    Remoção dos tokens expirados/revogados e dos jobs de recálculo finalizados há mais
+    de RECALC_JOBS_RETENTION_DAYS dias, checkpoint do WAL e PRAGMA optimize a cada
+    DB_MAINTENANCE_INTERVAL segundos.
+    """
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        try:
+            removidos = await executar_servico("auth.purgar_tokens", auth.purgar_tokens)
+            logging.info(f"Tokens expirados ou revogados removidos: {removidos}")
+            removidos = await executar_servico("jobs.purgar", purgar_jobs_recalculo_finalizados, RECALC_JOBS_RETENTION_DAYS)
+            logging.info(f"Jobs de recálculo finalizados removidos: {removidos}")
+            resultado = await executar_servico("db.manutencao", manter_banco)
+            logging.info(f"Manutenção do banco concluída: {resultado}")
+        except Exception as e:
+            logging.error(f"Falha na manutenção periódica do banco: {e}", exc_info=True)
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # Inicia as threads da fila de recálculo (retomando jobs interrompidos) e as encerra no shutdown
+    iniciar_fila_recalculo()
+    tarefa_manutencao = asyncio.create_task(_manutencao_periodica_banco()) if DB_MAINTENANCE_INTERVAL > 0 else None
+    yield
+    if tarefa_manutencao is not None:
+        tarefa_manutencao.cancel()
+    parar_fila_recalculo()
+    encerrar_executor_servicos()
 
 app = FastAPI(
     title="API de Acompanhamento de Carteiras de Ações e IR",
     description="API para upload de operações de ações e cálculo de imposto de renda",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=ciclo_de_vida
 )
 
 # Configuração de CORS para permitir requisições de origens diferentes
@@ -95,10 +141,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Mede cada requisição: latência por rota (métricas em /api/metrics), consultas, linhas e
+# tempo de banco, com aviso de consultas repetidas (N+1); com DB_DEBUG_HEADERS=1 os totais
+# de banco vão nos cabeçalhos da resposta
+@app.middleware("http")
+async def instrumentar_requisicao(request: Request, call_next):
+    inicio = time.perf_counter()
+    status_code = 500
+    with medir_consultas(f"{request.method} {request.url.path}") as medicao:
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+        finally:
+            # Rótulo pelo modelo da rota (ex.: /api/operacoes/{operacao_id}); caminhos sem
+            # rota ficam agrupados, para não criar uma série por URL desconhecida
+            rota = getattr(request.scope.get("route"), "path", "sem_rota")
+            DURACAO_HTTP.observar(time.perf_counter() - inicio, request.method, rota, str(status_code))
+            CONSULTAS_DB_HTTP.incrementar(rota, quantidade=medicao.consultas)
+            TEMPO_DB_HTTP.incrementar(rota, quantidade=medicao.tempo)
+    if DB_DEBUG_HEADERS:
+        response.headers.update(medicao.cabecalhos())
+    return response
+
 # Include the analysis router
 app.include_router(analysis_router.router, prefix="/api") # Assuming all API routes are prefixed with /api
 app.include_router(proventos_router.router, prefix="/api") # Added proventos_router
 app.include_router(usuario_router.router, prefix="/api") # Added usuario_router
+app.include_router(jobs_router.router, prefix="/api")
 
 # Endpoint para listar todas as ações (acoes)
 @app.get("/api/acoes", response_model=List[AcaoInfo], tags=["Ações"]) # Renamed path, response_model, tags
@@ -108,7 +177,7 @@ async def listar_acoes(): # Renamed function
     Este endpoint é público e não requer autenticação.
     """
     try:
-        acoes = services.listar_todas_acoes_service() # Renamed service call
+        acoes = await executar_servico("acoes.listar", services.listar_todas_acoes_service) # Renamed service call
         return acoes
     except Exception as e:
         # Log a exceção 'e' aqui para depuração
@@ -128,7 +197,7 @@ async def registrar_provento_para_acao(
     """
     try:
         # usuario.id is available if needed by the service for ownership, though not used in current provento logic
-        return services.registrar_provento_service(id_acao_url=id_acao, provento_in=provento_in)
+        return await executar_servico("proventos.registrar", services.registrar_provento_service, id_acao_url=id_acao, provento_in=provento_in)
     except HTTPException as e:
         raise e # Re-raise HTTPExceptions directly from the service
     except Exception as e:
@@ -144,7 +213,7 @@ async def listar_proventos_da_acao(
     Lista todos os proventos registrados para uma ação específica.
     """
     try:
-        return services.listar_proventos_por_acao_service(id_acao=id_acao)
+        return await executar_servico("proventos.por_acao", services.listar_proventos_por_acao_service, id_acao=id_acao)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -158,7 +227,7 @@ async def listar_todos_os_proventos():
     Este endpoint é público.
     """
     try:
-        return services.listar_todos_proventos_service()
+        return await executar_servico("proventos.listar", services.listar_todos_proventos_service)
     except Exception as e:
         logging.error(f"Error in GET /api/proventos: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao listar todos os proventos: {str(e)}")
@@ -176,7 +245,7 @@ async def registrar_evento_para_acao(
     Registra um novo evento corporativo para uma ação específica.
     """
     try:
-        return services.registrar_evento_corporativo_service(id_acao_url=id_acao, evento_in=evento_in)
+        return await executar_servico("eventos.registrar", services.registrar_evento_corporativo_service, id_acao_url=id_acao, evento_in=evento_in)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -192,7 +261,7 @@ async def listar_eventos_da_acao_corporativos(
     Lista todos os eventos corporativos registrados para uma ação específica.
     """
     try:
-        return services.listar_eventos_corporativos_por_acao_service(id_acao=id_acao)
+        return await executar_servico("eventos.por_acao", services.listar_eventos_corporativos_por_acao_service, id_acao=id_acao)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -207,7 +276,7 @@ async def listar_todos_os_eventos_corporativos_api( # Renamed to avoid conflict
     Lista todos os eventos corporativos de todas as ações cadastradas no sistema.
     """
     try:
-        return services.listar_todos_eventos_corporativos_service()
+        return await executar_servico("eventos.listar", services.listar_todos_eventos_corporativos_service)
     except Exception as e:
         logging.error(f"Error in GET /api/eventos_corporativos: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao listar todos os eventos corporativos: {str(e)}")
@@ -226,7 +295,7 @@ async def listar_proventos_usuario_detalhado(
         # O serviço já retorna List[Dict[str, Any]], que o Pydantic validará contra ProventoRecebidoUsuario.
         # Se ProventoRecebidoUsuario tiver Config.from_attributes = True e o serviço retornasse objetos ORM,
         # a conversão seria automática. Como o serviço já constrói os dicionários, está ok.
-        proventos_data = services.listar_proventos_recebidos_pelo_usuario_service(usuario_id=usuario.id)
+        proventos_data = await executar_servico("usuario.proventos", services.listar_proventos_recebidos_pelo_usuario_service, usuario_id=usuario.id)
         # Para garantir a validação e conversão correta para o response_model:
         return proventos_data
     except Exception as e:
@@ -241,7 +310,7 @@ async def obter_resumo_proventos_anuais_usuario(
     Gera um resumo anual dos proventos recebidos pelo usuário logado.
     """
     try:
-        return services.gerar_resumo_proventos_anuais_usuario_service(usuario_id=usuario.id)
+        return await executar_servico("usuario.proventos.resumo", services.gerar_resumo_proventos_anuais_usuario_service, usuario_id=usuario.id)
     except Exception as e:
         logging.error(f"Error in GET /api/usuario/proventos/resumo_anual/ for user {usuario.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao gerar resumo anual de proventos: {str(e)}")
@@ -255,7 +324,7 @@ async def obter_resumo_proventos_mensais_usuario(
     Gera um resumo mensal dos proventos recebidos pelo usuário logado para um ano específico.
     """
     try:
-        return services.gerar_resumo_proventos_mensais_usuario_service(usuario_id=usuario.id, ano_filtro=ano)
+        return await executar_servico("usuario.proventos.resumo", services.gerar_resumo_proventos_mensais_usuario_service, usuario_id=usuario.id, ano_filtro=ano)
     except Exception as e:
         logging.error(f"Error in GET /api/usuario/proventos/resumo_mensal/{ano}/ for user {usuario.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao gerar resumo mensal de proventos: {str(e)}")
@@ -268,7 +337,7 @@ async def obter_resumo_proventos_por_acao_usuario(
     Gera um resumo dos proventos recebidos pelo usuário logado, agrupados por ação.
     """
     try:
-        return services.gerar_resumo_proventos_por_acao_usuario_service(usuario_id=usuario.id)
+        return await executar_servico("usuario.proventos.resumo", services.gerar_resumo_proventos_por_acao_usuario_service, usuario_id=usuario.id)
     except Exception as e:
         logging.error(f"Error in GET /api/usuario/proventos/resumo_por_acao/ for user {usuario.id}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno ao gerar resumo de proventos por ação: {str(e)}")
@@ -283,7 +352,7 @@ async def recalcular_proventos_usuario_endpoint(
     """
     try:
         # Replace with the new "rapido" service
-        stats = services.recalcular_proventos_recebidos_rapido(usuario_id=usuario.id)
+        stats = await executar_servico("usuario.proventos.recalcular", services.recalcular_proventos_recebidos_rapido, usuario_id=usuario.id)
         return {
             "message": "Recálculo rápido de proventos concluído.",
             "stats": stats
@@ -378,14 +447,17 @@ async def registrar_usuario(usuario: UsuarioCreate):
     Registra um novo usuário no sistema.
     """
     try:
-        usuario_id = auth.criar_usuario(
+        # O hash da senha roda no pool dedicado, fora do event loop
+        usuario_id = await executar_hash_senha(
+            "auth.registrar",
+            auth.criar_usuario,
             username=usuario.username,
             email=usuario.email,
             senha=usuario.senha,
             nome_completo=usuario.nome_completo
         )
         
-        return auth.obter_usuario(usuario_id)
+        return await executar_servico("auth.registrar", auth.obter_usuario, usuario_id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -394,10 +466,11 @@ async def registrar_usuario(usuario: UsuarioCreate):
 
 @app.post("/api/auth/login", response_model=TokenResponse)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = auth.verificar_credenciais(form_data.username, form_data.password)
+    # O hash da senha roda no pool dedicado, fora do event loop
+    user = await executar_hash_senha("auth.login", auth.verificar_credenciais, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Usuário ou senha incorretos")
-    token = auth.gerar_token(user["id"])
+    token = await executar_servico("auth.login", auth.gerar_token, user["id"])
     return {"access_token": token, "token_type": "bearer"}
 
 # Commented out /api/auth/me endpoint removed.
@@ -407,7 +480,7 @@ async def logout(token: str = Depends(oauth2_scheme)):
     """
     Encerra a sessão do usuário revogando o token.
     """
-    success = auth.revogar_token(token)
+    success = await executar_servico("auth.logout", auth.revogar_token, token)
     
     if not success:
         raise HTTPException(status_code=400, detail="Erro ao encerrar sessão")
@@ -428,7 +501,7 @@ async def listar_usuarios(admin: UsuarioResponse = Depends(get_admin_user)): # C
     Lista todos os usuários do sistema.
     Requer permissão de administrador.
     """
-    return auth.obter_todos_usuarios()
+    return await executar_servico("usuarios.listar", auth.obter_todos_usuarios)
 
 @app.get("/api/usuarios/{usuario_id}", response_model=UsuarioResponse)
 async def obter_usuario_por_id(
@@ -439,7 +512,7 @@ async def obter_usuario_por_id(
     Obtém os dados de um usuário pelo ID.
     Requer permissão de administrador.
     """
-    usuario = auth.obter_usuario(usuario_id)
+    usuario = await executar_servico("usuarios.obter", auth.obter_usuario, usuario_id)
     
     if not usuario:
         raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado")
@@ -457,12 +530,15 @@ async def atualizar_usuario_por_id(
     Requer permissão de administrador.
     """
     try:
-        success = auth.atualizar_usuario(usuario_id, usuario_data.model_dump(exclude_unset=True))
+        dados = usuario_data.model_dump(exclude_unset=True)
+        # Com troca de senha há um hash a calcular: usa o pool dedicado
+        executar = executar_hash_senha if 'senha' in dados else executar_servico
+        success = await executar("usuarios.atualizar", auth.atualizar_usuario, usuario_id, dados)
         
         if not success:
             raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado")
         
-        return auth.obter_usuario(usuario_id)
+        return await executar_servico("usuarios.atualizar", auth.obter_usuario, usuario_id)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -477,7 +553,7 @@ async def excluir_usuario(
     Exclui um usuário do sistema.
     Requer permissão de administrador.
     """
-    success = auth.excluir_usuario(usuario_id)
+    success = await executar_servico("usuarios.excluir", auth.excluir_usuario, usuario_id)
     
     if not success:
         raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado")
@@ -494,12 +570,12 @@ async def adicionar_funcao_a_usuario(
     Adiciona uma função a um usuário.
     Requer permissão de administrador.
     """
-    success = auth.adicionar_funcao_usuario(usuario_id, funcao_nome)
+    success = await executar_servico("usuarios.funcoes", auth.adicionar_funcao_usuario, usuario_id, funcao_nome)
     
     if not success:
         raise HTTPException(status_code=404, detail="Usuário ou função não encontrados")
     
-    updated_usuario = auth.obter_usuario(usuario_id)
+    updated_usuario = await executar_servico("usuarios.obter", auth.obter_usuario, usuario_id)
     if not updated_usuario:
         # Should not happen if adicionar_funcao_usuario was successful and usuario_id is valid
         raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado após adicionar função.")
@@ -515,18 +591,18 @@ async def remover_funcao_de_usuario(
     Remove uma função de um usuário.
     Requer permissão de administrador.
     """
-    success = auth.remover_funcao_usuario(usuario_id, funcao_nome)
+    success = await executar_servico("usuarios.funcoes", auth.remover_funcao_usuario, usuario_id, funcao_nome)
     
     if not success:
         # This could mean user not found, function not found, or user didn't have the function.
         # For simplicity, we'll check if the user exists to give a more specific 404 for the user.
-        usuario = auth.obter_usuario(usuario_id)
+        usuario = await executar_servico("usuarios.obter", auth.obter_usuario, usuario_id)
         if not usuario:
             raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado.")
         # If user exists, the issue was with the function or its assignment.
         raise HTTPException(status_code=404, detail=f"Função '{funcao_nome}' não encontrada ou não associada ao usuário {usuario_id}.")
 
-    updated_usuario = auth.obter_usuario(usuario_id)
+    updated_usuario = await executar_servico("usuarios.obter", auth.obter_usuario, usuario_id)
     if not updated_usuario:
         # Should not happen if remover_funcao_usuario was successful and usuario_id is valid
         raise HTTPException(status_code=404, detail=f"Usuário {usuario_id} não encontrado após remover função.")
@@ -539,7 +615,7 @@ async def listar_funcoes(admin: UsuarioResponse = Depends(get_admin_user)): # Ch
     Lista todas as funções do sistema.
     Requer permissão de administrador.
     """
-    return auth.obter_todas_funcoes()
+    return await executar_servico("funcoes.listar", auth.obter_todas_funcoes)
 
 @app.post("/api/funcoes", response_model=FuncaoResponse)
 async def criar_nova_funcao(
@@ -551,10 +627,10 @@ async def criar_nova_funcao(
     Requer permissão de administrador.
     """
     try:
-        funcao_id = auth.criar_funcao(funcao.nome, funcao.descricao)
+        funcao_id = await executar_servico("funcoes.criar", auth.criar_funcao, funcao.nome, funcao.descricao)
         
         # Obtém a função criada usando o novo serviço
-        funcao_criada = auth.obter_funcao(funcao_id)
+        funcao_criada = await executar_servico("funcoes.obter", auth.obter_funcao, funcao_id)
         if not funcao_criada:
             # This case should ideally not happen if criar_funcao succeeded
             raise HTTPException(status_code=500, detail="Erro ao obter função recém-criada.")
@@ -579,7 +655,9 @@ async def atualizar_funcao_existente(
         if funcao_data.model_dump(exclude_unset=True) == {}:
             raise HTTPException(status_code=400, detail="Pelo menos um campo (nome ou descrição) deve ser fornecido para atualização.")
 
-        success = auth.atualizar_funcao(
+        success = await executar_servico(
+            "funcoes.atualizar",
+            auth.atualizar_funcao,
             funcao_id,
             nome=funcao_data.nome,
             descricao=funcao_data.descricao
@@ -587,7 +665,7 @@ async def atualizar_funcao_existente(
         if not success:
             # Se atualizar_funcao retorna False, pode ser "não encontrado" ou outro motivo não coberto por ValueError
             # Verificar se a função realmente não existe mais pode ser redundante se auth.atualizar_funcao já lida com isso
-            updated_funcao = auth.obter_funcao(funcao_id)
+            updated_funcao = await executar_servico("funcoes.obter", auth.obter_funcao, funcao_id)
             if not updated_funcao:
                  raise HTTPException(status_code=404, detail=f"Função com ID {funcao_id} não encontrada.")
             # Se chegou aqui, a atualização falhou por um motivo não de "não encontrado" que não levantou ValueError
@@ -595,7 +673,7 @@ async def atualizar_funcao_existente(
             raise HTTPException(status_code=409, detail=f"Não foi possível atualizar a função com ID {funcao_id}. Verifique se o novo nome já está em uso.")
 
 
-        updated_funcao = auth.obter_funcao(funcao_id)
+        updated_funcao = await executar_servico("funcoes.obter", auth.obter_funcao, funcao_id)
         if not updated_funcao:
             # Este caso é improvável se success=True, mas é uma salvaguarda
             raise HTTPException(status_code=404, detail=f"Função com ID {funcao_id} não encontrada após a atualização.")
@@ -620,7 +698,7 @@ async def deletar_funcao_existente(
     Requer permissão de administrador.
     """
     try:
-        success = auth.excluir_funcao(funcao_id)
+        success = await executar_servico("funcoes.excluir", auth.excluir_funcao, funcao_id)
         if not success:
             # Isso cobre o caso onde obter_funcao(funcao_id) em excluir_funcao retorna None
             raise HTTPException(status_code=404, detail=f"Função com ID {funcao_id} não encontrada.")
@@ -638,7 +716,7 @@ async def deletar_funcao_existente(
 @app.get("/api/operacoes", response_model=List[Operacao])
 async def listar_operacoes(usuario: UsuarioResponse = Depends(get_current_user)):
     try:
-        operacoes = listar_operacoes_service(usuario_id=usuario.id)
+        operacoes = await executar_servico("operacoes.listar", listar_operacoes_service, usuario_id=usuario.id)
         # Ajusta datas para string e inclui corretora_nome
         for op in operacoes:
             if isinstance(op["date"], (datetime, date)):
@@ -658,22 +736,23 @@ async def listar_operacoes_por_ticker(
     Lista todas as operações de um usuário para um ticker específico.
     """
     try:
-        operacoes = services.listar_operacoes_por_ticker_service(usuario_id=usuario.id, ticker=ticker) # Use .id
+        operacoes = await executar_servico("operacoes.por_ticker", services.listar_operacoes_por_ticker_service, usuario_id=usuario.id, ticker=ticker) # Use .id
         return operacoes
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown" # Use .id
         logging.error(f"Error in /api/operacoes/ticker/{ticker} for user {user_id_for_log}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error in /api/operacoes/ticker. Check logs.")
 
-@app.post("/api/upload", response_model=Dict[str, str])
+@app.post("/api/upload", response_model=Dict[str, Any])
 async def upload_operacoes(
     file: UploadFile = File(...),
     usuario: UsuarioResponse = Depends(get_current_user) # Changed type hint
 ):
     """
-    Endpoint para upload de arquivo JSON com operações de compra e venda de ações.
+    Endpoint para upload de arquivo JSON ou CSV com operações de compra e venda de ações.
+    O arquivo é processado em streaming e gravado em lotes.
     
-    O arquivo deve seguir o formato:
+    O arquivo JSON deve seguir o formato:
     [
       {
         "date": "YYYY-MM-DD",
@@ -685,32 +764,65 @@ async def upload_operacoes(
       },
       …
     ]
+
+    O CSV pode usar as mesmas colunas ou o cabeçalho da exportação de negociação da B3.
+
+    Carteira, resultados e proventos são recalculados em segundo plano; o progresso
+    pode ser acompanhado em /api/jobs/{job_id}.
+
+    Se uma operação falhar depois de lotes já gravados, a resposta é de importação
+    parcial ("parcial": true), com as operações importadas (as primeiras do arquivo) e
+    a posição da operação com erro; o reenvio deve partir da primeira não importada.
+    Se nada foi gravado, o erro é retornado como 400/422.
     """
     try:
-        # Lê o conteúdo do arquivo
-        conteudo = await file.read()
-        
-        # Converte o JSON para uma lista de dicionários
-        operacoes_json = json.loads(conteudo)
-        
-        # Valida e processa as operações
-        operacoes = [OperacaoCreate(**preprocess_imported_operation(op)) for op in operacoes_json]
-        
-        # Salva as operações no banco de dados com o ID do usuário
-        try:
-            processar_operacoes(operacoes, usuario_id=usuario.id) # Use .id
-            # Recalcula proventos após importar operações
-            from services import recalcular_proventos_recebidos_rapido
-            recalcular_proventos_recebidos_rapido(usuario_id=usuario.id)
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        
-        return {"mensagem": f"Arquivo processado com sucesso. {len(operacoes)} operações importadas."}
-    
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=400, detail="Formato de arquivo JSON inválido")
+        # Lê, valida e grava o arquivo em lotes, sem carregá-lo inteiro na memória
+        importacao = await executar_servico(
+            "operacoes.upload", importar_operacoes_arquivo,
+            file.file, usuario_id=usuario.id, nome_arquivo=file.filename, em_segundo_plano=True
+        )
+
+        return {
+            "mensagem": f"Arquivo processado com sucesso. {importacao['operacoes_importadas']} operações importadas.",
+            "job_id": importacao["job_id"],
+            "operacoes_importadas": importacao["operacoes_importadas"],
+            "parcial": False,
+        }
+
+    except ErroImportacao as e:
+        if not e.operacoes_importadas:
+            raise _erro_http_importacao(e.causa)
+        return {
+            "mensagem": (f"Importação parcial: as {e.operacoes_importadas} primeiras operações foram importadas. "
+                         f"A operação {e.operacao} do arquivo é inválida ({_detalhe_erro_importacao(e.causa)}); "
+                         f"corrija-a e reenvie o arquivo a partir da operação {e.operacoes_importadas + 1}."),
+            "job_id": e.job_id,
+            "operacoes_importadas": e.operacoes_importadas,
+            "parcial": True,
+            "operacao_com_erro": e.operacao,
+            "erro": _detalhe_erro_importacao(e.causa),
+        }
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(e)}")
+        raise _erro_http_importacao(e)
+
+def _detalhe_erro_importacao(erro: Exception) -> str:
+    if isinstance(erro, json.JSONDecodeError):
+        return "Formato de arquivo JSON inválido"
+    if isinstance(erro, csv.Error):
+        return "Formato de arquivo CSV inválido"
+    if isinstance(erro, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, item['loc']))}: {item['msg']}" for item in erro.errors(include_url=False))
+    return str(erro)
+
+def _erro_http_importacao(erro: Exception) -> HTTPException:
+    """Converte o erro de uma importação sem operações gravadas na resposta HTTP."""
+    if isinstance(erro, ValidationError):
+        return HTTPException(status_code=422, detail=erro.errors(include_url=False, include_context=False))
+    if isinstance(erro, (json.JSONDecodeError, csv.Error, ValueError)):
+        return HTTPException(status_code=400, detail=_detalhe_erro_importacao(erro))
+    return HTTPException(status_code=500, detail=f"Erro ao processar arquivo: {str(erro)}")
 
 @app.get("/api/resultados", response_model=List[ResultadoMensal])
 async def obter_resultados(usuario: UsuarioResponse = Depends(get_current_user)):
@@ -718,7 +830,7 @@ async def obter_resultados(usuario: UsuarioResponse = Depends(get_current_user))
     Retorna os resultados mensais de apuração de imposto de renda.
     """
     try:
-        resultados = calcular_resultados_mensais(usuario_id=usuario.id)
+        resultados = await executar_servico("resultados.listar", calcular_resultados_mensais, usuario_id=usuario.id)
         return resultados
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown"
@@ -734,7 +846,7 @@ async def listar_resultados_por_ticker(
     Lista resultados agregados para um ticker específico para o usuário logado.
     """
     try:
-        resultados = services.calcular_resultados_por_ticker_service(usuario_id=usuario.id, ticker=ticker) # Use .id
+        resultados = await executar_servico("resultados.por_ticker", services.calcular_resultados_por_ticker_service, usuario_id=usuario.id, ticker=ticker) # Use .id
         return resultados
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown" # Use .id
@@ -747,7 +859,7 @@ async def obter_carteira(usuario: UsuarioResponse = Depends(get_current_user)):
     Retorna a carteira atual de ações.
     """
     try:
-        carteira = calcular_carteira_atual(usuario_id=usuario.id)
+        carteira = await executar_servico("carteira.listar", calcular_carteira_atual, usuario_id=usuario.id)
         return carteira
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown"
@@ -760,7 +872,7 @@ async def obter_darfs(usuario: UsuarioResponse = Depends(get_current_user)):
     Retorna os DARFs gerados para pagamento de imposto de renda.
     """
     try:
-        darfs = gerar_darfs(usuario_id=usuario.id) # Use .id
+        darfs = await executar_servico("darfs.listar", gerar_darfs, usuario_id=usuario.id) # Use .id
         return darfs
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown" # Use .id
@@ -789,7 +901,8 @@ async def atualizar_status_darf(
         if darf_type_lower not in ["swing", "daytrade"]:
             raise HTTPException(status_code=400, detail="Tipo de DARF inválido. Use 'swing' or 'daytrade'.")
 
-        resultado = services.atualizar_status_darf_service(
+        resultado = await executar_servico(
+            "darfs.status", services.atualizar_status_darf_service,
             usuario_id=usuario.id, # Use .id
             year_month=year_month,
             darf_type=darf_type_lower,
@@ -832,8 +945,8 @@ async def criar_operacao(
         operacao: Dados da operação a ser criada.
     """
     try:
-        new_operacao_id = services.inserir_operacao_manual(operacao, usuario_id=usuario.id) # Use .id
-        operacao_criada = services.obter_operacao_service(new_operacao_id, usuario_id=usuario.id) # Use .id
+        new_operacao_id = await executar_servico("operacoes.criar", services.inserir_operacao_manual, operacao, usuario_id=usuario.id, em_segundo_plano=True) # Use .id
+        operacao_criada = await executar_servico("operacoes.criar", services.obter_operacao_service, new_operacao_id, usuario_id=usuario.id) # Use .id
         if not operacao_criada:
             # This case should ideally not happen if insertion and ID return were successful
             raise HTTPException(status_code=500, detail="Operação criada mas não pôde ser recuperada.")
@@ -863,10 +976,12 @@ async def atualizar_carteira(
         if ticker.upper() != dados.ticker.upper():
             raise HTTPException(status_code=400, detail="O ticker no path deve ser o mesmo do body")
         
-        atualizar_item_carteira(dados, usuario_id=usuario.id) # Use .id
+        await executar_servico("carteira.atualizar", atualizar_item_carteira, dados, usuario_id=usuario.id, em_segundo_plano=True) # Use .id
         return {"mensagem": f"Ação {ticker.upper()} atualizada com sucesso."}
     except HTTPException as e:
         raise e
+    except ErroRecalculoEmAndamento as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar ação: {str(e)}")
 
@@ -880,7 +995,7 @@ async def deletar_item_carteira(
     Esta é uma ação de override manual e não aciona recálculos automáticos da carteira.
     """
     try:
-        success = services.remover_item_carteira_service(usuario_id=usuario.id, ticker=ticker.upper()) # Use .id
+        success = await executar_servico("carteira.remover", services.remover_item_carteira_service, usuario_id=usuario.id, ticker=ticker.upper()) # Use .id
         if success:
             return {"mensagem": f"Ação {ticker.upper()} removida da carteira com sucesso."}
         else:
@@ -898,7 +1013,10 @@ async def obter_operacoes_fechadas(usuario: UsuarioResponse = Depends(get_curren
     Inclui detalhes como data de abertura e fechamento, preços, quantidade e resultado.
     """
     try:
-        operacoes_fechadas = calcular_operacoes_fechadas(usuario_id=usuario.id)
+        # Leitura das operações fechadas salvas (mantidas a cada alteração de operações)
+        operacoes_fechadas = await executar_servico(
+            "operacoes.fechadas", services.obter_operacoes_fechadas_service, usuario_id=usuario.id
+        )
         return operacoes_fechadas
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown"
@@ -917,7 +1035,7 @@ async def obter_resumo_operacoes_fechadas(usuario: UsuarioResponse = Depends(get
     - Operações com maior prejuízo
     """
     try:
-        resumo = services.gerar_resumo_operacoes_fechadas(usuario_id=usuario.id) # Use .id
+        resumo = await executar_servico("operacoes.fechadas", services.gerar_resumo_operacoes_fechadas, usuario_id=usuario.id) # Use .id
         return resumo
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown" # Use .id
@@ -932,11 +1050,33 @@ async def resetar_banco(admin: Dict = Depends(get_admin_user)):
     Preserva dados de usuários e autenticação.
     """
     try:
-        limpar_banco_dados()
+        await executar_servico("admin.reset", limpar_banco_dados)
         return {"mensagem": "Dados financeiros e operacionais foram removidos com sucesso."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao limpar banco de dados: {str(e)}")
 
+@app.get("/api/admin/execucao/metricas", response_model=Dict[str, Any])
+async def obter_metricas_execucao_endpoint(admin: UsuarioResponse = Depends(get_admin_user)):
+    """
+    Retorna as métricas da camada de execução: ocupação dos pools e, por endpoint,
+    chamadas aguardando vaga, em execução e tempos médios de espera/execução.
+    Requer permissão de administrador.
+    """
+    return obter_metricas_execucao()
+
+@app.get("/api/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def exportar_metricas(request: Request):
+    """
+    Métricas no formato de exposição do Prometheus: latência por rota, consultas ao
+    banco por rota, duração dos recálculos e do motor, caches, pool de conexões, fila
+    de recálculo e pools de execução. Com METRICS_TOKEN definido, exige
+    "Authorization: Bearer <METRICS_TOKEN>".
+    """
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de métricas inválido")
+    texto = await executar_servico("metricas.exportar", exportar_prometheus)
+    return PlainTextResponse(texto, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.delete("/api/operacoes/{operacao_id}", response_model=Dict[str, str])
 async def deletar_operacao(
     operacao_id: int = Path(..., description="ID da operação"),
@@ -950,7 +1090,7 @@ async def deletar_operacao(
     """
     try:
         # Use the new service function
-        success = deletar_operacao_service(operacao_id=operacao_id, usuario_id=usuario.id) # Use .id
+        success = await executar_servico("operacoes.remover", deletar_operacao_service, operacao_id=operacao_id, usuario_id=usuario.id, em_segundo_plano=True) # Use .id
         if success:
             return {"mensagem": f"Operação {operacao_id} removida com sucesso."}
         else:
@@ -973,7 +1113,7 @@ async def deletar_todas_operacoes(
     Use com cuidado, esta ação é irreversível.
     """
     try:
-        resultado = services.deletar_todas_operacoes_service(usuario_id=usuario.id) # Use .id
+        resultado = await executar_servico("operacoes.remover_todas", services.deletar_todas_operacoes_service, usuario_id=usuario.id) # Use .id
         return resultado
     except Exception as e:
         user_id_for_log = usuario.id if usuario else "Unknown" # Use .id
@@ -988,51 +1128,17 @@ async def listar_corretoras():
     """
     try:
         from database import get_db
-        with get_db() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, nome, cnpj FROM corretoras ORDER BY nome ASC")
-            corretoras = cursor.fetchall()
-            return [Corretora(id=row["id"], nome=row["nome"], cnpj=row["cnpj"]) for row in corretoras]
+
+        def _listar():
+            with get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, nome, cnpj FROM corretoras ORDER BY nome ASC")
+                return cursor.fetchall()
+
+        corretoras = await executar_servico("corretoras.listar", _listar)
+        return [Corretora(id=row["id"], nome=row["nome"], cnpj=row["cnpj"]) for row in corretoras]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar corretoras: {str(e)}")
 
-def preprocess_imported_operation(op: dict) -> dict:
-    # Mapeamento de campos
-    field_map = {
-        "Data do Negócio": "date",
-        "Código de Negociação": "ticker",
-        "Tipo de Movimentação": "operation",
-        "Quantidade": "quantity",
-        "Preço": "price",
-        "Instituição": "corretora_nome",
-        # Outros campos podem ser mapeados conforme necessário
-    }
-    new_op = {}
-    for k, v in op.items():
-        key = field_map.get(k, k)
-        new_op[key] = v
-    # Conversão de valores
-    if "price" in new_op and isinstance(new_op["price"], str):
-        new_op["price"] = float(new_op["price"].replace("R$", "").replace(",", "."))
-    if "quantity" in new_op:
-        new_op["quantity"] = int(new_op["quantity"])
-    if "operation" in new_op:
-        if new_op["operation"].lower().startswith("compra"):
-            new_op["operation"] = "buy"
-        elif new_op["operation"].lower().startswith("venda"):
-            new_op["operation"] = "sell"
-    if "ticker" in new_op:
-        new_op["ticker"] = str(new_op["ticker"]).replace("F", "")
-    if "date" in new_op:
-        # Converte para ISO
-        try:
-            new_op["date"] = datetime.strptime(new_op["date"], "%d/%m/%Y").date().isoformat()
-        except Exception:
-            pass
-    # Taxas e fees default
-    if "fees" not in new_op:
-        new_op["fees"] = 0.0
-    return new_op
-
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Métricas da API no formato de exposição do Prometheus (GET /api/metrics).
+
+Há três tipos de métrica:
+
+- `Contador` e `Histograma`, gravados no caminho das requisições e dos recálculos.
+  Cada thread grava em um dicionário próprio (threading.local), sem lock: o único
+  lock é tomado uma vez por thread, ao registrar o seu fragmento. A exportação soma
+  os fragmentos de todas as threads (inclusive as já encerradas, para que os
+  contadores nunca diminuam).
+- `MetricaColetada`, calculada apenas na exportação a partir de um estado que já
+  existe em outro módulo (pool de conexões, caches, fila de recálculo, executor).
+
+Os módulos declaram as próprias métricas ao serem importados. Este módulo não importa
+nenhum outro do backend, para poder ser usado pelo motor e pelo banco.
+"""
+import bisect
+import logging
+import math
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Se definido, GET /api/metrics exige o cabeçalho "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Limites dos buckets, em segundos, das latências de requisições e recálculos
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Rotulos = Tuple[str, ...]
+
+_metricas: List[Any] = []
+_lock_registro = threading.Lock()
+
+def _registrar(metrica: Any) -> None:
+    # Um módulo importado por dois caminhos (ex.: database e backend.database) declara a
+    # mesma métrica duas vezes: a declaração mais recente substitui a anterior
+    with _lock_registro:
+        _metricas[:] = [m for m in _metricas if m.nome != metrica.nome]
+        _metricas.append(metrica)
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatar_valor(valor: float) -> str:
+    if math.isinf(valor):
+        return "+Inf" if valor > 0 else "-Inf"
+    if float(valor).is_integer():
+        return str(int(valor))
+    return repr(float(valor))
+
+def _formatar_rotulos(nomes: Sequence[str], valores: Sequence[str]) -> str:
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)) + "}"
+
+class _MetricaPorThread:
+    """Base de Contador e Histograma: um dicionário {valores dos rótulos: valor} por thread."""
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._local = threading.local()
+        self._fragmentos: List[Dict[Rotulos, Any]] = []
+        self._lock = threading.Lock()
+        _registrar(self)
+
+    def _fragmento(self) -> Dict[Rotulos, Any]:
+        try:
+            return self._local.valores
+        except AttributeError:
+            valores: Dict[Rotulos, Any] = {}
+            with self._lock:
+                self._fragmentos.append(valores)
+            self._local.valores = valores
+            return valores
+
+    def _copiar_fragmentos(self) -> List[Dict[Rotulos, Any]]:
+        # dict() copia o fragmento de uma vez (sob o GIL), mesmo com a thread dona gravando
+        with self._lock:
+            fragmentos = list(self._fragmentos)
+        return [dict(fragmento) for fragmento in fragmentos]
+
+class Contador(_MetricaPorThread):
+    """Contador monotônico, opcionalmente com rótulos."""
+    tipo = "counter"
+
+    def incrementar(self, *valores_rotulos: str, quantidade: float = 1.0) -> None:
+        fragmento = self._fragmento()
+        fragmento[valores_rotulos] = fragmento.get(valores_rotulos, 0.0) + quantidade
+
+    def valores(self) -> Dict[Rotulos, float]:
+        """Total por combinação de rótulos, somando todas as threads."""
+        totais: Dict[Rotulos, float] = {}
+        for fragmento in self._copiar_fragmentos():
+            for chave, valor in fragmento.items():
+                totais[chave] = totais.get(chave, 0.0) + valor
+        return totais
+
+    def amostras(self) -> Iterator[str]:
+        for chave, valor in sorted(self.valores().items()):
+            yield f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_valor(valor)}"
+
+class Histograma(_MetricaPorThread):
+    """
+    Histograma com buckets fixos. Por combinação de rótulos, cada thread guarda a
+    contagem de cada bucket (não cumulativa, a última é +Inf) seguida da soma.
+    """
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Sequence[str] = (), buckets: Sequence[float] = BUCKETS_LATENCIA):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(nome, ajuda, rotulos)
+
+    def observar(self, valor: float, *valores_rotulos: str) -> None:
+        fragmento = self._fragmento()
+        contagens = fragmento.get(valores_rotulos)
+        if contagens is None:
+            contagens = fragmento[valores_rotulos] = [0] * (len(self.buckets) + 1) + [0.0]
+        contagens[bisect.bisect_left(self.buckets, valor)] += 1
+        contagens[-1] += valor
+
+    def valores(self) -> Dict[Rotulos, List[float]]:
+        """Contagens por bucket (não cumulativas) e soma, por combinação de rótulos."""
+        totais: Dict[Rotulos, List[float]] = {}
+        for fragmento in self._copiar_fragmentos():
+            for chave, contagens in fragmento.items():
+                contagens = list(contagens)
+                atual = totais.get(chave)
+                totais[chave] = contagens if atual is None else [a + b for a, b in zip(atual, contagens)]
+        return totais
+
+    def amostras(self) -> Iterator[str]:
+        nomes = self.rotulos + ("le",)
+        for chave, contagens in sorted(self.valores().items()):
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (math.inf,), contagens):
+                acumulado += contagem
+                yield f"{self.nome}_bucket{_formatar_rotulos(nomes, chave + (_formatar_valor(limite),))} {acumulado}"
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            yield f"{self.nome}_sum{rotulos} {_formatar_valor(contagens[-1])}"
+            yield f"{self.nome}_count{rotulos} {acumulado}"
+
+class MetricaColetada:
+    """
+    Métrica lida na exportação: `coletar()` devolve pares (valores dos rótulos, valor).
+    `tipo` é "gauge" ou "counter" (para totais mantidos por outro módulo).
+    """
+
+    def __init__(self, nome: str, ajuda: str, tipo: str, rotulos: Sequence[str],
+                 coletar: Callable[[], Iterable[Tuple[Rotulos, float]]]):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.tipo = tipo
+        self.rotulos = tuple(rotulos)
+        self.coletar = coletar
+        _registrar(self)
+
+    def amostras(self) -> Iterator[str]:
+        for chave, valor in sorted(self.coletar()):
+            yield f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_valor(valor)}"
+
+def exportar_prometheus() -> str:
+    """
+    Gera o texto de todas as métricas registradas no formato de exposição do
+    Prometheus (text/plain; version=0.0.4). Uma coleta que falhe é omitida e registrada
+    no log, sem derrubar as demais.
+    """
+    with _lock_registro:
+        metricas = list(_metricas)
+    linhas: List[str] = []
+    for metrica in metricas:
+        try:
+            amostras = list(metrica.amostras())
+        except Exception as e:
+            logging.warning(f"Falha ao coletar a métrica {metrica.nome}: {e}")
+            continue
+        linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+        linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+        linhas.extend(amostras)
+    return "\n".join(linhas) + "\n"
+
+# --- Métricas das requisições e dos recálculos ---
+
+DURACAO_HTTP = Histograma(
+    "investir_http_duracao_segundos", "Latência das requisições HTTP por rota.", ("metodo", "rota", "status"))
+CONSULTAS_DB_HTTP = Contador(
+    "investir_http_consultas_db_total", "Comandos SQL executados pelas requisições, por rota.", ("rota",))
+TEMPO_DB_HTTP = Contador(
+    "investir_http_tempo_db_segundos_total", "Tempo gasto no SQLite pelas requisições, por rota.", ("rota",))
+DURACAO_RECALCULO = Histograma(
+    "investir_recalculo_duracao_segundos", "Duração dos serviços de recálculo.", ("servico",))
+DURACAO_MOTOR = Histograma(
+    "investir_motor_duracao_segundos", "Duração de cada passada do motor de posições.")
+OPERACOES_MOTOR = Contador(
+    "investir_motor_operacoes_total", "Operações processadas pelo motor de posições.")
+
+def _operacoes_por_segundo() -> Iterator[Tuple[Rotulos, float]]:
+    operacoes = OPERACOES_MOTOR.valores().get((), 0.0)
+    segundos = sum(contagens[-1] for contagens in DURACAO_MOTOR.valores().values())
+    yield (), operacoes / segundos if segundos else 0.0
+
+MetricaColetada("investir_motor_operacoes_por_segundo",
+                "Vazão média do motor de posições (operações por segundo de motor) desde o início do processo.",
+                "gauge", (), _operacoes_por_segundo)
+
+_caches: Dict[str, Callable[[], Dict[str, int]]] = {}
+
+def registrar_cache(nome: str, estatisticas: Callable[[], Dict[str, int]]) -> None:
+    """
+    Expõe um cache em investir_cache_*{cache=nome}.
+
+    Args:
+        nome: Rótulo do cache.
+        estatisticas: Função que retorna {"acertos", "falhas", "entradas"}.
+    """
+    _caches[nome] = estatisticas
+
+def _coletar_caches(campo: str) -> Callable[[], Iterator[Tuple[Rotulos, float]]]:
+    def coletar():
+        for nome, estatisticas in list(_caches.items()):
+            dados = estatisticas()
+            if campo == "taxa_acerto":
+                consultas = dados["acertos"] + dados["falhas"]
+                yield (nome,), dados["acertos"] / consultas if consultas else 0.0
+            else:
+                yield (nome,), dados[campo]
+    return coletar
+
+MetricaColetada("investir_cache_acertos_total", "Consultas atendidas pelo cache.", "counter", ("cache",), _coletar_caches("acertos"))
+MetricaColetada("investir_cache_falhas_total", "Consultas não atendidas pelo cache.", "counter", ("cache",), _coletar_caches("falhas"))
+MetricaColetada("investir_cache_taxa_acerto", "Fração das consultas atendidas pelo cache.", "gauge", ("cache",), _coletar_caches("taxa_acerto"))
+MetricaColetada("investir_cache_entradas", "Entradas guardadas no cache.", "gauge", ("cache",), _coletar_caches("entradas"))
@@ -0,0 +1,142 @@
+"""
+Migrações versionadas do esquema do banco.
+
+Cada migração é um passo numerado e idempotente, aplicado uma única vez: a tabela
+schema_version registra as versões já aplicadas, e `aplicar_migracoes` executa
+apenas as pendentes, em ordem, cada uma em sua própria transação. Novas alterações
+de esquema entram no final de MIGRACOES, nunca alterando um passo já publicado.
+"""
+import hashlib
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+def _indices_compostos_por_usuario(cursor: sqlite3.Cursor) -> None:
+    """
+    Índices compostos para as consultas por usuário que ainda ordenavam em uma
+    B-tree temporária, e remoção dos índices de coluna única já cobertos por um
+    índice composto (cada índice a mais custa uma escrita a cada inserção).
+    """
+    # Operações por usuário em ordem cronológica (obter_todas_operacoes, obter_operacoes_a_partir_de_data,
+    # existe_operacao_anterior_a). Por ticker, idx_operacoes_usuario_ticker_date já entrega (date, id):
+    # o rowid é o último campo de toda entrada de índice.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_usuario_date_id ON operacoes(usuario_id, date, id)')
+    cursor.execute('DROP INDEX IF EXISTS idx_operacoes_usuario_id')
+
+    # Carteira por usuário em ordem de ticker
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_carteira_atual_usuario_ticker ON carteira_atual(usuario_id, ticker)')
+    cursor.execute('DROP INDEX IF EXISTS idx_carteira_atual_usuario_id')
+
+    # Operações fechadas por usuário (e por ticker) em ordem de fechamento
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_fechadas_usuario_data ON operacoes_fechadas(usuario_id, data_fechamento)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_operacoes_fechadas_usuario_ticker_data ON operacoes_fechadas(usuario_id, ticker, data_fechamento)')
+    cursor.execute('DROP INDEX IF EXISTS idx_operacoes_fechadas_usuario_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_operacoes_fechadas_usuario_ticker')
+
+    # Cobertos pelos índices únicos (usuario_id, mes) e (usuario_id, provento_global_id)
+    cursor.execute('DROP INDEX IF EXISTS idx_resultados_mensais_usuario_id')
+    cursor.execute('DROP INDEX IF EXISTS idx_usr_prov_rec_usuario_id')
+
+def _tokens_por_digest(cursor: sqlite3.Cursor) -> None:
+    """
+    Reconstrói a tabela tokens guardando o digest SHA-256 de cada JWT (token_hash, de
+    tamanho fixo e indexado por UNIQUE) no lugar do token completo.
+    """
+    cursor.execute('''
+    CREATE TABLE tokens_novo (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario_id INTEGER NOT NULL,
+        token_hash TEXT NOT NULL UNIQUE,
+        data_criacao TEXT NOT NULL,
+        data_expiracao TEXT NOT NULL,
+        revogado INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (usuario_id) REFERENCES usuarios(id) ON DELETE CASCADE
+    )
+    ''')
+    # Mesmo digest de auth.digest_token
+    linhas = cursor.execute('SELECT id, usuario_id, token, data_criacao, data_expiracao, revogado FROM tokens').fetchall()
+    cursor.executemany(
+        'INSERT INTO tokens_novo (id, usuario_id, token_hash, data_criacao, data_expiracao, revogado) VALUES (?, ?, ?, ?, ?, ?)',
+        [(id_, usuario_id, hashlib.sha256(token.encode('utf-8')).hexdigest(), criacao, expiracao, revogado)
+         for id_, usuario_id, token, criacao, expiracao, revogado in linhas])
+    cursor.execute('DROP TABLE tokens')
+    cursor.execute('ALTER TABLE tokens_novo RENAME TO tokens')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tokens_usuario_id ON tokens(usuario_id)')
+
+def _tickers_editados_nos_jobs(cursor: sqlite3.Cursor) -> None:
+    """
+    Tickers da carteira editados manualmente enquanto o job de recálculo estava
+    pendente: a reconstrução da carteira pelo job não sobrescreve essas posições.
+    """
+    colunas = {row[1] for row in cursor.execute('PRAGMA table_info(jobs_recalculo)')}
+    if 'tickers_manuais' not in colunas:
+        cursor.execute('ALTER TABLE jobs_recalculo ADD COLUMN tickers_manuais TEXT')
+
+def _corte_de_eventos_nos_checkpoints(cursor: sqlite3.Cursor) -> None:
+    """
+    Data até a qual os eventos corporativos estão aplicados em cada checkpoint de
+    resultados. Os checkpoints existentes são descartados: os do mês em curso podem
+    ter sido salvos sem os eventos posteriores à data do recálculo. O próximo
+    recálculo, sem checkpoints, reprocessa o histórico completo e os regrava.
+    """
+    colunas = {row[1] for row in cursor.execute('PRAGMA table_info(checkpoints_resultados)')}
+    if 'eventos_ate' not in colunas:
+        cursor.execute('ALTER TABLE checkpoints_resultados ADD COLUMN eventos_ate DATE')
+    cursor.execute('DELETE FROM checkpoints_resultados')
+
+# (versão, descrição, passo). As versões são sequenciais a partir de 1; a versão 0 é o
+# esquema base de database.criar_tabelas.
+MIGRACOES: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "Índices compostos por usuário", _indices_compostos_por_usuario),
+    (2, "Tokens indexados por digest", _tokens_por_digest),
+    (3, "Tickers editados manualmente nos jobs de recálculo", _tickers_editados_nos_jobs),
+    (4, "Corte de eventos corporativos nos checkpoints de resultados", _corte_de_eventos_nos_checkpoints),
+]
+# Versão de um banco com todas as migrações aplicadas
+VERSAO_ESQUEMA = MIGRACOES[-1][0]
+
+def obter_versao_esquema(conn: sqlite3.Connection) -> int:
+    """
+    Retorna a última versão de migração aplicada ao banco (0 se nenhuma).
+    """
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        versao INTEGER PRIMARY KEY,
+        descricao TEXT NOT NULL,
+        aplicada_em TEXT NOT NULL
+    )
+    ''')
+    versao = conn.execute('SELECT MAX(versao) FROM schema_version').fetchone()[0]
+    return versao or 0
+
+def aplicar_migracoes(conn: sqlite3.Connection) -> List[int]:
+    """
+    Aplica as migrações pendentes, em ordem, cada uma em uma transação.
+
+    Args:
+        conn: Conexão com o banco (sem transação aberta).
+
+    Returns:
+        List[int]: Versões aplicadas nesta chamada.
+    """
+    versao_atual = obter_versao_esquema(conn)
+    conn.commit()
+    aplicadas = []
+    for versao, descricao, passo in MIGRACOES:
+        if versao <= versao_atual:
+            continue
+        # BEGIN explícito: o sqlite3 não abre transação para DDL
+        conn.execute('BEGIN')
+        try:
+            passo(conn.cursor())
+            conn.execute('INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)',
+                         (versao, descricao, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"Falha ao aplicar a migração {versao} ({descricao}).", exc_info=True)
+            raise
+        logging.info(f"Migração {versao} aplicada: {descricao}.")
+        aplicadas.append(versao)
+    return aplicadas
@@ -75,15 +75,20 @@ class OperacaoBase(BaseModel):
         if isinstance(v, datetime): # Python's datetime type
             return v.date()
         if isinstance(v, str):
-            try:
-                # Try "dd/mm/yyyy" first
-                return datetime.strptime(v, "%d/%m/%Y").date()
-            except ValueError:
+            if len(v) == 10 and v[4] == "-" and v[7] == "-":
+                # Caminho rápido para "yyyy-mm-dd", o formato mais comum nas importações
+                try:
+                    return date.fromisoformat(v)
+                except ValueError:
+                    pass
+            # Tenta primeiro o formato que a string aparenta ter ("dd/mm/yyyy" usa barras)
+            formatos = ("%d/%m/%Y", "%Y-%m-%d") if "/" in v else ("%Y-%m-%d", "%d/%m/%Y")
+            for formato in formatos:
                 try:
-                    # Try "yyyy-mm-dd" next
-                    return datetime.strptime(v, "%Y-%m-%d").date()
+                    return datetime.strptime(v, formato).date()
                 except ValueError:
-                    raise ValueError("Formato de data inválido para 'Data do Negócio'. Use DD/MM/YYYY ou YYYY-MM-DD.")
+                    continue
+            raise ValueError("Formato de data inválido para 'Data do Negócio'. Use DD/MM/YYYY ou YYYY-MM-DD.")
         raise TypeError("Tipo inválido para 'Data do Negócio'. Deve ser uma string de data, objeto date ou datetime.")
 
     @field_validator('operation', mode='before')
@@ -414,7 +419,6 @@ class EventoCorporativoBase(BaseModel):
         if self.razao and ":" in self.razao:
             try:
                 numerador, denominador = map(float, self.razao.split(":"))
-                print(f"Calculando fator de ajuste: {denominador} / {numerador} para o evento {self.evento}")
                 return denominador / numerador
             except Exception:
                 return 1.0
@@ -520,4 +524,21 @@ class Corretora(BaseModel):
     id: int | None = None
     nome: str
     cnpj: str | None = None  # Agora opcional
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class JobRecalculo(BaseModel):
+    """Job da fila de recálculo em segundo plano (ver fila_recalculo.py)."""
+    id: int
+    status: str  # 'pendente', 'executando', 'concluido' ou 'erro'
+    progresso: int = 0  # 0 a 100
+    etapa: Optional[str] = None  # 'carteira', 'resultados' ou 'proventos'
+    a_partir_de: Optional[date] = None  # None = histórico completo
+    tickers: Optional[List[str]] = None  # None = carteira completa
+    recalcular_carteira: bool = True
+    solicitacoes: int = 1  # Quantas mutações foram mescladas neste job
+    erro: Optional[str] = None
+    criado_em: datetime
+    iniciado_em: Optional[datetime] = None
+    concluido_em: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
@@ -0,0 +1,858 @@
+"""
+Motor único de posições.
+
+Percorre as operações de um usuário uma única vez, em ordem cronológica, e alimenta
+em paralelo as três máquinas de estado usadas pelo sistema:
+
+- carteira: quantidade, custo total e preço médio por ticker (inclui day trades e
+  posições vendidas), usada por carteira_atual e Bens e Direitos;
+- apuração mensal: PM de swing trade, posições vendidas, resultados de day trade e
+  compensação de prejuízos, usada por resultados_mensais e DARFs;
+- lotes FIFO: pares abertura/fechamento usados por operacoes_fechadas.
+
+Eventos corporativos (desdobramentos, agrupamentos e bonificações) são aplicados uma
+única vez, no momento em que a data ex é atingida, às três máquinas de estado ao mesmo
+tempo. Assim os serviços leem a mesma visão das operações, sem recarregá-las ou
+reajustá-las cada um à sua maneira.
+"""
+from typing import List, Dict, Any, Optional
+from datetime import date, datetime, timedelta
+from collections import defaultdict
+import calendar
+import time
+
+from models import EventoCorporativoInfo
+from rastreamento import rastreio_atual
+from metricas import DURACAO_MOTOR, OPERACOES_MOTOR
+from registro_operacao import RegistroOperacao, normalizar_data
+
+
+def _calculate_darf_due_date(year_month_str: str) -> date:
+    """
+    Calcula a data de vencimento do DARF para um dado mês/ano de competência.
+    O vencimento é o último dia útil do mês seguinte ao mês de competência.
+    """
+    ano, mes_num = map(int, year_month_str.split('-'))
+
+    # Calcula o próximo mês e ano
+    prox_mes_ano = ano
+    prox_mes_num = mes_num + 1
+    if prox_mes_num > 12:
+        prox_mes_num = 1
+        prox_mes_ano += 1
+
+    # Último dia do próximo mês
+    ultimo_dia_prox_mes = calendar.monthrange(prox_mes_ano, prox_mes_num)[1]
+    vencimento = date(prox_mes_ano, prox_mes_num, ultimo_dia_prox_mes)
+
+    # Ajusta para o último dia útil (retrocede se for sábado ou domingo)
+    while vencimento.weekday() >= 5:  # 5 = Sábado, 6 = Domingo
+        vencimento -= timedelta(days=1)
+    return vencimento
+
+def _eh_day_trade(operacoes_dia: List[RegistroOperacao], ticker: str) -> bool:
+    """
+    Verifica se houve day trade para um ticker específico em um dia.
+
+    Args:
+        operacoes_dia: Lista de operações do dia.
+        ticker: Ticker a ser verificado.
+
+    Returns:
+        bool: True se houve day trade, False caso contrário.
+    """
+    compras = sum(op.quantity for op in operacoes_dia
+                 if op.ticker == ticker and op.operation == "buy")
+    vendas = sum(op.quantity for op in operacoes_dia
+                if op.ticker == ticker and op.operation == "sell")
+
+    # Se houve compra e venda do mesmo ticker no mesmo dia, é day trade
+    return compras > 0 and vendas > 0
+
+def _calcular_resultado_dia(operacoes_dia: List[RegistroOperacao], usuario_id: int) -> tuple[Dict[str, float], Dict[str, float]]: # Changed Tuple to tuple
+    """
+    Calcula o resultado de swing trade e day trade para um dia para um usuário.
+
+    Args:
+        operacoes_dia: Lista de operações do dia.
+        usuario_id: ID do usuário.
+
+    Returns:
+        tuple[Optional[Dict[str, float]], Dict[str, float]]: Resultados de swing trade (None) e day trade.
+    """
+    resultado_day = {
+        "vendas_total": 0.0, # Total de vendas (valor - taxas)
+        "custo_total": 0.0,  # Total de compras (valor + taxas)
+        "ganho_liquido": 0.0,
+        "irrf": 0.0
+    }
+
+    # Identifica os tickers com day trade DENTRO DAS OPERAÇÕES FORNECIDAS (operacoes_dia)
+    # Esta parte é crucial: _eh_day_trade deve ser chamada com as operações do dia para aquele ticker.
+    tickers_day_trade_neste_conjunto = set()
+    ops_por_ticker_no_dia = defaultdict(list)
+    for op_dt_check in operacoes_dia: # Renomeado para evitar conflito de nome
+        ops_por_ticker_no_dia[op_dt_check.ticker].append(op_dt_check)
+
+    for ticker_dt, ops_do_ticker_neste_conjunto in ops_por_ticker_no_dia.items(): # Renomeado para evitar conflito
+        if _eh_day_trade(ops_do_ticker_neste_conjunto, ticker_dt): # Passa a lista filtrada por ticker
+            tickers_day_trade_neste_conjunto.add(ticker_dt)
+
+    for op in operacoes_dia: # Processa apenas as operações que efetivamente são day trade
+        if op.ticker in tickers_day_trade_neste_conjunto:
+            valor = op.quantity * op.price
+            fees = op.fees
+            if op.operation == "buy":
+                resultado_day["custo_total"] += valor + fees
+            else:  # sell
+                resultado_day["vendas_total"] += valor - fees
+                resultado_day["irrf"] += (op.quantity * op.price) * 0.01 # IRRF is on gross sale value
+
+    resultado_day["ganho_liquido"] = resultado_day["vendas_total"] - resultado_day["custo_total"]
+    return None, resultado_day # Retorna None para resultado_swing
+
+
+def _criar_operacao_fechada_detalhada(op_abertura: RegistroOperacao, op_fechamento: RegistroOperacao, quantidade_fechada: int, tipo_fechamento: str) -> Dict:
+    """
+    Cria um dicionário detalhado para uma operação fechada, alinhado com OperacaoFechada e OperacaoDetalhe.
+    """
+    # Preços unitários
+    preco_unitario_abertura = op_abertura.price
+    preco_unitario_fechamento = op_fechamento.price
+
+    # Taxas proporcionais
+    taxas_proporcionais_abertura = (op_abertura.fees / op_abertura.quantity) * quantidade_fechada if op_abertura.quantity > 0 else 0
+    taxas_proporcionais_fechamento = (op_fechamento.fees / op_fechamento.quantity) * quantidade_fechada if op_fechamento.quantity > 0 else 0
+
+    # Valores totais para cálculo do resultado
+    valor_total_abertura_calculo = preco_unitario_abertura * quantidade_fechada
+    valor_total_fechamento_calculo = preco_unitario_fechamento * quantidade_fechada
+
+    # Determina o tipo e calcula o resultado
+    if tipo_fechamento == "compra_fechada_com_venda": # Compra (abertura) e Venda (fechamento)
+        tipo_operacao_fechada = "compra-venda"
+        resultado_bruto = valor_total_fechamento_calculo - valor_total_abertura_calculo
+        resultado_liquido = resultado_bruto - taxas_proporcionais_abertura - taxas_proporcionais_fechamento
+        data_ab = op_abertura.date
+        data_fec = op_fechamento.date
+    elif tipo_fechamento == "venda_descoberta_fechada_com_compra": # Venda (abertura) e Compra (fechamento)
+        tipo_operacao_fechada = "venda-compra"
+        resultado_bruto = valor_total_abertura_calculo - valor_total_fechamento_calculo # Venda é abertura (valor maior)
+        resultado_liquido = resultado_bruto - taxas_proporcionais_abertura - taxas_proporcionais_fechamento
+        data_ab = op_abertura.date # Data da venda a descoberto
+        data_fec = op_fechamento.date # Data da recompra
+    else:
+        raise ValueError(f"Tipo de fechamento desconhecido: {tipo_fechamento}")
+
+    # Cálculo do percentual de lucro/prejuízo
+    custo_para_calculo_percentual = 0.0
+    if op_abertura.operation == "buy": # Abertura foi uma compra
+        custo_para_calculo_percentual = (op_abertura.price * quantidade_fechada) + taxas_proporcionais_abertura
+    elif op_abertura.operation == "sell": # Abertura foi uma venda (short sale)
+        # Base é o valor recebido na venda, líquido de taxas da venda.
+        # O resultado_liquido já considera o lucro/prejuízo.
+        # A base para o percentual deve ser o "investimento" ou "risco" inicial.
+        # Para short sale, o "investimento" é o valor que se espera recomprar, mas o ganho é sobre o valor vendido.
+        # Se vendi por 100 (líquido de taxas) e recomprei por 80, lucro de 20. Percentual é 20/100 = 20%.
+        # Se vendi por 100 e recomprei por 120, prejuízo de 20. Percentual é -20/100 = -20%.
+        custo_para_calculo_percentual = (op_abertura.price * quantidade_fechada) - taxas_proporcionais_abertura
+
+    percentual_lucro = 0.0
+    base_para_percentual_abs = abs(custo_para_calculo_percentual)
+    if base_para_percentual_abs != 0:
+        percentual_lucro = (resultado_liquido / base_para_percentual_abs) * 100.0
+    else:
+        if resultado_liquido > 0:
+            percentual_lucro = 100.0
+        elif resultado_liquido < 0:
+            percentual_lucro = -100.0
+        # Se resultado_liquido for 0 e base também, percentual_lucro permanece 0.0
+
+    operacoes_relacionadas = [
+        {
+            "id": op_abertura.id,
+            "date": op_abertura.date,
+            "operation": op_abertura.operation,
+            "quantity": quantidade_fechada,
+            "price": preco_unitario_abertura,
+            "fees": taxas_proporcionais_abertura,
+            "valor_total": preco_unitario_abertura * quantidade_fechada
+        },
+        {
+            "id": op_fechamento.id,
+            "date": op_fechamento.date,
+            "operation": op_fechamento.operation,
+            "quantity": quantidade_fechada,
+            "price": preco_unitario_fechamento,
+            "fees": taxas_proporcionais_fechamento,
+            "valor_total": preco_unitario_fechamento * quantidade_fechada
+        }
+    ]
+
+    return {
+        "ticker": op_abertura.ticker,
+        "data_abertura": data_ab,
+        "data_fechamento": data_fec,
+        "tipo": tipo_operacao_fechada,
+        "quantidade": quantidade_fechada,
+        "valor_compra": preco_unitario_abertura,
+        "valor_venda": preco_unitario_fechamento,
+        "taxas_total": taxas_proporcionais_abertura + taxas_proporcionais_fechamento,
+        "resultado": resultado_liquido,
+        "percentual_lucro": percentual_lucro, # Added this key
+        "operacoes_relacionadas": operacoes_relacionadas,
+        "day_trade": op_abertura.date == op_fechamento.date
+    }
+
+
+def determinar_status_ir(op_fechada: Dict[str, Any], resultados_mensais_map: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Determina o status de IR de uma operação fechada a partir do resultado do mês de fechamento.
+
+    Args:
+        op_fechada: Operação fechada (com data_fechamento, resultado e day_trade).
+        resultados_mensais_map: Resultados mensais indexados por mês ('YYYY-MM').
+
+    Returns:
+        str: "Prejuízo Acumulado", "Isento", "Tributável Swing", "Tributável Day Trade" ou "Lucro Compensado".
+    """
+    data_fechamento_obj = op_fechada["data_fechamento"]
+    if isinstance(data_fechamento_obj, str):
+        data_fechamento_obj = datetime.fromisoformat(data_fechamento_obj.split("T")[0]).date()
+
+    mes_fechamento_str = data_fechamento_obj.strftime("%Y-%m")
+    resultado_do_mes_dict = resultados_mensais_map.get(mes_fechamento_str)
+
+    if op_fechada["resultado"] <= 0:
+        return "Prejuízo Acumulado"
+
+    if op_fechada["day_trade"]:
+        ir_pagar_mensal_day_trade = 0.0
+        if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("ir_pagar_day"), (int, float)):
+            ir_pagar_mensal_day_trade = resultado_do_mes_dict["ir_pagar_day"]
+        return "Tributável Day Trade" if ir_pagar_mensal_day_trade > 0 else "Lucro Compensado"
+
+    # Swing Trade
+    is_exempt_swing_mensal = False
+    if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("isento_swing"), bool):
+        is_exempt_swing_mensal = resultado_do_mes_dict["isento_swing"]
+    if is_exempt_swing_mensal:
+        return "Isento"
+
+    ir_pagar_mensal_swing_trade = 0.0
+    if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("ir_pagar_swing"), (int, float)):
+        ir_pagar_mensal_swing_trade = resultado_do_mes_dict["ir_pagar_swing"]
+    return "Tributável Swing" if ir_pagar_mensal_swing_trade > 0 else "Lucro Compensado"
+
+
+def _fator_evento(evento: EventoCorporativoInfo, quantidade: float) -> Optional[float]:
+    """
+    Retorna o multiplicador de quantidade que um evento corporativo aplica a uma posição,
+    ou None se o evento não altera quantidades.
+    """
+    if evento.evento and evento.evento.lower().startswith("bonific"):
+        # Bonificação: quantidade_nova = quantidade_antiga + (quantidade_antiga * (numerador/denominador))
+        if quantidade == 0:
+            return None
+        aumento = evento.get_bonus_quantity_increase(float(quantidade))
+        return (quantidade + aumento) / quantidade if aumento else None
+    # Desdobramento/Agrupamento: multiplicação
+    fator = evento.get_adjustment_factor()
+    if fator == 1.0 or fator == 0.0:
+        return None
+    return fator
+
+
+def _ajustar_posicao(estado: Dict[str, Any], fator: float, campo_qtd: str, campo_custo: str, campo_pm: str) -> None:
+    """
+    Ajusta uma posição por um fator de quantidade. O custo total é preservado e o
+    preço médio é diluído (ou concentrado) na mesma proporção.
+    """
+    quantidade = estado[campo_qtd]
+    if quantidade == 0:
+        return
+    sinal = 1 if quantidade > 0 else -1
+    nova_quantidade_abs = int(round(abs(quantidade) * fator))
+    estado[campo_qtd] = sinal * nova_quantidade_abs
+    estado[campo_pm] = estado[campo_custo] / nova_quantidade_abs if nova_quantidade_abs else 0.0
+
+
+def _ajustar_lote(lote: RegistroOperacao, fator: float) -> None:
+    """Ajusta um lote FIFO em aberto por um fator de quantidade, preservando o valor total."""
+    quantidade_antiga = lote.quantity
+    nova_quantidade = int(round(quantidade_antiga * fator))
+    if nova_quantidade > 0:
+        lote.price = float(lote.price) * quantidade_antiga / nova_quantidade
+    lote.quantity = nova_quantidade
+
+
+def executar_motor(
+    operacoes: List[Any],
+    eventos_por_ticker: Optional[Dict[str, List[EventoCorporativoInfo]]] = None,
+    estado_inicial: Optional[Dict[str, Any]] = None,
+    datas_snapshot: Optional[List[date]] = None,
+    data_referencia: Optional[date] = None,
+    usuario_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Processa as operações de um usuário em uma única passada ordenada.
+
+    Args:
+        operacoes: Operações como RegistroOperacao (obter_operacoes_motor_db) ou dicts com
+            date, ticker, operation, quantity, price, fees e id.
+        eventos_por_ticker: Eventos corporativos por ticker, ordenados por data_ex.
+        estado_inicial: Estado para retomar a apuração mensal a partir de um checkpoint:
+            {"checkpoints": [...], "prejuizo_acumulado_swing": float, "prejuizo_acumulado_day": float}.
+            Quando informado, apenas a apuração mensal é calculada (carteira e lotes FIFO
+            exigem o histórico completo e são retornados como None).
+        datas_snapshot: Datas para as quais a posição da carteira deve ser registrada.
+        data_referencia: Eventos com data ex posterior a esta data são ignorados (padrão: hoje).
+        usuario_id: ID do usuário (apenas para logs).
+
+    Returns:
+        Dict[str, Any]: {
+            "carteira": {ticker: {quantidade, custo_total, preco_medio}},
+            "resultados_mensais": [resultado mensal por mês com operações],
+            "operacoes_fechadas": [operações fechadas com status_ir],
+            "checkpoints": [estado de swing trade por ticker ao final de cada mês],
+            "snapshots": {data: {ticker: {quantidade, custo_total, preco_medio}}}
+        }
+    """
+    inicio_motor = time.perf_counter()
+    data_referencia = data_referencia or date.today()
+    eventos_por_ticker = eventos_por_ticker or {}
+    historico_completo = estado_inicial is None
+    # Rastreio do recálculo em andamento (nulo, sem custo, fora do nível DEBUG)
+    rastreio = rastreio_atual()
+    amostra = rastreio.amostra
+
+    # Normaliza as operações uma única vez (data como date, quantidade int, preço float).
+    # Registros lidos por obter_operacoes_motor_db já vêm normalizados e não são copiados:
+    # o motor nunca altera uma operação de entrada (os lotes FIFO são cópias).
+    ops = [op if isinstance(op, RegistroOperacao) else RegistroOperacao.de_dict(op) for op in operacoes]
+    ops.sort(key=lambda x: (x.date, x.id or 0))
+
+    # --- Estado das máquinas ---
+    carteira = defaultdict(lambda: {"quantidade": 0, "custo_total": 0.0, "preco_medio": 0.0})
+    carteira_swing = defaultdict(lambda: {"quantidade": 0, "custo_total": 0.0, "preco_medio": 0.0})
+    posicoes_vendidas = defaultdict(lambda: {"quantidade_vendida": 0, "valor_total_venda": 0.0, "preco_medio_venda": 0.0})
+    compras_pendentes = defaultdict(list)
+    vendas_pendentes = defaultdict(list)
+    prejuizo_acumulado_swing = 0.0
+    prejuizo_acumulado_day = 0.0
+
+    # Eventos já aplicados ao estado restaurado: até a data registrada no checkpoint
+    # (o fim do mês, ou a data de referência se o mês ainda estava em curso)
+    aplicado_ate: Dict[str, date] = {}
+    if estado_inicial:
+        for cp in estado_inicial.get("checkpoints", []):
+            carteira_swing[cp["ticker"]] = {
+                "quantidade": cp["quantidade"], "custo_total": cp["custo_total"], "preco_medio": cp["preco_medio"]
+            }
+            posicoes_vendidas[cp["ticker"]] = {
+                "quantidade_vendida": cp["quantidade_vendida"],
+                "valor_total_venda": cp["valor_total_venda"],
+                "preco_medio_venda": cp["preco_medio_venda"]
+            }
+            if cp.get("eventos_ate"):
+                aplicado_ate[cp["ticker"]] = normalizar_data(cp["eventos_ate"])
+            else:
+                ano_cp, mes_cp = map(int, cp["mes"].split("-"))
+                aplicado_ate[cp["ticker"]] = date(ano_cp, mes_cp, calendar.monthrange(ano_cp, mes_cp)[1])
+        prejuizo_acumulado_swing = estado_inicial.get("prejuizo_acumulado_swing") or 0.0
+        prejuizo_acumulado_day = estado_inicial.get("prejuizo_acumulado_day") or 0.0
+
+    # Fila única de eventos pendentes, ordenada por data ex
+    eventos_pendentes = []
+    for ticker_ev, eventos in eventos_por_ticker.items():
+        for evento in eventos:
+            if evento.data_ex is None or evento.data_ex > data_referencia:
+                continue
+            if ticker_ev in aplicado_ate and evento.data_ex <= aplicado_ate[ticker_ev]:
+                continue
+            eventos_pendentes.append((evento.data_ex, ticker_ev, evento))
+    eventos_pendentes.sort(key=lambda e: e[0])
+    indice_evento = 0
+    rastreio.contar("operacoes", len(ops))
+    rastreio.contar("eventos", len(eventos_pendentes))
+
+    def aplicar_eventos_ate(data_limite: date) -> None:
+        """Aplica a todas as máquinas os eventos com data ex <= data_limite."""
+        nonlocal indice_evento
+        while indice_evento < len(eventos_pendentes) and eventos_pendentes[indice_evento][0] <= data_limite:
+            _, ticker_ev, evento = eventos_pendentes[indice_evento]
+            indice_evento += 1
+            if ticker_ev in carteira:
+                fator = _fator_evento(evento, abs(carteira[ticker_ev]["quantidade"]))
+                if fator:
+                    _ajustar_posicao(carteira[ticker_ev], fator, "quantidade", "custo_total", "preco_medio")
+            if ticker_ev in carteira_swing:
+                fator = _fator_evento(evento, carteira_swing[ticker_ev]["quantidade"])
+                if fator:
+                    _ajustar_posicao(carteira_swing[ticker_ev], fator, "quantidade", "custo_total", "preco_medio")
+            if ticker_ev in posicoes_vendidas:
+                fator = _fator_evento(evento, posicoes_vendidas[ticker_ev]["quantidade_vendida"])
+                if fator:
+                    _ajustar_posicao(posicoes_vendidas[ticker_ev], fator, "quantidade_vendida", "valor_total_venda", "preco_medio_venda")
+            for lote in compras_pendentes.get(ticker_ev, []) + vendas_pendentes.get(ticker_ev, []):
+                fator = _fator_evento(evento, lote.quantity)
+                if fator:
+                    _ajustar_lote(lote, fator)
+
+    snapshots: Dict[date, Dict[str, Dict[str, Any]]] = {}
+    datas_snapshot_pendentes = sorted(set(datas_snapshot or []))
+
+    def registrar_snapshots_ate(data_limite: date) -> None:
+        """Registra a carteira para as datas de snapshot anteriores a data_limite."""
+        while datas_snapshot_pendentes and datas_snapshot_pendentes[0] < data_limite:
+            data_snapshot = datas_snapshot_pendentes.pop(0)
+            aplicar_eventos_ate(data_snapshot)
+            snapshots[data_snapshot] = {
+                ticker: dict(estado) for ticker, estado in carteira.items() if estado["quantidade"] != 0
+            }
+
+    resultados_mensais: List[Dict[str, Any]] = []
+    checkpoints: List[Dict[str, Any]] = []
+    # Operações fechadas agrupadas por ticker, na ordem em que cada ticker aparece
+    operacoes_fechadas_por_ticker: Dict[str, List[Dict[str, Any]]] = {}
+
+    # O tempo da aplicação de eventos é medido à parte (etapa "ajustar")
+    aplicar_eventos_ate = rastreio.cronometrar("ajustar", aplicar_eventos_ate)
+    indice_op = 0
+
+    # Agrupa as operações por mês e dia preservando a ordem (data, id)
+    operacoes_por_mes = defaultdict(lambda: defaultdict(list))
+    for op in ops:
+        operacoes_por_mes[op.date.strftime("%Y-%m")][op.date].append(op)
+
+    for mes_str, dias_do_mes in sorted(operacoes_por_mes.items()):
+        resultado_mes_swing = {"vendas": 0.0, "custo": 0.0, "ganho_liquido": 0.0}
+        resultado_mes_day = {"vendas_total": 0.0, "custo_total": 0.0, "ganho_liquido": 0.0, "irrf": 0.0}
+        tickers_no_mes = set()
+
+        for dia, ops_dia in sorted(dias_do_mes.items()):
+            registrar_snapshots_ate(dia)
+            # Operações na data ex já estão na base nova; as anteriores foram ajustadas ao atingir a data ex
+            aplicar_eventos_ate(dia)
+
+            for op in ops_dia:
+                tickers_no_mes.add(op.ticker)
+                if historico_completo:
+                    _processar_op_carteira(carteira[op.ticker], op)
+                    fechadas_ticker = operacoes_fechadas_por_ticker.setdefault(op.ticker, [])
+                    _processar_op_fifo(compras_pendentes[op.ticker], vendas_pendentes[op.ticker], op, fechadas_ticker)
+                    if amostra:
+                        indice_op += 1
+                        if indice_op % amostra == 0:
+                            rastreio.operacao(indice_op, op, carteira[op.ticker])
+
+            _processar_dia_apuracao(ops_dia, carteira_swing, posicoes_vendidas, resultado_mes_swing, resultado_mes_day, usuario_id)
+
+        resultado_dict, prejuizo_acumulado_swing, prejuizo_acumulado_day = _fechar_mes(
+            mes_str, resultado_mes_swing, resultado_mes_day, prejuizo_acumulado_swing, prejuizo_acumulado_day
+        )
+        resultados_mensais.append(resultado_dict)
+
+        # Snapshots do restante do mês, depois os eventos ocorridos até o fim do mês (entram no checkpoint)
+        ano, mes_num = map(int, mes_str.split("-"))
+        fim_do_mes = date(ano, mes_num, calendar.monthrange(ano, mes_num)[1])
+        registrar_snapshots_ate(fim_do_mes + timedelta(days=1))
+        eventos_ate = min(fim_do_mes, data_referencia)
+        aplicar_eventos_ate(eventos_ate)
+
+        # Checkpoint dos tickers movimentados no mês (os demais mantêm o checkpoint anterior).
+        # eventos_ate registra o corte real: no mês em curso, os eventos com data ex
+        # posterior à data de referência ainda não estão no estado salvo.
+        for ticker_mes in sorted(tickers_no_mes):
+            checkpoints.append({
+                "ticker": ticker_mes,
+                "mes": mes_str,
+                "eventos_ate": eventos_ate,
+                **carteira_swing[ticker_mes],
+                **posicoes_vendidas[ticker_mes],
+            })
+
+    registrar_snapshots_ate(date.max)
+    aplicar_eventos_ate(data_referencia)
+
+    operacoes_fechadas = [op_f for fechadas in operacoes_fechadas_por_ticker.values() for op_f in fechadas]
+    if historico_completo:
+        resultados_map = {r["mes"]: r for r in resultados_mensais}
+        for op_f in operacoes_fechadas:
+            op_f["status_ir"] = determinar_status_ir(op_f, resultados_map)
+
+    DURACAO_MOTOR.observar(time.perf_counter() - inicio_motor)
+    OPERACOES_MOTOR.incrementar(quantidade=len(ops))
+    return {
+        "carteira": {ticker: dict(estado) for ticker, estado in carteira.items()} if historico_completo else None,
+        "resultados_mensais": resultados_mensais,
+        "operacoes_fechadas": operacoes_fechadas if historico_completo else None,
+        "checkpoints": checkpoints,
+        "snapshots": snapshots,
+    }
+
+
+def _processar_op_carteira(posicao: Dict[str, Any], op: RegistroOperacao) -> None:
+    """
+    Aplica uma operação à posição da carteira (quantidade, custo_total, preco_medio).
+    Compras somam custo com taxas; vendas baixam custo pelo PM; vendas além da
+    posição comprada abrem posição vendida, cujo custo_total é o valor bruto vendido.
+    """
+    quantidade_op = op.quantity
+    valor_op_bruto = quantidade_op * op.price # Renomeado para clareza (valor bruto da operação)
+    fees_op = op.fees
+
+    # Salva o estado ANTES de modificar quantidade, custo_total e PM para lógica de compra/venda
+    estado_anterior_quantidade = posicao["quantidade"]
+    estado_anterior_preco_medio = posicao["preco_medio"]
+    estado_anterior_custo_total = posicao["custo_total"] # Captura o custo total anterior
+
+    if op.operation == "buy":
+        custo_da_compra_atual_total = valor_op_bruto + fees_op
+
+        if estado_anterior_quantidade < 0: # Estava vendido e esta compra está cobrindo (parcialmente ou totalmente)
+            quantidade_acoes_sendo_cobertas = min(abs(estado_anterior_quantidade), quantidade_op)
+
+            posicao["quantidade"] += quantidade_op
+
+            if posicao["quantidade"] == 0: # Compra zerou exatamente a posição vendida
+                posicao["custo_total"] = 0.0
+            elif posicao["quantidade"] > 0: # Compra cobriu a posição vendida e iniciou uma nova posição comprada
+                quantidade_comprada_excedente = posicao["quantidade"]
+                custo_da_parte_excedente = (custo_da_compra_atual_total / quantidade_op) * quantidade_comprada_excedente if quantidade_op != 0 else 0
+                posicao["custo_total"] = custo_da_parte_excedente
+            else: # Compra apenas reduziu a posição vendida (posicao["quantidade"] < 0)
+                reducao_valor_pos_vendida = estado_anterior_preco_medio * quantidade_acoes_sendo_cobertas
+                posicao["custo_total"] = estado_anterior_custo_total - reducao_valor_pos_vendida
+                if posicao["custo_total"] < 0: # Garante que não fique negativo
+                    posicao["custo_total"] = 0.0
+        else: # Estava zerado ou já comprado (caso normal de compra)
+            posicao["quantidade"] += quantidade_op
+            posicao["custo_total"] += custo_da_compra_atual_total
+    elif op.operation == "sell":
+        # Se estava comprado antes desta venda
+        if estado_anterior_quantidade > 0:
+            quantidade_vendida_da_posicao_comprada = min(estado_anterior_quantidade, quantidade_op)
+            custo_a_baixar = estado_anterior_preco_medio * quantidade_vendida_da_posicao_comprada
+            posicao["custo_total"] -= custo_a_baixar
+            posicao["quantidade"] -= quantidade_vendida_da_posicao_comprada
+
+            quantidade_op_restante_apos_vender_comprado = quantidade_op - quantidade_vendida_da_posicao_comprada
+            if quantidade_op_restante_apos_vender_comprado > 0: # Venda excedeu a posição comprada, virou vendido
+                # Agora, custo_total representa o valor da nova posição vendida.
+                proporcao_restante = quantidade_op_restante_apos_vender_comprado / quantidade_op if quantidade_op else 0
+                posicao["custo_total"] = (valor_op_bruto * proporcao_restante) # Usar valor bruto para PM de venda, taxas afetam resultado.
+                posicao["quantidade"] -= quantidade_op_restante_apos_vender_comprado
+        else: # Estava zerado ou já vendido (aumentando a posição vendida)
+            posicao["quantidade"] -= quantidade_op
+            # Custo_total para vendidos acumula o valor (bruto) obtido com as vendas.
+            # O preco_medio será (custo_total / abs(quantidade))
+            posicao["custo_total"] += valor_op_bruto
+
+    # Recalcula o preço médio final da posição
+    if posicao["quantidade"] > 0: # Posição comprada
+        posicao["preco_medio"] = posicao["custo_total"] / posicao["quantidade"]
+    elif posicao["quantidade"] < 0: # Posição vendida
+        if posicao["custo_total"] != 0: # Evitar divisão por zero se custo_total ainda for 0 por algum motivo
+            posicao["preco_medio"] = posicao["custo_total"] / abs(posicao["quantidade"])
+        elif op.operation == "sell": # Venda que resultou em posição negativa com custo_total zerado
+            posicao["preco_medio"] = op.price # Usa o preço da operação atual como PM
+        else:
+            posicao["preco_medio"] = 0.0 # Fallback
+    else: # Quantidade é zero
+        posicao["preco_medio"] = 0.0
+        posicao["custo_total"] = 0.0
+
+
+def _processar_op_fifo(compras_pendentes: List[RegistroOperacao], vendas_pendentes: List[RegistroOperacao], op_atual: RegistroOperacao, operacoes_fechadas: List[Dict[str, Any]]) -> None:
+    """
+    Casa uma operação com os lotes em aberto do ticker pelo método FIFO, registrando
+    em operacoes_fechadas cada par abertura/fechamento.
+    """
+    quantidade_atual = op_atual.quantity
+
+    if op_atual.operation == "buy":
+        # Tenta fechar com vendas pendentes (venda a descoberto)
+        while quantidade_atual > 0 and vendas_pendentes:
+            venda_pendente = vendas_pendentes[0]
+            qtd_fechar = min(quantidade_atual, venda_pendente.quantity)
+
+            operacoes_fechadas.append(_criar_operacao_fechada_detalhada(
+                op_abertura=venda_pendente,
+                op_fechamento=op_atual,
+                quantidade_fechada=qtd_fechar,
+                tipo_fechamento="venda_descoberta_fechada_com_compra"
+            ))
+
+            venda_pendente.quantity -= qtd_fechar
+            quantidade_atual -= qtd_fechar
+
+            if venda_pendente.quantity == 0:
+                vendas_pendentes.pop(0)
+
+        if quantidade_atual > 0:
+            compras_pendentes.append(op_atual.restante(quantidade_atual))
+
+    elif op_atual.operation == "sell":
+        # Tenta fechar com compras pendentes
+        while quantidade_atual > 0 and compras_pendentes:
+            compra_pendente = compras_pendentes[0]
+            qtd_fechar = min(quantidade_atual, compra_pendente.quantity)
+
+            operacoes_fechadas.append(_criar_operacao_fechada_detalhada(
+                op_abertura=compra_pendente,
+                op_fechamento=op_atual,
+                quantidade_fechada=qtd_fechar,
+                tipo_fechamento="compra_fechada_com_venda"
+            ))
+
+            compra_pendente.quantity -= qtd_fechar
+            quantidade_atual -= qtd_fechar
+
+            if compra_pendente.quantity == 0:
+                compras_pendentes.pop(0)
+
+        if quantidade_atual > 0: # Venda a descoberto
+            vendas_pendentes.append(op_atual.restante(quantidade_atual))
+
+
+def _processar_dia_apuracao(
+    ops_dia_list_original: List[RegistroOperacao],
+    carteira_estado_atual: Dict[str, Dict[str, Any]],
+    posicoes_vendidas_estado_atual: Dict[str, Dict[str, Any]],
+    resultado_mes_swing: Dict[str, float],
+    resultado_mes_day: Dict[str, float],
+    usuario_id: Optional[int],
+) -> None:
+    """
+    Apura um dia de operações: separa day trades de swing trades por ticker, atualiza o
+    PM de swing trade e as posições vendidas, e acumula vendas/custos no resultado do mês.
+    """
+    ops_day_trade_dia = []
+    ops_swing_trade_dia_compras = []
+    ops_swing_trade_dia_vendas = []
+
+    # Separa operações por ticker para checar day trade corretamente
+    ops_por_ticker_neste_dia = defaultdict(list)
+    for op_dia in ops_dia_list_original:
+        ops_por_ticker_neste_dia[op_dia.ticker].append(op_dia)
+
+    for ticker_dia, lista_ops_ticker_dia in ops_por_ticker_neste_dia.items():
+        if _eh_day_trade(lista_ops_ticker_dia, ticker_dia):
+            ops_day_trade_dia.extend(lista_ops_ticker_dia)
+        else: # Não é day trade para este ticker, são swing trades
+            for op_swing in lista_ops_ticker_dia:
+                if op_swing.operation == "buy":
+                    ops_swing_trade_dia_compras.append(op_swing)
+                else:
+                    ops_swing_trade_dia_vendas.append(op_swing)
+
+    # Ordena compras e vendas por ID para manter a ordem de execução no dia
+    ops_swing_trade_dia_compras.sort(key=lambda x: x.id or 0)
+    ops_swing_trade_dia_vendas.sort(key=lambda x: x.id or 0)
+
+    # Processar Compras de Swing Trade do Dia
+    for compra_op in ops_swing_trade_dia_compras:
+        ticker = compra_op.ticker
+        quantidade_compra_total = compra_op.quantity
+        preco_compra_unitario = compra_op.price
+        fees_compra_total = compra_op.fees
+
+        if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
+            qtd_a_cobrir = min(posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"], quantidade_compra_total)
+            pm_venda_anterior = posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"]
+
+            valor_da_venda_original_para_acoes_cobertas = qtd_a_cobrir * pm_venda_anterior # Valor bruto da venda original
+            custo_da_recompra_para_acoes_cobertas_bruto = qtd_a_cobrir * preco_compra_unitario
+            fees_compra_proporcional = (fees_compra_total / quantidade_compra_total) * qtd_a_cobrir if quantidade_compra_total > 0 else 0
+
+            # Adiciona o custo da recompra ao resultado do mês.
+            # A venda original já foi adicionada a resultado_mes_swing["vendas"].
+            resultado_mes_swing["custo"] += custo_da_recompra_para_acoes_cobertas_bruto + fees_compra_proporcional
+
+            # Atualiza posicoes_vendidas_estado_atual
+            posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] -= valor_da_venda_original_para_acoes_cobertas # Deduz o valor bruto das ações recompradas
+            posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] -= qtd_a_cobrir
+
+            if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
+                posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] / posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"]
+            else: # Zerou a posição vendida
+                posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = 0.0
+                posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] = 0.0 # Garante zeragem
+
+            quantidade_compra_restante = quantidade_compra_total - qtd_a_cobrir
+            if quantidade_compra_restante > 0:
+                # Trata o restante como uma compra normal para a carteira_estado_atual (posição comprada)
+                valor_compra_restante_bruto = quantidade_compra_restante * preco_compra_unitario
+                fees_compra_restante = (fees_compra_total / quantidade_compra_total) * quantidade_compra_restante if quantidade_compra_total > 0 else 0
+
+                carteira_estado_atual[ticker]["quantidade"] += quantidade_compra_restante
+                carteira_estado_atual[ticker]["custo_total"] += valor_compra_restante_bruto + fees_compra_restante
+                if carteira_estado_atual[ticker]["quantidade"] > 0: # Sempre será >0 aqui
+                     carteira_estado_atual[ticker]["preco_medio"] = carteira_estado_atual[ticker]["custo_total"] / carteira_estado_atual[ticker]["quantidade"]
+        else:
+            # Lógica original para compra normal (nenhuma posição vendida para cobrir)
+            carteira_estado_atual[ticker]["quantidade"] += quantidade_compra_total
+            carteira_estado_atual[ticker]["custo_total"] += (quantidade_compra_total * preco_compra_unitario) + fees_compra_total
+            if carteira_estado_atual[ticker]["quantidade"] > 0:
+                carteira_estado_atual[ticker]["preco_medio"] = carteira_estado_atual[ticker]["custo_total"] / carteira_estado_atual[ticker]["quantidade"]
+            else: # Improvável para uma compra, mas para segurança
+                carteira_estado_atual[ticker]["preco_medio"] = 0.0
+                carteira_estado_atual[ticker]["custo_total"] = 0.0
+
+    # Processar Vendas de Swing Trade do Dia
+    for venda_op in ops_swing_trade_dia_vendas:
+        ticker = venda_op.ticker
+        quantidade_venda_total = venda_op.quantity
+        preco_venda_unitario = venda_op.price
+        fees_total_venda = venda_op.fees
+
+        quantidade_vendida_de_posicao_comprada = 0
+        quantidade_vendida_a_descoberto = 0
+
+        # Parte 1: Venda cobre posição comprada existente
+        if carteira_estado_atual[ticker]["quantidade"] > 0:
+            pm_para_venda_comprada = carteira_estado_atual[ticker]["preco_medio"]
+            quantidade_vendida_de_posicao_comprada = min(carteira_estado_atual[ticker]["quantidade"], quantidade_venda_total)
+
+            custo_da_parte_comprada_vendida = quantidade_vendida_de_posicao_comprada * pm_para_venda_comprada
+            valor_bruto_da_parte_comprada_vendida = quantidade_vendida_de_posicao_comprada * preco_venda_unitario
+            fees_da_parte_comprada_vendida = (fees_total_venda / quantidade_venda_total) * quantidade_vendida_de_posicao_comprada if quantidade_venda_total > 0 else 0
+            valor_liquido_da_parte_comprada_vendida = valor_bruto_da_parte_comprada_vendida - fees_da_parte_comprada_vendida
+
+            resultado_mes_swing["vendas"] += valor_liquido_da_parte_comprada_vendida
+            resultado_mes_swing["custo"] += custo_da_parte_comprada_vendida
+
+            carteira_estado_atual[ticker]["quantidade"] -= quantidade_vendida_de_posicao_comprada
+            carteira_estado_atual[ticker]["custo_total"] -= custo_da_parte_comprada_vendida
+            if carteira_estado_atual[ticker]["quantidade"] <= 0:
+                carteira_estado_atual[ticker]["custo_total"] = 0.0
+                carteira_estado_atual[ticker]["preco_medio"] = 0.0
+
+        # Parte 2: Venda a descoberto (o restante da quantidade da operação de venda)
+        quantidade_vendida_a_descoberto = quantidade_venda_total - quantidade_vendida_de_posicao_comprada
+
+        if quantidade_vendida_a_descoberto > 0:
+            valor_desta_venda_descoberta_bruto = quantidade_vendida_a_descoberto * preco_venda_unitario
+            fees_desta_venda_descoberta = (fees_total_venda / quantidade_venda_total) * quantidade_vendida_a_descoberto if quantidade_venda_total > 0 else 0
+            valor_liquido_desta_venda_descoberta = valor_desta_venda_descoberta_bruto - fees_desta_venda_descoberta
+
+            resultado_mes_swing["vendas"] += valor_liquido_desta_venda_descoberta
+            # O custo da venda a descoberto será apurado na recompra.
+
+            posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] += valor_desta_venda_descoberta_bruto # Acumula valor bruto para PM de venda
+            posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] += quantidade_vendida_a_descoberto
+
+            if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
+                posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] / posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"]
+
+    # Calcular resultados de Day Trade do dia (se houver)
+    if ops_day_trade_dia:
+        _, resultado_dia_day_obj = _calcular_resultado_dia(ops_day_trade_dia, usuario_id)
+        if resultado_dia_day_obj: # Se houver resultado de day trade
+            resultado_mes_day["vendas_total"] += resultado_dia_day_obj["vendas_total"]
+            resultado_mes_day["custo_total"] += resultado_dia_day_obj["custo_total"]
+            # O ganho líquido do dia de daytrade é vendas - custo. Esse valor será somado ao do mês.
+            resultado_mes_day["ganho_liquido"] += resultado_dia_day_obj["ganho_liquido"]
+            resultado_mes_day["irrf"] += resultado_dia_day_obj["irrf"]
+
+
+def _fechar_mes(
+    mes_str: str,
+    resultado_mes_swing: Dict[str, float],
+    resultado_mes_day: Dict[str, float],
+    prejuizo_acumulado_swing: float,
+    prejuizo_acumulado_day: float,
+) -> tuple[Dict[str, Any], float, float]:
+    """
+    Consolida o resultado de um mês: isenção de swing trade, compensação de prejuízos,
+    IR devido/a pagar e dados de DARF.
+
+    Returns:
+        tuple[Dict[str, Any], float, float]: Resultado mensal e prejuízos acumulados (swing, day) atualizados.
+    """
+    resultado_mes_swing["ganho_liquido"] = resultado_mes_swing["vendas"] - resultado_mes_swing["custo"]
+    # O ganho líquido de day trade já foi acumulado.
+
+    isento_swing = resultado_mes_swing["vendas"] <= 20000.0
+
+    # Aplica a compensação de prejuízos (Swing Trade)
+    ganho_liquido_swing_antes_compensacao = resultado_mes_swing["ganho_liquido"]
+    if prejuizo_acumulado_swing > 0 and ganho_liquido_swing_antes_compensacao > 0:
+        compensacao = min(prejuizo_acumulado_swing, ganho_liquido_swing_antes_compensacao)
+        ganho_liquido_swing_apos_compensacao = ganho_liquido_swing_antes_compensacao - compensacao
+        prejuizo_acumulado_swing -= compensacao
+    elif ganho_liquido_swing_antes_compensacao < 0:
+        prejuizo_acumulado_swing += abs(ganho_liquido_swing_antes_compensacao)
+        ganho_liquido_swing_apos_compensacao = 0.0
+    else:
+        ganho_liquido_swing_apos_compensacao = ganho_liquido_swing_antes_compensacao
+
+    # Aplica a compensação de prejuízos (Day Trade)
+    ganho_liquido_day_antes_compensacao = resultado_mes_day["ganho_liquido"]
+    if prejuizo_acumulado_day > 0 and ganho_liquido_day_antes_compensacao > 0:
+        compensacao_day = min(prejuizo_acumulado_day, ganho_liquido_day_antes_compensacao)
+        ganho_liquido_day_apos_compensacao = ganho_liquido_day_antes_compensacao - compensacao_day
+        prejuizo_acumulado_day -= compensacao_day
+    elif ganho_liquido_day_antes_compensacao < 0:
+        prejuizo_acumulado_day += abs(ganho_liquido_day_antes_compensacao)
+        ganho_liquido_day_apos_compensacao = 0.0
+    else:
+        ganho_liquido_day_apos_compensacao = ganho_liquido_day_antes_compensacao
+
+    # Prepara o dicionário final para salvar no banco
+    resultado_dict: Dict[str, Any] = {
+        "mes": mes_str,
+        "vendas_swing": resultado_mes_swing["vendas"],
+        "custo_swing": resultado_mes_swing["custo"],
+        "ganho_liquido_swing": ganho_liquido_swing_apos_compensacao, # Já compensado
+        "isento_swing": isento_swing,
+        "prejuizo_acumulado_swing": prejuizo_acumulado_swing,
+
+        "vendas_day_trade": resultado_mes_day["vendas_total"],
+        "custo_day_trade": resultado_mes_day["custo_total"],
+        "ganho_liquido_day": ganho_liquido_day_apos_compensacao, # Já compensado
+        "irrf_day": resultado_mes_day["irrf"],
+        "prejuizo_acumulado_day": prejuizo_acumulado_day,
+
+        # Defaults for DARF fields
+        "darf_codigo_swing": None, "darf_competencia_swing": None, "darf_valor_swing": None, "darf_vencimento_swing": None, "status_darf_swing_trade": None,
+        "darf_codigo_day": None, "darf_competencia_day": None, "darf_valor_day": None, "darf_vencimento_day": None, "status_darf_day_trade": None,
+    }
+
+    # Swing Trade IR calculations
+    current_ir_devido_swing = 0.0
+    if not isento_swing and resultado_dict["ganho_liquido_swing"] > 0:
+        current_ir_devido_swing = resultado_dict["ganho_liquido_swing"] * 0.15
+
+    # Simplificando ir_pagar_swing = current_ir_devido_swing (desconsiderando IRRF de 0,005% em swing, que não é comum reter para DARF)
+    current_ir_pagar_swing = max(0.0, current_ir_devido_swing)
+
+    resultado_dict["ir_devido_swing"] = current_ir_devido_swing
+    resultado_dict["ir_pagar_swing"] = current_ir_pagar_swing
+
+    if current_ir_pagar_swing >= 10.0:
+        resultado_dict["darf_valor_swing"] = current_ir_pagar_swing
+        resultado_dict["darf_codigo_swing"] = "6015" # Código genérico, pode ser diferente para swing
+        resultado_dict["darf_competencia_swing"] = mes_str
+        resultado_dict["darf_vencimento_swing"] = _calculate_darf_due_date(mes_str)
+        resultado_dict["status_darf_swing_trade"] = "Pendente"
+
+    # Day Trade IR calculations
+    current_ir_devido_day = 0.0
+    if resultado_dict["ganho_liquido_day"] > 0:
+         current_ir_devido_day = resultado_dict["ganho_liquido_day"] * 0.20
+
+    current_ir_pagar_day = max(0.0, current_ir_devido_day - resultado_dict["irrf_day"])
+
+    resultado_dict["ir_devido_day"] = current_ir_devido_day
+    resultado_dict["ir_pagar_day"] = current_ir_pagar_day
+
+    if current_ir_pagar_day >= 10.0:
+        resultado_dict["darf_valor_day"] = current_ir_pagar_day
+        resultado_dict["darf_codigo_day"] = "6015"
+        resultado_dict["darf_competencia_day"] = mes_str
+        resultado_dict["darf_vencimento_day"] = _calculate_darf_due_date(mes_str)
+        resultado_dict["status_darf_day_trade"] = "Pendente"
+
+    return resultado_dict, prejuizo_acumulado_swing, prejuizo_acumulado_day
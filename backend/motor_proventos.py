@@ -0,0 +1,72 @@
+"""
+Motor de direitos a proventos.
+
+Para cada ticker, percorre uma única vez, em ordem cronológica, as operações do
+usuário, os eventos corporativos e as datas ex dos proventos. A posição corrente
+é ajustada pelos eventos quando a data ex do evento é atingida (como no motor de
+posições) e, a cada data ex de provento, a quantidade com direito é a posição ao
+final do dia anterior: operações feitas na própria data ex já não dão direito.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from indice_eventos import IndiceEventos
+
+def _normalizar_data(valor: Any) -> Optional[date]:
+    if valor is None or isinstance(valor, date) and not isinstance(valor, datetime):
+        return valor
+    if isinstance(valor, datetime):
+        return valor.date()
+    return date.fromisoformat(str(valor).split("T")[0])
+
+def calcular_direitos_proventos_ticker(
+    operacoes: Iterable[Dict[str, Any]],
+    proventos: Iterable[Dict[str, Any]],
+    indice_eventos: Optional[IndiceEventos] = None,
+) -> List[Tuple[Dict[str, Any], int]]:
+    """
+    Calcula a quantidade com direito a cada provento de um ticker.
+
+    Args:
+        operacoes: Operações do usuário no ticker (date, operation, quantity), em qualquer ordem.
+        proventos: Proventos do ticker (com data_ex), em qualquer ordem.
+        indice_eventos: Eventos corporativos do ticker (opcional).
+
+    Returns:
+        List[Tuple[Dict[str, Any], int]]: (provento, quantidade) para cada provento com
+        data ex e posição positiva na véspera, em ordem de data ex.
+    """
+    # Linha do tempo: na mesma data, o evento ajusta a posição antes das operações do dia
+    linha_do_tempo: List[Tuple[date, int, Any]] = []
+    for op in operacoes:
+        sinal = 1 if op["operation"].lower() == "buy" else -1 if op["operation"].lower() == "sell" else 0
+        if sinal:
+            linha_do_tempo.append((_normalizar_data(op["date"]), 1, sinal * int(op["quantity"])))
+    if indice_eventos is not None:
+        for data_ex, fator in zip(indice_eventos.datas_ex, indice_eventos.fatores):
+            if fator not in (0.0, 1.0):
+                linha_do_tempo.append((data_ex, 0, fator))
+    linha_do_tempo.sort(key=lambda item: (item[0], item[1]))
+
+    proventos_com_data = [(_normalizar_data(p.get("data_ex")), p) for p in proventos]
+    proventos_com_data = sorted(
+        ((data_ex, p) for data_ex, p in proventos_com_data if data_ex is not None), key=lambda item: item[0]
+    )
+
+    direitos: List[Tuple[Dict[str, Any], int]] = []
+    quantidade = 0
+    posicao = 0
+    for data_ex, provento in proventos_com_data:
+        # Consome tudo o que aconteceu antes da data ex
+        while posicao < len(linha_do_tempo) and linha_do_tempo[posicao][0] < data_ex:
+            _, tipo, valor = linha_do_tempo[posicao]
+            posicao += 1
+            if tipo == 1:
+                quantidade += valor
+            elif quantidade:
+                # Evento corporativo: ajusta a posição, arredondando como o motor de posições
+                sinal = 1 if quantidade > 0 else -1
+                quantidade = sinal * int(round(abs(quantidade) * valor))
+        if quantidade > 0:
+            direitos.append((provento, quantidade))
+    return direitos
@@ -0,0 +1,147 @@
+"""
+Rastreamento dos recálculos de posições.
+
+Um recálculo (recalcular_posicoes_usuario, recalcular_carteira, recalcular_resultados,
+calcular_operacoes_fechadas) abre um rastreio com `rastrear`; serviços chamados dentro
+dele reutilizam o mesmo rastreio, de modo que um recálculo completo gera uma única
+linha de log ao final, com o tempo de cada etapa e os contadores:
+
+- carregar: leitura das operações e dos eventos corporativos;
+- agregar: passada do motor de posições (carteira, apuração mensal e lotes FIFO);
+- ajustar: aplicação dos eventos corporativos, parte do tempo de `agregar`;
+- persistir: gravação de carteira, resultados mensais e operações fechadas.
+
+O rastreio só é ativado com o logger "investir.recalculo" em nível DEBUG. Desativado,
+`rastrear` entrega um rastreio nulo: as etapas são um contexto vazio e nenhuma mensagem
+é formatada. Com RECOMPUTE_TRACE_AMOSTRA=N (e DEBUG), o estado da carteira é registrado
+a cada N operações processadas pelo motor.
+"""
+import contextvars
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from metricas import DURACAO_RECALCULO
+
+logger = logging.getLogger("investir.recalculo")
+
+# Registra o estado da carteira a cada N operações do motor (0 desativa)
+RECOMPUTE_TRACE_AMOSTRA = int(os.getenv("RECOMPUTE_TRACE_AMOSTRA", "0"))
+
+class Rastreio:
+    """Tempos por etapa e contadores de um recálculo."""
+    ativo = True
+
+    def __init__(self, nome: str, usuario_id: Optional[int], amostra: int):
+        self.nome = nome
+        self.usuario_id = usuario_id
+        self.amostra = amostra
+        self.tempos: Dict[str, float] = {}
+        self.contadores: Dict[str, int] = {}
+        self._inicio = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nome: str) -> Iterator[None]:
+        """Acumula o tempo do bloco na etapa `nome`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.tempos[nome] = self.tempos.get(nome, 0.0) + time.perf_counter() - inicio
+
+    def cronometrar(self, nome: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        """Envolve `func` para acumular o tempo de cada chamada na etapa `nome`."""
+        def executar(*args, **kwargs):
+            with self.etapa(nome):
+                return func(*args, **kwargs)
+        return executar
+
+    def contar(self, nome: str, quantidade: int = 1) -> None:
+        self.contadores[nome] = self.contadores.get(nome, 0) + quantidade
+
+    def operacao(self, indice: int, op: Dict[str, Any], posicao: Dict[str, Any]) -> None:
+        """Registra a operação `indice` (já processada) e a posição resultante do ticker."""
+        logger.debug("[%s] usuário %s op #%d %s %s %s x %s em %s -> qtd %s, custo %.2f, PM %.4f",
+                     self.nome, self.usuario_id, indice, op["ticker"], op["operation"], op["quantity"],
+                     op["price"], op["date"], posicao["quantidade"], posicao["custo_total"], posicao["preco_medio"])
+
+    def finalizar(self) -> None:
+        total = time.perf_counter() - self._inicio
+        etapas = " ".join(f"{nome}={1000 * tempo:.1f}ms" for nome, tempo in self.tempos.items())
+        contadores = " ".join(f"{nome}={valor}" for nome, valor in self.contadores.items())
+        logger.debug("[%s] usuário %s: total=%.1fms %s %s", self.nome, self.usuario_id, 1000 * total, etapas, contadores)
+
+class _RastreioNulo:
+    """Rastreio desativado: nenhuma medição nem formatação."""
+    ativo = False
+    amostra = 0
+    _contexto = nullcontext()
+
+    def etapa(self, nome: str):
+        return self._contexto
+
+    def cronometrar(self, nome: str, func: Callable[..., Any]) -> Callable[..., Any]:
+        return func
+
+    def contar(self, nome: str, quantidade: int = 1) -> None:
+        pass
+
+    def operacao(self, indice: int, op: Dict[str, Any], posicao: Dict[str, Any]) -> None:
+        pass
+
+RASTREIO_NULO = _RastreioNulo()
+
+_rastreio_atual: contextvars.ContextVar[Optional[Rastreio]] = contextvars.ContextVar("rastreio_recalculo", default=None)
+
+@contextmanager
+def rastrear(nome: str, usuario_id: Optional[int] = None) -> Iterator[Any]:
+    """
+    Abre o rastreio de um recálculo, ou reutiliza o do serviço chamador.
+
+    Args:
+        nome: Nome do recálculo (aparece no log).
+        usuario_id: ID do usuário.
+
+    Yields:
+        Rastreio ativo, ou RASTREIO_NULO se o logger não estiver em nível DEBUG.
+    """
+    atual = _rastreio_atual.get()
+    if atual is not None:
+        yield atual
+        return
+    if not logger.isEnabledFor(logging.DEBUG):
+        yield RASTREIO_NULO
+        return
+    rastreio = Rastreio(nome, usuario_id, RECOMPUTE_TRACE_AMOSTRA)
+    token = _rastreio_atual.set(rastreio)
+    try:
+        yield rastreio
+    finally:
+        _rastreio_atual.reset(token)
+        rastreio.finalizar()
+
+def rastreado(nome: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Decorador para serviços de recálculo que recebem `usuario_id` (posicional ou
+    nomeado): executa o serviço dentro de `rastrear(nome, usuario_id)`. A duração de
+    cada chamada vai para a métrica investir_recalculo_duracao_segundos{servico=nome}.
+    """
+    def decorador(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def executar(*args, **kwargs):
+            usuario_id = kwargs.get("usuario_id", args[0] if args else None)
+            inicio = time.perf_counter()
+            try:
+                with rastrear(nome, usuario_id):
+                    return func(*args, **kwargs)
+            finally:
+                DURACAO_RECALCULO.observar(time.perf_counter() - inicio, nome)
+        return executar
+    return decorador
+
+def rastreio_atual():
+    """Rastreio do recálculo em andamento (RASTREIO_NULO se nenhum estiver ativo)."""
+    return _rastreio_atual.get() or RASTREIO_NULO
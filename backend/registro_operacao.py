@@ -0,0 +1,88 @@
+"""
+Registro compacto de operação para os laços de cálculo.
+
+O motor de posições e o histórico da carteira percorrem todas as operações de um
+usuário a cada recálculo. Em vez de um dicionário por operação (sqlite3.Row
+convertido em dict e copiado de novo na normalização e em cada lote FIFO), esses
+laços usam `RegistroOperacao`: apenas os campos do cálculo, em __slots__ (sem
+dicionário por instância), já normalizados (data como date, quantidade int, preço
+float, taxas sem None).
+
+As consultas do motor montam os registros diretamente no cursor, com
+`linha_para_registro` como row_factory, sem passar por sqlite3.Row nem dict.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Mapping
+
+
+def normalizar_data(valor: Any) -> date:
+    """Converte a data de uma operação (date, datetime ou texto ISO) em date."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return datetime.fromisoformat(str(valor).split("T")[0]).date()
+
+
+class RegistroOperacao:
+    """
+    Operação normalizada, com os campos de uma linha da tabela operacoes usados no cálculo.
+    O acesso por chave (op["ticker"]) é mantido para o código que recebe dicts.
+    """
+    __slots__ = ("id", "date", "ticker", "operation", "quantity", "price", "fees")
+
+    def __init__(self, id: Any, date: date, ticker: str, operation: str, quantity: int, price: float, fees: float):
+        self.id = id
+        self.date = date
+        self.ticker = ticker
+        self.operation = operation
+        self.quantity = quantity
+        self.price = price
+        self.fees = fees
+
+    @classmethod
+    def de_dict(cls, op: Mapping[str, Any]) -> "RegistroOperacao":
+        """Normaliza uma operação recebida como dict (API, importação, testes)."""
+        return cls(op.get("id"), normalizar_data(op["date"]), op["ticker"], op["operation"],
+                   int(op["quantity"]), float(op["price"]), op.get("fees") or 0.0)
+
+    def restante(self, quantidade: int) -> "RegistroOperacao":
+        """Cópia da operação com outra quantidade (lote FIFO ainda em aberto)."""
+        return RegistroOperacao(self.id, self.date, self.ticker, self.operation, quantidade, self.price, self.fees)
+
+    @property
+    def operation_type(self) -> str:
+        # Nome do campo no serviço de análise da carteira
+        return self.operation
+
+    def __getitem__(self, campo: str) -> Any:
+        try:
+            return getattr(self, campo)
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def get(self, campo: str, padrao: Any = None) -> Any:
+        return getattr(self, campo, padrao)
+
+    def como_dict(self) -> Dict[str, Any]:
+        return {campo: getattr(self, campo) for campo in self.__slots__}
+
+    def __eq__(self, outro: Any) -> bool:
+        if not isinstance(outro, RegistroOperacao):
+            return NotImplemented
+        return all(getattr(self, campo) == getattr(outro, campo) for campo in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return (f"RegistroOperacao(id={self.id!r}, date={self.date!r}, ticker={self.ticker!r}, "
+                f"operation={self.operation!r}, quantity={self.quantity!r}, price={self.price!r}, fees={self.fees!r})")
+
+
+# Colunas esperadas por linha_para_registro, na ordem do SELECT
+COLUNAS_REGISTRO = "id, date, ticker, operation, quantity, price, fees"
+
+def linha_para_registro(cursor: Any, linha: tuple) -> RegistroOperacao:
+    """row_factory que monta um RegistroOperacao de uma linha com as colunas de COLUNAS_REGISTRO."""
+    return RegistroOperacao(linha[0], normalizar_data(linha[1]), linha[2], linha[3],
+                            int(linha[4]), float(linha[5]), linha[6] or 0.0)
@@ -7,7 +7,8 @@ from app.services.portfolio_analysis_service import calculate_portfolio_history
 # from schemas import PortfolioHistoryResponseSchema, EquityPointSchema, ProfitabilityDetailsSchema # Will use schemas.<Name>
 from models import UsuarioResponse # Corrected
 from dependencies import get_current_user # Corrected import path
-from services import listar_operacoes_service # Corrected
+from database import obter_operacoes_motor_db
+from execucao import executar_servico
 
 router = APIRouter(
     prefix="/analysis",
@@ -26,38 +27,18 @@ async def get_portfolio_equity_history(
     Calculates and returns the historical equity curve and profitability of a user's portfolio.
     """
     try:
-        # Fetch operations for the current user
-        user_operations_raw = listar_operacoes_service(usuario_id=current_user.id)
-
-        # Transform operations to match the structure expected by calculate_portfolio_history
-        # Specifically, map 'operation' to 'operation_type'
-        transformed_operations: List[Dict[str, Any]] = []
-        for op_raw in user_operations_raw:
-            transformed_op = op_raw.copy() # Ensure all original fields are there
-            if 'operation' in transformed_op:
-                transformed_op['operation_type'] = transformed_op.pop('operation')
-
-            # Ensure date is string "YYYY-MM-DD" if it's not already (it should be from DB/model)
-            # The portfolio_analysis_service.Operacao model expects a string or date object for 'date'
-            # and its validator will handle it. So, direct pass-through of date object is fine.
-            if isinstance(transformed_op.get('date'), date):
-                 transformed_op['date'] = transformed_op['date'].isoformat()
-
-            # Ensure 'price' and 'fees' are present, even if service sets defaults, good practice here.
-            if 'price' not in transformed_op:
-                # This case should ideally not happen if data from DB is clean
-                raise ValueError(f"Operation missing 'price': {op_raw.get('id')}")
-            if 'fees' not in transformed_op:
-                transformed_op['fees'] = 0.0 # Default if missing, though model has default
-
-            transformed_operations.append(transformed_op)
+        # Operations are loaded as compact records (no dict per row nor Pydantic model per
+        # operation); calculate_portfolio_history uses them as they are
+        user_operations = await executar_servico("analysis.equity_history", obter_operacoes_motor_db, current_user.id)
 
         if start_date > end_date:
             raise ValueError("Start date cannot be after end date.")
 
         # Call the service function
-        history_data = calculate_portfolio_history(
-            operations_data=transformed_operations,
+        # Busca preços externos e calcula a curva fora do event loop
+        history_data = await executar_servico(
+            "analysis.equity_history", calculate_portfolio_history,
+            operations_data=user_operations,
             start_date_str=start_date.isoformat(),
             end_date_str=end_date.isoformat(),
             period_frequency=frequency
@@ -96,7 +77,8 @@ async def get_bens_e_direitos_acoes_endpoint(
         # Correctly import and call the service function
         from app.services.portfolio_analysis_service import get_bens_e_direitos_acoes as service_get_bens_e_direitos_acoes # Corrected import
 
-        bens_e_direitos_data = service_get_bens_e_direitos_acoes(
+        bens_e_direitos_data = await executar_servico(
+            "analysis.bens_e_direitos", service_get_bens_e_direitos_acoes,
             user_id=current_user.id,
             target_date_str=target_date_str
         )
@@ -131,7 +113,8 @@ async def get_rendimentos_isentos_endpoint(
         # Import and call the service function
         from app.services.portfolio_analysis_service import get_rendimentos_isentos_por_ano
 
-        rendimentos_data = get_rendimentos_isentos_por_ano(
+        rendimentos_data = await executar_servico(
+            "analysis.rendimentos_isentos", get_rendimentos_isentos_por_ano,
             user_id=current_user.id,
             year=year
         )
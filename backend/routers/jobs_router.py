@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from typing import List
+
+from models import UsuarioResponse, JobRecalculo
+from dependencies import get_current_user
+from database import obter_job_recalculo, listar_jobs_recalculo_usuario
+from execucao import executar_servico
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"],
+)
+
+@router.get("", response_model=List[JobRecalculo])
+async def listar_jobs_recalculo(
+    limite: int = Query(20, ge=1, le=100),
+    current_user: UsuarioResponse = Depends(get_current_user)
+):
+    """
+    Lista os jobs de recálculo mais recentes do usuário (status e progresso).
+    """
+    return await executar_servico("jobs.listar", listar_jobs_recalculo_usuario, current_user.id, limite)
+
+@router.get("/{job_id}", response_model=JobRecalculo)
+async def obter_status_job_recalculo(
+    job_id: int = Path(..., description="ID do job de recálculo"),
+    current_user: UsuarioResponse = Depends(get_current_user)
+):
+    """
+    Retorna o status e o progresso de um job de recálculo do usuário.
+    """
+    job = await executar_servico("jobs.obter", obter_job_recalculo, job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} não encontrado.")
+    return job
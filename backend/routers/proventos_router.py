@@ -7,6 +7,7 @@ from app.services.proventos_service import get_sum_earnings_last_12_months, Mont
 # User model and authentication dependency
 from models import UsuarioResponse
 from dependencies import get_current_user
+from execucao import executar_servico
 
 # Regarding database session:
 # The service get_sum_earnings_last_12_months has `db: Session` in its signature.
@@ -34,7 +35,7 @@ async def get_last_12_months_earnings_summary(
     """
     try:
         # Pass db=None as it's not used by the service due to database.py's self-managed connections
-        earnings_summary = get_sum_earnings_last_12_months(db=None, user_id=current_user.id)
+        earnings_summary = await executar_servico("proventos.ultimos_12_meses", get_sum_earnings_last_12_months, db=None, user_id=current_user.id)
         return earnings_summary
     except Exception as e:
         # Log the exception e here for debugging purposes on the server
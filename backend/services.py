@@ -2,6 +2,7 @@ from typing import List, Dict, Any, Optional # Tuple replaced with tuple, Option
 from datetime import date, datetime, timedelta # date was already implicitly imported via from datetime import date, datetime
 from decimal import Decimal # Kept for specific calculations in recalcular_resultados
 import calendar
+import itertools
 from collections import defaultdict
 from fastapi import HTTPException # Added HTTPException
 import logging
@@ -19,24 +20,39 @@ import sqlite3 # For sqlite3.IntegrityError
 
 from database import (
     inserir_operacao,
+    inserir_operacoes_em_lote,
+    obter_tickers_existentes,
     inserir_corretora_se_nao_existir,  # Importada para uso na importação
     obter_todas_operacoes, # Comment removed
     atualizar_carteira,
+    salvar_edicao_manual_carteira,
     obter_carteira_atual,
-    salvar_resultado_mensal,
+    salvar_resultados_mensais_em_lote,
+    salvar_carteira_em_lote,
     obter_resultados_mensais,
     obter_operacao_por_id, # Added
     # Import new/updated database functions
-    obter_operacoes_para_calculo_fechadas,
-    salvar_operacao_fechada,
-    limpar_operacoes_fechadas_usuario,
+    salvar_operacoes_fechadas_em_lote,
+    substituir_operacoes_fechadas_tickers_db,
+    atualizar_status_ir_operacoes_fechadas_db,
+    obter_operacoes_fechadas_salvas,
+    obter_versoes_operacoes_db,
+    obter_tickers_operacoes_fechadas_desatualizadas_db,
+    incrementar_versoes_operacoes_ticker_db,
     remover_operacao,  # Added import for remover_operacao
     remover_todas_operacoes_usuario, # Added import for new function
     atualizar_status_darf_db, # Added for DARF status update
     limpar_carteira_usuario_db, # Added for clearing portfolio before recalc
     limpar_resultados_mensais_usuario_db, # Added for clearing monthly results before recalc
+    obter_ultimo_resultado_mensal_anterior_a,
+    obter_checkpoints_resultados_anteriores_a,
+    limpar_checkpoints_resultados_usuario_db,
+    limpar_checkpoints_resultados_por_ticker_db,
+    obter_operacoes_motor_db,
+    existe_operacao_anterior_a,
     remover_item_carteira_db, # Added for deleting single portfolio item
     obter_operacoes_por_ticker_db, # Added for fetching operations by ticker
+    obter_item_carteira_db,
     obter_todas_acoes, # Renamed from obter_todos_stocks
     # Provento related database functions
     inserir_provento,
@@ -56,6 +72,10 @@ from database import (
     # For new service:
     limpar_usuario_proventos_recebidos_db,
     inserir_usuario_provento_recebido_db,
+    obter_posicoes_operacoes_usuario_db,
+    substituir_usuario_proventos_recebidos_db,
+    inserir_usuario_proventos_recebidos_em_lote_db,
+    obter_operacoes_ticker_usuarios_ate_data_db,
     obter_tickers_operados_por_usuario, # Added for recalcular_proventos_recebidos_rapido
     obter_proventos_por_ticker,      # Added for recalcular_proventos_recebidos_rapido
     obter_primeira_data_operacao_usuario, # Added for recalcular_proventos_recebidos_rapido
@@ -66,6 +86,20 @@ from database import (
     obter_resumo_por_acao_proventos_recebidos_db
 )
 
+from fila_recalculo import enfileirar_recalculo, processar_fila_recalculo
+from indice_eventos import obter_indice_eventos, invalidar_indice_eventos
+from motor_proventos import calcular_direitos_proventos_ticker
+from rastreamento import rastreado, rastreio_atual
+
+from motor_posicoes import (
+    executar_motor,
+    determinar_status_ir,
+    _calculate_darf_due_date,
+    _eh_day_trade,
+    _calcular_resultado_dia,
+    _criar_operacao_fechada_detalhada,
+)
+
 # --- Função Auxiliar para Transformação de Proventos do DB ---
 def _transformar_provento_db_para_modelo(p_db: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     if p_db is None:
@@ -117,113 +151,73 @@ def _transformar_provento_db_para_modelo(p_db: Dict[str, Any]) -> Optional[Dict[
     return dados_transformados
 
 
-def _calculate_darf_due_date(year_month_str: str) -> date:
-    """
-    Calcula a data de vencimento do DARF para um dado mês/ano de competência.
-    O vencimento é o último dia útil do mês seguinte ao mês de competência.
+def gravar_lote_operacoes(
+    operacoes: List[OperacaoCreate],
+    usuario_id: int,
+    cache_tickers: Optional[Dict[str, bool]] = None,
+    cache_corretoras: Optional[Dict[str, int]] = None,
+) -> int:
     """
-    ano, mes_num = map(int, year_month_str.split('-'))
-    
-    # Calcula o próximo mês e ano
-    prox_mes_ano = ano
-    prox_mes_num = mes_num + 1
-    if prox_mes_num > 12:
-        prox_mes_num = 1
-        prox_mes_ano += 1
-        
-    # Último dia do próximo mês
-    ultimo_dia_prox_mes = calendar.monthrange(prox_mes_ano, prox_mes_num)[1]
-    vencimento = date(prox_mes_ano, prox_mes_num, ultimo_dia_prox_mes)
-    
-    # Ajusta para o último dia útil (retrocede se for sábado ou domingo)
-    while vencimento.weekday() >= 5:  # 5 = Sábado, 6 = Domingo
-        vencimento -= timedelta(days=1)
-    return vencimento
+    Grava um lote de operações em uma única transação, sem recalcular carteira e resultados.
+    Os tickers são verificados na tabela `acoes` com uma consulta por lote; os caches
+    (ticker -> existe, nome da corretora -> id) podem ser compartilhados entre lotes
+    da mesma importação para evitar consultas repetidas.
 
-def processar_operacoes(operacoes: List[OperacaoCreate], usuario_id: int) -> None:
-    """
-    Processa uma lista de operações, salvando-as no banco de dados
-    e atualizando a carteira atual para um usuário específico.
-    
     Args:
-        operacoes: Lista de operações a serem processadas.
+        operacoes: Lote de operações a gravar (o campo date é normalizado para ISO).
         usuario_id: ID do usuário.
+        cache_tickers: Cache opcional de existência de tickers.
+        cache_corretoras: Cache opcional de IDs de corretoras por nome.
+
+    Returns:
+        int: Quantidade de operações gravadas.
+
+    Raises:
+        ValueError: Se algum ticker do lote não existir na tabela `acoes`.
     """
+    cache_tickers = {} if cache_tickers is None else cache_tickers
+    cache_corretoras = {} if cache_corretoras is None else cache_corretoras
+
+    tickers_desconhecidos = [t for t in dict.fromkeys(op.ticker for op in operacoes) if t not in cache_tickers]
+    if tickers_desconhecidos:
+        existentes = obter_tickers_existentes(tickers_desconhecidos)
+        for ticker in tickers_desconhecidos:
+            cache_tickers[ticker] = ticker in existentes
+
+    registros = []
     for op in operacoes:
+        if not cache_tickers[op.ticker]:
+            raise ValueError(f"Ticker {op.ticker} não encontrado na tabela de ações (acoes).")
         # Conversão automática do campo date
         if hasattr(op, 'date'):
             op.date = parse_date_to_iso(op.date)
         # Se vier nome de corretora e não vier id, insere se não existir
-        corretora_nome = getattr(op, 'corretora_nome', None) or (op.dict().get('corretora_nome') if hasattr(op, 'dict') else None)
+        corretora_nome = getattr(op, 'corretora_nome', None)
         if not getattr(op, 'corretora_id', None) and corretora_nome:
-            corretora_id = inserir_corretora_se_nao_existir(corretora_nome)
-            op.corretora_id = corretora_id
-        inserir_operacao(op.model_dump(), usuario_id=usuario_id)
-    recalcular_carteira(usuario_id=usuario_id)
-    recalcular_resultados(usuario_id=usuario_id)
+            if corretora_nome not in cache_corretoras:
+                cache_corretoras[corretora_nome] = inserir_corretora_se_nao_existir(corretora_nome)
+            op.corretora_id = cache_corretoras[corretora_nome]
+        registros.append(op.model_dump())
 
-def _eh_day_trade(operacoes_dia: List[Dict[str, Any]], ticker: str) -> bool:
-    """
-    Verifica se houve day trade para um ticker específico em um dia.
-    
-    Args:
-        operacoes_dia: Lista de operações do dia.
-        ticker: Ticker a ser verificado.
-        
-    Returns:
-        bool: True se houve day trade, False caso contrário.
-    """
-    compras = sum(op["quantity"] for op in operacoes_dia 
-                 if op["ticker"] == ticker and op["operation"] == "buy")
-    vendas = sum(op["quantity"] for op in operacoes_dia 
-                if op["ticker"] == ticker and op["operation"] == "sell")
-    
-    # Se houve compra e venda do mesmo ticker no mesmo dia, é day trade
-    return compras > 0 and vendas > 0
+    return inserir_operacoes_em_lote(registros, usuario_id=usuario_id)
 
-def _calcular_resultado_dia(operacoes_dia: List[Dict[str, Any]], usuario_id: int) -> tuple[Dict[str, float], Dict[str, float]]: # Changed Tuple to tuple
+def processar_operacoes(operacoes: List[OperacaoCreate], usuario_id: int) -> None:
     """
-    Calcula o resultado de swing trade e day trade para um dia para um usuário.
+    Processa uma lista de operações, salvando-as no banco de dados
+    e atualizando a carteira atual para um usuário específico.
     
     Args:
-        operacoes_dia: Lista de operações do dia.
+        operacoes: Lista de operações a serem processadas.
         usuario_id: ID do usuário.
-        
-    Returns:
-        tuple[Optional[Dict[str, float]], Dict[str, float]]: Resultados de swing trade (None) e day trade.
     """
-    import logging # Se já não estiver importado globalmente no módulo
+    if not operacoes:
+        return
+    gravar_lote_operacoes(operacoes, usuario_id=usuario_id)
 
-    resultado_day = {
-        "vendas_total": 0.0, # Total de vendas (valor - taxas)
-        "custo_total": 0.0,  # Total de compras (valor + taxas)
-        "ganho_liquido": 0.0,
-        "irrf": 0.0
-    }
-    
-    # Identifica os tickers com day trade DENTRO DAS OPERAÇÕES FORNECIDAS (operacoes_dia)
-    # Esta parte é crucial: _eh_day_trade deve ser chamada com as operações do dia para aquele ticker.
-    tickers_day_trade_neste_conjunto = set()
-    ops_por_ticker_no_dia = defaultdict(list)
-    for op_dt_check in operacoes_dia: # Renomeado para evitar conflito de nome
-        ops_por_ticker_no_dia[op_dt_check["ticker"]].append(op_dt_check)
-
-    for ticker_dt, ops_do_ticker_neste_conjunto in ops_por_ticker_no_dia.items(): # Renomeado para evitar conflito
-        if _eh_day_trade(ops_do_ticker_neste_conjunto, ticker_dt): # Passa a lista filtrada por ticker
-            tickers_day_trade_neste_conjunto.add(ticker_dt)
-
-    for op in operacoes_dia: # Processa apenas as operações que efetivamente são day trade
-        if op["ticker"] in tickers_day_trade_neste_conjunto:
-            valor = op["quantity"] * op["price"]
-            fees = op.get("fees", 0.0)
-            if op["operation"] == "buy":
-                resultado_day["custo_total"] += valor + fees
-            else:  # sell
-                resultado_day["vendas_total"] += valor - fees
-                resultado_day["irrf"] += (op["quantity"] * op["price"]) * 0.01 # IRRF is on gross sale value
-    
-    resultado_day["ganho_liquido"] = resultado_day["vendas_total"] - resultado_day["custo_total"]
-    return None, resultado_day # Retorna None para resultado_swing
+    # Recalcula apenas os tickers importados e os meses a partir da operação mais antiga
+    datas_operacoes = [datetime.strptime(str(op.date), "%Y-%m-%d").date() for op in operacoes]
+    recalcular_carteira(usuario_id=usuario_id, tickers=sorted({op.ticker for op in operacoes}))
+    recalcular_resultados(usuario_id=usuario_id, a_partir_de=min(datas_operacoes))
 
 def calcular_resultados_mensais(usuario_id: int) -> List[Dict[str, Any]]:
     """
@@ -275,7 +269,7 @@ def gerar_darfs(usuario_id: int) -> List[Dict[str, Any]]:
 
 # Novas funções para as funcionalidades adicionais
 
-def inserir_operacao_manual(operacao: OperacaoCreate, usuario_id: int) -> int:
+def inserir_operacao_manual(operacao: OperacaoCreate, usuario_id: int, em_segundo_plano: bool = False) -> int:
     """
     Insere uma operação manualmente para um usuário e recalcula a carteira e os resultados.
     Retorna o ID da operação inserida.
@@ -283,6 +277,7 @@ def inserir_operacao_manual(operacao: OperacaoCreate, usuario_id: int) -> int:
     Args:
         operacao: Dados da operação a ser inserida.
         usuario_id: ID do usuário.
+        em_segundo_plano: Se True, o recálculo é enfileirado em vez de executado na chamada.
         
     Returns:
         int: ID da operação inserida.
@@ -292,10 +287,14 @@ def inserir_operacao_manual(operacao: OperacaoCreate, usuario_id: int) -> int:
         new_operacao_id = inserir_operacao(operacao.model_dump(), usuario_id=usuario_id)
     except ValueError: # Catching the specific ValueError from database.inserir_operacao
         raise # Re-raise it to be handled by the router (e.g., converted to HTTPException)
+
+    if em_segundo_plano:
+        enfileirar_recalculo(usuario_id, a_partir_de=operacao.date, tickers=[operacao.ticker])
+        return new_operacao_id
     
-    # Recalcula a carteira e os resultados
-    recalcular_carteira(usuario_id=usuario_id)
-    recalcular_resultados(usuario_id=usuario_id)
+    # Recalcula a posição do ticker e os resultados a partir do mês da operação
+    recalcular_carteira(usuario_id=usuario_id, tickers=[operacao.ticker])
+    recalcular_resultados(usuario_id=usuario_id, a_partir_de=operacao.date)
 
     try:
         logging.info(f"Iniciando recálculo rápido de proventos para usuário {usuario_id} após inserção manual de operação ID {new_operacao_id}.")
@@ -323,13 +322,17 @@ def obter_operacao_service(operacao_id: int, usuario_id: int) -> Optional[Operac
         return Operacao(**operacao_data)
     return None
 
-def atualizar_item_carteira(dados: AtualizacaoCarteira, usuario_id: int) -> None:
+def atualizar_item_carteira(dados: AtualizacaoCarteira, usuario_id: int, em_segundo_plano: bool = False) -> None:
     """
     Atualiza um item da carteira manualmente para um usuário.
     
     Args:
         dados: Novos dados do item da carteira (ticker, quantidade e preço médio).
         usuario_id: ID do usuário.
+        em_segundo_plano: Se True, o recálculo dos resultados é enfileirado em vez de executado na chamada.
+
+    Raises:
+        ErroRecalculoEmAndamento: Em segundo plano, se um job do usuário estiver reconstruindo a carteira.
     """
     custo_total_calculado: float
     if dados.quantidade < 0:
@@ -340,6 +343,13 @@ def atualizar_item_carteira(dados: AtualizacaoCarteira, usuario_id: int) -> None
         # Para posições compradas ou zeradas (quantidade >= 0)
         custo_total_calculado = dados.quantidade * dados.preco_medio
 
+    if em_segundo_plano:
+        # A edição e o job são gravados juntos; o job não reconstrói a posição editada
+        salvar_edicao_manual_carteira(dados.ticker, dados.quantidade, dados.preco_medio,
+                                      custo_total_calculado, usuario_id=usuario_id)
+        processar_fila_recalculo(usuario_id)
+        return
+
     # Atualiza o item na carteira
     atualizar_carteira(dados.ticker, dados.quantidade, dados.preco_medio, custo_total_calculado, usuario_id=usuario_id)
     
@@ -350,703 +360,289 @@ def atualizar_item_carteira(dados: AtualizacaoCarteira, usuario_id: int) -> None
     # potentially correct historical discrepancies reflected in tax calculations.
     # For now, we keep them to ensure tax data is updated based on operations,
     # but acknowledge the portfolio itself is now manually set for this item.
-    recalcular_resultados(usuario_id=usuario_id) 
-    calcular_operacoes_fechadas(usuario_id=usuario_id) 
+    saida_motor = executar_motor_usuario(usuario_id)
+    recalcular_resultados(usuario_id=usuario_id, saida_motor=saida_motor)
+    calcular_operacoes_fechadas(usuario_id=usuario_id, saida_motor=saida_motor)
 
 
-def calcular_operacoes_fechadas(usuario_id: int) -> List[Dict[str, Any]]:
+@rastreado("calcular_operacoes_fechadas")
+def calcular_operacoes_fechadas(usuario_id: int, saida_motor: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Calcula as operações fechadas para um usuário.
-    Usa o método FIFO (First In, First Out) para rastrear as operações.
-    Os resultados são salvos no banco de dados.
-    
+    Usa o método FIFO (First In, First Out) do motor de posições para casar aberturas e
+    fechamentos; o status de IR vem dos resultados mensais calculados na mesma passada.
+    Os resultados são salvos no banco de dados, com a versão das operações de cada ticker.
+
     Args:
         usuario_id: ID do usuário.
-        
+        saida_motor: Saída já calculada do motor de posições (opcional).
+
     Returns:
         List[Dict[str, Any]]: Lista de operações fechadas.
     """
-    # Limpa operações fechadas antigas do usuário
-    limpar_operacoes_fechadas_usuario(usuario_id=usuario_id)
+    # A versão é lida antes das operações: uma alteração concorrente deixa o registro
+    # desatualizado (e recalculado na leitura), nunca marcado como atual
+    versoes = obter_versoes_operacoes_db(usuario_id)
+    if saida_motor is None:
+        saida_motor = executar_motor_usuario(usuario_id)
 
-    # Fetch monthly results to determine tax exemption status for swing trades
-    resultados_mensais_list = obter_resultados_mensais(usuario_id=usuario_id)
-    resultados_mensais_map = {rm['mes']: rm for rm in resultados_mensais_list}
+    # Substitui as operações fechadas antigas do usuário em uma única transação
+    operacoes_fechadas = saida_motor["operacoes_fechadas"]
+    with rastreio_atual().etapa("persistir"):
+        salvar_operacoes_fechadas_em_lote(usuario_id, operacoes_fechadas, versoes)
 
-    # Obtém todas as operações do usuário
-    operacoes = obter_operacoes_para_calculo_fechadas(usuario_id=usuario_id)
-    
-    # Dicionário para rastrear as operações por ticker
-    operacoes_por_ticker = defaultdict(list)
-    for op in operacoes:
-        # Garante que 'fees' exista
-        op_data = op.copy()
-        if 'fees' not in op_data:
-            op_data['fees'] = 0.0
-        operacoes_por_ticker[op_data["ticker"]].append(op_data)
-    
-    # Lista para armazenar as operações fechadas que serão salvas
-    operacoes_fechadas_para_salvar = []
-    
-    # Processa cada ticker
-    for ticker, ops_ticker in operacoes_por_ticker.items():
-        # Ordena as operações por data e depois por ID (para manter a ordem de inserção no mesmo dia)
-        ops_ticker.sort(key=lambda x: (x["date"], x["id"]))
-        
-        # Filas para rastrear compras e vendas pendentes (FIFO)
-        compras_pendentes = [] # Lista de Dicts de operações de compra
-        vendas_pendentes = []  # Lista de Dicts de operações de venda (para venda a descoberto)
-        
-        for op_atual in ops_ticker:
-            quantidade_atual = op_atual["quantity"]
-            
-            if op_atual["operation"] == "buy":
-                # Tenta fechar com vendas pendentes (venda a descoberto)
-                while quantidade_atual > 0 and vendas_pendentes:
-                    venda_pendente = vendas_pendentes[0]
-                    qtd_fechar = min(quantidade_atual, venda_pendente["quantity"])
-                    
-                    op_fechada = _criar_operacao_fechada_detalhada(
-                        op_abertura=venda_pendente, 
-                        op_fechamento=op_atual, 
-                        quantidade_fechada=qtd_fechar,
-                        tipo_fechamento="venda_descoberta_fechada_com_compra"
-                    )
-                    operacoes_fechadas_para_salvar.append(op_fechada)
-                    
-                    venda_pendente["quantity"] -= qtd_fechar
-                    quantidade_atual -= qtd_fechar
-                    
-                    if venda_pendente["quantity"] == 0:
-                        vendas_pendentes.pop(0)
-                
-                if quantidade_atual > 0:
-                    op_atual_restante = op_atual.copy()
-                    op_atual_restante["quantity"] = quantidade_atual
-                    compras_pendentes.append(op_atual_restante)
-
-            elif op_atual["operation"] == "sell":
-                # Tenta fechar com compras pendentes
-                while quantidade_atual > 0 and compras_pendentes:
-                    compra_pendente = compras_pendentes[0]
-                    qtd_fechar = min(quantidade_atual, compra_pendente["quantity"])
-
-                    op_fechada = _criar_operacao_fechada_detalhada(
-                        op_abertura=compra_pendente, 
-                        op_fechamento=op_atual, 
-                        quantidade_fechada=qtd_fechar,
-                        tipo_fechamento="compra_fechada_com_venda"
-                    )
-                    operacoes_fechadas_para_salvar.append(op_fechada)
-                    
-                    compra_pendente["quantity"] -= qtd_fechar
-                    quantidade_atual -= qtd_fechar
-                    
-                    if compra_pendente["quantity"] == 0:
-                        compras_pendentes.pop(0)
-                
-                if quantidade_atual > 0: # Venda a descoberto
-                    op_atual_restante = op_atual.copy()
-                    op_atual_restante["quantity"] = quantidade_atual
-                    vendas_pendentes.append(op_atual_restante)
-
-    # Salva todas as operações fechadas no banco E adiciona status_ir
-    for op_f in operacoes_fechadas_para_salvar:
-        # Determine status_ir
-        data_fechamento_obj = op_f["data_fechamento"]
-        # Ensure data_fechamento_obj is a date object if it's not already (it should be from _criar_operacao_fechada_detalhada)
-        if isinstance(data_fechamento_obj, str): 
-            data_fechamento_obj = datetime.fromisoformat(data_fechamento_obj.split("T")[0]).date()
-        
-        mes_fechamento_str = data_fechamento_obj.strftime("%Y-%m")
-        resultado_do_mes_dict = resultados_mensais_map.get(mes_fechamento_str)
-
-        if op_f["resultado"] <= 0:
-            op_f["status_ir"] = "Prejuízo Acumulado"
-        else: # op_f["resultado"] > 0
-            if op_f["day_trade"]:
-                ir_pagar_mensal_day_trade = 0.0
-                if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("ir_pagar_day"), (int, float)):
-                    ir_pagar_mensal_day_trade = resultado_do_mes_dict["ir_pagar_day"]
-                
-                if ir_pagar_mensal_day_trade > 0:
-                    op_f["status_ir"] = "Tributável Day Trade"
-                else: 
-                    op_f["status_ir"] = "Lucro Compensado"
-                    
-            else: # Swing Trade
-                is_exempt_swing_mensal = False 
-                if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("isento_swing"), bool):
-                    is_exempt_swing_mensal = resultado_do_mes_dict["isento_swing"]
-
-                if is_exempt_swing_mensal:
-                    op_f["status_ir"] = "Isento"
-                else: 
-                    ir_pagar_mensal_swing_trade = 0.0
-                    if resultado_do_mes_dict and isinstance(resultado_do_mes_dict.get("ir_pagar_swing"), (int, float)):
-                        ir_pagar_mensal_swing_trade = resultado_do_mes_dict["ir_pagar_swing"]
-                    
-                    if ir_pagar_mensal_swing_trade > 0:
-                        op_f["status_ir"] = "Tributável Swing"
-                    else: 
-                        op_f["status_ir"] = "Lucro Compensado"
-        
-        # Salva a operação fechada (que agora inclui status_ir, though salvar_operacao_fechada might not save it yet)
-        salvar_operacao_fechada(op_f, usuario_id=usuario_id)
-        
-    return operacoes_fechadas_para_salvar
+    return operacoes_fechadas
 
 
-def _criar_operacao_fechada_detalhada(op_abertura: Dict, op_fechamento: Dict, quantidade_fechada: int, tipo_fechamento: str) -> Dict:
+def obter_operacoes_fechadas_service(usuario_id: int, ticker: Optional[str] = None) -> List[Dict[str, Any]]:
     """
-    Cria um dicionário detalhado para uma operação fechada, alinhado com OperacaoFechada e OperacaoDetalhe.
+    Retorna as operações fechadas salvas de um usuário.
+
+    As operações fechadas são mantidas a cada alteração de operações (recalcular_carteira
+    por ticker e recalcular_resultados). Tickers cujas operações mudaram sem que o
+    registro fosse atualizado (ex.: recálculo ainda na fila) são recalculados antes da leitura.
+
+    Args:
+        usuario_id: ID do usuário.
+        ticker: Apenas as operações fechadas deste ticker (opcional); somente ele é verificado.
+
+    Returns:
+        List[Dict[str, Any]]: Operações fechadas, por data de fechamento.
     """
-    # Preços unitários
-    preco_unitario_abertura = op_abertura["price"]
-    preco_unitario_fechamento = op_fechamento["price"]
-    
-    # Taxas proporcionais
-    taxas_proporcionais_abertura = (op_abertura["fees"] / op_abertura["quantity"]) * quantidade_fechada if op_abertura["quantity"] > 0 else 0
-    taxas_proporcionais_fechamento = (op_fechamento["fees"] / op_fechamento["quantity"]) * quantidade_fechada if op_fechamento["quantity"] > 0 else 0
-
-    # Valores totais para cálculo do resultado
-    valor_total_abertura_calculo = preco_unitario_abertura * quantidade_fechada
-    valor_total_fechamento_calculo = preco_unitario_fechamento * quantidade_fechada
-
-    # Determina o tipo e calcula o resultado
-    if tipo_fechamento == "compra_fechada_com_venda": # Compra (abertura) e Venda (fechamento)
-        tipo_operacao_fechada = "compra-venda"
-        resultado_bruto = valor_total_fechamento_calculo - valor_total_abertura_calculo
-        resultado_liquido = resultado_bruto - taxas_proporcionais_abertura - taxas_proporcionais_fechamento
-        data_ab = op_abertura["date"]
-        data_fec = op_fechamento["date"]
-    elif tipo_fechamento == "venda_descoberta_fechada_com_compra": # Venda (abertura) e Compra (fechamento)
-        tipo_operacao_fechada = "venda-compra"
-        resultado_bruto = valor_total_abertura_calculo - valor_total_fechamento_calculo # Venda é abertura (valor maior)
-        resultado_liquido = resultado_bruto - taxas_proporcionais_abertura - taxas_proporcionais_fechamento
-        data_ab = op_abertura["date"] # Data da venda a descoberto
-        data_fec = op_fechamento["date"] # Data da recompra
-    else:
-        raise ValueError(f"Tipo de fechamento desconhecido: {tipo_fechamento}")
-
-    # Cálculo do percentual de lucro/prejuízo
-    custo_para_calculo_percentual = 0.0
-    if op_abertura["operation"] == "buy": # Abertura foi uma compra
-        custo_para_calculo_percentual = (op_abertura["price"] * quantidade_fechada) + taxas_proporcionais_abertura
-    elif op_abertura["operation"] == "sell": # Abertura foi uma venda (short sale)
-        # Base é o valor recebido na venda, líquido de taxas da venda.
-        # O resultado_liquido já considera o lucro/prejuízo.
-        # A base para o percentual deve ser o "investimento" ou "risco" inicial.
-        # Para short sale, o "investimento" é o valor que se espera recomprar, mas o ganho é sobre o valor vendido.
-        # Se vendi por 100 (líquido de taxas) e recomprei por 80, lucro de 20. Percentual é 20/100 = 20%.
-        # Se vendi por 100 e recomprei por 120, prejuízo de 20. Percentual é -20/100 = -20%.
-        custo_para_calculo_percentual = (op_abertura["price"] * quantidade_fechada) - taxas_proporcionais_abertura
-        
-    percentual_lucro = 0.0
-    base_para_percentual_abs = abs(custo_para_calculo_percentual)
-    if base_para_percentual_abs != 0:
-        percentual_lucro = (resultado_liquido / base_para_percentual_abs) * 100.0
-    else:
-        if resultado_liquido > 0:
-            percentual_lucro = 100.0 
-        elif resultado_liquido < 0:
-            percentual_lucro = -100.0
-        # Se resultado_liquido for 0 e base também, percentual_lucro permanece 0.0
-
-    operacoes_relacionadas = [
-        {
-            "id": op_abertura.get("id"),
-            "date": op_abertura["date"],
-            "operation": op_abertura["operation"],
-            "quantity": quantidade_fechada,
-            "price": preco_unitario_abertura,
-            "fees": taxas_proporcionais_abertura,
-            "valor_total": preco_unitario_abertura * quantidade_fechada
-        },
-        {
-            "id": op_fechamento.get("id"),
-            "date": op_fechamento["date"],
-            "operation": op_fechamento["operation"],
-            "quantity": quantidade_fechada,
-            "price": preco_unitario_fechamento,
-            "fees": taxas_proporcionais_fechamento,
-            "valor_total": preco_unitario_fechamento * quantidade_fechada
-        }
-    ]
+    desatualizados = obter_tickers_operacoes_fechadas_desatualizadas_db(usuario_id, ticker=ticker)
+    if desatualizados:
+        versoes, saidas = _executar_motor_tickers(usuario_id, desatualizados)
+        _salvar_operacoes_fechadas_tickers(usuario_id, versoes, saidas, {r["mes"]: r for r in obter_resultados_mensais(usuario_id)})
+    return obter_operacoes_fechadas_salvas(usuario_id, ticker=ticker)
 
-    return {
-        "ticker": op_abertura["ticker"],
-        "data_abertura": data_ab,
-        "data_fechamento": data_fec,
-        "tipo": tipo_operacao_fechada,
-        "quantidade": quantidade_fechada,
-        "valor_compra": preco_unitario_abertura,
-        "valor_venda": preco_unitario_fechamento,
-        "taxas_total": taxas_proporcionais_abertura + taxas_proporcionais_fechamento,
-        "resultado": resultado_liquido,
-        "percentual_lucro": percentual_lucro, # Added this key
-        "operacoes_relacionadas": operacoes_relacionadas,
-        "day_trade": op_abertura["date"] == op_fechamento["date"]
-    }
 
+def _executar_motor_tickers(usuario_id: int, tickers: List[str]) -> tuple:
+    """
+    Executa o motor de posições separadamente para cada ticker (as posições e os lotes
+    FIFO de um ticker não dependem dos demais).
 
-def recalcular_carteira(usuario_id: int) -> None:
+    Returns:
+        tuple: (versão das operações por ticker, saída do motor por ticker ou None se o
+        ticker não tiver mais operações).
     """
-    Recalcula a carteira atual de um usuário com base em todas as suas operações.
-    A carteira existente do usuário é limpa antes do recálculo.
+    rastreio = rastreio_atual()
+    versoes = obter_versoes_operacoes_db(usuario_id, tickers)
+    saidas: Dict[str, Optional[Dict[str, Any]]] = {}
+    for ticker in tickers:
+        with rastreio.etapa("carregar"):
+            operacoes_ticker = obter_operacoes_motor_db(usuario_id, ticker=ticker)
+            eventos_ticker = _carregar_eventos_por_ticker([ticker]) if operacoes_ticker else None
+        with rastreio.etapa("agregar"):
+            saidas[ticker] = executar_motor(operacoes_ticker, eventos_ticker, usuario_id=usuario_id) if operacoes_ticker else None
+    return versoes, saidas
+
+
+def _salvar_operacoes_fechadas_tickers(usuario_id: int, versoes: Dict[str, int],
+                                       saidas: Dict[str, Optional[Dict[str, Any]]],
+                                       resultados_map: Dict[str, Dict[str, Any]]) -> None:
     """
-    import logging
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    # Limpa a carteira atual do usuário no banco de dados antes de recalcular
-    limpar_carteira_usuario_db(usuario_id=usuario_id)
+    Substitui as operações fechadas dos tickers processados por _executar_motor_tickers.
+    O motor por ticker não conhece os resultados mensais dos demais tickers: o status de IR
+    é recalculado com `resultados_map` (resultados mensais do usuário por mês).
+    """
+    operacoes_fechadas = []
+    for saida in saidas.values():
+        if saida is not None:
+            operacoes_fechadas.extend(saida["operacoes_fechadas"])
+    for op_fechada in operacoes_fechadas:
+        op_fechada["status_ir"] = determinar_status_ir(op_fechada, resultados_map)
+    substituir_operacoes_fechadas_tickers_db(usuario_id, list(saidas), operacoes_fechadas, versoes)
 
-    # Obtém todas as operações do usuário
-    operacoes_originais = obter_todas_operacoes(usuario_id=usuario_id)
-
-    # --- START NEW LOGIC FOR CORPORATE EVENTS ---
-    adjusted_operacoes = []
-    if operacoes_originais: # Only proceed if there are operations
-        today_date = date.today()
-        unique_tickers = list(set(op_from_db['ticker'] for op_from_db in operacoes_originais))
-        events_by_ticker: Dict[str, List[EventoCorporativoInfo]] = {}
-
-        for ticker_symbol in unique_tickers:
-            id_acao = obter_id_acao_por_ticker(ticker_symbol)
-            if id_acao:
-                raw_events_data = obter_eventos_corporativos_por_id_acao_e_data_ex_anterior_a(id_acao, today_date)
-                # Event data from DB should have date objects due to [date] alias and converters
-                events_by_ticker[ticker_symbol] = [EventoCorporativoInfo.model_validate(event_data) for event_data in raw_events_data]
-
-        for op_from_db in operacoes_originais:
-            current_op_date = op_from_db['date']
-            # Ensure current_op_date is a date object (should be from obter_todas_operacoes)
-            if not isinstance(current_op_date, date):
-                try: # Defensive parsing if it's an ISO string
-                    current_op_date = datetime.fromisoformat(str(current_op_date).split("T")[0]).date()
-                except ValueError: # If parsing fails, log and skip adjustment for this op or handle error
-                    logging.error(f"Invalid date format for operation ID {op_from_db.get('id')}: {op_from_db['date']}. Skipping event adjustment for this op.")
-                    adjusted_operacoes.append(op_from_db.copy()) # Add original op and continue
-                    continue
-
-            adj_op_data = op_from_db.copy()
-            adj_op_data['date'] = current_op_date
-
-            adj_op_data['quantity'] = int(adj_op_data['quantity'])
-            adj_op_data['price'] = float(adj_op_data['price'])
-
-            ticker_events = events_by_ticker.get(adj_op_data['ticker'], [])
-
-            for event_info in ticker_events:
-                if event_info.data_ex is None:
-                    continue
-
-                if adj_op_data['date'] < event_info.data_ex:
-                    if event_info.evento and event_info.evento.lower().startswith("bonific"):
-                        # Bonificação: quantidade_nova = quantidade_antiga + (quantidade_antiga * (numerador/denominador))
-                        bonus_increase = event_info.get_bonus_quantity_increase(float(adj_op_data['quantity']))
-                        quantidade_antiga = float(adj_op_data['quantity'])
-                        quantidade_nova = quantidade_antiga + bonus_increase
-                        adj_op_data['quantity'] = int(round(quantidade_nova))
-                        # Preço por ação é diluído: novo_preco = (preco_antigo * quantidade_antiga) / quantidade_nova
-                        if quantidade_nova > 0:
-                            adj_op_data['price'] = float(adj_op_data['price']) * quantidade_antiga / quantidade_nova
-                        continue
-                    factor = event_info.get_adjustment_factor()
-                    if factor == 1.0:
-                        continue
-
-                    current_quantity_float = float(adj_op_data['quantity'])
-                    current_price_float = float(adj_op_data['price'])
-
-                    # Desdobramento/Agrupamento: multiplicação
-                    current_quantity_float = current_quantity_float * factor
-                    if factor != 0.0:
-                        current_price_float = current_price_float / factor
-
-                    adj_op_data['quantity'] = int(round(current_quantity_float))
-                    adj_op_data['price'] = current_price_float
-
-            adjusted_operacoes.append(adj_op_data)
-    else: # No original operations
-        adjusted_operacoes = []
-    # --- END NEW LOGIC FOR CORPORATE EVENTS ---
-    
-    # Dicionário para armazenar a carteira atual
-    carteira_temp = defaultdict(lambda: {"quantidade": 0, "custo_total": 0.0, "preco_medio": 0.0})
-    
-    # Processa cada operação ajustada
-    for op in adjusted_operacoes: # Iterate over adjusted_operacoes
-        logging.info(f"[recalcular_carteira] Processando op ajustada: {op['ticker']}, {op['operation']}, Qtd: {op['quantity']}, Preço: {op['price']}, Data: {op.get('date')})")
-        ticker = op["ticker"]
 
-        # Log ANTES da operação
-        # Certifique-se de que o ticker existe em carteira_temp para evitar KeyError se for a primeira operação do ticker
-        # Usamos .get para segurança, embora defaultdict deva criar
-        pm_antes = carteira_temp[ticker].get('preco_medio', 0.0) if ticker in carteira_temp else 0.0
-        logging.info(f"[recalcular_carteira] ANTES op ({op['ticker']}): Qtd: {carteira_temp[ticker]['quantidade']}, CustoTotal: {carteira_temp[ticker]['custo_total']}, PM: {pm_antes}")
+def _atualizar_status_ir_operacoes_fechadas(usuario_id: int, resultados_mensais: List[Dict[str, Any]],
+                                            mes_inicio: Optional[str] = None) -> None:
+    """
+    Atualiza o status de IR das operações fechadas salvas a partir de `mes_inicio`
+    com os resultados mensais recalculados (a isenção e o IR devido de um mês dependem
+    de todos os tickers, não apenas do ticker alterado).
+    """
+    a_partir_de = date.fromisoformat(f"{mes_inicio}-01") if mes_inicio else None
+    resultados_map = {r["mes"]: r for r in resultados_mensais}
+    atualizacoes = []
+    for op_fechada in obter_operacoes_fechadas_salvas(usuario_id, a_partir_de=a_partir_de):
+        status_ir = determinar_status_ir(op_fechada, resultados_map)
+        if status_ir != op_fechada.get("status_ir"):
+            atualizacoes.append((status_ir, op_fechada["id"]))
+    atualizar_status_ir_operacoes_fechadas_db(atualizacoes)
 
-        quantidade_op = op["quantity"]
-        valor_op_bruto = quantidade_op * op["price"] # Renomeado para clareza (valor bruto da operação)
-        fees_op = op.get("fees", 0.0)
 
-        # Salva o estado ANTES de modificar quantidade, custo_total e PM para lógica de compra/venda
-        estado_anterior_quantidade = carteira_temp[ticker]["quantidade"]
-        estado_anterior_preco_medio = carteira_temp[ticker]["preco_medio"]
-        estado_anterior_custo_total = carteira_temp[ticker]["custo_total"] # Captura o custo total anterior
+def _carregar_eventos_por_ticker(tickers, data_limite: Optional[date] = None) -> Dict[str, List[EventoCorporativoInfo]]:
+    """
+    Carrega os eventos corporativos (data ex até `data_limite`, padrão hoje) de cada ticker,
+    no formato esperado pelo motor de posições.
 
-        if op["operation"] == "buy":
-            custo_da_compra_atual_total = valor_op_bruto + fees_op
-
-            if estado_anterior_quantidade < 0: # Estava vendido e esta compra está cobrindo (parcialmente ou totalmente)
-                quantidade_acoes_sendo_cobertas = min(abs(estado_anterior_quantidade), quantidade_op)
-
-                carteira_temp[ticker]["quantidade"] += quantidade_op
-
-                if carteira_temp[ticker]["quantidade"] == 0: # Compra zerou exatamente a posição vendida
-                    carteira_temp[ticker]["custo_total"] = 0.0
-                elif carteira_temp[ticker]["quantidade"] > 0: # Compra cobriu a posição vendida e iniciou uma nova posição comprada
-                    quantidade_comprada_excedente = carteira_temp[ticker]["quantidade"]
-                    custo_da_parte_excedente = (custo_da_compra_atual_total / quantidade_op) * quantidade_comprada_excedente if quantidade_op != 0 else 0
-                    carteira_temp[ticker]["custo_total"] = custo_da_parte_excedente
-                else: # Compra apenas reduziu a posição vendida (carteira_temp[ticker]["quantidade"] < 0)
-                    reducao_valor_pos_vendida = estado_anterior_preco_medio * quantidade_acoes_sendo_cobertas
-                    carteira_temp[ticker]["custo_total"] = estado_anterior_custo_total - reducao_valor_pos_vendida
-                    if carteira_temp[ticker]["custo_total"] < 0: # Garante que não fique negativo
-                        carteira_temp[ticker]["custo_total"] = 0.0
-            else: # Estava zerado ou já comprado (caso normal de compra)
-                carteira_temp[ticker]["quantidade"] += quantidade_op
-                carteira_temp[ticker]["custo_total"] += custo_da_compra_atual_total
-        elif op["operation"] == "sell":
-            # valor_liquido_venda = valor_op_bruto - fees_op # Valor que efetivamente altera o caixa ou valor da posição
-
-            # Se estava comprado antes desta venda
-            if estado_anterior_quantidade > 0:
-                quantidade_vendida_da_posicao_comprada = min(estado_anterior_quantidade, quantidade_op)
-                custo_a_baixar = estado_anterior_preco_medio * quantidade_vendida_da_posicao_comprada
-                carteira_temp[ticker]["custo_total"] -= custo_a_baixar
-                carteira_temp[ticker]["quantidade"] -= quantidade_vendida_da_posicao_comprada
-
-                quantidade_op_restante_apos_vender_comprado = quantidade_op - quantidade_vendida_da_posicao_comprada
-                if quantidade_op_restante_apos_vender_comprado > 0: # Venda excedeu a posição comprada, virou vendido
-                    # Custo_total da parte comprada deve ter sido zerado ou estar próximo de zero.
-                    # Agora, custo_total representa o valor da nova posição vendida.
-                    proporcao_restante = quantidade_op_restante_apos_vender_comprado / quantidade_op if quantidade_op else 0
-                    carteira_temp[ticker]["custo_total"] = (valor_op_bruto * proporcao_restante) # Usar valor bruto para PM de venda, taxas afetam resultado.
-                    carteira_temp[ticker]["quantidade"] -= quantidade_op_restante_apos_vender_comprado
-            else: # Estava zerado ou já vendido (aumentando a posição vendida)
-                carteira_temp[ticker]["quantidade"] -= quantidade_op
-                # Custo_total para vendidos acumula o valor (bruto) obtido com as vendas.
-                # O preco_medio será (custo_total / abs(quantidade))
-                carteira_temp[ticker]["custo_total"] += valor_op_bruto
-
-        logging.info(f"[recalcular_carteira] APÓS op ({op['ticker']}): Qtd: {carteira_temp[ticker]['quantidade']}, CustoTotal: {carteira_temp[ticker]['custo_total']}")
-
-        # Recalcula o preço médio final da posição
-        if carteira_temp[ticker]["quantidade"] > 0: # Posição comprada
-            carteira_temp[ticker]["preco_medio"] = carteira_temp[ticker]["custo_total"] / carteira_temp[ticker]["quantidade"]
-            logging.info(f"[recalcular_carteira] NOVO PM COMPRADO ({op['ticker']}): {carteira_temp[ticker]['preco_medio']}")
-        elif carteira_temp[ticker]["quantidade"] < 0: # Posição vendida
-            # Se a quantidade é negativa, o custo_total deve representar o valor total obtido
-            # com as vendas a descoberto, e o preco_medio o preço médio dessas vendas.
-            # Estes valores devem ter sido calculados corretamente no bloco 'if op["operation"] == "sell"'.
-            # Aqui, apenas garantimos que sejam usados para o preco_medio e não zerados.
-            if abs(carteira_temp[ticker]["quantidade"]) > 0 and carteira_temp[ticker]["custo_total"] != 0: # Evitar divisão por zero se custo_total ainda for 0 por algum motivo
-                carteira_temp[ticker]["preco_medio"] = carteira_temp[ticker]["custo_total"] / abs(carteira_temp[ticker]["quantidade"])
-            elif op["operation"] == "sell": # Se foi uma venda que resultou em pos negativa e custo_total está 0 (deveria ter sido setado)
-                 carteira_temp[ticker]["preco_medio"] = op["price"] # Usa o preço da operação atual como PM
-                 # O custo_total também deveria ter sido op["price"] * op["quantity"] no bloco da venda
-                 # Se o custo_total ficou 0 para AERI3, precisamos garantir que ele seja atualizado no bloco de venda.
-            else:
-                 carteira_temp[ticker]["preco_medio"] = 0.0 # Fallback
-            logging.info(f"[recalcular_carteira] NOVO PM VENDIDO ({op['ticker']}): {carteira_temp[ticker]['preco_medio']}, CustoTotal: {carteira_temp[ticker]['custo_total']}")
-        else: # Quantidade é zero
-            carteira_temp[ticker]["preco_medio"] = 0.0
-            carteira_temp[ticker]["custo_total"] = 0.0
-            logging.info(f"[recalcular_carteira] PM ZERADO ({op['ticker']}): Qtd zero.")
-            
-    # Atualiza a carteira no banco de dados para o usuário
-    for ticker, dados in carteira_temp.items():
-        # Salva mesmo se a quantidade for zero para remover da carteira no DB,
-        # ou a função atualizar_carteira pode decidir não salvar se quantidade for zero.
-        # A função `atualizar_carteira` do database usa INSERT OR REPLACE, 
-        # então se a quantidade for 0, ela ainda será salva assim.
-        # Se quisermos remover, precisaríamos de uma lógica de DELETE no DB.
-        # Por ora, salvar com quantidade zero é aceitável.
-        atualizar_carteira(ticker, dados["quantidade"], dados["preco_medio"], dados["custo_total"], usuario_id=usuario_id)
-
-
-def recalcular_resultados(usuario_id: int) -> None:
-    """
-    Recalcula os resultados mensais de um usuário com base em todas as suas operações.
-    Os resultados mensais existentes do usuário são limpos antes do recálculo.
-    """
-    import logging # Adicionado para logs
-    # Limpa os resultados mensais existentes do usuário no banco de dados
-    limpar_resultados_mensais_usuario_db(usuario_id=usuario_id)
+    Args:
+        tickers: Tickers cujas operações serão processadas.
+        data_limite: Data limite para a data ex dos eventos (opcional).
 
-    # Obtém todas as operações do usuário, ordenadas por data e ID
-    # A função obter_todas_operacoes já deve retornar ordenado por data, e ID como desempate.
-    # Se não, a ordenação precisa ser garantida aqui. Ex: operacoes.sort(key=lambda x: (x['date'], x.get('id', 0)))
-    operacoes = obter_todas_operacoes(usuario_id=usuario_id)
-    
-    # Dicionário para manter o estado da carteira para cálculo de PM de Swing Trade
-    carteira_estado_atual = defaultdict(lambda: {"quantidade": 0, "custo_total": 0.0, "preco_medio": 0.0})
-    posicoes_vendidas_estado_atual = defaultdict(lambda: {"quantidade_vendida": 0, "valor_total_venda": 0.0, "preco_medio_venda": 0.0})
+    Returns:
+        Dict[str, List[EventoCorporativoInfo]]: Eventos por ticker, ordenados por data ex.
+    """
+    data_limite = data_limite or date.today()
+    eventos_por_ticker: Dict[str, List[EventoCorporativoInfo]] = {}
+    for ticker in sorted(set(tickers)):
+        indice = obter_indice_eventos(ticker)
+        if indice.id_acao:
+            eventos_por_ticker[ticker] = indice.eventos_ate(data_limite)
+    return eventos_por_ticker
+
+
+def executar_motor_usuario(usuario_id: int, datas_snapshot: Optional[List[date]] = None) -> Dict[str, Any]:
+    """
+    Executa o motor de posições sobre todo o histórico de operações de um usuário,
+    com uma única leitura das operações e dos eventos corporativos.
+
+    Args:
+        usuario_id: ID do usuário.
+        datas_snapshot: Datas para as quais a posição da carteira deve ser registrada (opcional).
+
+    Returns:
+        Dict[str, Any]: Saída de `motor_posicoes.executar_motor` (carteira, resultados_mensais,
+        operacoes_fechadas, checkpoints e snapshots).
+    """
+    operacoes, eventos_por_ticker = carregar_entradas_motor_usuario(usuario_id)
+    with rastreio_atual().etapa("agregar"):
+        return executar_motor(operacoes, eventos_por_ticker, datas_snapshot=datas_snapshot, usuario_id=usuario_id)
+
+
+def carregar_entradas_motor_usuario(usuario_id: int) -> tuple:
+    """
+    Lê do banco as entradas do motor de posições de um usuário, permitindo executar
+    o motor (cálculo puro) separadamente, por exemplo em outro processo.
+
+    Args:
+        usuario_id: ID do usuário.
+
+    Returns:
+        tuple: (operações do usuário, eventos corporativos por ticker).
+    """
+    with rastreio_atual().etapa("carregar"):
+        operacoes = obter_operacoes_motor_db(usuario_id)
+        return operacoes, _carregar_eventos_por_ticker({op["ticker"] for op in operacoes})
+
+
+@rastreado("recalcular_posicoes_usuario")
+def recalcular_posicoes_usuario(usuario_id: int) -> Dict[str, Any]:
+    """
+    Recalcula carteira, resultados mensais e operações fechadas de um usuário a partir
+    de uma única passada do motor de posições.
+
+    Args:
+        usuario_id: ID do usuário.
+
+    Returns:
+        Dict[str, Any]: Saída do motor de posições.
+    """
+    saida_motor = executar_motor_usuario(usuario_id)
+    recalcular_carteira(usuario_id=usuario_id, saida_motor=saida_motor)
+    recalcular_resultados(usuario_id=usuario_id, saida_motor=saida_motor)
+    calcular_operacoes_fechadas(usuario_id=usuario_id, saida_motor=saida_motor)
+    return saida_motor
 
-    # Agrupa as operações por mês
-    operacoes_por_mes = defaultdict(list)
-    for op in operacoes:
-        op_date = op["date"]
-        if isinstance(op_date, str):
-            op_date = datetime.fromisoformat(op_date.split("T")[0]).date()
-        elif isinstance(op_date, datetime):
-            op_date = op_date.date()
-        op["date"] = op_date # Garante que a data é um objeto date
-        
-        mes = op_date.strftime("%Y-%m")
-        operacoes_por_mes[mes].append(op)
-    
-    prejuizo_acumulado_swing = 0.0
-    prejuizo_acumulado_day = 0.0
-    
-    for mes_str, ops_mes_original in sorted(operacoes_por_mes.items()): # Renomeado para clareza
-        resultado_mes_swing = {"vendas": 0.0, "custo": 0.0, "ganho_liquido": 0.0}
-        resultado_mes_day = {"vendas_total": 0.0, "custo_total": 0.0, "ganho_liquido": 0.0, "irrf": 0.0}
-        
-        operacoes_por_dia_no_mes = defaultdict(list)
-        for op_m in ops_mes_original: # Renomeado para clareza
-            dia_iso = op_m["date"].isoformat()
-            operacoes_por_dia_no_mes[dia_iso].append(op_m)
-            
-        for dia_str, ops_dia_list_original in sorted(operacoes_por_dia_no_mes.items()):
-            
-            ops_day_trade_dia = []
-            ops_swing_trade_dia_compras = []
-            ops_swing_trade_dia_vendas = []
-
-            # Separa operações por ticker para checar day trade corretamente
-            ops_por_ticker_neste_dia = defaultdict(list)
-            for op_dia in ops_dia_list_original:
-                ops_por_ticker_neste_dia[op_dia["ticker"]].append(op_dia)
-
-            for ticker_dia, lista_ops_ticker_dia in ops_por_ticker_neste_dia.items():
-                if _eh_day_trade(lista_ops_ticker_dia, ticker_dia):
-                    ops_day_trade_dia.extend(lista_ops_ticker_dia)
-                else: # Não é day trade para este ticker, são swing trades
-                    for op_swing in lista_ops_ticker_dia:
-                        if op_swing["operation"] == "buy":
-                            ops_swing_trade_dia_compras.append(op_swing)
-                        else:
-                            ops_swing_trade_dia_vendas.append(op_swing)
-
-            # Ordena compras e vendas por ID para manter a ordem de execução no dia
-            ops_swing_trade_dia_compras.sort(key=lambda x: x.get('id', 0))
-            ops_swing_trade_dia_vendas.sort(key=lambda x: x.get('id', 0))
-
-            # Processar Compras de Swing Trade do Dia
-            for compra_op in ops_swing_trade_dia_compras:
-                ticker = compra_op["ticker"]
-                quantidade_compra_total = compra_op["quantity"]
-                preco_compra_unitario = compra_op["price"]
-                fees_compra_total = compra_op.get("fees", 0.0)
-                # valor_compra_bruto_total = quantidade_compra_total * preco_compra_unitario # Não usado diretamente abaixo, mas conceitual
-
-                if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
-                    qtd_a_cobrir = min(posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"], quantidade_compra_total)
-                    pm_venda_anterior = posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"]
-                    
-                    valor_da_venda_original_para_acoes_cobertas = qtd_a_cobrir * pm_venda_anterior # Valor bruto da venda original
-                    custo_da_recompra_para_acoes_cobertas_bruto = qtd_a_cobrir * preco_compra_unitario
-                    fees_compra_proporcional = (fees_compra_total / quantidade_compra_total) * qtd_a_cobrir if quantidade_compra_total > 0 else 0
-
-                    # Adiciona o custo da recompra ao resultado do mês.
-                    # A venda original já foi adicionada a resultado_mes_swing["vendas"].
-                    resultado_mes_swing["custo"] += custo_da_recompra_para_acoes_cobertas_bruto + fees_compra_proporcional
-                    
-                    # Atualiza posicoes_vendidas_estado_atual
-                    posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] -= valor_da_venda_original_para_acoes_cobertas # Deduz o valor bruto das ações recompradas
-                    posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] -= qtd_a_cobrir
-                    
-                    if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
-                        posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] / posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"]
-                    else: # Zerou a posição vendida
-                        posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = 0.0
-                        posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] = 0.0 # Garante zeragem
-                    
-                    logging.info(f"[recalcular_resultados] COMPRA COBRINDO VENDA ({ticker}): Qtd Coberta:{qtd_a_cobrir}, Preço Compra:{preco_compra_unitario}, PM Venda Anterior:{pm_venda_anterior}")
-                    logging.info(f"[recalcular_resultados] Estado Pos Vendida APÓS COBERTURA ({ticker}): Qtd:{posicoes_vendidas_estado_atual[ticker]['quantidade_vendida']}, PM Vendido:{posicoes_vendidas_estado_atual[ticker]['preco_medio_venda']}")
-
-                    quantidade_compra_restante = quantidade_compra_total - qtd_a_cobrir
-                    if quantidade_compra_restante > 0:
-                        # Trata o restante como uma compra normal para a carteira_estado_atual (posição comprada)
-                        valor_compra_restante_bruto = quantidade_compra_restante * preco_compra_unitario
-                        fees_compra_restante = (fees_compra_total / quantidade_compra_total) * quantidade_compra_restante if quantidade_compra_total > 0 else 0
-                        
-                        carteira_estado_atual[ticker]["quantidade"] += quantidade_compra_restante
-                        carteira_estado_atual[ticker]["custo_total"] += valor_compra_restante_bruto + fees_compra_restante
-                        if carteira_estado_atual[ticker]["quantidade"] > 0: # Sempre será >0 aqui
-                             carteira_estado_atual[ticker]["preco_medio"] = carteira_estado_atual[ticker]["custo_total"] / carteira_estado_atual[ticker]["quantidade"]
-                        logging.info(f"[recalcular_resultados] COMPRA SWING (Restante após cobrir venda) ({ticker}): Qtd:{quantidade_compra_restante}, Preço:{preco_compra_unitario}, Novo PM Comprado:{carteira_estado_atual[ticker]['preco_medio']}")
-                else:
-                    # Lógica original para compra normal (nenhuma posição vendida para cobrir)
-                    carteira_estado_atual[ticker]["quantidade"] += quantidade_compra_total
-                    carteira_estado_atual[ticker]["custo_total"] += (quantidade_compra_total * preco_compra_unitario) + fees_compra_total
-                    if carteira_estado_atual[ticker]["quantidade"] > 0:
-                        carteira_estado_atual[ticker]["preco_medio"] = carteira_estado_atual[ticker]["custo_total"] / carteira_estado_atual[ticker]["quantidade"]
-                    else: # Improvável para uma compra, mas para segurança
-                        carteira_estado_atual[ticker]["preco_medio"] = 0.0
-                        carteira_estado_atual[ticker]["custo_total"] = 0.0
-                    logging.info(f"[recalcular_resultados] COMPRA SWING (Normal) ({ticker}): Qtd:{quantidade_compra_total}, Preço:{preco_compra_unitario}, Novo PM Comprado:{carteira_estado_atual[ticker]['preco_medio']}")
-
-            # Processar Vendas de Swing Trade do Dia
-            for venda_op in ops_swing_trade_dia_vendas:
-                ticker = venda_op["ticker"]
-                quantidade_venda_total = venda_op["quantity"]
-                preco_venda_unitario = venda_op["price"]
-                fees_total_venda = venda_op.get("fees", 0.0)
-                
-                quantidade_vendida_de_posicao_comprada = 0
-                quantidade_vendida_a_descoberto = 0
-
-                # Parte 1: Venda cobre posição comprada existente
-                if carteira_estado_atual[ticker]["quantidade"] > 0:
-                    pm_para_venda_comprada = carteira_estado_atual[ticker]["preco_medio"]
-                    quantidade_vendida_de_posicao_comprada = min(carteira_estado_atual[ticker]["quantidade"], quantidade_venda_total)
-                    
-                    custo_da_parte_comprada_vendida = quantidade_vendida_de_posicao_comprada * pm_para_venda_comprada
-                    valor_bruto_da_parte_comprada_vendida = quantidade_vendida_de_posicao_comprada * preco_venda_unitario
-                    fees_da_parte_comprada_vendida = (fees_total_venda / quantidade_venda_total) * quantidade_vendida_de_posicao_comprada if quantidade_venda_total > 0 else 0
-                    valor_liquido_da_parte_comprada_vendida = valor_bruto_da_parte_comprada_vendida - fees_da_parte_comprada_vendida
-
-                    resultado_mes_swing["vendas"] += valor_liquido_da_parte_comprada_vendida
-                    resultado_mes_swing["custo"] += custo_da_parte_comprada_vendida
-                    
-                    carteira_estado_atual[ticker]["quantidade"] -= quantidade_vendida_de_posicao_comprada
-                    carteira_estado_atual[ticker]["custo_total"] -= custo_da_parte_comprada_vendida
-                    if carteira_estado_atual[ticker]["quantidade"] <= 0:
-                        carteira_estado_atual[ticker]["custo_total"] = 0.0
-                        carteira_estado_atual[ticker]["preco_medio"] = 0.0
-                    
-                    logging.info(f"[recalcular_resultados] VENDA DE POS_COMPRADA ({ticker}): Qtd:{quantidade_vendida_de_posicao_comprada}, Preço:{preco_venda_unitario}, PM Usado:{pm_para_venda_comprada}, Custo Venda:{custo_da_parte_comprada_vendida}")
-
-                # Parte 2: Venda a descoberto (o restante da quantidade da operação de venda)
-                quantidade_vendida_a_descoberto = quantidade_venda_total - quantidade_vendida_de_posicao_comprada
-                
-                if quantidade_vendida_a_descoberto > 0:
-                    valor_desta_venda_descoberta_bruto = quantidade_vendida_a_descoberto * preco_venda_unitario
-                    fees_desta_venda_descoberta = (fees_total_venda / quantidade_venda_total) * quantidade_vendida_a_descoberto if quantidade_venda_total > 0 else 0
-                    valor_liquido_desta_venda_descoberta = valor_desta_venda_descoberta_bruto - fees_desta_venda_descoberta
-
-                    resultado_mes_swing["vendas"] += valor_liquido_desta_venda_descoberta
-                    # O custo da venda a descoberto será apurado na recompra.
-
-                    posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] += valor_desta_venda_descoberta_bruto # Acumula valor bruto para PM de venda
-                    posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] += quantidade_vendida_a_descoberto
-                    
-                    if posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"] > 0:
-                        posicoes_vendidas_estado_atual[ticker]["preco_medio_venda"] = posicoes_vendidas_estado_atual[ticker]["valor_total_venda"] / posicoes_vendidas_estado_atual[ticker]["quantidade_vendida"]
-                    
-                    logging.info(f"[recalcular_resultados] VENDA A DESCOBERTO ({ticker}): Qtd:{quantidade_vendida_a_descoberto}, Preço:{preco_venda_unitario}, Novo PM Vendido:{posicoes_vendidas_estado_atual[ticker]['preco_medio_venda']}")
-
-                logging.info(f"[recalcular_resultados] Estado Carteira APÓS VENDA ({ticker}): Qtd:{carteira_estado_atual[ticker]['quantidade']}, CustoTotal:{carteira_estado_atual[ticker]['custo_total']}, PM:{carteira_estado_atual[ticker]['preco_medio']}")
-                logging.info(f"[recalcular_resultados] Estado Pos Vendida APÓS VENDA ({ticker}): Qtd:{posicoes_vendidas_estado_atual[ticker]['quantidade_vendida']}, PM Vendido:{posicoes_vendidas_estado_atual[ticker]['preco_medio_venda']}")
-
-            # Calcular resultados de Day Trade do dia (se houver)
-            if ops_day_trade_dia:
-                _, resultado_dia_day_obj = _calcular_resultado_dia(ops_day_trade_dia, usuario_id)
-                if resultado_dia_day_obj: # Se houver resultado de day trade
-                    resultado_mes_day["vendas_total"] += resultado_dia_day_obj["vendas_total"]
-                    resultado_mes_day["custo_total"] += resultado_dia_day_obj["custo_total"]
-                    # O ganho líquido do dia de daytrade é vendas - custo. Esse valor será somado ao do mês.
-                    resultado_mes_day["ganho_liquido"] += resultado_dia_day_obj["ganho_liquido"]
-                    resultado_mes_day["irrf"] += resultado_dia_day_obj["irrf"]
-
-        # Após processar todos os dias do mês:
-        resultado_mes_swing["ganho_liquido"] = resultado_mes_swing["vendas"] - resultado_mes_swing["custo"]
-        # O ganho líquido de day trade já foi acumulado.
-
-        isento_swing = resultado_mes_swing["vendas"] <= 20000.0
-        
-        # Aplica a compensação de prejuízos (Swing Trade)
-        ganho_liquido_swing_antes_compensacao = resultado_mes_swing["ganho_liquido"]
-        if prejuizo_acumulado_swing > 0 and ganho_liquido_swing_antes_compensacao > 0:
-            compensacao = min(prejuizo_acumulado_swing, ganho_liquido_swing_antes_compensacao)
-            ganho_liquido_swing_apos_compensacao = ganho_liquido_swing_antes_compensacao - compensacao
-            prejuizo_acumulado_swing -= compensacao
-        elif ganho_liquido_swing_antes_compensacao < 0:
-            prejuizo_acumulado_swing += abs(ganho_liquido_swing_antes_compensacao)
-            ganho_liquido_swing_apos_compensacao = 0.0
-        else:
-            ganho_liquido_swing_apos_compensacao = ganho_liquido_swing_antes_compensacao
-
-        # Aplica a compensação de prejuízos (Day Trade)
-        ganho_liquido_day_antes_compensacao = resultado_mes_day["ganho_liquido"]
-        if prejuizo_acumulado_day > 0 and ganho_liquido_day_antes_compensacao > 0:
-            compensacao_day = min(prejuizo_acumulado_day, ganho_liquido_day_antes_compensacao)
-            ganho_liquido_day_apos_compensacao = ganho_liquido_day_antes_compensacao - compensacao_day
-            prejuizo_acumulado_day -= compensacao_day
-        elif ganho_liquido_day_antes_compensacao < 0:
-            prejuizo_acumulado_day += abs(ganho_liquido_day_antes_compensacao)
-            ganho_liquido_day_apos_compensacao = 0.0
-        else:
-            ganho_liquido_day_apos_compensacao = ganho_liquido_day_antes_compensacao
-
-        # Prepara o dicionário final para salvar no banco
-        resultado_dict: Dict[str, Any] = {
-            "mes": mes_str,
-            "vendas_swing": resultado_mes_swing["vendas"],
-            "custo_swing": resultado_mes_swing["custo"],
-            "ganho_liquido_swing": ganho_liquido_swing_apos_compensacao, # Já compensado
-            "isento_swing": isento_swing,
-            "prejuizo_acumulado_swing": prejuizo_acumulado_swing,
-
-            "vendas_day_trade": resultado_mes_day["vendas_total"],
-            "custo_day_trade": resultado_mes_day["custo_total"],
-            "ganho_liquido_day": ganho_liquido_day_apos_compensacao, # Já compensado
-            "irrf_day": resultado_mes_day["irrf"],
-            "prejuizo_acumulado_day": prejuizo_acumulado_day,
-            
-            # Defaults for DARF fields
-            "darf_codigo_swing": None, "darf_competencia_swing": None, "darf_valor_swing": None, "darf_vencimento_swing": None, "status_darf_swing_trade": None,
-            "darf_codigo_day": None, "darf_competencia_day": None, "darf_valor_day": None, "darf_vencimento_day": None, "status_darf_day_trade": None,
-        }
-
-        # Swing Trade IR calculations
-        current_ir_devido_swing = 0.0
-        if not isento_swing and resultado_dict["ganho_liquido_swing"] > 0:
-            current_ir_devido_swing = resultado_dict["ganho_liquido_swing"] * 0.15
-        
-        # Simplificando ir_pagar_swing = current_ir_devido_swing (desconsiderando IRRF de 0,005% em swing, que não é comum reter para DARF)
-        current_ir_pagar_swing = max(0.0, current_ir_devido_swing) 
-        
-        resultado_dict["ir_devido_swing"] = current_ir_devido_swing
-        resultado_dict["ir_pagar_swing"] = current_ir_pagar_swing
-
-        if current_ir_pagar_swing >= 10.0:
-            resultado_dict["darf_valor_swing"] = current_ir_pagar_swing
-            resultado_dict["darf_codigo_swing"] = "6015" # Código genérico, pode ser diferente para swing
-            resultado_dict["darf_competencia_swing"] = mes_str
-            resultado_dict["darf_vencimento_swing"] = _calculate_darf_due_date(mes_str)
-            resultado_dict["status_darf_swing_trade"] = "Pendente"
-        
-        # Day Trade IR calculations
-        current_ir_devido_day = 0.0
-        if resultado_dict["ganho_liquido_day"] > 0:
-             current_ir_devido_day = resultado_dict["ganho_liquido_day"] * 0.20
-        
-        current_ir_pagar_day = max(0.0, current_ir_devido_day - resultado_dict["irrf_day"])
 
-        resultado_dict["ir_devido_day"] = current_ir_devido_day
-        resultado_dict["ir_pagar_day"] = current_ir_pagar_day
+@rastreado("recalcular_carteira")
+def recalcular_carteira(usuario_id: int, tickers: Optional[List[str]] = None, saida_motor: Optional[Dict[str, Any]] = None,
+                        tickers_preservados: Optional[List[str]] = None) -> None:
+    """
+    Recalcula a carteira atual de um usuário com base em suas operações.
+
+    Sem `tickers`, a carteira existente do usuário é limpa e recalculada por completo.
+    Com `tickers`, apenas as posições desses tickers são recalculadas (cada ticker é
+    independente dos demais), o que evita reprocessar toda a carteira após uma
+    inserção ou remoção pontual.
+
+    Args:
+        usuario_id: ID do usuário.
+        tickers: Tickers afetados (opcional).
+        saida_motor: Saída já calculada do motor de posições para o histórico completo (opcional).
+        tickers_preservados: Tickers editados manualmente, cujas posições são mantidas (opcional).
+    """
+    rastreio = rastreio_atual()
+    if tickers is not None:
+        versoes, saidas = _executar_motor_tickers(usuario_id, tickers)
+        itens = []
+        tickers_removidos = []
+        for ticker, saida_ticker in saidas.items():
+            if saida_ticker is None:
+                # Nenhuma operação restante para o ticker: a posição deixa de existir
+                tickers_removidos.append(ticker)
+                continue
+            itens.append({"ticker": ticker, **saida_ticker["carteira"][ticker]})
+        with rastreio.etapa("persistir"):
+            salvar_carteira_em_lote(usuario_id, itens, tickers_removidos=tickers_removidos,
+                                    tickers_preservados=tickers_preservados)
+            # Os lotes FIFO saem da mesma passada: as operações fechadas desses tickers são
+            # substituídas aqui, com o status de IR dos resultados salvos; os meses afetados
+            # pela alteração são atualizados em seguida por recalcular_resultados
+            _salvar_operacoes_fechadas_tickers(usuario_id, versoes, saidas, {r["mes"]: r for r in obter_resultados_mensais(usuario_id)})
+        return
+
+    if saida_motor is None:
+        saida_motor = executar_motor_usuario(usuario_id)
+
+    # Substitui a carteira do usuário em uma única transação. Posições zeradas também
+    # são salvas (com quantidade zero), como no INSERT OR REPLACE de atualizar_carteira.
+    itens = [{"ticker": ticker, **dados} for ticker, dados in saida_motor["carteira"].items()]
+    with rastreio.etapa("persistir"):
+        salvar_carteira_em_lote(usuario_id, itens, substituir=True, tickers_preservados=tickers_preservados)
+
+
+@rastreado("recalcular_resultados")
+def recalcular_resultados(usuario_id: int, a_partir_de: Optional[date] = None, saida_motor: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Recalcula os resultados mensais de um usuário com base em suas operações.
 
-        if current_ir_pagar_day >= 10.0:
-            resultado_dict["darf_valor_day"] = current_ir_pagar_day
-            resultado_dict["darf_codigo_day"] = "6015"
-            resultado_dict["darf_competencia_day"] = mes_str
-            resultado_dict["darf_vencimento_day"] = _calculate_darf_due_date(mes_str)
-            resultado_dict["status_darf_day_trade"] = "Pendente"
-            
-        salvar_resultado_mensal(resultado_dict, usuario_id=usuario_id)
+    Sem `a_partir_de`, os resultados mensais existentes do usuário são limpos e todo o
+    histórico é reprocessado. Com `a_partir_de`, o estado ao final do mês anterior
+    (PM de swing trade e posições vendidas por ticker, salvos em checkpoints_resultados,
+    e prejuízos acumulados do último resultado mensal) é restaurado e apenas os meses
+    a partir do mês afetado são reprocessados.
+
+    Args:
+        usuario_id: ID do usuário.
+        a_partir_de: Data da operação mais antiga afetada pela alteração (opcional).
+        saida_motor: Saída já calculada do motor de posições para o histórico completo (opcional).
+    """
+    rastreio = rastreio_atual()
+    mes_inicio = None
+    estado_inicial = None
+    if a_partir_de is not None and saida_motor is None:
+        mes_inicio = a_partir_de.strftime("%Y-%m")
+        inicio_mes = a_partir_de.replace(day=1)
+        checkpoints_anteriores = obter_checkpoints_resultados_anteriores_a(usuario_id, mes_inicio)
+        if not checkpoints_anteriores and existe_operacao_anterior_a(usuario_id, inicio_mes):
+            # Há histórico anterior sem checkpoint (base anterior aos checkpoints): recalcula tudo
+            mes_inicio = None
+        else:
+            ultimo_resultado = obter_ultimo_resultado_mensal_anterior_a(usuario_id, mes_inicio) or {}
+            estado_inicial = {
+                "checkpoints": checkpoints_anteriores,
+                "prejuizo_acumulado_swing": ultimo_resultado.get("prejuizo_acumulado_swing") or 0.0,
+                "prejuizo_acumulado_day": ultimo_resultado.get("prejuizo_acumulado_day") or 0.0,
+            }
+
+    if mes_inicio is None:
+        if saida_motor is None:
+            saida_motor = executar_motor_usuario(usuario_id)
+    else:
+        with rastreio.etapa("carregar"):
+            operacoes = obter_operacoes_motor_db(usuario_id, data_inicio=inicio_mes)
+            # Tickers restaurados do checkpoint também podem ter eventos após o mês do checkpoint
+            tickers = {op["ticker"] for op in operacoes} | {cp["ticker"] for cp in estado_inicial["checkpoints"]}
+            eventos_por_ticker = _carregar_eventos_por_ticker(tickers)
+        with rastreio.etapa("agregar"):
+            saida_motor = executar_motor(operacoes, eventos_por_ticker, estado_inicial=estado_inicial, usuario_id=usuario_id)
+
+    # Resultados (todos ou a partir de mes_inicio) e o estado por ticker ao final de cada mês,
+    # persistido para recálculos incrementais, são substituídos em uma única transação
+    with rastreio.etapa("persistir"):
+        salvar_resultados_mensais_em_lote(usuario_id, saida_motor["resultados_mensais"], saida_motor["checkpoints"], mes_inicio)
+        _atualizar_status_ir_operacoes_fechadas(usuario_id, saida_motor["resultados_mensais"], mes_inicio)
 
 def listar_operacoes_service(usuario_id: int) -> List[Dict[str, Any]]:
     """
@@ -1054,14 +650,20 @@ def listar_operacoes_service(usuario_id: int) -> List[Dict[str, Any]]:
     """
     return obter_todas_operacoes(usuario_id=usuario_id)
 
-def deletar_operacao_service(operacao_id: int, usuario_id: int) -> bool:
+def deletar_operacao_service(operacao_id: int, usuario_id: int, em_segundo_plano: bool = False) -> bool:
     """
     Serviço para deletar uma operação e recalcular carteira e resultados.
     Retorna True se a operação foi deletada, False caso contrário.
-    """
-    if remover_operacao(operacao_id, usuario_id=usuario_id):
-        recalcular_carteira(usuario_id=usuario_id)
-        recalcular_resultados(usuario_id=usuario_id)
+    Com `em_segundo_plano`, o recálculo é enfileirado em vez de executado na chamada.
+    """
+    operacao_removida = obter_operacao_por_id(operacao_id, usuario_id)
+    if operacao_removida and remover_operacao(operacao_id, usuario_id=usuario_id):
+        if em_segundo_plano:
+            enfileirar_recalculo(usuario_id, a_partir_de=operacao_removida["date"], tickers=[operacao_removida["ticker"]])
+            return True
+        # Recalcula apenas o ticker da operação removida e os meses a partir de sua data
+        recalcular_carteira(usuario_id=usuario_id, tickers=[operacao_removida["ticker"]])
+        recalcular_resultados(usuario_id=usuario_id, a_partir_de=operacao_removida["date"])
         return True
     return False
 
@@ -1069,7 +671,7 @@ def gerar_resumo_operacoes_fechadas(usuario_id: int) -> Dict[str, Any]:
     """
     Gera um resumo das operações fechadas para um usuário.
     """
-    operacoes_fechadas = calcular_operacoes_fechadas(usuario_id=usuario_id)
+    operacoes_fechadas = obter_operacoes_fechadas_service(usuario_id=usuario_id)
     
     # Calcula o resumo
     total_operacoes = len(operacoes_fechadas)
@@ -1164,6 +766,7 @@ def deletar_todas_operacoes_service(usuario_id: int) -> Dict[str, Any]:
     limpar_usuario_proventos_recebidos_db(usuario_id=usuario_id)
     limpar_carteira_usuario_db(usuario_id=usuario_id)
     limpar_resultados_mensais_usuario_db(usuario_id=usuario_id)
+    limpar_checkpoints_resultados_usuario_db(usuario_id=usuario_id)
     # Se existirem funções para limpar resumos de proventos, chame aqui
     # limpar_resumo_anual_proventos_usuario_db(usuario_id=usuario_id)
     # limpar_resumo_mensal_proventos_usuario_db(usuario_id=usuario_id)
@@ -1210,12 +813,13 @@ def listar_operacoes_por_ticker_service(usuario_id: int, ticker: str) -> List[Op
 def calcular_resultados_por_ticker_service(usuario_id: int, ticker: str) -> ResultadoTicker:
     """
     Calcula e retorna resultados agregados para um ticker específico para o usuário.
+    Apenas a posição, as operações e as operações fechadas do ticker são lidas: o custo
+    não depende do tamanho da carteira.
     """
     ticker_upper = ticker.upper()
 
-    # 1. Current Holdings
-    carteira_completa = obter_carteira_atual(usuario_id=usuario_id) # This function already filters by user_id
-    item_carteira_atual = next((item for item in carteira_completa if item["ticker"] == ticker_upper), None)
+    # 1. Current Holdings (busca pela chave ticker/usuario_id)
+    item_carteira_atual = obter_item_carteira_db(usuario_id=usuario_id, ticker=ticker_upper)
 
     quantidade_atual = 0
     preco_medio_atual = 0.0
@@ -1223,36 +827,30 @@ def calcular_resultados_por_ticker_service(usuario_id: int, ticker: str) -> Resu
 
     if item_carteira_atual:
         quantidade_atual = item_carteira_atual.get("quantidade", 0)
-        preco_medio_atual = item_carterio_atual.get("preco_medio", 0.0)
+        preco_medio_atual = item_carteira_atual.get("preco_medio", 0.0)
         custo_total_atual = item_carteira_atual.get("custo_total", 0.0)
 
     # 2. Historical Aggregates from Operations
+    operacoes_ticker = obter_operacoes_por_ticker_db(usuario_id=usuario_id, ticker=ticker_upper)
 
-    operacoes_ticker = listar_operacoes_por_ticker_service(usuario_id=usuario_id, ticker=ticker_upper)
-    
     total_investido_historico = 0.0
     total_vendido_historico = 0.0
     operacoes_compra_total_quantidade = 0
     operacoes_venda_total_quantidade = 0
 
     for op in operacoes_ticker:
-        if op.operation == "buy":
-            total_investido_historico += op.quantity * op.price + op.fees
-            operacoes_compra_total_quantidade += op.quantity
-        elif op.operation == "sell":
-            total_vendido_historico += op.quantity * op.price - op.fees
-            operacoes_venda_total_quantidade += op.quantity
-            
+        fees = op["fees"] or 0.0
+        if op["operation"] == "buy":
+            total_investido_historico += op["quantity"] * op["price"] + fees
+            operacoes_compra_total_quantidade += op["quantity"]
+        elif op["operation"] == "sell":
+            total_vendido_historico += op["quantity"] * op["price"] - fees
+            operacoes_venda_total_quantidade += op["quantity"]
+
     # 3. Realized Profit/Loss from Closed Operations
-    # calcular_operacoes_fechadas recalcula e salva no DB, depois retorna a lista.
-    # Se for chamado com frequência, pode ser um gargalo. Considerar se as ops fechadas devem ser apenas lidas.
-    # Para este contexto, vamos assumir que queremos os dados mais recentes, então o recálculo é aceitável.
-    operacoes_fechadas_todas = calcular_operacoes_fechadas(usuario_id=usuario_id) 
-    
-    lucro_prejuizo_realizado_total = 0.0
-    for op_fechada in operacoes_fechadas_todas:
-        if op_fechada.get('ticker') == ticker_upper:
-            lucro_prejuizo_realizado_total += op_fechada.get('resultado', 0.0)
+    # Operações fechadas salvas do ticker (o FIFO só é recalculado se o ticker estiver desatualizado)
+    operacoes_fechadas_ticker = obter_operacoes_fechadas_service(usuario_id=usuario_id, ticker=ticker_upper)
+    lucro_prejuizo_realizado_total = sum(op_fechada.get('resultado', 0.0) for op_fechada in operacoes_fechadas_ticker)
 
     return ResultadoTicker(
         ticker=ticker_upper,
@@ -1300,6 +898,14 @@ def registrar_provento_service(id_acao_url: int, provento_in: ProventoCreate) ->
     }
 
     new_provento_id = inserir_provento(provento_data_db)
+
+    try:
+        usuarios = distribuir_provento_para_usuarios(new_provento_id)
+        logging.info(f"Provento ID {new_provento_id} registrado para {usuarios} usuário(s).")
+    except Exception as e_distribuicao:
+        # O provento já foi cadastrado; cada usuário pode recalcular em /api/usuario/proventos/recalcular
+        logging.error(f"Falha ao distribuir o provento ID {new_provento_id} aos usuários: {e_distribuicao}", exc_info=True)
+
     provento_db = obter_provento_por_id(new_provento_id)
 
     if not provento_db:
@@ -1362,7 +968,7 @@ def listar_proventos_recebidos_pelo_usuario_service(usuario_id: int) -> List[Usu
     Lista os proventos que um usuário recebeu, buscando da tabela persistida.
     """
     proventos_db_dicts = obter_proventos_recebidos_por_usuario_db(usuario_id)
-    logging.warning(f"[DEBUG] usuario_id={usuario_id} - proventos_db_dicts (raw): {proventos_db_dicts}")
+    logging.debug("usuario_id=%s - proventos_db_dicts (raw): %s", usuario_id, proventos_db_dicts)
 
     proventos_validados = []
     for p_db_dict in proventos_db_dicts:
@@ -1596,6 +1202,11 @@ def registrar_evento_corporativo_service(id_acao_url: int, evento_in: EventoCorp
     }
 
     new_evento_id = inserir_evento_corporativo(evento_data_db)
+    # Checkpoints de recálculo incremental anteriores ao evento não o refletem
+    limpar_checkpoints_resultados_por_ticker_db(acao_existente["ticker"])
+    invalidar_indice_eventos(acao_existente["ticker"])
+    # Os lotes FIFO do ticker mudam com o evento: as operações fechadas ficam desatualizadas
+    incrementar_versoes_operacoes_ticker_db(acao_existente["ticker"])
     evento_db = obter_evento_corporativo_por_id(new_evento_id)
 
     if not evento_db:
@@ -1620,72 +1231,111 @@ def listar_eventos_corporativos_por_acao_service(id_acao: int) -> List[EventoCor
 
 
 # --- Serviço de Recálculo de Proventos Recebidos pelo Usuário (Rápido) ---
+def _registro_provento_recebido(prov: Dict[str, Any], quantidade: int, valor_unitario: float, data_calculo: str) -> Dict[str, Any]:
+    """Monta o registro de usuario_proventos_recebidos de um provento (formato de obter_proventos_por_ticker)."""
+    return {
+        "provento_global_id": prov["id"],
+        "id_acao": prov["id_acao"],
+        "ticker_acao": prov["ticker_acao"],
+        "nome_acao": prov["nome_acao"],
+        "tipo_provento": prov["tipo"],
+        "data_ex": prov["data_ex"],
+        "dt_pagamento": prov["dt_pagamento"],
+        "valor_unitario_provento": valor_unitario,
+        "quantidade_possuida_na_data_ex": quantidade,
+        "valor_total_recebido": round(quantidade * valor_unitario, 2),
+        "data_calculo": data_calculo,
+    }
+
+
+def distribuir_provento_para_usuarios(provento_id: int) -> int:
+    """
+    Registra um provento recém-cadastrado para todos os usuários que tinham o ticker
+    na véspera da data ex, sem recalcular os demais proventos de cada usuário.
+    As operações do ticker de todos os usuários são lidas em uma única consulta
+    (índice operacoes(ticker, usuario_id, date)) e os registros são inseridos em
+    uma única transação; usuários que já têm o provento registrado são mantidos.
+
+    Args:
+        provento_id: ID do provento global.
+
+    Returns:
+        int: Quantidade de usuários para os quais o provento foi registrado.
+    """
+    provento_db = obter_provento_por_id(provento_id)
+    if not provento_db or not provento_db.get("data_ex"):
+        return 0
+    acao = obter_acao_por_id(provento_db["id_acao"])
+    if not acao:
+        return 0
+
+    data_ex = provento_db["data_ex"]
+    if isinstance(data_ex, str):
+        data_ex = date.fromisoformat(data_ex)
+    prov = {**provento_db, "data_ex": data_ex, "ticker_acao": acao["ticker"], "nome_acao": acao.get("nome")}
+    try:
+        valor_unitario = float(str(prov["valor"]).replace(",", "."))
+    except ValueError:
+        logging.warning(f"[Proventos] valor inválido no provento ID {provento_id}: {prov['valor']}. Distribuição ignorada.")
+        return 0
+
+    indice = obter_indice_eventos(acao["ticker"])
+    data_calculo = dt.now().isoformat()
+    registros: List[Dict[str, Any]] = []
+    operacoes = obter_operacoes_ticker_usuarios_ate_data_db(acao["ticker"], data_ex)
+    for usuario_id, operacoes_usuario in itertools.groupby(operacoes, key=lambda op: op["usuario_id"]):
+        for _, quantidade in calcular_direitos_proventos_ticker(operacoes_usuario, [prov], indice):
+            registro = _registro_provento_recebido(prov, quantidade, valor_unitario, data_calculo)
+            registro["usuario_id"] = usuario_id
+            registros.append(registro)
+
+    return inserir_usuario_proventos_recebidos_em_lote_db(registros) if registros else 0
+
+
 def recalcular_proventos_recebidos_rapido(usuario_id: int) -> Dict[str, Any]:
-    print(f"[Proventos Rápido] Iniciando recálculo para usuário ID: {usuario_id}")
+    """
+    Recalcula os proventos recebidos por um usuário. As operações do usuário são lidas
+    em uma única consulta e, para cada ticker, cruzadas com as datas ex dos proventos e
+    os eventos corporativos em uma única passada (motor_proventos). Todos os registros
+    são gravados em uma transação, substituindo os anteriores.
 
-    limpar_usuario_proventos_recebidos_db(usuario_id)
-    print(f"[Proventos Rápido] Registros antigos de proventos limpos para usuário ID: {usuario_id}")
+    Args:
+        usuario_id: ID do usuário.
 
-    tickers = obter_tickers_operados_por_usuario(usuario_id)
-    print(f"[Proventos Rápido] Tickers operados por usuário {usuario_id}: {tickers}")
+    Returns:
+        Dict[str, Any]: Estatísticas (verificados, calculados, erros).
+    """
+    operacoes_por_ticker: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for op in obter_posicoes_operacoes_usuario_db(usuario_id):
+        operacoes_por_ticker[op["ticker"]].append(op)
 
     verificados = 0
-    calculados = 0
     erros = 0
+    registros: List[Dict[str, Any]] = []
+    data_calculo = dt.now().isoformat()
 
-    for ticker in tickers:
-        print(f"[Proventos Rápido] Processando ticker: {ticker} para usuário {usuario_id}")
+    for ticker, operacoes in operacoes_por_ticker.items():
         try:
-            primeira_data = obter_primeira_data_operacao_usuario(usuario_id, ticker)
-            if not primeira_data:
-                print(f"[Proventos Rápido] Nenhuma operação encontrada para {ticker}. Pulando.")
-                continue
-
-            proventos = obter_proventos_por_ticker(ticker)
-            proventos = [p for p in proventos if p.get("data_ex") and p["data_ex"] >= primeira_data]
+            primeira_data = min(op["date"] for op in operacoes)
+            proventos = [p for p in obter_proventos_por_ticker(ticker) if p.get("data_ex") and p["data_ex"] >= primeira_data]
+            verificados += len(proventos)
+            direitos = calcular_direitos_proventos_ticker(operacoes, proventos, obter_indice_eventos(ticker))
         except Exception as e:
-            print(f"[Proventos Rápido] Erro ao obter proventos para o ticker {ticker}: {e}")
+            logging.error(f"[Proventos Rápido] Erro ao processar os proventos do ticker {ticker} (usuário {usuario_id}): {e}", exc_info=True)
             erros += 1
             continue
 
-        for prov in proventos:
+        for prov, quantidade in direitos:
             try:
-                verificados += 1
-                data_ex = prov.get("data_ex")
-                if not data_ex:
-                    print(f"[Proventos Rápido] Provento ID {prov['id']} sem data_ex. Pulando.")
-                    continue
-
-                if isinstance(data_ex, str):
-                    data_ex = date.fromisoformat(data_ex)
-
-                operacoes = obter_operacoes_por_ticker_ate_data_db(usuario_id, ticker, data_ex.isoformat())
-                quantidade = 0
-                for op in operacoes:
-                    if op["operation"].lower() == "buy":
-                        quantidade += op["quantity"]
-                    elif op["operation"].lower() == "sell":
-                        quantidade -= op["quantity"]
-
-                if quantidade > 0:
-                    valor_str = str(prov["valor"]).replace(",", ".")
-                    try:
-                        valor_unitario = float(valor_str)
-                    except ValueError:
-                        print(f"[Proventos Rápido] valor inválido no provento ID {prov['id']} do ticker {ticker}: {prov['valor']}")
-                        erros += 1
-                        continue
-
-                    valor_total = round(quantidade * valor_unitario, 2)
-                    inserir_usuario_provento_recebido_db(usuario_id, prov["id"], quantidade, valor_total)
-                    calculados += 1
-
-
-            except Exception as e:
-                print(f"[Proventos Rápido] Erro ao processar provento ID {prov.get('id')} do ticker {ticker}: {e}")
+                valor_unitario = float(str(prov["valor"]).replace(",", "."))
+            except ValueError:
+                logging.warning(f"[Proventos Rápido] valor inválido no provento ID {prov['id']} do ticker {ticker}: {prov['valor']}")
                 erros += 1
+                continue
+            registros.append(_registro_provento_recebido(prov, quantidade, valor_unitario, data_calculo))
 
-    print(f"[Proventos Rápido] Fim do recálculo. Verificados: {verificados}, Calculados: {calculados}, Erros: {erros}")
+    calculados = substituir_usuario_proventos_recebidos_db(usuario_id, registros)
+    logging.info(f"[Proventos Rápido] Usuário {usuario_id}: verificados {verificados}, calculados {calculados}, erros {erros}.")
     return {
         "verificados": verificados,
         "calculados": calculados,
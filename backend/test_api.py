@@ -34,8 +34,10 @@ def setup_test_database(monkeypatch_session):
     """
     monkeypatch_session.setattr(db_module, "DATABASE_FILE", TEST_DB_FILENAME)
     
-    if os.path.exists(TEST_DB_FILENAME):
-        os.remove(TEST_DB_FILENAME)
+    # Also remove the WAL sidecar files: a stale -wal would be replayed onto the new database
+    for path in (TEST_DB_FILENAME, TEST_DB_FILENAME + "-wal", TEST_DB_FILENAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
     # Now that DATABASE_FILE is patched, these will use the test DB
     db_module.criar_tabelas()
@@ -43,8 +45,10 @@ def setup_test_database(monkeypatch_session):
 
     yield
 
-    if os.path.exists(TEST_DB_FILENAME):
-        os.remove(TEST_DB_FILENAME)
+    # Also remove the WAL sidecar files: a stale -wal would be replayed onto the new database
+    for path in (TEST_DB_FILENAME, TEST_DB_FILENAME + "-wal", TEST_DB_FILENAME + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
 
 
 @pytest.fixture
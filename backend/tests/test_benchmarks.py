@@ -0,0 +1,53 @@
+import unittest
+import os
+import sys
+from collections import Counter
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import gerador, suite
+
+
+class TestGeradorCarteiras(unittest.TestCase):
+    """
+    Verifica o gerador de carteiras sintéticas (reprodutível pela semente) e executa a
+    suíte de benchmarks em um tamanho pequeno para que ela não deixe de funcionar.
+    """
+
+    def test_mesma_semente_gera_mesma_carteira(self):
+        a = gerador.gerar_carteira(500, tickers=5, semente=7)
+        b = gerador.gerar_carteira(500, tickers=5, semente=7)
+        c = gerador.gerar_carteira(500, tickers=5, semente=8)
+        self.assertEqual(a['operacoes'], b['operacoes'])
+        self.assertEqual(a['proventos'], b['proventos'])
+        self.assertNotEqual(a['operacoes'], c['operacoes'])
+
+    def test_composicao_da_carteira(self):
+        carteira = gerador.gerar_carteira(2000, tickers=10, day_trade=0.2, eventos_por_ticker=3, proventos_por_ticker=4)
+        operacoes = carteira['operacoes']
+        self.assertEqual(len(operacoes), 2000)
+        self.assertEqual({op['ticker'] for op in operacoes}, set(carteira['tickers']))
+        self.assertEqual(len(carteira['eventos']), 30)
+        self.assertEqual(len(carteira['proventos']), 40)
+        self.assertEqual([op['date'] for op in operacoes], sorted(op['date'] for op in operacoes))
+
+        # Day trades: compra e venda do mesmo ticker e quantidade no mesmo dia
+        pares = Counter((op['date'], op['ticker'], op['quantity']) for op in operacoes)
+        self.assertGreater(sum(1 for n in pares.values() if n >= 2), 100)
+        # Preços das operações próximos ao preço do dia servido offline
+        for op in operacoes[:50]:
+            preco_dia = carteira['precos'][op['ticker']][date.fromisoformat(op['date'])]
+            self.assertAlmostEqual(op['price'], preco_dia, delta=preco_dia * 0.011)
+
+    def test_suite_executa_todas_as_etapas(self):
+        resultados = suite.executar_tamanho(200, {'tickers': 4, 'semente': 3}, medir_memoria=True)
+        self.assertEqual([r['etapa'] for r in resultados], [nome for nome, _ in suite._etapas({}, [], 1)])
+        for r in resultados:
+            self.assertGreater(r['tempo_s'], 0)
+            self.assertGreater(r['consultas'], 0)
+            self.assertGreater(r['pico_mib'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
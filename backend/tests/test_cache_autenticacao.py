@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import auth
+from auth import CacheTTL
+from dependencies import get_current_user
+
+
+class TestCacheAutenticacao(unittest.TestCase):
+    """
+    Verifica o cache de tokens verificados e de usuários de get_current_user e a
+    invalidação por revogação, alteração do usuário e alteração de funções.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        auth.invalidar_cache_autenticacao()
+        self.usuario_id = auth.criar_usuario('ana', 'ana@example.com', 'senha123', 'Ana')
+        self.token = auth.gerar_token(self.usuario_id)
+
+    def tearDown(self):
+        auth.invalidar_cache_autenticacao()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _usuario_atual(self, token=None):
+        return get_current_user(token or self.token)
+
+    def _codigo_erro(self, token=None):
+        with self.assertRaises(HTTPException) as ctx:
+            self._usuario_atual(token)
+        return ctx.exception.detail["error_code"]
+
+    def test_requisicoes_repetidas_nao_consultam_o_banco(self):
+        self.assertEqual(self._usuario_atual().username, 'ana')
+        with patch.object(auth, 'verificar_token') as verificar, patch.object(auth, 'obter_usuario') as obter:
+            usuario = self._usuario_atual()
+            verificar.assert_not_called()
+            obter.assert_not_called()
+        self.assertEqual(usuario.id, self.usuario_id)
+        self.assertEqual(usuario.funcoes, ['usuario'])
+
+    def test_revogar_token_invalida_o_cache(self):
+        self._usuario_atual()
+        self.assertTrue(auth.revogar_token(self.token))
+        self.assertEqual(self._codigo_erro(), 'TOKEN_REVOKED')
+
+    def test_revogar_todos_os_tokens_invalida_o_cache(self):
+        self._usuario_atual()
+        auth.revogar_todos_tokens_usuario(self.usuario_id)
+        self.assertEqual(self._codigo_erro(), 'TOKEN_REVOKED')
+
+    def test_troca_de_senha_invalida_tokens_e_usuario(self):
+        self._usuario_atual()
+        auth.atualizar_usuario(self.usuario_id, {'nome_completo': 'Ana Souza'})
+        self.assertEqual(self._usuario_atual().nome_completo, 'Ana Souza')
+        auth.atualizar_usuario(self.usuario_id, {'senha': 'nova-senha'})
+        self.assertEqual(self._codigo_erro(), 'TOKEN_REVOKED')
+
+    def test_alteracao_de_funcoes_invalida_o_usuario(self):
+        self._usuario_atual()
+        auth.adicionar_funcao_usuario(self.usuario_id, 'admin')
+        self.assertEqual(sorted(self._usuario_atual().funcoes), ['admin', 'usuario'])
+        auth.remover_funcao_usuario(self.usuario_id, 'admin')
+        self.assertEqual(self._usuario_atual().funcoes, ['usuario'])
+
+    def test_token_nao_fica_em_cache_alem_da_expiracao(self):
+        with patch.object(auth, 'JWT_EXPIRATION', 1):
+            token = auth.gerar_token(self.usuario_id)
+        self._usuario_atual(token)
+        time.sleep(2.1)
+        self.assertEqual(self._codigo_erro(token), 'TOKEN_EXPIRED')
+
+    def test_cache_ttl_limitado(self):
+        cache = CacheTTL(2)
+        for chave in ('a', 'b', 'c'):
+            cache.guardar(chave, chave.upper(), 60, cache.geracao())
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.obter('a'))  # a mais antiga foi descartada
+        self.assertEqual(cache.obter('c'), 'C')
+
+        # Valor lido antes de uma invalidação não é guardado
+        geracao = cache.geracao()
+        cache.remover(lambda chave, _: chave == 'b')
+        cache.guardar('b', 'B', 60, geracao)
+        self.assertIsNone(cache.obter('b'))
+
+        cache.guardar('d', 'D', 0.01, cache.geracao())
+        time.sleep(0.02)
+        self.assertIsNone(cache.obter('d'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,18 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import sqlite3 # Import sqlite3 to allow mocking of its Row type if necessary
+import os
+import sys
 
-# Assuming database.py is in the parent directory relative to the tests directory
-# Adjust the import path as necessary based on your project structure
-from backend import database
+# database.py importa os módulos irmãos (migracoes, metricas...) pelo nome: o diretório
+# backend entra no sys.path, como nos demais testes
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
 
 class TestDatabaseFunctions(unittest.TestCase):
 
-    @patch('backend.database.get_db')
+    @patch('database.get_db')
     def test_obter_tickers_operados_por_usuario(self, mock_get_db):
         # Setup mock connection and cursor
         mock_conn = MagicMock()
@@ -57,7 +61,7 @@ class TestDatabaseFunctions(unittest.TestCase):
         ''', (3,)
         )
 
-    @patch('backend.database.get_db')
+    @patch('database.get_db')
     def test_obter_proventos_por_ticker(self, mock_get_db):
         # Setup mock connection and cursor
         mock_conn = MagicMock()
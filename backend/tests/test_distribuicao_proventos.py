@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import indice_eventos
+
+
+class TestDistribuicaoProventos(unittest.TestCase):
+    """
+    Verifica a distribuição de um provento recém-cadastrado a todos os usuários
+    com posição no ticker, em uma única passada e gravação em lote.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('TAEE11', 'Taesa'), ('VALE3', 'Vale')])
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [('2024-01-10', 'TAEE11', 'buy', 100, 35.0, 0.0, 1),
+                 ('2024-02-10', 'TAEE11', 'sell', 40, 36.0, 0.0, 1),
+                 ('2024-01-15', 'TAEE11', 'buy', 50, 34.0, 0.0, 2),   # dobra com o desdobramento
+                 ('2024-03-01', 'TAEE11', 'buy', 200, 36.0, 0.0, 3),  # na data ex: sem direito
+                 ('2024-01-05', 'TAEE11', 'buy', 10, 35.0, 0.0, 4),
+                 ('2024-01-20', 'TAEE11', 'sell', 10, 35.0, 0.0, 4),  # posição zerada
+                 ('2024-01-05', 'VALE3', 'buy', 10, 70.0, 0.0, 5)])
+            conn.commit()
+        self.id_acao = database.obter_id_acao_por_ticker('TAEE11')
+        database.inserir_evento_corporativo({'id_acao': self.id_acao, 'evento': 'Desdobramento', 'razao': '1:2',
+                                             'data_aprovacao': None, 'data_registro': None, 'data_ex': '2024-02-01'})
+
+    def tearDown(self):
+        indice_eventos.invalidar_indice_eventos()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _inserir_provento(self):
+        return database.inserir_provento({'id_acao': self.id_acao, 'tipo': 'Dividendo', 'valor': 0.75,
+                                          'data_registro': None, 'data_ex': '2024-03-01', 'dt_pagamento': '2024-03-20'})
+
+    def test_distribui_para_quem_tinha_posicao_na_vespera(self):
+        provento_id = self._inserir_provento()
+        with patch.object(database, 'inserir_usuario_provento_recebido_db') as inserir_por_linha:
+            self.assertEqual(services.distribuir_provento_para_usuarios(provento_id), 2)
+            inserir_por_linha.assert_not_called()
+
+        usuario_1 = database.obter_proventos_recebidos_por_usuario_db(1)
+        self.assertEqual([(r["quantidade_possuida_na_data_ex"], r["valor_total_recebido"]) for r in usuario_1], [(160, 120.0)])
+        usuario_2 = database.obter_proventos_recebidos_por_usuario_db(2)
+        self.assertEqual(usuario_2[0]["quantidade_possuida_na_data_ex"], 100)
+        self.assertEqual(usuario_2[0]["data_ex"], date(2024, 3, 1))
+        for usuario_id in (3, 4, 5):
+            self.assertEqual(database.obter_proventos_recebidos_por_usuario_db(usuario_id), [])
+
+    def test_registros_existentes_sao_mantidos(self):
+        provento_id = self._inserir_provento()
+        services.distribuir_provento_para_usuarios(provento_id)
+        self.assertEqual(services.distribuir_provento_para_usuarios(provento_id), 0)
+        self.assertEqual(len(database.obter_proventos_recebidos_por_usuario_db(1)), 1)
+
+    def test_falha_na_distribuicao_nao_impede_o_cadastro(self):
+        from models import ProventoCreate
+        provento = ProventoCreate.model_construct(id_acao=self.id_acao, tipo='Dividendo', valor=0.75,
+                                                  data_registro=date(2024, 2, 20), data_ex=date(2024, 3, 1),
+                                                  dt_pagamento=date(2024, 3, 20))
+        with patch.object(services, 'distribuir_provento_para_usuarios', side_effect=RuntimeError('falha')):
+            try:
+                services.registrar_provento_service(self.id_acao, provento)
+            except RuntimeError:
+                self.fail("A falha na distribuição não deve impedir o cadastro do provento")
+        self.assertEqual(len(database.obter_proventos_por_acao_id(self.id_acao)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
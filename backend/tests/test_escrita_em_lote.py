@@ -0,0 +1,91 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+def _resultado(mes, ganho=0.0):
+    return {
+        "mes": mes, "vendas_swing": 0.0, "custo_swing": 0.0, "ganho_liquido_swing": ganho, "isento_swing": True,
+        "ir_devido_swing": 0.0, "ir_pagar_swing": 0.0, "vendas_day_trade": 0.0, "custo_day_trade": 0.0,
+        "ganho_liquido_day": 0.0, "ir_devido_day": 0.0, "irrf_day": 0.0, "ir_pagar_day": 0.0,
+        "prejuizo_acumulado_swing": 0.0, "prejuizo_acumulado_day": 0.0,
+        "darf_vencimento_swing": date(2024, 2, 29) if ganho else None,
+    }
+
+
+class TestEscritaEmLote(unittest.TestCase):
+    """
+    Verifica as gravações em lote (uma transação) de carteira, resultados mensais e operações fechadas.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        self.usuario_id = 1
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_upsert_de_resultado_mensal_mantem_um_registro_por_mes(self):
+        id_inicial = database.salvar_resultado_mensal(_resultado('2024-01'), usuario_id=self.usuario_id)
+        id_atualizado = database.salvar_resultado_mensal(_resultado('2024-01', 100.0), usuario_id=self.usuario_id)
+        resultados = database.obter_resultados_mensais(usuario_id=self.usuario_id)
+        self.assertEqual(id_inicial, id_atualizado)
+        self.assertEqual(len(resultados), 1)
+        self.assertEqual(resultados[0]["ganho_liquido_swing"], 100.0)
+        self.assertEqual(resultados[0]["darf_vencimento_swing"], '2024-02-29')
+
+    def test_resultados_em_lote_substituem_a_partir_do_mes(self):
+        database.salvar_resultados_mensais_em_lote(
+            self.usuario_id, [_resultado('2024-01'), _resultado('2024-02'), _resultado('2024-03')])
+        ids_antes = {r["mes"]: r["id"] for r in database.obter_resultados_mensais(usuario_id=self.usuario_id)}
+
+        database.salvar_resultados_mensais_em_lote(self.usuario_id, [_resultado('2024-02', 50.0)], mes_inicio='2024-02')
+        resultados = database.obter_resultados_mensais(usuario_id=self.usuario_id)
+        self.assertEqual([r["mes"] for r in resultados], ['2024-01', '2024-02'])
+        self.assertEqual(resultados[0]["id"], ids_antes['2024-01'])
+        self.assertEqual(resultados[1]["ganho_liquido_swing"], 50.0)
+
+    def test_falha_no_lote_desfaz_a_transacao(self):
+        database.salvar_resultados_mensais_em_lote(self.usuario_id, [_resultado('2024-01')])
+        with self.assertRaises(KeyError):
+            database.salvar_resultados_mensais_em_lote(self.usuario_id, [{"mes": '2024-02'}])
+        self.assertEqual([r["mes"] for r in database.obter_resultados_mensais(usuario_id=self.usuario_id)], ['2024-01'])
+
+    def test_carteira_em_lote(self):
+        database.salvar_carteira_em_lote(self.usuario_id, [
+            {"ticker": 'PETR4', "quantidade": 100, "preco_medio": 20.0, "custo_total": 2000.0},
+            {"ticker": 'VALE3', "quantidade": 10, "preco_medio": 50.0, "custo_total": 500.0},
+        ])
+        database.salvar_carteira_em_lote(self.usuario_id, [
+            {"ticker": 'ITUB4', "quantidade": 5, "preco_medio": 30.0, "custo_total": 150.0},
+        ], tickers_removidos=['VALE3'])
+        self.assertEqual([c["ticker"] for c in database.obter_carteira_atual(usuario_id=self.usuario_id)], ['ITUB4', 'PETR4'])
+
+        database.salvar_carteira_em_lote(self.usuario_id, [
+            {"ticker": 'BBAS3', "quantidade": 1, "preco_medio": 40.0, "custo_total": 40.0},
+        ], substituir=True)
+        self.assertEqual([c["ticker"] for c in database.obter_carteira_atual(usuario_id=self.usuario_id)], ['BBAS3'])
+
+    def test_operacoes_fechadas_em_lote_substituem_as_anteriores(self):
+        op_fechada = {
+            "data_abertura": date(2024, 1, 10), "data_fechamento": date(2024, 2, 10), "ticker": 'PETR4',
+            "quantidade": 100, "valor_compra": 20.0, "valor_venda": 25.0, "resultado": 500.0, "percentual_lucro": 25.0,
+        }
+        database.salvar_operacoes_fechadas_em_lote(self.usuario_id, [op_fechada, op_fechada])
+        database.salvar_operacoes_fechadas_em_lote(self.usuario_id, [op_fechada])
+        self.assertEqual(len(database.obter_operacoes_fechadas_salvas(usuario_id=self.usuario_id)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import os
+import sys
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import execucao
+from execucao import ExecutorServicos
+
+
+class TestExecucao(unittest.TestCase):
+    """
+    Verifica a execução de serviços bloqueantes fora do event loop, com limite de
+    concorrência por endpoint e métricas de fila.
+    """
+
+    def setUp(self):
+        self.executor = ExecutorServicos(threads=4)
+
+    def tearDown(self):
+        self.executor.encerrar()
+
+    def test_limite_de_concorrencia_por_endpoint(self):
+        simultaneas = []
+        em_execucao = [0]
+        lock = threading.Lock()
+
+        def servico():
+            with lock:
+                em_execucao[0] += 1
+                simultaneas.append(em_execucao[0])
+            time.sleep(0.05)
+            with lock:
+                em_execucao[0] -= 1
+            return threading.current_thread().name
+
+        async def cenario():
+            return await asyncio.gather(*[self.executor.executar('pesado', servico) for _ in range(6)])
+
+        with patch.dict(execucao.LIMITES_CONCORRENCIA, {'pesado': 2}):
+            threads = asyncio.run(cenario())
+
+        self.assertTrue(all(nome.startswith('servicos') for nome in threads))
+        self.assertEqual(max(simultaneas), 2)
+        metricas = self.executor.metricas()["endpoints"]["pesado"]
+        self.assertEqual(metricas["concluidas"], 6)
+        self.assertEqual(metricas["max_em_espera"], 4)  # 6 chamadas, 2 vagas
+        self.assertEqual(metricas["em_espera"], 0)
+        self.assertGreater(metricas["tempo_medio_espera"], 0.0)
+
+    def test_event_loop_continua_livre_durante_servico_bloqueante(self):
+        async def cenario():
+            servico = asyncio.ensure_future(self.executor.executar('lento', time.sleep, 0.2))
+            inicio = time.perf_counter()
+            await asyncio.sleep(0.01)
+            latencia_loop = time.perf_counter() - inicio
+            await servico
+            return latencia_loop
+
+        self.assertLess(asyncio.run(cenario()), 0.15)
+
+    def test_falha_e_contabilizada_e_propagada(self):
+        def servico():
+            raise ValueError('erro de negócio')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(self.executor.executar('falha', servico))
+        metricas = self.executor.metricas()["endpoints"]["falha"]
+        self.assertEqual((metricas["falhas"], metricas["em_execucao"]), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import fila_recalculo
+from models import AtualizacaoCarteira, OperacaoCreate
+
+
+def _op(data, ticker, operacao, quantidade, preco, taxas=0.0):
+    return OperacaoCreate(date=data, ticker=ticker, operation=operacao, quantity=quantidade, price=preco, fees=taxas)
+
+
+class TestFilaRecalculo(unittest.TestCase):
+    """
+    Verifica a fila de recálculo em segundo plano: mescla de pedidos, execução pelos
+    workers e tratamento de falhas, usando um banco SQLite temporário.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('PETR4', 'Petrobras'), ('VALE3', 'Vale')])
+            conn.commit()
+        self.fila = fila_recalculo.FilaRecalculo(2)
+        self.fila_patch = patch.object(fila_recalculo, '_fila_recalculo', self.fila)
+        self.fila_patch.start()
+        self.usuario_id = 1
+
+    def tearDown(self):
+        self.fila.parar(timeout=10)
+        self.fila_patch.stop()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_pedidos_pendentes_sao_mesclados(self):
+        job_id = database.enfileirar_job_recalculo(self.usuario_id, date(2024, 3, 1), ['PETR4'])
+        self.assertEqual(database.enfileirar_job_recalculo(self.usuario_id, date(2024, 1, 15), ['VALE3']), job_id)
+        job = database.obter_job_recalculo(job_id, self.usuario_id)
+        self.assertEqual(job["a_partir_de"], date(2024, 1, 15))
+        self.assertEqual(job["tickers"], ['PETR4', 'VALE3'])
+        self.assertEqual(job["solicitacoes"], 2)
+
+        # Histórico completo (None) prevalece sobre qualquer data ou lista de tickers
+        database.enfileirar_job_recalculo(self.usuario_id, None, None)
+        job = database.obter_job_recalculo(job_id, self.usuario_id)
+        self.assertIsNone(job["a_partir_de"])
+        self.assertIsNone(job["tickers"])
+
+        # Um job em execução não recebe novos pedidos: um novo job pendente é criado
+        self.assertEqual(database.reservar_proximo_job_recalculo()["id"], job_id)
+        self.assertNotEqual(database.enfileirar_job_recalculo(self.usuario_id, date(2024, 5, 1), ['PETR4']), job_id)
+        self.assertIsNone(database.reservar_proximo_job_recalculo())  # mesmo usuário: execução em série
+        self.assertEqual(database.reiniciar_jobs_recalculo_interrompidos(), 1)
+
+    def test_workers_executam_o_recalculo_enfileirado(self):
+        services.inserir_operacao_manual(_op(date(2024, 1, 10), 'PETR4', 'buy', 100, 20.0), self.usuario_id,
+                                         em_segundo_plano=True)
+        services.inserir_operacao_manual(_op(date(2024, 2, 10), 'PETR4', 'sell', 40, 25.0), self.usuario_id,
+                                         em_segundo_plano=True)
+        self.assertTrue(fila_recalculo.aguardar_fila_recalculo(timeout=30))
+
+        jobs = database.listar_jobs_recalculo_usuario(self.usuario_id)
+        self.assertTrue(all(job["status"] == 'concluido' and job["progresso"] == 100 for job in jobs))
+        self.assertEqual(sum(job["solicitacoes"] for job in jobs), 2)
+        self.assertEqual(database.obter_carteira_atual(usuario_id=self.usuario_id)[0]["quantidade"], 60)
+        fevereiro = next(r for r in database.obter_resultados_mensais(usuario_id=self.usuario_id) if r["mes"] == '2024-02')
+        self.assertAlmostEqual(fevereiro["ganho_liquido_swing"], 200.0)
+
+    def test_falha_no_job_fica_registrada(self):
+        with patch.object(fila_recalculo, 'executar_job_recalculo', side_effect=RuntimeError('falhou')):
+            job_id = fila_recalculo.enfileirar_recalculo(self.usuario_id, date(2024, 1, 1), ['PETR4'])
+            self.assertTrue(fila_recalculo.aguardar_fila_recalculo(timeout=30))
+        job = database.obter_job_recalculo(job_id, self.usuario_id)
+        self.assertEqual(job["status"], 'erro')
+        self.assertEqual(job["erro"], 'falhou')
+
+    def _inserir_e_enfileirar(self, tickers):
+        # Operação gravada e job pendente ainda não reservado por nenhum worker
+        database.inserir_operacao({'date': date(2024, 1, 10), 'ticker': 'PETR4', 'operation': 'buy',
+                                   'quantity': 100, 'price': 20.0, 'fees': 0.0}, usuario_id=self.usuario_id)
+        return database.enfileirar_job_recalculo(self.usuario_id, date(2024, 1, 10), tickers)
+
+    def test_edicao_manual_sobrevive_ao_recalculo_pendente(self):
+        for tickers in (['PETR4'], None):
+            with self.subTest(tickers=tickers):
+                job_id = self._inserir_e_enfileirar(tickers)
+                services.atualizar_item_carteira(AtualizacaoCarteira(ticker='PETR4', quantidade=80, preco_medio=18.0),
+                                                 self.usuario_id, em_segundo_plano=True)
+                job = database.obter_job_recalculo(job_id, self.usuario_id)
+                self.assertTrue(job["recalcular_carteira"])
+                self.assertEqual(job["tickers_manuais"], ['PETR4'])
+                self.assertTrue(fila_recalculo.aguardar_fila_recalculo(timeout=30))
+
+                self.assertEqual(database.obter_job_recalculo(job_id, self.usuario_id)["status"], 'concluido')
+                item = database.obter_carteira_atual(usuario_id=self.usuario_id)[0]
+                self.assertEqual((item["quantidade"], item["preco_medio"]), (80, 18.0))
+                with database.get_db() as conn:
+                    conn.execute('DELETE FROM operacoes')
+                    conn.commit()
+
+    def test_alteracao_de_operacao_posterior_a_edicao_reconstroi_o_ticker(self):
+        database.enfileirar_job_recalculo(self.usuario_id, recalcular_carteira=False, tickers_manuais=['PETR4', 'VALE3'])
+        job_id = database.enfileirar_job_recalculo(self.usuario_id, date(2024, 1, 10), ['PETR4'])
+        self.assertEqual(database.obter_job_recalculo(job_id, self.usuario_id)["tickers_manuais"], ['VALE3'])
+        database.enfileirar_job_recalculo(self.usuario_id, None, None)
+        self.assertEqual(database.obter_job_recalculo(job_id, self.usuario_id)["tickers_manuais"], [])
+
+    def test_edicao_recusada_durante_reconstrucao_da_carteira(self):
+        job_id = self._inserir_e_enfileirar(['PETR4'])
+        self.assertEqual(database.reservar_proximo_job_recalculo()["id"], job_id)
+        with self.assertRaises(database.ErroRecalculoEmAndamento):
+            services.atualizar_item_carteira(AtualizacaoCarteira(ticker='PETR4', quantidade=80, preco_medio=18.0),
+                                             self.usuario_id, em_segundo_plano=True)
+        self.assertEqual(database.obter_carteira_atual(usuario_id=self.usuario_id), [])
+        self.assertEqual(len(database.listar_jobs_recalculo_usuario(self.usuario_id)), 1)
+        database.reiniciar_jobs_recalculo_interrompidos()
+
+    def test_worker_continua_apos_falha_na_consulta(self):
+        reservar = database.reservar_proximo_job_recalculo
+        falhas = [sqlite3.OperationalError('database is locked')]
+
+        def reservar_com_falha(*args):
+            if falhas:
+                raise falhas.pop()
+            return reservar(*args)
+
+        with patch.object(fila_recalculo, 'reservar_proximo_job_recalculo', side_effect=reservar_com_falha), \
+             patch.object(fila_recalculo, 'ESPERA_APOS_FALHA_FILA', 0.01):
+            job_id = fila_recalculo.enfileirar_recalculo(self.usuario_id, date(2024, 1, 1), ['PETR4'])
+            self.assertTrue(fila_recalculo.aguardar_fila_recalculo(timeout=30))
+        self.assertEqual(falhas, [])
+        self.assertTrue(self.fila.ativa)
+        self.assertEqual(database.obter_job_recalculo(job_id, self.usuario_id)["status"], 'concluido')
+
+    def test_sem_workers_executa_apenas_os_jobs_do_usuario(self):
+        with patch.object(fila_recalculo, '_fila_recalculo', fila_recalculo.FilaRecalculo(0)):
+            job_outro = database.enfileirar_job_recalculo(2, date(2024, 1, 1), ['VALE3'])
+            job_id = fila_recalculo.enfileirar_recalculo(self.usuario_id, date(2024, 1, 1), ['PETR4'])
+        self.assertEqual(database.obter_job_recalculo(job_id, self.usuario_id)["status"], 'concluido')
+        self.assertEqual(database.obter_job_recalculo(job_outro, 2)["status"], 'pendente')
+
+    def test_purga_dos_jobs_finalizados(self):
+        antigo = database.enfileirar_job_recalculo(self.usuario_id, None, None)
+        database.reservar_proximo_job_recalculo()
+        database.finalizar_job_recalculo(antigo)
+        recente = database.enfileirar_job_recalculo(self.usuario_id, None, None)
+        database.reservar_proximo_job_recalculo()
+        database.finalizar_job_recalculo(recente, erro='falhou')
+        pendente = database.enfileirar_job_recalculo(self.usuario_id, None, None)
+        with database.get_db() as conn:
+            conn.execute('UPDATE jobs_recalculo SET concluido_em = ? WHERE id = ?',
+                         ((datetime.now() - timedelta(days=10)).isoformat(timespec="seconds"), antigo))
+            conn.commit()
+
+        self.assertEqual(database.purgar_jobs_recalculo_finalizados(7), 1)
+        restantes = [job["id"] for job in database.listar_jobs_recalculo_usuario(self.usuario_id)]
+        self.assertEqual(restantes, [pendente, recente])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import auth
+import execucao
+from execucao import executar_hash_senha
+
+
+class TestHashSenhas(unittest.TestCase):
+    """
+    Verifica o hash de senhas com parâmetros configuráveis, o rehash transparente no
+    login e a execução do hash no pool dedicado, fora do event loop.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        self.usuario_id = auth.criar_usuario('ana', 'ana@example.com', 'senha123')
+
+    def tearDown(self):
+        auth.invalidar_cache_autenticacao()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _senha_gravada(self):
+        with database.get_db() as conn:
+            row = conn.execute('SELECT senha_hash, senha_salt FROM usuarios WHERE id = ?', (self.usuario_id,)).fetchone()
+            return row['senha_hash'], row['senha_salt']
+
+    def test_hash_registra_os_parametros(self):
+        senha_hash, salt = self._senha_gravada()
+        self.assertTrue(senha_hash.startswith(f'pbkdf2_sha256${auth.PASSWORD_HASH_ITERATIONS}$'))
+        self.assertTrue(auth.verificar_senha('senha123', salt, senha_hash))
+        self.assertFalse(auth.verificar_senha('senha124', salt, senha_hash))
+        self.assertFalse(auth.precisa_rehash(senha_hash))
+
+    def test_hash_no_formato_anterior_continua_valido(self):
+        salt = auth.gerar_salt()
+        legado = hashlib.pbkdf2_hmac('sha256', b'senha123', bytes.fromhex(salt), 100000).hex()
+        self.assertTrue(auth.verificar_senha('senha123', salt, legado))
+        with patch.object(auth, 'PASSWORD_HASH_ITERATIONS', 200000):
+            self.assertTrue(auth.precisa_rehash(legado))
+
+    def test_login_refaz_hash_com_novos_parametros(self):
+        antes, _ = self._senha_gravada()
+        with patch.object(auth, 'PASSWORD_HASH_ITERATIONS', 1000):
+            self.assertIsNotNone(auth.verificar_credenciais('ana', 'senha123'))
+            depois, salt = self._senha_gravada()
+            self.assertNotEqual(depois, antes)
+            self.assertTrue(depois.startswith('pbkdf2_sha256$1000$'))
+            # Senha errada não altera o hash
+            self.assertIsNone(auth.verificar_credenciais('ana', 'errada'))
+            self.assertEqual(self._senha_gravada()[0], depois)
+        # De volta aos parâmetros originais, o hash de 1000 iterações ainda é aceito e é refeito
+        self.assertIsNotNone(auth.verificar_credenciais('ana@example.com', 'senha123'))
+        self.assertTrue(self._senha_gravada()[0].startswith(f'pbkdf2_sha256${auth.PASSWORD_HASH_ITERATIONS}$'))
+
+    def test_hash_nao_bloqueia_o_event_loop(self):
+        async def cenario():
+            ticks = 0
+            parar = asyncio.Event()
+
+            async def contar():
+                nonlocal ticks
+                while not parar.is_set():
+                    await asyncio.sleep(0.001)
+                    ticks += 1
+
+            contador = asyncio.create_task(contar())
+            with patch.object(auth, 'PASSWORD_HASH_ITERATIONS', 400000):
+                usuario = await executar_hash_senha('auth.login', auth.verificar_credenciais, 'ana', 'senha123')
+            parar.set()
+            await contador
+            return usuario, ticks
+
+        usuario, ticks = asyncio.run(cenario())
+        self.assertEqual(usuario['id'], self.usuario_id)
+        self.assertGreater(ticks, 5)
+        self.assertIn('auth.login', execucao.obter_metricas_execucao()['hash_senhas']['endpoints'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+import os
+import sys
+import io
+import json
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import importador_operacoes
+from importador_operacoes import ErroImportacao, importar_operacoes_arquivo, iterar_operacoes_json
+
+
+class TestImportadorOperacoes(unittest.TestCase):
+    """
+    Verifica a importação em streaming (JSON e CSV) gravada em lotes com um único recálculo.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('PETR4', 'Petrobras'), ('VALE3', 'Vale')])
+            conn.commit()
+        self.usuario_id = 1
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_json_lido_em_blocos_pequenos(self):
+        elementos = [{"ticker": 'PETR4', "price": 12345.5, "texto": "a, ] {b}"}, [1, 2], 1234567, "fim"]
+        conteudo = json.dumps(elementos, ensure_ascii=False).encode('utf-8')
+        self.assertEqual(list(iterar_operacoes_json(io.BytesIO(conteudo), tamanho_bloco=3)), elementos)
+        self.assertEqual(list(iterar_operacoes_json(io.BytesIO(b' [ ] '))), [])
+        with self.assertRaises(json.JSONDecodeError):
+            list(iterar_operacoes_json(io.BytesIO(b'[{"a": 1} {"b": 2}]'), tamanho_bloco=4))
+        with self.assertRaises(json.JSONDecodeError):
+            list(iterar_operacoes_json(io.BytesIO(b'[{"a": 1},'), tamanho_bloco=4))
+
+    def test_importacao_json_em_lotes_recalcula_uma_vez(self):
+        operacoes = [
+            {"date": '2024-01-10', "ticker": 'PETR4', "operation": 'buy', "quantity": 10, "price": 20.0, "fees": 1.0}
+            for _ in range(7)
+        ] + [{"Data do Negócio": '05/02/2024', "Código de Negociação": 'PETR4', "Tipo de Movimentação": 'Venda',
+              "Quantidade": 30, "Preço": 'R$25,00'}]
+        arquivo = io.BytesIO(json.dumps(operacoes).encode('utf-8'))
+
+        with patch.object(importador_operacoes, 'recalcular_carteira', wraps=services.recalcular_carteira) as carteira, \
+             patch.object(importador_operacoes, 'recalcular_resultados', wraps=services.recalcular_resultados) as resultados:
+            resultado = importar_operacoes_arquivo(arquivo, self.usuario_id, 'operacoes.json', tamanho_lote=3)
+
+        self.assertEqual(resultado, {"operacoes_importadas": 8, "job_id": None})
+        carteira.assert_called_once_with(usuario_id=self.usuario_id, tickers=['PETR4'])
+        resultados.assert_called_once_with(usuario_id=self.usuario_id, a_partir_de=date(2024, 1, 10))
+        posicao = database.obter_carteira_atual(usuario_id=self.usuario_id)[0]
+        self.assertEqual(posicao["quantidade"], 40)
+
+    def test_importacao_csv_exportacao_b3(self):
+        csv_b3 = (
+            "Data do Negócio;Tipo de Movimentação;Mercado;Prazo/Vencimento;Instituição;Código de Negociação;Quantidade;Preço;Valor\n"
+            "10/01/2024;Compra;Mercado à Vista;-;CORRETORA X;VALE3F;100;R$ 1.050,50;R$ 105.050,00\n"
+            "\n"
+            "11/01/2024;Venda;Mercado à Vista;-;CORRETORA X;VALE3;40;R$ 1.060,00;R$ 42.400,00\n"
+        ).encode('utf-8-sig')
+
+        resultado = importar_operacoes_arquivo(io.BytesIO(csv_b3), self.usuario_id, 'negociacao.csv')
+
+        self.assertEqual(resultado["operacoes_importadas"], 2)
+        operacoes = database.obter_todas_operacoes(usuario_id=self.usuario_id)
+        self.assertEqual([(op["ticker"], op["operation"], op["quantity"]) for op in operacoes],
+                         [('VALE3', 'buy', 100), ('VALE3', 'sell', 40)])
+        self.assertAlmostEqual(operacoes[0]["price"], 1050.5)
+
+    def test_ticker_inexistente_interrompe_sem_perder_lotes_gravados(self):
+        operacoes = [
+            {"date": '2024-01-10', "ticker": 'PETR4', "operation": 'buy', "quantity": 10, "price": 20.0},
+            {"date": '2024-01-11', "ticker": 'XXXX3', "operation": 'buy', "quantity": 10, "price": 20.0},
+        ]
+        arquivo = io.BytesIO(json.dumps(operacoes).encode('utf-8'))
+
+        with self.assertRaisesRegex(ValueError, 'XXXX3') as erro:
+            importar_operacoes_arquivo(arquivo, self.usuario_id, tamanho_lote=1)
+        self.assertIsInstance(erro.exception, ErroImportacao)
+        self.assertEqual((erro.exception.operacoes_importadas, erro.exception.operacao), (1, 2))
+
+        # O primeiro lote foi gravado e a carteira reflete o que foi importado
+        self.assertEqual(len(database.obter_todas_operacoes(usuario_id=self.usuario_id)), 1)
+        self.assertEqual(database.obter_carteira_atual(usuario_id=self.usuario_id)[0]["quantidade"], 10)
+
+    def test_erro_informa_operacao_e_operacoes_importadas(self):
+        valida = {"date": '2024-01-10', "ticker": 'PETR4', "operation": 'buy', "quantity": 10, "price": 20.0}
+        # Lotes de 2: o primeiro é gravado, o segundo é descartado junto com a operação inválida (a 4ª)
+        operacoes = [valida, valida, valida, {**valida, "price": -1}, valida]
+        with self.assertRaises(ErroImportacao) as erro:
+            importar_operacoes_arquivo(io.BytesIO(json.dumps(operacoes).encode('utf-8')), self.usuario_id, tamanho_lote=2)
+        self.assertEqual((erro.exception.operacoes_importadas, erro.exception.operacao), (2, 4))
+        self.assertEqual(len(database.obter_todas_operacoes(usuario_id=self.usuario_id)), 2)
+
+        # Ticker inexistente no meio de um lote e arquivo truncado
+        operacoes = [valida, {**valida, "ticker": 'XXXX3'}]
+        with self.assertRaises(ErroImportacao) as erro:
+            importar_operacoes_arquivo(io.BytesIO(json.dumps(operacoes).encode('utf-8')), self.usuario_id)
+        self.assertEqual((erro.exception.operacoes_importadas, erro.exception.operacao), (0, 2))
+        with self.assertRaises(ErroImportacao) as erro:
+            importar_operacoes_arquivo(io.BytesIO(json.dumps([valida]).encode('utf-8')[:-1] + b','), self.usuario_id)
+        self.assertEqual(erro.exception.operacao, 2)
+        self.assertIsInstance(erro.exception.causa, json.JSONDecodeError)
+
+    def test_upload_parcial(self):
+        from fastapi.testclient import TestClient
+        import main
+        from dependencies import get_current_user
+        from models import UsuarioResponse
+
+        main.app.dependency_overrides[get_current_user] = lambda: UsuarioResponse(
+            id=self.usuario_id, username='teste', email='teste@example.com', nome_completo='Teste', funcoes=[])
+        self.addCleanup(main.app.dependency_overrides.clear)
+        cliente = TestClient(main.app)
+        valida = {"date": '2024-01-10', "ticker": 'PETR4', "operation": 'buy', "quantity": 10, "price": 20.0}
+
+        # Um lote completo (TAMANHO_LOTE_IMPORTACAO) é gravado antes da operação inválida
+        lote = importador_operacoes.TAMANHO_LOTE_IMPORTACAO
+        conteudo = json.dumps([valida] * lote + [{**valida, "ticker": 'XXXX3'}])
+        resposta = cliente.post('/api/upload', files={'file': ('ops.json', conteudo)})
+        self.assertEqual(resposta.status_code, 200)
+        corpo = resposta.json()
+        self.assertTrue(corpo['parcial'])
+        self.assertEqual((corpo['operacoes_importadas'], corpo['operacao_com_erro']), (lote, lote + 1))
+        self.assertIn('XXXX3', corpo['erro'])
+
+        # Nada gravado: o erro continua sendo 400 (e 422 para operação inválida)
+        resposta = cliente.post('/api/upload', files={'file': ('ops.json', json.dumps([{**valida, "ticker": 'XXXX3'}]))})
+        self.assertEqual(resposta.status_code, 400)
+        resposta = cliente.post('/api/upload', files={'file': ('ops.json', json.dumps([{**valida, "price": -1}]))})
+        self.assertEqual(resposta.status_code, 422)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import sys
+import random
+import tempfile
+from datetime import date, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import indice_eventos
+from indice_eventos import IndiceEventos, obter_indice_eventos
+from models import EventoCorporativoInfo, EventoCorporativoCreate
+
+
+def _ajustar_evento_a_evento(quantidade, preco, data_operacao, eventos, data_limite):
+    """Ajuste de referência: aplica cada evento chamando os métodos do modelo."""
+    for evento in sorted(eventos, key=lambda e: e.data_ex):
+        if not (data_operacao < evento.data_ex <= data_limite):
+            continue
+        if evento.evento.lower().startswith("bonific"):
+            nova_quantidade = float(quantidade) + evento.get_bonus_quantity_increase(float(quantidade))
+            if nova_quantidade > 0:
+                preco = float(preco) * float(quantidade) / nova_quantidade
+            quantidade = int(round(nova_quantidade))
+            continue
+        fator = evento.get_adjustment_factor()
+        if fator != 1.0:
+            if fator != 0:
+                preco = float(preco) / fator
+            quantidade = int(round(float(quantidade) * fator))
+    return quantidade, preco
+
+
+class TestIndiceEventos(unittest.TestCase):
+    """
+    Verifica o índice de eventos corporativos: equivalência com o ajuste evento a
+    evento, cache por ticker e invalidação ao registrar um novo evento.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.execute('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', ('BBAS3', 'Banco do Brasil'))
+            conn.commit()
+        self.id_acao = database.obter_id_acao_por_ticker('BBAS3')
+
+    def tearDown(self):
+        indice_eventos.invalidar_indice_eventos()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_equivale_ao_ajuste_evento_a_evento(self):
+        random.seed(3)
+        tipos = [("Desdobramento", "1:2"), ("Desdobramento", "1:3"), ("Grupamento", "10:1"),
+                 ("Bonificação", "1:10"), ("Bonificação", "1:1"), ("Desdobramento", "2:3")]
+        for _ in range(200):
+            eventos = []
+            for i in range(random.randint(0, 4)):
+                tipo, razao = random.choice(tipos)
+                eventos.append(EventoCorporativoInfo(id=i + 1, id_acao=1, evento=tipo, razao=razao,
+                                                     data_ex=date(2024, 1, 1) + timedelta(days=random.randint(0, 60))))
+            indice = IndiceEventos(eventos)
+            data_operacao = date(2024, 1, 1) + timedelta(days=random.randint(0, 60))
+            data_limite = date(2024, 1, 1) + timedelta(days=random.randint(0, 70))
+            quantidade = random.randint(1, 1000)
+            esperado = _ajustar_evento_a_evento(quantidade, 25.0, data_operacao, eventos, data_limite)
+            obtido = indice.ajustar(quantidade, 25.0, data_operacao, data_limite)
+            self.assertEqual(obtido[0], esperado[0])
+            self.assertAlmostEqual(obtido[1], esperado[1], places=9)
+
+    def test_eventos_ate_respeita_data_limite(self):
+        indice = IndiceEventos([
+            EventoCorporativoInfo(id=2, id_acao=1, evento="Grupamento", razao="10:1", data_ex=date(2024, 3, 1)),
+            EventoCorporativoInfo(id=1, id_acao=1, evento="Desdobramento", razao="1:2", data_ex=date(2024, 1, 1)),
+            EventoCorporativoInfo(id=3, id_acao=1, evento="Desdobramento", razao="1:2", data_ex=None),
+        ])
+        self.assertEqual([e.id for e in indice.eventos_ate(date(2024, 2, 1))], [1])
+        self.assertEqual([e.id for e in indice.eventos_ate()], [1, 2])
+        # Operação na própria data ex não é ajustada pelo evento
+        self.assertEqual(indice.ajustar_quantidade(100, date(2024, 1, 1)), 10)
+        self.assertEqual(indice.ajustar_quantidade(100, date(2023, 12, 31), date(2024, 1, 1)), 200)
+
+    def test_cache_e_invalidado_ao_registrar_evento(self):
+        indice = obter_indice_eventos('BBAS3')
+        self.assertEqual(len(indice), 0)
+        with patch.object(indice_eventos, 'obter_eventos_corporativos_por_acao_id') as consulta:
+            self.assertIs(obter_indice_eventos('BBAS3'), indice)
+            consulta.assert_not_called()
+
+        # model_construct: o serviço recebe as datas já convertidas pelos validadores
+        services.registrar_evento_corporativo_service(self.id_acao, EventoCorporativoCreate.model_construct(
+            id_acao=self.id_acao, evento="Desdobramento", razao="1:2",
+            data_aprovacao=None, data_registro=None, data_ex=date(2024, 4, 16)))
+        indice = obter_indice_eventos('BBAS3')
+        self.assertEqual(indice.datas_ex, [date(2024, 4, 16)])
+        self.assertEqual(indice.ajustar_quantidade(1000, date(2024, 1, 10)), 2000)
+        self.assertEqual(services._carregar_eventos_por_ticker(['BBAS3'], date(2024, 4, 15)), {'BBAS3': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import instrumentacao_db
+from execucao import executar_servico
+from instrumentacao_db import medir_consultas, medicao_atual, forma_consulta
+
+
+class TestInstrumentacaoDb(unittest.TestCase):
+    """
+    Verifica a contagem de consultas, linhas e tempo de banco por requisição, a
+    propagação da medição para o pool de serviços, o aviso de consultas repetidas
+    (N+1) e os cabeçalhos de depuração.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        # main cria as tabelas ao ser importado: a importação vem depois do patch do arquivo do banco
+        import main
+        self.main = main
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [(f'TICK{i}', f'Empresa {i}') for i in range(10)])
+            conn.commit()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_forma_da_consulta(self):
+        self.assertEqual(forma_consulta("SELECT * FROM acoes\n   WHERE ticker = 'PETR4' AND id IN (?, ?,?)  LIMIT 10"),
+                         "SELECT * FROM acoes WHERE ticker = ? AND id IN (?+) LIMIT ?")
+        self.assertEqual(forma_consulta("SELECT id FROM t WHERE a = ?"), forma_consulta("SELECT id  FROM t WHERE a = ?"))
+
+    def test_conta_consultas_linhas_e_tempo(self):
+        with medir_consultas('teste') as medicao:
+            with database.get_db() as conn:
+                self.assertEqual(len(conn.execute('SELECT * FROM acoes').fetchall()), 10)
+                self.assertEqual(sum(1 for _ in conn.execute('SELECT * FROM acoes WHERE id <= 4')), 4)
+                cursor = conn.cursor()
+                cursor.execute('SELECT ticker FROM acoes WHERE ticker = ?', ('TICK1',))
+                self.assertEqual(cursor.fetchone()['ticker'], 'TICK1')
+            self.assertIsNotNone(database.obter_acao_info_por_ticker('TICK2'))
+        self.assertEqual(medicao.consultas, 4)
+        # A iteração direta sobre o cursor não conta linhas (só fetchone/fetchmany/fetchall)
+        self.assertEqual(medicao.linhas, 12)
+        self.assertGreater(medicao.tempo, 0)
+        self.assertIsNone(medicao_atual())
+
+        # Fora de uma requisição nada é medido
+        database.obter_acao_info_por_ticker('TICK3')
+        self.assertEqual(medicao.consultas, 4)
+
+    def test_medicao_propagada_ao_pool_de_servicos(self):
+        async def requisicao():
+            with medir_consultas('GET /teste') as medicao:
+                await executar_servico('teste.acao', database.obter_acao_info_por_ticker, 'TICK1')
+                await executar_servico('teste.acao', database.obter_acao_info_por_ticker, 'TICK2')
+            return medicao
+
+        medicao = asyncio.run(requisicao())
+        self.assertEqual(medicao.consultas, 2)
+        self.assertEqual(medicao.linhas, 2)
+
+    def test_aviso_de_consulta_repetida(self):
+        with patch.object(instrumentacao_db, 'DB_QUERY_REPEAT_LIMIT', 5):
+            with self.assertLogs(instrumentacao_db.logger, level=logging.WARNING) as logs:
+                with medir_consultas('GET /api/acoes') as medicao:
+                    for i in range(10):
+                        database.obter_acao_info_por_ticker(f'TICK{i}')
+                    database.obter_acao_info_por_ticker('TICK0')
+            self.assertEqual(medicao.repetidas(), [('SELECT ticker, nome, cnpj FROM acoes WHERE ticker = ?', 11)])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('[GET /api/acoes] consulta executada 11x', logs.records[0].getMessage())
+
+    def test_cabecalhos_em_modo_debug(self):
+        cliente = TestClient(self.main.app)
+        with patch.object(self.main, 'DB_DEBUG_HEADERS', True):
+            resposta = cliente.get('/api/acoes')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()), 10)
+        self.assertEqual(resposta.headers['X-DB-Queries'], '1')
+        self.assertEqual(resposta.headers['X-DB-Rows'], '10')
+        self.assertIn('X-DB-Time-Ms', resposta.headers)
+        self.assertEqual(resposta.headers['X-DB-Repeated-Queries'], '0')
+
+        self.assertNotIn('X-DB-Queries', cliente.get('/api/acoes').headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
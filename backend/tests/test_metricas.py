@@ -0,0 +1,130 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import metricas
+import services
+from auth import CacheTTL
+from metricas import Contador, Histograma, exportar_prometheus
+
+
+class TestMetricas(unittest.TestCase):
+    """
+    Verifica os contadores e histogramas por thread, o formato de exposição do
+    Prometheus e as métricas de requisições, recálculos, caches e fila em /api/metrics.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        # main cria as tabelas ao ser importado: a importação vem depois do patch do arquivo do banco
+        import main
+        self.main = main
+        database.criar_tabelas()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_contador_e_histograma_somam_todas_as_threads(self):
+        contador = Contador('teste_threads_total', 'Contador de teste.', ('tipo',))
+        histograma = Histograma('teste_threads_segundos', 'Histograma de teste.', buckets=(0.1, 1.0))
+
+        def gravar():
+            for _ in range(1000):
+                contador.incrementar('a')
+                histograma.observar(0.5)
+            contador.incrementar('b', quantidade=2.5)
+            histograma.observar(0.05)
+            histograma.observar(3.0)
+
+        threads = [threading.Thread(target=gravar) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(contador.valores(), {('a',): 4000, ('b',): 10.0})
+        texto = exportar_prometheus()
+        self.assertIn('# TYPE teste_threads_total counter', texto)
+        self.assertIn('teste_threads_total{tipo="a"} 4000', texto)
+        self.assertIn('teste_threads_total{tipo="b"} 10', texto)
+        self.assertIn('# TYPE teste_threads_segundos histogram', texto)
+        self.assertIn('teste_threads_segundos_bucket{le="0.1"} 4', texto)
+        self.assertIn('teste_threads_segundos_bucket{le="1"} 4004', texto)
+        self.assertIn('teste_threads_segundos_bucket{le="+Inf"} 4008', texto)
+        self.assertIn('teste_threads_segundos_count 4008', texto)
+        self.assertIn('teste_threads_segundos_sum 2012.2', texto)
+
+    def test_rotulos_escapados_e_redeclaracao(self):
+        contador = Contador('teste_escape_total', 'Contador de teste.', ('rota',))
+        contador.incrementar('a"b\\c')
+        self.assertIn('teste_escape_total{rota="a\\"b\\\\c"} 1', exportar_prometheus())
+        # A mesma métrica declarada de novo (módulo importado por outro caminho) substitui a anterior
+        Contador('teste_escape_total', 'Contador de teste.', ('rota',)).incrementar('x')
+        texto = exportar_prometheus()
+        self.assertEqual(texto.count('# TYPE teste_escape_total counter'), 1)
+        self.assertIn('teste_escape_total{rota="x"} 1', texto)
+        self.assertNotIn('rota="a', texto)
+
+    def test_recalculo_e_motor(self):
+        with database.get_db() as conn:
+            conn.execute('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', ('PETR4', 'Petrobras'))
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(f'2024-01-{dia:02d}', 'PETR4', 'buy' if dia % 3 else 'sell', 100, 30.0, 1.0, 1) for dia in range(1, 13)])
+            conn.commit()
+        antes_ops = metricas.OPERACOES_MOTOR.valores().get((), 0)
+        antes_recalculos = metricas.DURACAO_RECALCULO.valores().get(('recalcular_carteira',), [0] * 15)
+
+        services.recalcular_carteira(usuario_id=1)
+
+        self.assertEqual(metricas.OPERACOES_MOTOR.valores()[()] - antes_ops, 12)
+        depois = metricas.DURACAO_RECALCULO.valores()[('recalcular_carteira',)]
+        self.assertEqual(sum(depois[:-1]) - sum(antes_recalculos[:-1]), 1)
+        self.assertRegex(exportar_prometheus(), r'investir_motor_operacoes_por_segundo \d')
+
+    def test_estatisticas_do_cache(self):
+        cache = CacheTTL(10)
+        cache.guardar('a', 1, ttl=60, geracao=cache.geracao())
+        cache.obter('a')
+        cache.obter('a')
+        cache.obter('b')
+        self.assertEqual(cache.estatisticas(), {'acertos': 2, 'falhas': 1, 'entradas': 1})
+
+    def test_endpoint_de_metricas(self):
+        database.enfileirar_job_recalculo(1)
+        cliente = TestClient(self.main.app)
+        self.assertEqual(cliente.get('/api/acoes').status_code, 200)
+        self.assertEqual(cliente.get('/api/inexistente/123').status_code, 404)
+
+        resposta = cliente.get('/api/metrics')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        texto = resposta.text
+        self.assertRegex(texto, r'investir_http_duracao_segundos_count\{metodo="GET",rota="/api/acoes",status="200"\} \d+')
+        self.assertIn('rota="sem_rota",status="404"', texto)
+        self.assertNotIn('/api/inexistente', texto)
+        self.assertIn('investir_fila_recalculo_jobs{status="pendente"} 1', texto)
+        for nome in ('investir_db_conexoes_em_uso', 'investir_cache_taxa_acerto{cache="tokens"}',
+                     'investir_http_consultas_db_total{rota="/api/acoes"}'):
+            self.assertIn(nome, texto)
+
+        with patch.object(self.main, 'METRICS_TOKEN', 'segredo'):
+            self.assertEqual(cliente.get('/api/metrics').status_code, 401)
+            resposta = cliente.get('/api/metrics', headers={'Authorization': 'Bearer segredo'})
+            self.assertEqual(resposta.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import migracoes
+
+
+class TestMigracoes(unittest.TestCase):
+    """
+    Verifica o esquema versionado: inicialização de um banco atualizado com uma única
+    verificação de versão, atualização de bancos legados e atomicidade das migrações.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.tmpdir.name, 'test.db')
+        self.db_patch = patch.object(database, 'DATABASE_FILE', self.arquivo)
+        self.db_patch.start()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_banco_atualizado_nao_reexecuta_o_esquema(self):
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            emitidas = []
+            conn.set_trace_callback(emitidas.append)
+            try:
+                database.criar_tabelas()
+            finally:
+                conn.set_trace_callback(None)
+        alteracoes = [sql for sql in emitidas
+                      if sql.lstrip().upper().startswith(("PRAGMA", "ALTER", "DROP", "INSERT", "CREATE INDEX"))]
+        self.assertEqual(alteracoes, [])
+        self.assertEqual(sum("schema_version" in sql for sql in emitidas), 2)  # CREATE IF NOT EXISTS e MAX(versao)
+
+    def test_banco_legado_recebe_esquema_base_e_migracoes(self):
+        # Banco anterior ao versionamento: operacoes sem usuario_id e sem schema_version
+        conn = sqlite3.connect(self.arquivo)
+        conn.execute('CREATE TABLE operacoes (id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT NOT NULL, ticker TEXT NOT NULL, '
+                     'operation TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL NOT NULL, fees REAL NOT NULL DEFAULT 0.0)')
+        conn.execute("INSERT INTO operacoes (date, ticker, operation, quantity, price) VALUES ('2024-01-10', 'PETR4', 'buy', 100, 30.0)")
+        conn.commit()
+        conn.close()
+
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            self.assertEqual(migracoes.obter_versao_esquema(conn), migracoes.VERSAO_ESQUEMA)
+            colunas = {row[1] for row in conn.execute("PRAGMA table_info(operacoes)")}
+            self.assertTrue({'usuario_id', 'corretora_id'} <= colunas)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM operacoes").fetchone()[0], 1)
+            self.assertIsNotNone(conn.execute("SELECT 1 FROM usuarios WHERE username = 'admin'").fetchone())
+
+    def test_falha_na_migracao_desfaz_o_passo(self):
+        database.criar_tabelas()
+
+        def passo_com_falha(cursor):
+            cursor.execute('CREATE INDEX idx_teste_migracao ON operacoes(price)')
+            raise RuntimeError('falha no passo')
+
+        versao = migracoes.VERSAO_ESQUEMA + 1
+        with patch.object(migracoes, 'MIGRACOES', migracoes.MIGRACOES + [(versao, "Passo com falha", passo_com_falha)]):
+            with database.get_db() as conn:
+                with self.assertRaises(RuntimeError):
+                    migracoes.aplicar_migracoes(conn)
+                self.assertEqual(migracoes.obter_versao_esquema(conn), migracoes.VERSAO_ESQUEMA)
+                self.assertIsNone(conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'idx_teste_migracao'").fetchone())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from motor_posicoes import executar_motor
+from models import EventoCorporativoInfo
+
+
+def _op(op_id, data, ticker, operacao, quantidade, preco, taxas=0.0):
+    return {"id": op_id, "date": data, "ticker": ticker, "operation": operacao,
+            "quantity": quantidade, "price": preco, "fees": taxas}
+
+
+def _evento(evento, data_ex, razao):
+    return EventoCorporativoInfo(id=1, id_acao=1, evento=evento, data_ex=data_ex, razao=razao)
+
+
+class TestMotorPosicoes(unittest.TestCase):
+    """
+    Verifica que a passada única do motor mantém carteira, apuração mensal e lotes FIFO
+    consistentes entre si, inclusive na presença de eventos corporativos.
+    """
+
+    def test_carteira_resultados_e_fechadas_consistentes(self):
+        operacoes = [
+            _op(1, date(2024, 1, 10), 'PETR4', 'buy', 100, 20.0),
+            _op(2, date(2024, 1, 20), 'PETR4', 'buy', 100, 30.0),
+            _op(3, date(2024, 2, 5), 'PETR4', 'sell', 150, 40.0),
+            _op(4, date(2024, 2, 5), 'VALE3', 'buy', 10, 50.0),
+            _op(5, date(2024, 2, 5), 'VALE3', 'sell', 10, 55.0),
+        ]
+        saida = executar_motor(operacoes, data_referencia=date(2024, 12, 31))
+
+        self.assertEqual(saida["carteira"]["PETR4"]["quantidade"], 50)
+        self.assertAlmostEqual(saida["carteira"]["PETR4"]["preco_medio"], 25.0)
+        self.assertEqual(saida["carteira"]["VALE3"]["quantidade"], 0)
+
+        fevereiro = next(r for r in saida["resultados_mensais"] if r["mes"] == '2024-02')
+        self.assertAlmostEqual(fevereiro["vendas_swing"], 6000.0)
+        self.assertAlmostEqual(fevereiro["custo_swing"], 3750.0)
+        self.assertAlmostEqual(fevereiro["ganho_liquido_day"], 50.0)
+
+        fechadas_petr = [f for f in saida["operacoes_fechadas"] if f["ticker"] == 'PETR4']
+        self.assertEqual([f["quantidade"] for f in fechadas_petr], [100, 50])
+        self.assertTrue(all(f["status_ir"] == "Isento" for f in fechadas_petr))
+        fechada_vale = next(f for f in saida["operacoes_fechadas"] if f["ticker"] == 'VALE3')
+        self.assertTrue(fechada_vale["day_trade"])
+
+    def test_desdobramento_aplicado_a_todas_as_maquinas(self):
+        operacoes = [
+            _op(1, date(2024, 1, 10), 'PETR4', 'buy', 100, 20.0),
+            _op(2, date(2024, 3, 10), 'PETR4', 'sell', 200, 12.0),
+        ]
+        eventos = {'PETR4': [_evento('Desdobramento', date(2024, 2, 1), '1:2')]}
+        saida = executar_motor(operacoes, eventos, data_referencia=date(2024, 12, 31))
+
+        # 100 ações a 20,00 viram 200 a 10,00 na data ex; a venda de 200 zera a posição
+        self.assertEqual(saida["carteira"]["PETR4"]["quantidade"], 0)
+        marco = next(r for r in saida["resultados_mensais"] if r["mes"] == '2024-03')
+        self.assertAlmostEqual(marco["custo_swing"], 2000.0)
+        self.assertAlmostEqual(marco["vendas_swing"], 2400.0)
+        fechada = saida["operacoes_fechadas"][0]
+        self.assertEqual(fechada["quantidade"], 200)
+        self.assertAlmostEqual(fechada["resultado"], 400.0)
+        # O checkpoint de janeiro é anterior à data ex; o de março já reflete o desdobramento
+        checkpoint_jan = next(cp for cp in saida["checkpoints"] if cp["mes"] == '2024-01')
+        self.assertEqual(checkpoint_jan["quantidade"], 100)
+
+    def test_bonificacao_e_evento_futuro(self):
+        operacoes = [_op(1, date(2024, 1, 10), 'ITSA4', 'buy', 100, 10.0)]
+        eventos = {'ITSA4': [
+            _evento('Bonificação', date(2024, 2, 1), '1:10'),
+            _evento('Desdobramento', date(2025, 1, 1), '1:2'),
+        ]}
+        saida = executar_motor(operacoes, eventos, data_referencia=date(2024, 12, 31))
+
+        # A bonificação de 10% é aplicada; o desdobramento após a data de referência não
+        self.assertEqual(saida["carteira"]["ITSA4"]["quantidade"], 110)
+        self.assertAlmostEqual(saida["carteira"]["ITSA4"]["custo_total"], 1000.0)
+
+    def test_snapshots_respeitam_data_ex(self):
+        operacoes = [
+            _op(1, date(2023, 6, 1), 'PETR4', 'buy', 100, 20.0, 10.0),
+            _op(2, date(2024, 3, 1), 'PETR4', 'buy', 100, 30.0),
+        ]
+        eventos = {'PETR4': [_evento('Desdobramento', date(2024, 1, 15), '1:2')]}
+        saida = executar_motor(operacoes, eventos, datas_snapshot=[date(2023, 12, 31), date(2024, 1, 20)],
+                               data_referencia=date(2024, 12, 31))
+
+        antes = saida["snapshots"][date(2023, 12, 31)]["PETR4"]
+        self.assertEqual(antes["quantidade"], 100)
+        self.assertAlmostEqual(antes["preco_medio"], 20.1)
+        depois = saida["snapshots"][date(2024, 1, 20)]["PETR4"]
+        self.assertEqual(depois["quantidade"], 200)
+        self.assertAlmostEqual(depois["preco_medio"], 10.05)
+        self.assertEqual(saida["carteira"]["PETR4"]["quantidade"], 300)
+
+    def test_retomada_a_partir_de_checkpoint_equivale_a_passada_completa(self):
+        operacoes = [
+            _op(1, date(2024, 1, 10), 'PETR4', 'buy', 100, 20.0),
+            _op(2, date(2024, 2, 10), 'PETR4', 'sell', 50, 15.0),
+            _op(3, date(2024, 4, 10), 'PETR4', 'sell', 100, 18.0),
+        ]
+        eventos = {'PETR4': [_evento('Desdobramento', date(2024, 3, 1), '1:2')]}
+        completa = executar_motor(operacoes, eventos, data_referencia=date(2024, 12, 31))
+
+        checkpoint_fev = [cp for cp in completa["checkpoints"] if cp["mes"] == '2024-02']
+        fevereiro = next(r for r in completa["resultados_mensais"] if r["mes"] == '2024-02')
+        retomada = executar_motor(
+            operacoes[2:], eventos,
+            estado_inicial={
+                "checkpoints": checkpoint_fev,
+                "prejuizo_acumulado_swing": fevereiro["prejuizo_acumulado_swing"],
+                "prejuizo_acumulado_day": fevereiro["prejuizo_acumulado_day"],
+            },
+            data_referencia=date(2024, 12, 31),
+        )
+
+        self.assertIsNone(retomada["carteira"])
+        self.assertEqual(retomada["resultados_mensais"], completa["resultados_mensais"][2:])
+        self.assertEqual(retomada["checkpoints"], completa["checkpoints"][2:])
+
+    def test_checkpoint_do_mes_em_curso_nao_inclui_eventos_futuros(self):
+        operacoes = [
+            _op(1, date(2024, 5, 2), 'PETR4', 'buy', 100, 20.0),
+            _op(2, date(2024, 6, 10), 'PETR4', 'sell', 200, 12.0),
+        ]
+        eventos = {'PETR4': [_evento('Desdobramento', date(2024, 5, 20), '1:2')]}
+
+        # Recálculo feito em 10/05: o desdobramento de 20/05 ainda não entra no checkpoint de maio
+        parcial = executar_motor(operacoes[:1], eventos, data_referencia=date(2024, 5, 10))
+        checkpoint_mai = parcial["checkpoints"]
+        self.assertEqual((checkpoint_mai[0]["quantidade"], checkpoint_mai[0]["eventos_ate"]), (100, date(2024, 5, 10)))
+
+        # Retomada em junho a partir desse checkpoint: o desdobramento é aplicado uma única vez
+        maio = parcial["resultados_mensais"][0]
+        retomada = executar_motor(
+            operacoes[1:], eventos,
+            estado_inicial={
+                "checkpoints": checkpoint_mai,
+                "prejuizo_acumulado_swing": maio["prejuizo_acumulado_swing"],
+                "prejuizo_acumulado_day": maio["prejuizo_acumulado_day"],
+            },
+            data_referencia=date(2024, 12, 31),
+        )
+        completa = executar_motor(operacoes, eventos, data_referencia=date(2024, 12, 31))
+        self.assertEqual(retomada["resultados_mensais"], completa["resultados_mensais"][1:])
+        self.assertEqual(retomada["checkpoints"], completa["checkpoints"][1:])
+        self.assertEqual(retomada["checkpoints"][0]["quantidade"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import indice_eventos
+from indice_eventos import IndiceEventos
+from models import EventoCorporativoInfo
+from motor_proventos import calcular_direitos_proventos_ticker
+
+
+def _op(data, operacao, quantidade):
+    return {"date": data, "operation": operacao, "quantity": quantidade}
+
+
+class TestMotorProventos(unittest.TestCase):
+    """
+    Verifica o cálculo de direitos a proventos em uma passada por ticker e a
+    gravação em lote dos proventos recebidos.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('ITSA4', 'Itaúsa'), ('VALE3', 'Vale')])
+            conn.commit()
+        self.usuario_id = 1
+
+    def tearDown(self):
+        indice_eventos.invalidar_indice_eventos()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_quantidade_na_vespera_da_data_ex(self):
+        operacoes = [
+            _op(date(2024, 1, 10), 'buy', 100),
+            _op(date(2024, 3, 1), 'buy', 50),    # na data ex: sem direito ao provento de 01/03
+            _op(date(2024, 5, 10), 'sell', 150),
+        ]
+        proventos = [{"id": i, "data_ex": d} for i, d in
+                     enumerate([date(2024, 1, 10), date(2024, 3, 1), date(2024, 4, 1), date(2024, 6, 1)])]
+        direitos = calcular_direitos_proventos_ticker(operacoes, proventos)
+        self.assertEqual([(p["id"], q) for p, q in direitos], [(1, 100), (2, 150)])
+
+    def test_eventos_corporativos_ajustam_a_posicao(self):
+        indice = IndiceEventos([
+            EventoCorporativoInfo(id=1, id_acao=1, evento="Bonificação", razao="1:10", data_ex=date(2024, 2, 1)),
+            EventoCorporativoInfo(id=2, id_acao=1, evento="Grupamento", razao="10:1", data_ex=date(2024, 4, 1)),
+        ])
+        operacoes = [_op(date(2024, 1, 5), 'buy', 1000), _op(date(2024, 2, 1), 'buy', 100)]
+        proventos = [{"id": 1, "data_ex": date(2024, 3, 1)}, {"id": 2, "data_ex": date(2024, 5, 1)}]
+        direitos = calcular_direitos_proventos_ticker(operacoes, proventos, indice)
+        self.assertEqual([q for _, q in direitos], [1200, 120])
+
+    def test_recalculo_grava_todos_os_proventos_em_uma_transacao(self):
+        id_itsa = database.obter_id_acao_por_ticker('ITSA4')
+        id_vale = database.obter_id_acao_por_ticker('VALE3')
+        for id_acao, tipo, valor, data_ex in [
+            (id_itsa, 'Dividendo', 0.5, '2024-02-01'),
+            (id_itsa, 'JCP', 0.25, '2024-06-03'),
+            (id_vale, 'Dividendo', 2.0, '2023-12-01'),  # antes da primeira operação
+            (id_vale, 'Dividendo', 2.0, '2024-04-01'),
+        ]:
+            database.inserir_provento({'id_acao': id_acao, 'tipo': tipo, 'valor': valor, 'data_registro': None,
+                                       'data_ex': data_ex, 'dt_pagamento': data_ex})
+        database.inserir_evento_corporativo({'id_acao': id_itsa, 'evento': 'Desdobramento', 'razao': '1:2',
+                                             'data_aprovacao': None, 'data_registro': None, 'data_ex': '2024-05-02'})
+        with database.get_db() as conn:
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [('2024-01-15', 'ITSA4', 'buy', 100, 10.0, 0.0, self.usuario_id),
+                 ('2024-01-20', 'VALE3', 'buy', 10, 70.0, 0.0, self.usuario_id)])
+            conn.commit()
+
+        with patch.object(database, 'inserir_usuario_provento_recebido_db') as inserir_por_linha:
+            stats = services.recalcular_proventos_recebidos_rapido(self.usuario_id)
+            inserir_por_linha.assert_not_called()
+        self.assertEqual(stats, {"verificados": 3, "calculados": 3, "erros": 0})
+
+        recebidos = {(r["ticker_acao"], r["data_ex"]): r for r in database.obter_proventos_recebidos_por_usuario_db(self.usuario_id)}
+        self.assertEqual(recebidos[('ITSA4', date(2024, 2, 1))]["valor_total_recebido"], 50.0)
+        self.assertEqual(recebidos[('ITSA4', date(2024, 6, 3))]["quantidade_possuida_na_data_ex"], 200)  # após o desdobramento
+        self.assertEqual(recebidos[('VALE3', date(2024, 4, 1))]["valor_total_recebido"], 20.0)
+
+        # Um novo recálculo substitui os registros anteriores
+        services.recalcular_proventos_recebidos_rapido(self.usuario_id)
+        self.assertEqual(len(database.obter_proventos_recebidos_por_usuario_db(self.usuario_id)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
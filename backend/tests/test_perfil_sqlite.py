@@ -0,0 +1,95 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+class TestPerfilSqlite(unittest.TestCase):
+    """
+    Verifica o perfil de armazenamento aplicado às conexões (WAL, synchronous,
+    cache, mmap, busy_timeout) e a manutenção periódica do banco.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.tmpdir.name, 'perfil.db')
+        self.db_patch = patch.object(database, 'DATABASE_FILE', self.arquivo)
+        self.db_patch.start()
+        self.pool_patch = patch.object(database, '_pool_conexoes', database.PoolConexoes(4))
+        self.pool_patch.start()
+        with database.get_db() as conn:
+            conn.execute('CREATE TABLE t (v INTEGER)')
+            conn.execute('INSERT INTO t (v) VALUES (1)')
+            conn.commit()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.pool_patch.stop()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_perfil_aplicado_na_conexao(self):
+        with database.get_db() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0], -database.DB_CACHE_SIZE_KB)
+            self.assertEqual(conn.execute('PRAGMA busy_timeout').fetchone()[0], database.DB_BUSY_TIMEOUT_MS)
+            self.assertEqual(conn.execute('PRAGMA mmap_size').fetchone()[0], database.DB_MMAP_SIZE)
+
+    def test_perfil_configuravel(self):
+        with patch.object(database, 'DB_JOURNAL_MODE', 'DELETE'), patch.object(database, 'DB_SYNCHRONOUS', 'FULL'):
+            database.fechar_conexoes_pool()
+            with database.get_db() as conn:
+                self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'delete')
+                self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 2)  # FULL
+
+    def test_leitura_nao_bloqueia_durante_escrita(self):
+        escrita_aberta = threading.Event()
+        liberar_escrita = threading.Event()
+
+        def escrever():
+            with database.get_db() as conn:
+                conn.execute('INSERT INTO t (v) VALUES (2)')  # transação aberta, não confirmada
+                escrita_aberta.set()
+                liberar_escrita.wait(5)
+                conn.commit()
+
+        escritor = threading.Thread(target=escrever)
+        escritor.start()
+        try:
+            self.assertTrue(escrita_aberta.wait(5))
+            leitura = {}
+
+            def ler():
+                with database.get_db() as conn:
+                    leitura["valores"] = [r[0] for r in conn.execute('SELECT v FROM t')]
+
+            leitor = threading.Thread(target=ler)
+            leitor.start()
+            leitor.join(2)
+            # O leitor vê o último estado confirmado sem esperar o escritor
+            self.assertFalse(leitor.is_alive())
+            self.assertEqual(leitura["valores"], [1])
+        finally:
+            liberar_escrita.set()
+            escritor.join()
+
+    def test_manter_banco_trunca_wal(self):
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO t (v) VALUES (?)', [(i,) for i in range(1000)])
+            conn.commit()
+        self.assertGreater(os.path.getsize(self.arquivo + '-wal'), 0)
+        resultado = database.manter_banco()
+        self.assertFalse(resultado["ocupado"])
+        self.assertEqual(resultado["paginas_wal"], 0)
+        self.assertEqual(os.path.getsize(self.arquivo + '-wal'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
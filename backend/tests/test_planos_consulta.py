@@ -0,0 +1,101 @@
+import unittest
+import os
+import re
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import migracoes
+
+# Consultas de leitura por usuário executadas a cada requisição ou recálculo.
+# Consultas marcadas com ordenar=True também não podem ordenar em uma B-tree temporária.
+CONSULTAS_QUENTES = [
+    ("obter_todas_operacoes", lambda: database.obter_todas_operacoes(1), True),
+    ("obter_operacoes_por_ticker_db", lambda: database.obter_operacoes_por_ticker_db(1, 'PETR4'), True),
+    ("obter_operacoes_por_ticker_ate_data_db", lambda: database.obter_operacoes_por_ticker_ate_data_db(1, 'PETR4', '2024-06-30'), True),
+    ("obter_operacoes_a_partir_de_data", lambda: database.obter_operacoes_a_partir_de_data(1, date(2024, 1, 1)), True),
+    ("obter_operacoes_motor_db", lambda: database.obter_operacoes_motor_db(1), True),
+    ("obter_operacoes_motor_db (ticker)", lambda: database.obter_operacoes_motor_db(1, ticker='PETR4'), True),
+    ("obter_operacoes_motor_db (data)", lambda: database.obter_operacoes_motor_db(1, data_inicio=date(2024, 1, 1)), True),
+    ("existe_operacao_anterior_a", lambda: database.existe_operacao_anterior_a(1, date(2024, 1, 1)), True),
+    ("obter_tickers_operados_por_usuario", lambda: database.obter_tickers_operados_por_usuario(1), True),
+    ("obter_posicoes_operacoes_usuario_db", lambda: database.obter_posicoes_operacoes_usuario_db(1), True),
+    ("obter_operacoes_ticker_usuarios_ate_data_db", lambda: database.obter_operacoes_ticker_usuarios_ate_data_db('PETR4', date(2024, 6, 30)), True),
+    ("obter_resultados_mensais", lambda: database.obter_resultados_mensais(1), True),
+    ("obter_ultimo_resultado_mensal_anterior_a", lambda: database.obter_ultimo_resultado_mensal_anterior_a(1, '2024-06'), True),
+    ("obter_checkpoints_resultados_anteriores_a", lambda: database.obter_checkpoints_resultados_anteriores_a(1, '2024-06'), True),
+    ("obter_carteira_atual", lambda: database.obter_carteira_atual(1), True),
+    ("obter_item_carteira_db", lambda: database.obter_item_carteira_db(1, 'PETR4'), True),
+    ("obter_operacoes_fechadas_salvas", lambda: database.obter_operacoes_fechadas_salvas(1), True),
+    ("obter_operacoes_fechadas_salvas (ticker)", lambda: database.obter_operacoes_fechadas_salvas(1, ticker='PETR4'), True),
+    ("obter_tickers_operacoes_fechadas_desatualizadas_db", lambda: database.obter_tickers_operacoes_fechadas_desatualizadas_db(1), True),
+    ("obter_proventos_recebidos_por_usuario_db", lambda: database.obter_proventos_recebidos_por_usuario_db(1), True),
+    # Os resumos agrupam por SUBSTR(dt_pagamento): a busca usa o índice, o agrupamento não
+    ("obter_resumo_anual_proventos_recebidos_db", lambda: database.obter_resumo_anual_proventos_recebidos_db(1), False),
+    ("obter_resumo_mensal_proventos_recebidos_db", lambda: database.obter_resumo_mensal_proventos_recebidos_db(1, 2024), False),
+    ("obter_resumo_por_acao_proventos_recebidos_db", lambda: database.obter_resumo_por_acao_proventos_recebidos_db(1), False),
+]
+
+
+class TestPlanosConsulta(unittest.TestCase):
+    """
+    Verifica, com EXPLAIN QUERY PLAN, que as consultas por usuário usam índices
+    (nenhuma varredura completa de tabela) e o versionamento das migrações.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _planos(self, consulta):
+        """Executa a consulta capturando o SQL emitido e retorna o plano de cada SELECT."""
+        with database.get_db() as conn:
+            emitidas = []
+            conn.set_trace_callback(emitidas.append)
+            try:
+                consulta()
+            finally:
+                conn.set_trace_callback(None)
+            return {sql: [linha[3] for linha in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                    for sql in emitidas if sql.lstrip().upper().startswith("SELECT")}
+
+    def test_consultas_quentes_nao_varrem_tabelas(self):
+        with database.get_db() as conn:
+            tabelas = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for nome, consulta, ordenar in CONSULTAS_QUENTES:
+            with self.subTest(consulta=nome):
+                planos = self._planos(consulta)
+                self.assertTrue(planos, f"{nome} não executou nenhum SELECT")
+                for sql, plano in planos.items():
+                    varreduras = [p for p in plano if re.match(r"SCAN (\w+)", p) and re.match(r"SCAN (\w+)", p).group(1) in tabelas]
+                    self.assertEqual(varreduras, [], f"{nome}: varredura completa em {sql}")
+                    if ordenar:
+                        self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plano, f"{nome}: ordenação sem índice em {sql}")
+
+    def test_migracoes_sao_aplicadas_uma_vez(self):
+        with database.get_db() as conn:
+            self.assertEqual(migracoes.obter_versao_esquema(conn), migracoes.MIGRACOES[-1][0])
+            self.assertEqual(migracoes.aplicar_migracoes(conn), [])
+            indices = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('idx_operacoes_usuario_date_id', indices)
+        self.assertNotIn('idx_operacoes_usuario_id', indices)
+
+        # Reexecutar criar_tabelas não recria os índices removidos pelas migrações
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            self.assertIsNone(conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_operacoes_usuario_id'").fetchone())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+
+
+class TestPoolConexoes(unittest.TestCase):
+    """
+    Verifica a reutilização de conexões por thread em database.get_db.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.tmpdir.name, 'pool.db')
+        self.db_patch = patch.object(database, 'DATABASE_FILE', self.arquivo)
+        self.db_patch.start()
+        self.pool_patch = patch.object(database, '_pool_conexoes', database.PoolConexoes(4))
+        self.pool_patch.start()
+        with database.get_db() as conn:
+            conn.execute('CREATE TABLE t (v INTEGER)')
+            conn.commit()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.pool_patch.stop()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_reutiliza_conexao_na_mesma_thread(self):
+        with database.get_db() as conn1:
+            pass
+        with database.get_db() as conn2:
+            pass
+        self.assertIs(conn1, conn2)
+        metricas = database.obter_metricas_pool_conexoes()
+        self.assertEqual(metricas["conexoes_criadas"], 1)
+        self.assertEqual(metricas["reutilizacoes"], 2)
+
+    def test_contexto_aninhado_compartilha_conexao_e_desfaz_transacao_pendente(self):
+        with database.get_db() as externo:
+            externo.execute('INSERT INTO t VALUES (1)')
+            with database.get_db() as interno:
+                self.assertIs(interno, externo)
+            # Sair do contexto interno não desfaz a escrita do externo
+            self.assertTrue(externo.in_transaction)
+        with database.get_db() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone()[0], 0)
+
+    def test_threads_usam_conexoes_distintas(self):
+        conexoes = []
+
+        def usar():
+            with database.get_db() as conn:
+                conn.execute('SELECT 1')
+                conexoes.append(id(conn))
+
+        threads = [threading.Thread(target=usar) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        with database.get_db() as conn:
+            conexoes.append(id(conn))
+        self.assertEqual(len(set(conexoes)), 4)
+
+    def test_limite_do_pool(self):
+        database.fechar_conexoes_pool()
+        database.configurar_pool_conexoes(0)
+        with database.get_db() as conn1:
+            pass
+        with database.get_db() as conn2:
+            pass
+        self.assertIsNot(conn1, conn2)
+        self.assertEqual(database.obter_metricas_pool_conexoes()["conexoes_em_cache"], 0)
+
+    def test_arquivo_recriado_invalida_conexao(self):
+        with database.get_db() as conn1:
+            pass
+        os.remove(self.arquivo)
+        with database.get_db() as conn2:
+            conn2.execute('CREATE TABLE t (v INTEGER)')
+            conn2.commit()
+        self.assertIsNot(conn1, conn2)
+        self.assertEqual(database.obter_metricas_pool_conexoes()["conexoes_descartadas"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../'
 # Imports from your project
 from app.services.portfolio_analysis_service import get_holdings_on_date, calculate_portfolio_history, Operacao as ServiceOperacao, get_rendimentos_isentos_por_ano, RendimentoIsento
 from models import EventoCorporativoInfo # For testing get_adjustment_factor
+from indice_eventos import IndiceEventos
 
 # --- Tests for EventoCorporativoInfo.get_adjustment_factor ---
 # Added dummy id to EventoCorporativoInfo calls
@@ -294,6 +295,42 @@ def test_calculate_portfolio_history_with_split(
     # The call to mock_get_events for date 2023-01-10 is relevant for the final equity value.
     mock_get_events.assert_any_call(1, date(2023, 1, 10)) # Check one of the calls
 
+@patch('app.services.portfolio_analysis_service.get_historical_prices')
+@patch('app.services.portfolio_analysis_service.obter_indice_eventos')
+def test_calculate_portfolio_history_matrix_matches_daily_holdings(
+    mock_obter_indice_eventos,
+    mock_get_historical_prices
+):
+    """The vectorized curve must match get_holdings_on_date date by date, with one events index per ticker."""
+    events = {
+        "TICK1": [EventoCorporativoInfo(id=1, id_acao=1, evento="Desdobramento", razao="1:2", data_ex=date(2023, 1, 5))],
+        "TICK2": [EventoCorporativoInfo(id=2, id_acao=2, evento="Bonificação", razao="1:10", data_ex=date(2023, 1, 4))],
+    }
+    mock_obter_indice_eventos.side_effect = lambda ticker: IndiceEventos(events[ticker], id_acao=1)
+    prices = {
+        "TICK1": {"2023-01-02": 20.0, "2023-01-03": 21.0, "2023-01-06": 11.0, "2023-01-09": 12.0},
+        "TICK2": {"2023-01-02": 50.0, "2023-01-04": 45.0, "2023-01-09": 46.0},
+    }
+    mock_get_historical_prices.side_effect = lambda ticker, start, end: prices[ticker]
+
+    operations_data_dicts = [
+        {'ticker': 'TICK1', 'date': '2023-01-02', 'operation_type': 'buy', 'quantity': 10, 'price': 20.0, 'fees': 0.0},
+        {'ticker': 'TICK2', 'date': '2023-01-02', 'operation_type': 'buy', 'quantity': 100, 'price': 50.0, 'fees': 0.0},
+        {'ticker': 'TICK1', 'date': '2023-01-07', 'operation_type': 'sell', 'quantity': 5, 'price': 11.0, 'fees': 0.0},
+        {'ticker': 'TICK2', 'date': '2023-01-08', 'operation_type': 'sell', 'quantity': 110, 'price': 46.0, 'fees': 0.0},
+    ]
+
+    history = calculate_portfolio_history(operations_data_dicts, "2023-01-01", "2023-01-10", period_frequency="daily")
+    values = {point['date']: point['value'] for point in history['equity_curve']}
+
+    assert values["2023-01-01"] == 0.0
+    assert values["2023-01-03"] == 10 * 21.0 + 100 * 50.0   # TICK2 has no quote on 01-03: last known price
+    assert values["2023-01-04"] == 10 * 21.0 + 110 * 45.0   # bonus: 100 -> 110
+    assert values["2023-01-05"] == 20 * 21.0 + 110 * 45.0   # split in effect, no new TICK1 quote yet
+    assert values["2023-01-07"] == 15 * 11.0 + 110 * 45.0
+    assert values["2023-01-09"] == 15 * 12.0                 # TICK2 fully sold
+    assert mock_obter_indice_eventos.call_count == 2
+
 # --- Additional get_holdings_on_date tests ---
 
 def test_get_holdings_empty_operations_list():
@@ -0,0 +1,129 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+from app.services import precos_historicos
+from app.services.precos_historicos import CachePrecosHistoricos, ProvedorPrecos, ProvedorPrecosLocal, _calcular_lacunas
+
+
+def _pregoes(inicio, fim, preco_inicial=10.0):
+    precos = {}
+    dia, preco = inicio, preco_inicial
+    while dia <= fim:
+        if dia.weekday() < 5:
+            precos[dia] = preco
+            preco += 0.5
+        dia += timedelta(days=1)
+    return precos
+
+
+class TestPrecosHistoricos(unittest.TestCase):
+    """
+    Verifica o cache de preços históricos: LRU em memória, persistência no SQLite
+    e consulta ao provedor apenas dos intervalos faltantes.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        self.provedor = ProvedorPrecosLocal({'PETR4': _pregoes(date(2024, 1, 1), date(2024, 6, 30))})
+        self.cache = CachePrecosHistoricos(self.provedor, tamanho=8)
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_consulta_repetida_nao_chama_o_provedor(self):
+        primeira = self.cache.obter('PETR4', date(2024, 1, 1), date(2024, 1, 31))
+        self.assertEqual(len(self.provedor.chamadas), 1)
+        self.assertEqual(min(primeira), date(2024, 1, 1))
+        self.assertEqual(max(primeira), date(2024, 1, 31))  # fim inclusivo
+
+        self.assertEqual(self.cache.obter('PETR4', date(2024, 1, 1), date(2024, 1, 31)), primeira)
+        # Um novo cache (ex.: reinício da API) é servido pelo banco
+        novo_cache = CachePrecosHistoricos(self.provedor)
+        self.assertEqual(novo_cache.obter('PETR4', date(2024, 1, 10), date(2024, 1, 20)),
+                         {d: p for d, p in primeira.items() if date(2024, 1, 10) <= d <= date(2024, 1, 20)})
+        self.assertEqual(len(self.provedor.chamadas), 1)
+
+    def test_apenas_lacunas_sao_buscadas(self):
+        self.cache.obter('PETR4', date(2024, 2, 1), date(2024, 2, 29))
+        self.cache.obter('PETR4', date(2024, 4, 1), date(2024, 4, 30))
+        self.provedor.chamadas.clear()
+
+        precos = self.cache.obter('PETR4', date(2024, 1, 15), date(2024, 5, 15))
+        self.assertEqual(self.provedor.chamadas, [
+            ('PETR4', date(2024, 1, 15), date(2024, 1, 31)),
+            ('PETR4', date(2024, 3, 1), date(2024, 3, 31)),
+            ('PETR4', date(2024, 5, 1), date(2024, 5, 15)),
+        ])
+        esperado = {d: p for d, p in self.provedor.precos['PETR4'].items() if date(2024, 1, 15) <= d <= date(2024, 5, 15)}
+        self.assertEqual(precos, esperado)
+        self.assertEqual(database.obter_cobertura_precos_db('PETR4'), [(date(2024, 1, 15), date(2024, 5, 15))])
+
+    def test_dia_corrente_nao_e_marcado_como_coberto(self):
+        hoje = date.today()
+        self.provedor.precos['VALE3'] = {hoje - timedelta(days=1): 60.0, hoje: 61.0}
+        self.assertEqual(self.cache.obter('VALE3', hoje - timedelta(days=1), hoje)[hoje], 61.0)
+        self.assertEqual(database.obter_cobertura_precos_db('VALE3'), [(hoje - timedelta(days=1), hoje - timedelta(days=1))])
+
+        self.provedor.precos['VALE3'][hoje] = 62.0
+        self.cache.limpar()
+        self.assertEqual(self.cache.obter('VALE3', hoje - timedelta(days=1), hoje)[hoje], 62.0)
+        self.assertEqual(self.provedor.chamadas[-1], ('VALE3', hoje, hoje))
+
+    def test_falha_do_provedor_nao_marca_cobertura(self):
+        with patch.object(self.provedor, 'buscar', side_effect=ConnectionError('sem rede')):
+            self.assertEqual(self.cache.obter('PETR4', date(2024, 1, 1), date(2024, 1, 31)), {})
+        self.assertEqual(database.obter_cobertura_precos_db('PETR4'), [])
+        self.assertEqual(len(self.cache.obter('PETR4', date(2024, 1, 1), date(2024, 1, 31))), 23)
+
+    def test_get_historical_prices_usa_o_cache(self):
+        from app.services.portfolio_analysis_service import get_historical_prices
+        with patch.object(precos_historicos, '_cache_precos', self.cache):
+            precos = get_historical_prices('PETR4', '2024-01-01', '2024-01-05')
+            get_historical_prices('PETR4', '2024-01-01', '2024-01-05')
+        self.assertEqual(precos, {'2024-01-01': 10.0, '2024-01-02': 10.5, '2024-01-03': 11.0,
+                                  '2024-01-04': 11.5, '2024-01-05': 12.0})
+        self.assertEqual(len(self.provedor.chamadas), 1)
+
+    def test_falhas_e_consultas_vazias_sao_registradas_no_log(self):
+        from app.services import portfolio_analysis_service
+        from app.services.portfolio_analysis_service import get_historical_prices
+        with patch.object(precos_historicos, '_cache_precos', self.cache):
+            with self.assertLogs(level='WARNING') as logs:
+                self.assertEqual(get_historical_prices('VALE3', '2024-01-01', '2024-01-05'), {})
+            self.assertIn('No data found for ticker VALE3', logs.output[0])
+        with patch.object(portfolio_analysis_service, 'obter_precos_historicos', side_effect=RuntimeError('indisponível')), \
+             self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(get_historical_prices('ITUB4', '2024-01-01', '2024-01-05'), {})
+        self.assertIn('indisponível', logs.output[0])
+
+    def test_provedor_exige_buscar(self):
+        with self.assertRaises(TypeError):
+            ProvedorPrecos()
+
+        class ProvedorIncompleto(ProvedorPrecos):
+            pass
+
+        with self.assertRaises(TypeError):
+            ProvedorIncompleto()
+
+    def test_calcular_lacunas(self):
+        cobertura = [(date(2024, 1, 1), date(2024, 1, 10)), (date(2024, 1, 20), date(2024, 1, 31))]
+        self.assertEqual(_calcular_lacunas(cobertura, date(2024, 1, 5), date(2024, 1, 25)),
+                         [(date(2024, 1, 11), date(2024, 1, 19))])
+        self.assertEqual(_calcular_lacunas(cobertura, date(2024, 1, 2), date(2024, 1, 9)), [])
+        self.assertEqual(_calcular_lacunas([], date(2024, 1, 2), date(2024, 1, 9)), [(date(2024, 1, 2), date(2024, 1, 9))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import logging
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import rastreamento
+
+
+class TestRastreamento(unittest.TestCase):
+    """
+    Verifica o rastreamento dos recálculos: nenhum custo nem log fora do nível DEBUG,
+    uma linha por recálculo com os tempos das etapas e a amostragem por operação.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        self.usuario_id = 1
+        with database.get_db() as conn:
+            conn.execute('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', ('PETR4', 'Petrobras'))
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(f'2024-01-{dia:02d}', 'PETR4', 'buy' if dia % 3 else 'sell', 100, 30.0 + dia, 1.0, self.usuario_id)
+                 for dia in range(1, 21)])
+            conn.commit()
+        self.nivel_original = rastreamento.logger.level
+
+    def tearDown(self):
+        rastreamento.logger.setLevel(self.nivel_original)
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_desativado_nao_cria_rastreio_nem_loga(self):
+        rastreamento.logger.setLevel(logging.INFO)
+        with patch.object(rastreamento, 'Rastreio') as rastreio, patch('logging.basicConfig') as basic_config:
+            with self.assertNoLogs(level=logging.INFO):
+                services.recalcular_posicoes_usuario(self.usuario_id)
+            rastreio.assert_not_called()
+            basic_config.assert_not_called()
+        self.assertIs(rastreamento.rastreio_atual(), rastreamento.RASTREIO_NULO)
+
+    def test_uma_linha_por_recalculo_com_etapas(self):
+        rastreamento.logger.setLevel(logging.DEBUG)
+        with self.assertLogs(rastreamento.logger, level=logging.DEBUG) as logs:
+            services.recalcular_posicoes_usuario(self.usuario_id)
+        self.assertEqual(len(logs.records), 1)
+        mensagem = logs.records[0].getMessage()
+        self.assertIn('[recalcular_posicoes_usuario] usuário 1', mensagem)
+        for etapa in ('carregar=', 'agregar=', 'ajustar=', 'persistir=', 'operacoes=20'):
+            self.assertIn(etapa, mensagem)
+
+        # Serviço chamado isoladamente abre o próprio rastreio
+        with self.assertLogs(rastreamento.logger, level=logging.DEBUG) as logs:
+            services.recalcular_resultados(usuario_id=self.usuario_id, a_partir_de=date(2024, 1, 10))
+        self.assertIn('[recalcular_resultados]', logs.records[0].getMessage())
+
+    def test_amostragem_por_operacao(self):
+        rastreamento.logger.setLevel(logging.DEBUG)
+        with patch.object(rastreamento, 'RECOMPUTE_TRACE_AMOSTRA', 5):
+            with self.assertLogs(rastreamento.logger, level=logging.DEBUG) as logs:
+                services.recalcular_carteira(usuario_id=self.usuario_id)
+        operacoes = [r.getMessage() for r in logs.records if ' op #' in r.getMessage()]
+        self.assertEqual(len(operacoes), 4)
+        self.assertIn('op #5 PETR4', operacoes[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+from models import OperacaoCreate
+
+
+def _op(data, ticker, operacao, quantidade, preco, taxas=0.0):
+    return OperacaoCreate(date=data, ticker=ticker, operation=operacao, quantity=quantidade, price=preco, fees=taxas)
+
+
+class TestRecalculoIncremental(unittest.TestCase):
+    """
+    Verifica que o recálculo incremental (a partir do mês/ticker afetado) produz
+    o mesmo resultado que o recálculo completo, usando um banco SQLite temporário.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('PETR4', 'Petrobras'), ('VALE3', 'Vale'), ('ITUB4', 'Itau')])
+            conn.commit()
+        self.usuario_id = 1
+
+        services.processar_operacoes([
+            _op(date(2024, 1, 10), 'PETR4', 'buy', 1000, 30.0, 5.0),
+            _op(date(2024, 1, 15), 'VALE3', 'buy', 500, 70.0, 5.0),
+            _op(date(2024, 2, 5), 'PETR4', 'sell', 600, 25.0, 5.0),  # prejuízo swing
+            _op(date(2024, 2, 20), 'ITUB4', 'sell', 200, 30.0, 2.0),  # venda a descoberto
+            _op(date(2024, 3, 7), 'VALE3', 'buy', 100, 68.0, 1.0),
+            _op(date(2024, 3, 7), 'VALE3', 'sell', 100, 69.0, 1.0),  # day trade
+            _op(date(2024, 4, 2), 'ITUB4', 'buy', 200, 28.0, 2.0),   # cobre a venda a descoberto
+            _op(date(2024, 5, 14), 'VALE3', 'sell', 500, 90.0, 5.0), # lucro compensa prejuízo
+            _op(date(2024, 6, 3), 'PETR4', 'sell', 400, 40.0, 5.0),
+        ], usuario_id=self.usuario_id)
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _estado(self):
+        resultados = [
+            {k: v for k, v in r.items() if k != 'id'}
+            for r in database.obter_resultados_mensais(usuario_id=self.usuario_id)
+        ]
+        carteira = database.obter_carteira_atual(usuario_id=self.usuario_id)
+        return resultados, carteira
+
+    def _estado_recalculo_completo(self):
+        services.recalcular_carteira(usuario_id=self.usuario_id)
+        services.recalcular_resultados(usuario_id=self.usuario_id)
+        return self._estado()
+
+    def test_insercao_retroativa_equivale_ao_recalculo_completo(self):
+        services.inserir_operacao_manual(_op(date(2024, 3, 20), 'PETR4', 'buy', 200, 20.0, 2.0), usuario_id=self.usuario_id)
+        incremental = self._estado()
+        self.assertEqual(incremental, self._estado_recalculo_completo())
+
+    def test_remocao_equivale_ao_recalculo_completo(self):
+        operacoes = database.obter_todas_operacoes(usuario_id=self.usuario_id)
+        venda_fev = next(op for op in operacoes if op['ticker'] == 'PETR4' and op['date'] == date(2024, 2, 5))
+        self.assertTrue(services.deletar_operacao_service(venda_fev['id'], usuario_id=self.usuario_id))
+        incremental = self._estado()
+        self.assertEqual(incremental, self._estado_recalculo_completo())
+
+    def test_remocao_da_ultima_operacao_do_ticker_remove_posicao(self):
+        services.inserir_operacao_manual(_op(date(2024, 6, 10), 'ITUB4', 'buy', 10, 30.0), usuario_id=self.usuario_id)
+        with database.get_db() as conn:
+            ids_itub = [row['id'] for row in conn.execute(
+                "SELECT id FROM operacoes WHERE usuario_id = ? AND ticker = 'ITUB4'", (self.usuario_id,))]
+        for operacao_id in ids_itub:
+            services.deletar_operacao_service(operacao_id, usuario_id=self.usuario_id)
+        _, carteira = self._estado()
+        self.assertNotIn('ITUB4', [item['ticker'] for item in carteira])
+        self.assertEqual(self._estado(), self._estado_recalculo_completo())
+
+    def test_meses_anteriores_nao_sao_reprocessados(self):
+        ids_antes = {r['mes']: r['id'] for r in database.obter_resultados_mensais(usuario_id=self.usuario_id)}
+        services.inserir_operacao_manual(_op(date(2024, 5, 20), 'PETR4', 'sell', 100, 35.0), usuario_id=self.usuario_id)
+        ids_depois = {r['mes']: r['id'] for r in database.obter_resultados_mensais(usuario_id=self.usuario_id)}
+        for mes in ('2024-01', '2024-02', '2024-03', '2024-04'):
+            self.assertEqual(ids_antes[mes], ids_depois[mes])
+        self.assertNotEqual(ids_antes['2024-05'], ids_depois['2024-05'])
+
+    def test_sem_checkpoints_recalcula_historico_completo(self):
+        database.limpar_checkpoints_resultados_usuario_db(usuario_id=self.usuario_id)
+        services.inserir_operacao_manual(_op(date(2024, 5, 20), 'VALE3', 'buy', 50, 80.0), usuario_id=self.usuario_id)
+        incremental = self._estado()
+        self.assertEqual(incremental, self._estado_recalculo_completo())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import os
+import pickle
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+from app.services import portfolio_analysis_service
+from app.services.portfolio_analysis_service import calculate_portfolio_history
+from indice_eventos import IndiceEventos
+from models import EventoCorporativoInfo
+from motor_posicoes import executar_motor
+from registro_operacao import RegistroOperacao
+
+
+class TestRegistroOperacao(unittest.TestCase):
+    """
+    Verifica os registros compactos de operação: leitura direta do cursor, equivalência
+    do motor com registros e com dicts, operações de entrada nunca alteradas pelos lotes
+    FIFO e o histórico da carteira sem modelos Pydantic por operação.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', [('PETR4', 'Petrobras'), ('VALE3', 'Vale')])
+            conn.executemany(
+                'INSERT INTO operacoes (date, ticker, operation, quantity, price, fees, usuario_id) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [('2024-01-10', 'PETR4', 'buy', 100, 20, 1.5, 1),
+                 ('2024-01-10', 'VALE3', 'buy', 10, 50.0, 0.0, 1),
+                 ('2024-01-10', 'VALE3', 'sell', 10, 55.0, 0.5, 1),
+                 ('2024-01-05', 'PETR4', 'sell', 30, 19.0, 0.0, 1),
+                 ('2024-03-10', 'PETR4', 'sell', 150, 12.0, 2.0, 1),
+                 ('2024-03-10', 'PETR4', 'buy', 5, 12.0, 0.0, 2)])
+            conn.commit()
+
+    def tearDown(self):
+        database.fechar_conexoes_pool()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_leitura_direta_do_cursor(self):
+        operacoes = database.obter_operacoes_motor_db(1)
+        self.assertEqual(len(operacoes), 5)
+        self.assertTrue(all(isinstance(op, RegistroOperacao) for op in operacoes))
+        self.assertEqual([op.date for op in operacoes], sorted(op.date for op in operacoes))
+        primeira = operacoes[0]
+        self.assertEqual((primeira.date, primeira.ticker, primeira.operation, primeira.quantity), (date(2024, 1, 5), 'PETR4', 'sell', 30))
+        self.assertIsInstance(operacoes[1].price, float)
+        self.assertFalse(hasattr(primeira, '__dict__'))
+
+        self.assertEqual([op.ticker for op in database.obter_operacoes_motor_db(1, ticker='VALE3')], ['VALE3', 'VALE3'])
+        self.assertEqual([op.date for op in database.obter_operacoes_motor_db(1, data_inicio=date(2024, 2, 1))], [date(2024, 3, 10)])
+        self.assertEqual(database.obter_operacoes_motor_db(3), [])
+
+    def test_registro_como_dict_e_pickle(self):
+        op = RegistroOperacao.de_dict({'id': 7, 'date': '2024-02-01T00:00:00', 'ticker': 'PETR4',
+                                       'operation': 'buy', 'quantity': '10', 'price': 20, 'fees': None})
+        self.assertEqual((op.date, op.quantity, op.price, op.fees), (date(2024, 2, 1), 10, 20.0, 0.0))
+        self.assertEqual(op['ticker'], 'PETR4')
+        self.assertEqual(op.get('corretora_id'), None)
+        self.assertEqual(op.operation_type, 'buy')
+        with self.assertRaises(KeyError):
+            op['corretora_id']
+
+        lote = op.restante(4)
+        self.assertEqual((lote.id, lote.quantity, lote.price), (7, 4, 20.0))
+        self.assertEqual(op.quantity, 10)
+        self.assertEqual(pickle.loads(pickle.dumps(op)), op)
+
+    def test_motor_com_registros_igual_ao_motor_com_dicts(self):
+        registros = database.obter_operacoes_motor_db(1)
+        originais = [op.como_dict() for op in registros]
+        eventos = {'PETR4': [EventoCorporativoInfo(id=1, id_acao=1, evento='Desdobramento',
+                                                   data_ex=date(2024, 2, 1), razao='1:2')]}
+
+        saida_registros = executar_motor(registros, eventos, data_referencia=date(2024, 12, 31))
+        saida_dicts = executar_motor(originais, eventos, data_referencia=date(2024, 12, 31))
+
+        self.assertEqual(saida_registros, saida_dicts)
+        # Os lotes FIFO (venda a descoberto, desdobramento, fechamentos parciais) são cópias
+        self.assertEqual([op.como_dict() for op in registros], originais)
+        # -30 + 100 = 70, 140 após o desdobramento, -150: posição vendida de 10
+        self.assertEqual(saida_registros['carteira']['PETR4']['quantidade'], -10)
+
+    @patch.object(portfolio_analysis_service, 'get_historical_prices')
+    @patch.object(portfolio_analysis_service, 'obter_indice_eventos')
+    def test_historico_da_carteira_com_registros(self, mock_indice_eventos, mock_precos):
+        mock_indice_eventos.side_effect = lambda ticker: IndiceEventos([], id_acao=1)
+        mock_precos.side_effect = lambda ticker, inicio, fim: {'2024-01-31': 21.0, '2024-03-31': 13.0} if ticker == 'PETR4' else {'2024-01-31': 52.0}
+
+        registros = database.obter_operacoes_motor_db(1)
+        dicts = [{**op.como_dict(), 'operation_type': op.operation} for op in registros]
+        for op in dicts:
+            del op['operation']
+
+        com_registros = calculate_portfolio_history(registros, '2024-01-01', '2024-03-31', 'monthly')
+        com_dicts = calculate_portfolio_history(dicts, '2024-01-01', '2024-03-31', 'monthly')
+        self.assertEqual(com_registros, com_dicts)
+        self.assertEqual(com_registros['equity_curve'][0], {'date': '2024-01-31', 'value': 70 * 21.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+import indice_eventos
+from models import OperacaoCreate, EventoCorporativoCreate
+
+
+def _op(data, ticker, operacao, quantidade, preco):
+    return OperacaoCreate(date=data, ticker=ticker, operation=operacao, quantity=quantidade, price=preco, fees=0.0)
+
+
+def _resumo(operacoes_fechadas):
+    campos = ("ticker", "data_abertura", "data_fechamento", "tipo", "quantidade", "resultado", "day_trade", "status_ir")
+    return sorted(tuple(op[campo] for campo in campos) for op in operacoes_fechadas)
+
+
+class TestRegistroOperacoesFechadas(unittest.TestCase):
+    """
+    Verifica o registro persistente de operações fechadas: mantido a cada alteração
+    de operações, lido sem recalcular o FIFO e recalculado apenas para tickers desatualizados.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)',
+                             [('PETR4', 'Petrobras'), ('VALE3', 'Vale'), ('ITUB4', 'Itaú')])
+            conn.commit()
+        self.usuario_id = 1
+        services.processar_operacoes([
+            _op(date(2024, 1, 10), 'PETR4', 'buy', 1000, 20.0),
+            _op(date(2024, 2, 5), 'PETR4', 'sell', 500, 30.0),    # 15.000 vendidos: isento
+            _op(date(2024, 1, 12), 'VALE3', 'buy', 100, 60.0),
+            _op(date(2024, 3, 7), 'VALE3', 'sell', 100, 70.0),
+        ], usuario_id=self.usuario_id)
+
+    def tearDown(self):
+        indice_eventos.invalidar_indice_eventos()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _recalculo_completo(self):
+        with patch.object(database, 'salvar_operacoes_fechadas_em_lote'):
+            return services.calcular_operacoes_fechadas(self.usuario_id)
+
+    def test_leitura_nao_recalcula_o_fifo(self):
+        with patch.object(services, 'executar_motor') as motor:
+            operacoes_fechadas = services.obter_operacoes_fechadas_service(self.usuario_id)
+            motor.assert_not_called()
+        self.assertEqual(_resumo(operacoes_fechadas), _resumo(self._recalculo_completo()))
+        petr = next(op for op in operacoes_fechadas if op["ticker"] == 'PETR4')
+        self.assertEqual(petr["status_ir"], "Isento")
+        self.assertEqual([o["operation"] for o in petr["operacoes_relacionadas"]], ['buy', 'sell'])
+
+    def test_status_ir_de_outros_tickers_acompanha_o_mes(self):
+        # Outra venda no mesmo mês ultrapassa o limite de isenção: PETR4 passa a ser tributável
+        services.inserir_operacao_manual(_op(date(2024, 2, 20), 'VALE3', 'sell', 100, 80.0), usuario_id=self.usuario_id)
+        operacoes_fechadas = services.obter_operacoes_fechadas_service(self.usuario_id)
+        self.assertEqual(_resumo(operacoes_fechadas), _resumo(self._recalculo_completo()))
+        petr = next(op for op in operacoes_fechadas if op["ticker"] == 'PETR4')
+        self.assertEqual(petr["status_ir"], "Tributável Swing")
+
+    def test_apenas_tickers_desatualizados_sao_recalculados(self):
+        # Alteração gravada sem recálculo (ex.: job ainda na fila)
+        database.inserir_operacao({'date': date(2024, 4, 2), 'ticker': 'ITUB4', 'operation': 'buy',
+                                   'quantity': 10, 'price': 30.0, 'fees': 0.0}, usuario_id=self.usuario_id)
+        database.inserir_operacao({'date': date(2024, 4, 3), 'ticker': 'ITUB4', 'operation': 'sell',
+                                   'quantity': 10, 'price': 32.0, 'fees': 0.0}, usuario_id=self.usuario_id)
+        self.assertEqual(database.obter_tickers_operacoes_fechadas_desatualizadas_db(self.usuario_id), ['ITUB4'])
+
+        with patch.object(services, 'executar_motor', wraps=services.executar_motor) as motor:
+            operacoes_fechadas = services.obter_operacoes_fechadas_service(self.usuario_id)
+            self.assertEqual(motor.call_count, 1)
+        self.assertIn('ITUB4', {op["ticker"] for op in operacoes_fechadas})
+        self.assertEqual(database.obter_tickers_operacoes_fechadas_desatualizadas_db(self.usuario_id), [])
+
+        # Remoção de todas as operações do ticker também desatualiza o registro
+        for op in database.obter_operacoes_por_ticker_db(usuario_id=self.usuario_id, ticker='ITUB4'):
+            database.remover_operacao(op["id"], usuario_id=self.usuario_id)
+        self.assertNotIn('ITUB4', {op["ticker"] for op in services.obter_operacoes_fechadas_service(self.usuario_id)})
+
+    def test_evento_corporativo_desatualiza_o_ticker(self):
+        id_acao = database.obter_id_acao_por_ticker('VALE3')
+        services.registrar_evento_corporativo_service(id_acao, EventoCorporativoCreate.model_construct(
+            id_acao=id_acao, evento="Desdobramento", razao="1:2",
+            data_aprovacao=None, data_registro=None, data_ex=date(2024, 2, 1)))
+        self.assertEqual(database.obter_tickers_operacoes_fechadas_desatualizadas_db(self.usuario_id), ['VALE3'])
+        operacoes_fechadas = services.obter_operacoes_fechadas_service(self.usuario_id)
+        self.assertEqual(_resumo(operacoes_fechadas), _resumo(self._recalculo_completo()))
+        # Lote de 100 a 60,00 vira 200 a 30,00; a venda de 100 fecha metade
+        vale = next(op for op in operacoes_fechadas if op["ticker"] == 'VALE3')
+        self.assertEqual((vale["quantidade"], vale["valor_compra"]), (100, 30.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
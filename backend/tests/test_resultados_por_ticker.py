@@ -0,0 +1,71 @@
+import unittest
+import os
+import sys
+import tempfile
+from datetime import date
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import services
+from models import OperacaoCreate
+
+
+def _op(data, ticker, operacao, quantidade, preco, taxas=0.0):
+    return OperacaoCreate(date=data, ticker=ticker, operation=operacao, quantity=quantidade, price=preco, fees=taxas)
+
+
+class TestResultadosPorTicker(unittest.TestCase):
+    """
+    Verifica que os resultados de um ticker são calculados apenas com os dados desse ticker.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_patch = patch.object(database, 'DATABASE_FILE', os.path.join(self.tmpdir.name, 'test.db'))
+        self.db_patch.start()
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            conn.executemany('INSERT INTO acoes (ticker, nome) VALUES (?, ?)', [('PETR4', 'Petrobras'), ('VALE3', 'Vale')])
+            conn.commit()
+        self.usuario_id = 1
+        services.processar_operacoes([
+            _op(date(2024, 1, 10), 'PETR4', 'buy', 200, 20.0, 2.0),
+            _op(date(2024, 2, 5), 'PETR4', 'sell', 50, 30.0, 1.0),
+            _op(date(2024, 1, 12), 'VALE3', 'buy', 100, 60.0),
+            _op(date(2024, 3, 7), 'VALE3', 'sell', 100, 70.0),
+        ], usuario_id=self.usuario_id)
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def test_resultado_do_ticker(self):
+        with patch.object(services, 'obter_carteira_atual') as carteira_completa, \
+             patch.object(services, 'executar_motor') as motor:
+            resultado = services.calcular_resultados_por_ticker_service(self.usuario_id, 'petr4')
+            carteira_completa.assert_not_called()
+            motor.assert_not_called()
+
+        self.assertEqual(resultado.quantidade_atual, 150)
+        self.assertAlmostEqual(resultado.preco_medio_atual, 20.01)
+        self.assertAlmostEqual(resultado.total_investido_historico, 4002.0)
+        self.assertAlmostEqual(resultado.total_vendido_historico, 1499.0)
+        self.assertAlmostEqual(resultado.lucro_prejuizo_realizado_total, 50 * 10.0 - 0.5 - 1.0)
+        self.assertEqual((resultado.operacoes_compra_total_quantidade, resultado.operacoes_venda_total_quantidade), (200, 50))
+
+    def test_ticker_desatualizado_recalcula_apenas_ele(self):
+        database.inserir_operacao({'date': date(2024, 4, 2), 'ticker': 'VALE3', 'operation': 'buy',
+                                   'quantity': 10, 'price': 50.0, 'fees': 0.0}, usuario_id=self.usuario_id)
+        database.inserir_operacao({'date': date(2024, 4, 2), 'ticker': 'PETR4', 'operation': 'sell',
+                                   'quantity': 10, 'price': 25.0, 'fees': 0.0}, usuario_id=self.usuario_id)
+        with patch.object(services, 'executar_motor', wraps=services.executar_motor) as motor:
+            resultado = services.calcular_resultados_por_ticker_service(self.usuario_id, 'VALE3')
+            self.assertEqual([chamada.args[0][0]["ticker"] for chamada in motor.call_args_list], ['VALE3'])
+        self.assertAlmostEqual(resultado.lucro_prejuizo_realizado_total, 1000.0)
+        self.assertEqual(database.obter_tickers_operacoes_fechadas_desatualizadas_db(self.usuario_id), ['PETR4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -87,6 +87,24 @@ def mock_salvar_resultado_mensal(resultado_data, usuario_id):
     res_copy['usuario_id'] = usuario_id
     mock_db_resultados_mensais.append(res_copy)
 
+def mock_salvar_carteira_em_lote(usuario_id, itens, substituir=False, tickers_removidos=None, tickers_preservados=None):
+    preservados = {ticker: mock_db_carteira[ticker] for ticker in tickers_preservados or [] if ticker in mock_db_carteira}
+    if substituir:
+        mock_limpar_carteira_usuario_db(usuario_id)
+    mock_db_carteira.update(preservados)
+    for ticker in tickers_removidos or []:
+        if ticker not in preservados:
+            mock_db_carteira.pop(ticker, None)
+    for item in itens:
+        if item["ticker"] in preservados:
+            continue
+        mock_atualizar_carteira(item["ticker"], item["quantidade"], item["preco_medio"], usuario_id)
+
+def mock_salvar_resultados_mensais_em_lote(usuario_id, resultados, checkpoints=None, mes_inicio=None):
+    mock_limpar_resultados_mensais_usuario_db(usuario_id)
+    for resultado in resultados:
+        mock_salvar_resultado_mensal(resultado, usuario_id)
+
 def mock_obter_resultados_mensais(usuario_id):
     global mock_db_resultados_mensais
     return [res for res in mock_db_resultados_mensais if res['usuario_id'] == usuario_id]
@@ -102,10 +120,10 @@ class TestServices(unittest.TestCase):
         mock_db_resultados_mensais = []
         self.usuario_id = 1 # Usuário padrão para os testes
 
-    @patch('services.limpar_carteira_usuario_db', side_effect=mock_limpar_carteira_usuario_db)
-    @patch('services.obter_todas_operacoes', side_effect=mock_obter_todas_operacoes)
-    @patch('services.atualizar_carteira', side_effect=mock_atualizar_carteira)
-    def test_recalcular_carteira_cenario_usuario(self, mock_atualizar, mock_obter_ops, mock_limpar_carteira):
+    @patch('services._carregar_eventos_por_ticker', return_value={})
+    @patch('services.obter_operacoes_motor_db', side_effect=mock_obter_todas_operacoes)
+    @patch('services.salvar_carteira_em_lote', side_effect=mock_salvar_carteira_em_lote)
+    def test_recalcular_carteira_cenario_usuario(self, mock_salvar_carteira, mock_obter_ops, mock_carregar_eventos):
         # Teste 1: Cenário do usuário
         # Compra de 1000 ações ITUB4 a R$19,00
         op1_data = {'date': date(2025, 1, 9), 'ticker': 'ITUB4', 'operation': 'buy', 'quantity': 1000, 'price': 19.00, 'fees': 0.0}
@@ -120,11 +138,13 @@ class TestServices(unittest.TestCase):
         self.assertEqual(mock_db_carteira['ITUB4']['quantidade'], 1000)
         self.assertAlmostEqual(mock_db_carteira['ITUB4']['preco_medio'], 19.00, places=2)
 
-    @patch('services.limpar_resultados_mensais_usuario_db', side_effect=mock_limpar_resultados_mensais_usuario_db)
-    @patch('services.obter_todas_operacoes', side_effect=mock_obter_todas_operacoes)
+    @patch('services.obter_operacoes_fechadas_salvas', return_value=[])
+    @patch('services.atualizar_status_ir_operacoes_fechadas_db')
+    @patch('services._carregar_eventos_por_ticker', return_value={})
+    @patch('services.obter_operacoes_motor_db', side_effect=mock_obter_todas_operacoes)
     @patch('services.obter_carteira_atual', side_effect=mock_obter_carteira_atual)
-    @patch('services.salvar_resultado_mensal', side_effect=mock_salvar_resultado_mensal)
-    def test_recalcular_resultados_cenario_usuario(self, mock_salvar_res, mock_obter_cart, mock_obter_ops, mock_limpar_res):
+    @patch('services.salvar_resultados_mensais_em_lote', side_effect=mock_salvar_resultados_mensais_em_lote)
+    def test_recalcular_resultados_cenario_usuario(self, mock_salvar_res, mock_obter_cart, mock_obter_ops, mock_carregar_eventos, mock_atualizar_status_ir, mock_obter_fechadas):
         # Teste 1 (continuação): Cenário do usuário para resultado
         # Setup inicial da carteira (compra)
         op1_data = {'date': date(2025, 1, 9), 'ticker': 'ITUB4', 'operation': 'buy', 'quantity': 1000, 'price': 19.00, 'fees': 0.0}
@@ -146,13 +166,14 @@ class TestServices(unittest.TestCase):
         self.assertAlmostEqual(resultado_jan_2025['ir_pagar_swing'], 900.00, places=2)
         self.assertFalse(resultado_jan_2025['isento_swing'])
 
-    @patch('services.limpar_carteira_usuario_db', side_effect=mock_limpar_carteira_usuario_db)
-    @patch('services.obter_todas_operacoes', side_effect=mock_obter_todas_operacoes)
-    @patch('services.atualizar_carteira', side_effect=mock_atualizar_carteira)
-    @patch('services.limpar_resultados_mensais_usuario_db', side_effect=mock_limpar_resultados_mensais_usuario_db)
+    @patch('services.obter_operacoes_fechadas_salvas', return_value=[])
+    @patch('services.atualizar_status_ir_operacoes_fechadas_db')
+    @patch('services._carregar_eventos_por_ticker', return_value={})
+    @patch('services.obter_operacoes_motor_db', side_effect=mock_obter_todas_operacoes)
+    @patch('services.salvar_carteira_em_lote', side_effect=mock_salvar_carteira_em_lote)
     @patch('services.obter_carteira_atual', side_effect=mock_obter_carteira_atual)
-    @patch('services.salvar_resultado_mensal', side_effect=mock_salvar_resultado_mensal)
-    def test_multiplas_compras_e_venda_total(self, mock_salvar_res, mock_obter_cart, mock_limpar_res_mensais, mock_atualizar_cart, mock_obter_ops, mock_limpar_cart):
+    @patch('services.salvar_resultados_mensais_em_lote', side_effect=mock_salvar_resultados_mensais_em_lote)
+    def test_multiplas_compras_e_venda_total(self, mock_salvar_res, mock_obter_cart, mock_salvar_carteira, mock_obter_ops, mock_carregar_eventos, mock_atualizar_status_ir, mock_obter_fechadas):
         # Teste 2: Múltiplas Compras
         # Compra 1: 500 ITUB4 @ R$18,00
         mock_inserir_operacao({'date': date(2025, 1, 5), 'ticker': 'ITUB4', 'operation': 'buy', 'quantity': 500, 'price': 18.00, 'fees': 0.0}, self.usuario_id)
@@ -174,13 +195,14 @@ class TestServices(unittest.TestCase):
         self.assertAlmostEqual(resultado_jan_2025['ganho_liquido_swing'], 6000.00, places=2) # (25-19)*1000
         self.assertAlmostEqual(resultado_jan_2025['ir_pagar_swing'], 900.00, places=2)
 
-    @patch('services.limpar_carteira_usuario_db', side_effect=mock_limpar_carteira_usuario_db)
-    @patch('services.obter_todas_operacoes', side_effect=mock_obter_todas_operacoes)
-    @patch('services.atualizar_carteira', side_effect=mock_atualizar_carteira)
-    @patch('services.limpar_resultados_mensais_usuario_db', side_effect=mock_limpar_resultados_mensais_usuario_db)
+    @patch('services.obter_operacoes_fechadas_salvas', return_value=[])
+    @patch('services.atualizar_status_ir_operacoes_fechadas_db')
+    @patch('services._carregar_eventos_por_ticker', return_value={})
+    @patch('services.obter_operacoes_motor_db', side_effect=mock_obter_todas_operacoes)
+    @patch('services.salvar_carteira_em_lote', side_effect=mock_salvar_carteira_em_lote)
     @patch('services.obter_carteira_atual', side_effect=mock_obter_carteira_atual)
-    @patch('services.salvar_resultado_mensal', side_effect=mock_salvar_resultado_mensal)
-    def test_venda_parcial_e_novas_compras(self, mock_salvar_res, mock_obter_cart, mock_limpar_res_mensais, mock_atualizar_cart, mock_obter_ops, mock_limpar_cart):
+    @patch('services.salvar_resultados_mensais_em_lote', side_effect=mock_salvar_resultados_mensais_em_lote)
+    def test_venda_parcial_e_novas_compras(self, mock_salvar_res, mock_obter_cart, mock_salvar_carteira, mock_obter_ops, mock_carregar_eventos, mock_atualizar_status_ir, mock_obter_fechadas):
         # Teste 3: Venda Parcial
         # Compra 1: 1000 ITUB4 @ R$19,00
         mock_inserir_operacao({'date': date(2025, 2, 1), 'ticker': 'ITUB4', 'operation': 'buy', 'quantity': 1000, 'price': 19.00, 'fees': 0.0}, self.usuario_id)
@@ -0,0 +1,97 @@
+import unittest
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import database
+import migracoes
+import auth
+from auth import TokenRevokedError, TokenNotFoundError
+
+
+class TestTokens(unittest.TestCase):
+    """
+    Verifica a tabela tokens indexada pelo digest do JWT, a migração dos tokens
+    existentes e a remoção periódica dos tokens expirados e revogados.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.arquivo = os.path.join(self.tmpdir.name, 'test.db')
+        self.db_patch = patch.object(database, 'DATABASE_FILE', self.arquivo)
+        self.db_patch.start()
+
+    def tearDown(self):
+        auth.invalidar_cache_autenticacao()
+        database.fechar_conexoes_pool()
+        self.db_patch.stop()
+        self.tmpdir.cleanup()
+
+    def _criar_usuario(self):
+        database.criar_tabelas()
+        return auth.criar_usuario('ana', 'ana@example.com', 'senha123')
+
+    def test_token_guardado_apenas_como_digest(self):
+        usuario_id = self._criar_usuario()
+        token = auth.gerar_token(usuario_id)
+        outro = auth.gerar_token(usuario_id)  # mesmo segundo: o jti diferencia os tokens
+        self.assertNotEqual(token, outro)
+        with database.get_db() as conn:
+            colunas = {row[1] for row in conn.execute("PRAGMA table_info(tokens)")}
+            self.assertNotIn('token', colunas)
+            hashes = {row[0] for row in conn.execute("SELECT token_hash FROM tokens WHERE usuario_id = ?", (usuario_id,))}
+            plano = ' '.join(row[3] for row in conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id, revogado FROM tokens WHERE token_hash = ?", (hashes.copy().pop(),)))
+        self.assertEqual(hashes, {auth.digest_token(token), auth.digest_token(outro)})
+        self.assertIn('USING INDEX', plano)
+
+        self.assertEqual(auth.verificar_token(token)['sub'], str(usuario_id))
+        self.assertTrue(auth.revogar_token(token))
+        with self.assertRaises(TokenRevokedError):
+            auth.verificar_token(token)
+        self.assertEqual(auth.verificar_token(outro)['sub'], str(usuario_id))
+
+    def test_migracao_converte_tokens_existentes(self):
+        usuario_id = self._criar_usuario()
+        token = auth.gerar_token(usuario_id)
+        # Recria a tabela no formato anterior (token completo) e volta o banco à versão 1
+        with database.get_db() as conn:
+            conn.execute('DROP TABLE tokens')
+            conn.execute('CREATE TABLE tokens (id INTEGER PRIMARY KEY AUTOINCREMENT, usuario_id INTEGER NOT NULL, '
+                         'token TEXT NOT NULL UNIQUE, data_criacao TEXT NOT NULL, data_expiracao TEXT NOT NULL, '
+                         'revogado INTEGER NOT NULL DEFAULT 0)')
+            conn.execute("INSERT INTO tokens (usuario_id, token, data_criacao, data_expiracao) VALUES (?, ?, ?, ?)",
+                         (usuario_id, token, datetime.now().isoformat(), (datetime.now() + timedelta(days=1)).isoformat()))
+            conn.execute('DELETE FROM schema_version WHERE versao >= 2')
+            conn.commit()
+
+        database.criar_tabelas()
+        with database.get_db() as conn:
+            self.assertEqual(migracoes.obter_versao_esquema(conn), migracoes.VERSAO_ESQUEMA)
+        self.assertEqual(auth.verificar_token(token)['sub'], str(usuario_id))
+
+    def test_purgar_remove_expirados_e_revogados(self):
+        usuario_id = self._criar_usuario()
+        valido = auth.gerar_token(usuario_id)
+        revogado = auth.gerar_token(usuario_id)
+        auth.revogar_token(revogado)
+        with patch.object(auth, 'JWT_EXPIRATION', -60):
+            expirado = auth.gerar_token(usuario_id)
+
+        self.assertEqual(auth.purgar_tokens(), 2)
+        self.assertEqual(auth.verificar_token(valido)['sub'], str(usuario_id))
+        for token in (revogado, expirado):
+            with self.assertRaises(TokenNotFoundError):
+                auth.verificar_token(token)
+
+        # Daqui a dois dias o token válido também terá expirado
+        self.assertEqual(auth.purgar_tokens(datetime.now() + timedelta(days=2)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()